@@ -0,0 +1,5 @@
+import sys
+
+from benchmarks import pipeline
+
+sys.exit(pipeline.main())
@@ -0,0 +1,514 @@
+import argparse
+import json
+import os
+import platform
+import sys
+
+from pyramid import threadlocal as p_threadlocal
+from webob import request as webob_request
+
+from pyramid_avro import client
+from pyramid_avro import metrics
+from pyramid_avro import routes
+
+here = os.path.abspath(os.path.dirname(__file__))
+
+BASELINE_FILE = os.path.join(here, "baseline.json")
+BASELINE_VERSION = 1
+
+# The phases reported for each case: the route's own (see metrics.PHASES)
+# plus the whole round trip, measured here.
+PHASE_CALL = "call"
+REPORTED_PHASES = (
+    metrics.PHASE_READ,
+    metrics.PHASE_HANDSHAKE,
+    metrics.PHASE_DECODE,
+    metrics.PHASE_HANDLER,
+    metrics.PHASE_VALIDATE,
+    metrics.PHASE_ENCODE,
+    metrics.PHASE_WRITE,
+    PHASE_CALL
+)
+
+# Regressions smaller than this many seconds are taken for noise.
+MIN_REGRESSION = 2e-6
+
+TOLERANCE = 0.25
+
+# The number of times each case is run, keeping the fastest.
+REPEAT = 3
+
+_primitives = ["int", "long", "string", "double", "boolean"]
+
+
+def _wide_record(width):
+    return {
+        "type": "record",
+        "name": "Wide",
+        "fields": [
+            {"name": "f{}".format(i), "type": _primitives[i % 5]}
+            for i in range(width)
+        ]
+    }
+
+
+def bench_protocol():
+    """
+    The protocol benchmarked: one message per payload shape, each echoing
+    its "value" argument back.
+
+    :return: the protocol JSON.
+    """
+    node = {
+        "type": "record",
+        "name": "Node",
+        "fields": [
+            {"name": "value", "type": "long"},
+            {"name": "label", "type": "string"},
+            {"name": "child", "type": ["null", "Node"]}
+        ]
+    }
+    collections = {
+        "type": "record",
+        "name": "Collections",
+        "fields": [
+            {"name": "numbers", "type": {"type": "array", "items": "long"}},
+            {"name": "labels", "type": {"type": "map", "values": "string"}}
+        ]
+    }
+    point = {
+        "type": "record",
+        "name": "Point",
+        "fields": [
+            {"name": "x", "type": "double"},
+            {"name": "y", "type": "double"}
+        ]
+    }
+    union_items = ["null", "long", "string", "double", "Point"]
+
+    def echo(value_type):
+        return {
+            "request": [{"name": "value", "type": value_type}],
+            "response": value_type
+        }
+
+    return json.dumps({
+        "protocol": "Bench",
+        "namespace": "bench",
+        "types": [_wide_record(40), node, collections, point],
+        "messages": {
+            "scalar": {
+                "request": [
+                    {"name": "id", "type": "long"},
+                    {"name": "value", "type": "string"}
+                ],
+                "response": "string"
+            },
+            "wide": echo("Wide"),
+            "nested": echo("Node"),
+            "collections": echo("Collections"),
+            "unions": echo({"type": "array", "items": union_items}),
+            "blob": echo("bytes")
+        }
+    })
+
+
+def _wide_value(width):
+    values = [7, 7 << 40, "seven", 7.5, True]
+    return dict(("f{}".format(i), values[i % 5]) for i in range(width))
+
+
+def _nested_value(depth):
+    node = None
+    for i in range(depth):
+        node = {"value": i, "label": "node {}".format(i), "child": node}
+    return node
+
+
+def _union_value(size):
+    items = [None, 7, "seven", 7.5, {"x": 1.0, "y": 2.0}]
+    return [items[i % 5] for i in range(size)]
+
+
+class Case(object):
+    """
+    A benchmarked call: a message, its arguments, and how to send it.
+    """
+
+    def __init__(self, name, message, args, iterations, stateless=False):
+        """
+        :param name: the case name.
+        :param message: the message called.
+        :param args: the message arguments.
+        :param iterations: the default number of calls timed.
+        :param stateless: whether calls skip the handshake.
+        """
+        self.name = name
+        self.message = message
+        self.args = args
+        self.iterations = iterations
+        self.stateless = stateless
+
+
+def bench_cases():
+    """
+    :return: the benchmark Cases, in the order they run.
+    """
+    return [
+        Case("scalar", "scalar", {"id": 1, "value": "x"}, 2000),
+        Case(
+            "scalar-stateless",
+            "scalar",
+            {"id": 1, "value": "x"},
+            2000,
+            stateless=True
+        ),
+        Case("wide", "wide", {"value": _wide_value(40)}, 1000),
+        Case("nested", "nested", {"value": _nested_value(32)}, 500),
+        Case(
+            "collections",
+            "collections",
+            {"value": {
+                "numbers": list(range(10000)),
+                "labels": dict(
+                    ("key{}".format(i), "value{}".format(i))
+                    for i in range(1000)
+                )
+            }},
+            50
+        ),
+        Case("unions", "unions", {"value": _union_value(1000)}, 100),
+        Case("blob", "blob", {"value": b"\x07" * (1024 * 1024)}, 50)
+    ]
+
+
+def echo(request):
+    return request.avro_data["value"]
+
+
+def build_route(protocol_json):
+    """
+    Build the benchmarked route, recording phase timings.
+
+    :param protocol_json: the protocol JSON.
+    :return: a routes.AvroServiceRoute.
+    """
+    route = routes.AvroServiceRoute(
+        "avro.bench",
+        protocol_json,
+        metrics=metrics.RouteMetrics("bench")
+    )
+    for message in route.protocol.message_map:
+        route.register_message_impl(message, echo)
+    return route
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def run_case(route, protocol_json, case, iterations=None, warmup=10):
+    """
+    Call a route with a case's call, in process, through
+    AvroServiceRoute.__call__, timing each phase.
+
+    :param route: a route from build_route.
+    :param protocol_json: the protocol JSON.
+    :param case: a Case.
+    :param iterations: the number of calls timed, instead of the case's.
+    :param warmup: the number of calls made first, untimed.
+    :return: a dict of phase -> median seconds.
+    """
+    iterations = iterations or case.iterations
+    requestor = client.Requestor(protocol_json)
+    body = requestor.call_body(case.message, case.args, case.stateless)
+    headers = requestor.headers(case.stateless)
+    calls = []
+
+    for i in range(warmup + iterations):
+        if i == warmup:
+            route.metrics = metrics.RouteMetrics("bench", iterations)
+        request = webob_request.Request.blank(
+            "/bench",
+            method="POST",
+            headers=headers,
+            body=body
+        )
+        p_threadlocal.manager.push({"request": request, "registry": None})
+        try:
+            started = metrics.clock()
+            response = route(request)
+            for _ in response.app_iter:
+                pass
+            ended = metrics.clock()
+        finally:
+            p_threadlocal.manager.pop()
+        if response.status_code != 200:
+            raise RuntimeError("{} failed: {}".format(
+                case.name,
+                response.status
+            ))
+        if i >= warmup:
+            calls.append(ended - started)
+
+    results = {PHASE_CALL: _median(calls)}
+    for phase, summary in route.metrics.summary()[case.message].items():
+        if phase in REPORTED_PHASES:
+            results[phase] = summary["p50"]
+    return results
+
+
+def calibrate(rounds=10):
+    """
+    Time a fixed pure-Python workload, so results from machines of different
+    speeds can be compared. The fastest round is taken, being the least
+    disturbed by anything else running.
+
+    :param rounds: the number of times it's timed.
+    :return: the fewest seconds.
+    """
+    timings = []
+    for _ in range(rounds):
+        started = metrics.clock()
+        data = {}
+        for i in range(20000):
+            data[str(i)] = [i, float(i), str(i)]
+        sum(len(value[2]) for value in data.values())
+        timings.append(metrics.clock() - started)
+    return min(timings)
+
+
+def run(case_names=None, iterations=None, repeat=REPEAT):
+    """
+    Run the benchmarks.
+
+    Every case is run "repeat" times, in turns, and each phase's fastest
+    median is kept: slowdowns from anything else running on the machine
+    rarely last through every turn.
+
+    :param case_names: the cases to run. Defaults to every case.
+    :param iterations: the number of calls timed per case, instead of each
+        case's default.
+    :param repeat: the number of times each case is run.
+    :return: a results dict, as stored in a baseline.
+    """
+    protocol_json = bench_protocol()
+    cases = [
+        case for case in bench_cases()
+        if not case_names or case.name in case_names
+    ]
+    unknown = set(case_names or ()) - set(case.name for case in cases)
+    if unknown:
+        raise ValueError("Unknown cases: {}".format(sorted(unknown)))
+
+    results = {
+        "version": BASELINE_VERSION,
+        "python": platform.python_version(),
+        "calibration": calibrate(),
+        "cases": {}
+    }
+    routes_by_case = dict(
+        (case.name, build_route(protocol_json)) for case in cases
+    )
+    for _ in range(repeat):
+        for case in cases:
+            timings = run_case(
+                routes_by_case[case.name],
+                protocol_json,
+                case,
+                iterations
+            )
+            best = results["cases"].setdefault(case.name, timings)
+            for phase, seconds in timings.items():
+                best[phase] = min(best[phase], seconds)
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE,
+            min_regression=MIN_REGRESSION):
+    """
+    Compare results against a baseline, scaling the baseline by the ratio
+    of their calibrations.
+
+    :param results: results from run.
+    :param baseline: results stored earlier.
+    :param tolerance: the fraction a phase may slow down by before it's a
+        regression.
+    :param min_regression: the fewest seconds a phase must slow down by to
+        be a regression.
+    :return: a list of (case, phase, baseline seconds, scaled baseline
+        seconds, seconds, regressed) tuples.
+    """
+    scale = results["calibration"] / baseline["calibration"]
+    rows = []
+    for case_name in sorted(results["cases"]):
+        base_case = baseline["cases"].get(case_name)
+        if base_case is None:
+            continue
+        for phase in REPORTED_PHASES:
+            seconds = results["cases"][case_name].get(phase)
+            base_seconds = base_case.get(phase)
+            if seconds is None or base_seconds is None:
+                continue
+            expected = base_seconds * scale
+            regressed = (
+                seconds > expected * (1 + tolerance) and
+                seconds - expected > min_regression
+            )
+            rows.append((
+                case_name,
+                phase,
+                base_seconds,
+                expected,
+                seconds,
+                regressed
+            ))
+    return rows
+
+
+def _micros(seconds):
+    return "{:.1f}".format(seconds * 1e6)
+
+
+def format_results(results, rows=None):
+    """
+    Lay results out as a table of microseconds, with the comparison to a
+    baseline if given.
+
+    :param results: results from run.
+    :param rows: rows from compare.
+    :return: the table text.
+    """
+    lines = ["{:<18} {:<10} {:>12} {:>12} {:>8}".format(
+        "case",
+        "phase",
+        "us",
+        "baseline us",
+        "change"
+    )]
+    compared = dict(((row[0], row[1]), row) for row in rows or ())
+    for case_name in sorted(results["cases"]):
+        case = results["cases"][case_name]
+        for phase in REPORTED_PHASES:
+            if phase not in case:
+                continue
+            row = compared.get((case_name, phase))
+            if row is None:
+                expected = change = ""
+            else:
+                expected = _micros(row[3])
+                change = "{:+.0%}".format(row[4] / row[3] - 1)
+                if row[5]:
+                    change += " !"
+            lines.append("{:<18} {:<10} {:>12} {:>12} {:>8}".format(
+                case_name,
+                phase,
+                _micros(case[phase]),
+                expected,
+                change
+            ))
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None, out=None):
+    """
+    Run the benchmarks from the command line: python -m benchmarks.
+
+    :param argv: the command line arguments, after the program name.
+    :param out: where to write the report. Defaults to stdout.
+    :return: an exit code.
+    """
+    out = out or sys.stdout
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmark pyramid_avro's request/response pipeline in "
+                    "process, per phase, against a stored baseline."
+    )
+    parser.add_argument(
+        "cases",
+        nargs="*",
+        help="The cases to run (default: all of them)."
+    )
+    parser.add_argument(
+        "-n", "--iterations",
+        type=int,
+        help="The calls timed per case (default: each case's own)."
+    )
+    parser.add_argument(
+        "-r", "--repeat",
+        type=int,
+        default=REPEAT,
+        help="The times each case is run, keeping the fastest "
+             "(default: %(default)s)."
+    )
+    parser.add_argument(
+        "--baseline",
+        default=BASELINE_FILE,
+        help="The baseline to compare against (default: %(default)s)."
+    )
+    parser.add_argument(
+        "--save",
+        metavar="PATH",
+        help="Write the results to PATH, e.g. to update the baseline."
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Exit with an error when a phase regressed."
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=TOLERANCE,
+        help="The fraction a phase may slow down by before it's a "
+             "regression (default: %(default)s)."
+    )
+    args = parser.parse_args(argv)
+    if args.iterations is not None and args.iterations < 1:
+        parser.error("--iterations must be at least 1.")
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1.")
+
+    try:
+        results = run(args.cases, args.iterations, args.repeat)
+    except ValueError as ex:
+        parser.error(str(ex))
+
+    rows = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as _file:
+            baseline = json.load(_file)
+        if baseline.get("version") == BASELINE_VERSION:
+            rows = compare(results, baseline, args.tolerance)
+        else:
+            out.write("Ignoring baseline {}: unknown version.\n".format(
+                args.baseline
+            ))
+    out.write(format_results(results, rows))
+
+    if args.save:
+        with open(args.save, "w") as _file:
+            json.dump(results, _file, indent=2, sort_keys=True)
+            _file.write("\n")
+
+    regressions = [row for row in rows or () if row[5]]
+    if regressions:
+        out.write("{} phase(s) regressed beyond {:.0%}.\n".format(
+            len(regressions),
+            args.tolerance
+        ))
+        if args.check:
+            return 1
+    return 0
+
+
+__all__ = [
+    Case.__name__,
+    bench_cases.__name__,
+    bench_protocol.__name__,
+    compare.__name__,
+    main.__name__,
+    run.__name__,
+    run_case.__name__
+]
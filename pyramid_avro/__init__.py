@@ -4,17 +4,31 @@ import traceback
 
 from pyramid import config as p_config
 from pyramid import exceptions as p_exc
-
+from pyramid import settings as p_settings
+
+from . import cache
+from . import compiler
+from . import compression as pa_compression
+from . import metrics
+from . import pools
+from . import profiling
 from . import py2_compat
 from . import routes
 from . import settings
-from . import utils
+from . import tracing
+from . import watch
 
 logger = logging.getLogger(__name__)
 
 
 def add_avro_route(config, service_name, pattern=None, protocol=None,
-                   schema=None):
+                   schema=None, validate_response=None,
+                   validate_sample_rate=None, validate_messages=None,
+                   request_data=None, response_frame_size=None,
+                   stateless_handshake=None, protocol_cache_size=None,
+                   batch_workers=None, batch_max_calls=None,
+                   compression=None, request_compression=None,
+                   max_decompressed_size=None, lazy=None):
     """
     Queues an action to add an avro route to this config based on the provided
     parameters.
@@ -37,6 +51,40 @@ def add_avro_route(config, service_name, pattern=None, protocol=None,
     :param pattern: a url path pattern to register for this service.
     :param protocol: an optional Avro protocol file.
     :param schema: an optional Avro schema file.
+    :param validate_response: an optional response validation mode, one of
+        "full", "sampled", "encode" or "off". Defaults to the
+        "avro.validate_response" setting.
+    :param validate_sample_rate: an optional fraction of responses to
+        validate in "sampled" mode. Defaults to the
+        "avro.validate_sample_rate" setting.
+    :param validate_messages: optional per-message validation modes, as a
+        dict or a "message:mode" string.
+    :param request_data: how decoded arguments are handed to message
+        implementations: "direct", "readonly" or "copy". Defaults to the
+        "avro.request_data" setting.
+    :param response_frame_size: the largest avro frame written in a
+        response. Defaults to the "avro.response_frame_size" setting.
+    :param stateless_handshake: whether to accept calls that skip the avro
+        handshake in favor of protocol hash headers. Defaults to the
+        "avro.stateless_handshake" setting.
+    :param protocol_cache_size: the most client protocols to remember.
+        Defaults to the "avro.protocol_cache_size" setting.
+    :param batch_workers: the most calls of a batch request to invoke at
+        once. Defaults to the "avro.batch_workers" setting.
+    :param batch_max_calls: the most calls a batch request may hold.
+        Defaults to the "avro.batch_max_calls" setting.
+    :param compression: the codecs responses may be compressed with, in
+        order of preference, as a list or a string of names (see
+        compression.make_codec). Defaults to the "avro.compression" setting.
+    :param request_compression: the codecs requests may be compressed with,
+        as a list or a string of names. Defaults to the
+        "avro.request_compression" setting.
+    :param max_decompressed_size: the most bytes a compressed request may
+        inflate to. Defaults to the "avro.max_decompressed_size" setting.
+    :param lazy: whether to put off parsing the protocol until the first
+        request to the service (see routes.LazyAvroServiceRoute). Defaults
+        to the "avro.lazy_routes" setting, unless the service is one of the
+        "avro.eager_services".
     """
 
     avro_settings = settings.get_config_options(config.get_settings())
@@ -58,30 +106,24 @@ def add_avro_route(config, service_name, pattern=None, protocol=None,
     )
 
     # Derive base directory for files.
+    package_dir = os.path.dirname(config.root_package.__file__)
     base_dir = avro_settings["protocol_dir"]
     if base_dir is None or not os.path.isabs(base_dir):
-        parts = [os.path.dirname(config.root_package.__file__)]
+        parts = [package_dir]
         if base_dir is not None:
             parts.append(base_dir)
         base_dir = os.path.join(*parts)
 
+    parse_cache_dir = avro_settings["parse_cache_dir"]
+    if parse_cache_dir is not None:
+        parse_cache_dir = os.path.join(package_dir, parse_cache_dir)
+
     # Discover protocol and schema files.
-    if protocol is not None:
-        if not os.path.isabs(protocol):
-            # Make sure this is an absolute path.
-            protocol = os.path.join(base_dir, protocol)
-
-        # If schema was none, "auto-discover" it.
-        if schema is None:
-            directory, filename = os.path.split(protocol)
-            filename, ext = os.path.splitext(filename)
-            filename = ".".join([filename, "avpr"])
-            schema = os.path.join(directory, filename)
-
-    # Normalize schema path.
-    if schema is not None:
-        if not os.path.isabs(schema):
-            schema = os.path.join(base_dir, schema)
+    protocol, schema = settings.derive_service_files(
+        protocol,
+        schema,
+        base_dir
+    )
 
     auto_compile = avro_settings["auto_compile"]
     if not auto_compile and not os.path.exists(schema):
@@ -89,13 +131,15 @@ def add_avro_route(config, service_name, pattern=None, protocol=None,
             "No such file or directory '{}'".format(schema)
         )
 
+    tools_jar = avro_settings["tools_jar"]
     if auto_compile:
-        tools_jar = avro_settings["tools_jar"]
-        if tools_jar is None:
+        # The python compiler doesn't need the tools jar.
+        if avro_settings["compiler"] == settings.COMPILER_PYTHON:
+            tools_jar = None
+        elif tools_jar is None:
             err = "Cannot auto_compile without tools_jar defined."
             raise p_config.ConfigurationError(err)
-
-        if not os.path.exists(tools_jar):
+        elif not os.path.exists(tools_jar):
             err = "No such file or directory: {}".format(tools_jar)
             raise p_config.ConfigurationError(err)
 
@@ -103,17 +147,125 @@ def add_avro_route(config, service_name, pattern=None, protocol=None,
             err = "Cannot auto_compile without a protocol defined."
             raise p_config.ConfigurationError(err)
 
+    if validate_response is None:
+        validate_response = avro_settings["validate_response"]
+    if validate_sample_rate is None:
+        validate_sample_rate = avro_settings["validate_sample_rate"]
+    if request_data is None:
+        request_data = avro_settings["request_data"]
+    if response_frame_size is None:
+        response_frame_size = avro_settings["response_frame_size"]
+    if stateless_handshake is None:
+        stateless_handshake = avro_settings["stateless_handshake"]
+    if protocol_cache_size is None:
+        protocol_cache_size = avro_settings["protocol_cache_size"]
+    if batch_workers is None:
+        batch_workers = avro_settings["batch_workers"]
+    if batch_max_calls is None:
+        batch_max_calls = avro_settings["batch_max_calls"]
+    if compression is None:
+        compression = avro_settings["compression"]
+    if request_compression is None:
+        request_compression = avro_settings["request_compression"]
+    if max_decompressed_size is None:
+        max_decompressed_size = avro_settings["max_decompressed_size"]
+    if lazy is None:
+        lazy = (
+            avro_settings["lazy_routes"] and
+            service_name not in avro_settings["eager_services"]
+        )
+    lazy = p_settings.asbool(lazy)
+    reload_schemas = avro_settings["reload_schemas"]
+
+    route_options = {
+        "request_data": settings.parse_request_data_mode(request_data),
+        "response_frame_size": settings.parse_positive_int(
+            response_frame_size,
+            "response_frame_size"
+        ),
+        "stateless_handshake": p_settings.asbool(stateless_handshake),
+        "protocol_cache_size": settings.parse_positive_int(
+            protocol_cache_size,
+            "protocol_cache_size"
+        ),
+        "batch_workers": settings.parse_positive_int(
+            batch_workers,
+            "batch_workers"
+        ),
+        "batch_max_calls": settings.parse_positive_int(
+            batch_max_calls,
+            "batch_max_calls"
+        ),
+        "validate_response": settings.parse_validation_mode(
+            validate_response
+        ),
+        "validate_sample_rate": settings.parse_sample_rate(
+            validate_sample_rate
+        ),
+        "validate_messages": settings.parse_message_options(
+            validate_messages,
+            settings.parse_validation_mode
+        ),
+        "metrics": None,
+        "tracer": None,
+        "profiler": None,
+        "compression": None,
+        "decompression": None
+    }
+    if avro_settings["metrics"]:
+        route_options["metrics"] = metrics.RouteMetrics(
+            service_name,
+            avro_settings["metrics_window"]
+        )
+    if avro_settings["tracing"]:
+        route_options["tracer"] = tracing.Tracer(
+            service_name,
+            _span_exporter(config, avro_settings, package_dir)
+        )
+    profile = avro_settings["profile"]
+    profile_sample_rate = avro_settings["profile_sample_rate"]
+    profile_secret = avro_settings["profile_secret"]
+    if profile or profile_sample_rate or profile_secret:
+        profile_dir = avro_settings["profile_dir"]
+        if profile_dir is None:
+            err = "Cannot profile requests without profile_dir defined."
+            raise p_config.ConfigurationError(err)
+        route_options["profiler"] = profiling.RouteProfiler(
+            service_name,
+            os.path.join(package_dir, profile_dir),
+            output=avro_settings["profile_format"],
+            always=profile,
+            sample_rate=profile_sample_rate,
+            secret=profile_secret,
+            messages=avro_settings["profile_messages"],
+            interval=avro_settings["profile_interval"]
+        )
+
+    codings = settings.parse_codings(compression)
+    if codings:
+        route_options["compression"] = pa_compression.ResponseCompression(
+            [_compression_codec(config, coding, avro_settings)
+             for coding in codings],
+            avro_settings["compression_min_size"]
+        )
+    codings = settings.parse_codings(request_compression)
+    if codings:
+        route_options["decompression"] = pa_compression.RequestDecompression(
+            [_decompression_codec(config, coding, avro_settings)
+             for coding in codings],
+            settings.parse_positive_int(
+                max_decompressed_size,
+                "max_decompressed_size"
+            )
+        )
+
     def register():
         # Begin route definition.
         route = ".".join(["avro", service_name])
         registry = config.registry
         # Shadow outer-scope
-        protocol_file = protocol
         schema_file = schema
 
-        if avro_settings["auto_compile"]:
-            utils.compile_protocol(protocol_file, schema_file, tools_jar)
-
         try:
             with open(schema_file) as _file:
                 schema_contents = _file.read()
@@ -122,7 +274,22 @@ def add_avro_route(config, service_name, pattern=None, protocol=None,
             raise p_config.ConfigurationError(message)
 
         try:
-            route_def = routes.AvroServiceRoute(route, schema_contents)
+            if lazy or reload_schemas:
+                route_def = routes.LazyAvroServiceRoute(
+                    route,
+                    schema_file,
+                    fingerprint=cache.schema_fingerprint(schema_contents),
+                    parse_cache_dir=parse_cache_dir,
+                    **route_options
+                )
+                if not lazy:
+                    route_def.materialize()
+            else:
+                route_def = routes.AvroServiceRoute(
+                    route,
+                    cache.load_protocol(schema_contents, parse_cache_dir),
+                    **route_options
+                )
         except Exception:
             raise p_exc.ConfigurationError(
                 "Failed to register route {}:\n {}".format(
@@ -136,6 +303,12 @@ def add_avro_route(config, service_name, pattern=None, protocol=None,
             routes.IAvroServiceRoute,
             name=route
         )
+        if route_options["metrics"] is not None:
+            registry.registerUtility(
+                route_options["metrics"],
+                metrics.IAvroRouteMetrics,
+                name=route
+            )
         logger.debug("Registering avro service: {} => {}".format(
             route,
             service_path
@@ -143,14 +316,203 @@ def add_avro_route(config, service_name, pattern=None, protocol=None,
         config.add_route(route, service_path, request_method="POST")
         config.add_view(route_name=route, view=route_def)
 
+    compile_job = None
+    if auto_compile:
+        compile_job = compiler.CompileJob(protocol, schema, tools_jar)
+        _queue_compile(config, compile_job, avro_settings)
     config.action(
         ("avro-route", service_name),
         register,
         order=p_config.PHASE0_CONFIG
     )
+    if reload_schemas:
+        _queue_reload(config, service_name, schema, compile_job, avro_settings)
+
+
+def _span_exporter(config, avro_settings, package_dir):
+    # One exporter is shared by every service. Applications may register
+    # their own ISpanExporter utility before adding routes instead.
+    registry = config.registry
+    exporter = registry.queryUtility(tracing.ISpanExporter)
+    if exporter is not None:
+        return exporter
+
+    trace_file = avro_settings["trace_file"]
+    if trace_file:
+        trace_file = os.path.join(package_dir, trace_file)
+    try:
+        exporter = tracing.make_exporter(
+            avro_settings["trace_exporter"],
+            trace_file,
+            config.maybe_dotted,
+            avro_settings
+        )
+    except (ImportError, ValueError) as ex:
+        raise p_config.ConfigurationError(
+            "Invalid trace_exporter: {}".format(ex)
+        )
+    if exporter is not None:
+        registry.registerUtility(exporter, tracing.ISpanExporter)
+    return exporter
+
+
+def _compression_codec(config, name, avro_settings):
+    # Applications may register their own ICompressionCodec utilities, by
+    # name, before adding routes.
+    codec = config.registry.queryUtility(
+        pa_compression.ICompressionCodec,
+        name=name
+    )
+    if codec is not None:
+        return codec
+    try:
+        return pa_compression.make_codec(
+            name,
+            avro_settings["compression_level"],
+            config.maybe_dotted,
+            avro_settings
+        )
+    except (ImportError, ValueError) as ex:
+        raise p_config.ConfigurationError(
+            "Invalid compression codec: {}".format(ex)
+        )
+
+
+def _decompression_codec(config, name, avro_settings):
+    codec = _compression_codec(config, name, avro_settings)
+    if not callable(getattr(codec, "decompressor", None)):
+        raise p_config.ConfigurationError(
+            "Compression codec '{}' can't decompress requests.".format(name)
+        )
+    return codec
 
 
-def register_avro_message(config, service_name, message_impl, message=None):
+def _queue_compile(config, job, avro_settings):
+    # Protocols are compiled together, before any route is registered.
+    registry = config.registry
+    jobs = getattr(registry, "avro_compile_jobs", None)
+    if jobs is not None:
+        jobs.append(job)
+        return
+
+    jobs = registry.avro_compile_jobs = [job]
+
+    def compile_protocols():
+        del registry.avro_compile_jobs
+        try:
+            compiler.compile_all(
+                jobs,
+                workers=avro_settings["compile_workers"],
+                cache=avro_settings["compile_cache"],
+                backend=avro_settings["compiler"]
+            )
+        except compiler.CompileError as ex:
+            raise p_config.ConfigurationError(str(ex))
+
+    config.action(
+        None,
+        compile_protocols,
+        order=p_config.PHASE0_CONFIG - 1
+    )
+
+
+def _queue_reload(config, service_name, schema, job, avro_settings):
+    # One watcher reloads every service, started once they're registered.
+    registry = config.registry
+    services = getattr(registry, "avro_reload_services", None)
+    if services is not None:
+        services.append((service_name, schema, job))
+        return
+
+    services = registry.avro_reload_services = [(service_name, schema, job)]
+
+    def start_watcher():
+        del registry.avro_reload_services
+        schema_routes = {}
+        for name, schema_file, _ in services:
+            schema_routes.setdefault(schema_file, []).append(
+                registry.getUtility(
+                    routes.IAvroServiceRoute,
+                    name=".".join(["avro", name])
+                )
+            )
+        reloader = watch.SchemaReloader(
+            schema_routes,
+            [job for _, _, job in services if job is not None],
+            workers=avro_settings["compile_workers"],
+            cache=avro_settings["compile_cache"],
+            backend=avro_settings["compiler"]
+        )
+        watcher = watch.FileWatcher(
+            reloader.paths,
+            reloader,
+            interval=avro_settings["reload_interval"]
+        )
+        watcher.start()
+        # Forked workers restart it on their first request.
+        for schema_file_routes in schema_routes.values():
+            for route in schema_file_routes:
+                route.watcher = watcher
+        logger.debug("Watching {} avro schema file(s) with {}.".format(
+            len(reloader.paths),
+            watcher.backend
+        ))
+        registry.avro_schema_watcher = watcher
+
+    config.action(
+        None,
+        start_watcher,
+        order=p_config.PHASE0_CONFIG + 1
+    )
+
+
+def add_avro_pool(config, pool_name, kind=None, max_workers=None,
+                  max_queue=None, rejection=None, block_timeout=None):
+    """
+    Queues an action to add a named executor pool, which message
+    implementations can then be bound to with "register_avro_message".
+
+    Pools are registered before any message, so they may be added in any
+    order relative to the messages using them.
+
+    :param config: a pyramid.config.Configurator object.
+    :param pool_name: a name for the pool.
+    :param kind: "thread" (default) or "process".
+    :param max_workers: the most calls to run at once (default: 4).
+    :param max_queue: the most calls to hold waiting for a worker
+        (default: 0).
+    :param rejection: what to do with calls beyond that: "reject"
+        (default), "caller_runs" or "block".
+    :param block_timeout: the most seconds a "block" pool waits for room.
+    """
+    pool_options = settings.parse_pool_options(dict(
+        (key, val) for key, val in [
+            ("kind", kind),
+            ("max_workers", max_workers),
+            ("max_queue", max_queue),
+            ("rejection", rejection),
+            ("block_timeout", block_timeout)
+        ]
+        if val is not None
+    ))
+
+    def register():
+        logger.debug("Registering avro pool: {}".format(pool_name))
+        config.registry.registerUtility(
+            pools.ExecutorPool(pool_name, **pool_options),
+            pools.IAvroExecutorPool,
+            name=pool_name
+        )
+
+    config.action(
+        ("avro-pool", pool_name),
+        register,
+        order=p_config.PHASE0_CONFIG - 1
+    )
+
+
+def register_avro_message(config, service_name, message_impl, message=None,
+                          request_data=None, pool=None):
     """
     Registers a callable object as the implementation for a message belonging
     to an avro protocol service whose route has been added with the above
@@ -167,6 +529,10 @@ def register_avro_message(config, service_name, message_impl, message=None):
     :param service_name: an avro service name added with add_avro_route.
     :param message_impl: an implementation for message.
     :param message: an optional message name.
+    :param request_data: optionally override how decoded arguments are
+        handed to this implementation: "direct", "readonly" or "copy".
+    :param pool: the name of an executor pool added with "add_avro_pool" to
+        run this implementation on, instead of the request's own thread.
     :return:
     """
 
@@ -180,6 +546,8 @@ def register_avro_message(config, service_name, message_impl, message=None):
 
     message_name = message or message_impl.__name__
     route = ".".join(["avro", service_name])
+    if request_data is not None:
+        request_data = settings.parse_request_data_mode(request_data)
 
     def register():
         registry = config.registry
@@ -188,11 +556,26 @@ def register_avro_message(config, service_name, message_impl, message=None):
             err = "Service '{}' has no route defined.".format(service_name)
             raise p_exc.ConfigurationError(err)
 
+        executor_pool = None
+        if pool is not None:
+            executor_pool = registry.queryUtility(
+                pools.IAvroExecutorPool,
+                name=pool
+            )
+            if executor_pool is None:
+                err = "No avro pool named '{}'.".format(pool)
+                raise p_exc.ConfigurationError(err)
+
         logger.debug("Registering message {} for service {}".format(
             message_name,
             route
         ))
-        route_def.register_message_impl(message_name, message_impl)
+        route_def.register_message_impl(
+            message_name,
+            message_impl,
+            request_data=request_data,
+            pool=executor_pool
+        )
 
     config.action(
         ("avro-message", service_name, message_name),
@@ -205,20 +588,32 @@ def includeme(config):
     """
     Adds directives:
         # add_avro_route
+        # add_avro_pool
         # register_avro_message
 
-    Scans the provided settings for any pre-defined services and adds them at
-    this step.
+    Scans the provided settings for any pre-defined services and pools and
+    adds them at this step, along with the stats route when "avro.stats_path"
+    is set (see metrics.stats_view).
 
     :param config: a pyramid.config.Configurator object.
     """
     config.add_directive("add_avro_route", add_avro_route)
+    config.add_directive("add_avro_pool", add_avro_pool)
     config.add_directive("register_avro_message", register_avro_message)
     options = settings.get_config_options(config.get_settings())
+    pool_defs = options.get("pool") or {}
+    for pool_name, pool_opts in pool_defs.items():
+        config.add_avro_pool(pool_name, **pool_opts)
+
     service_defs = options.get("service") or {}
     for service_name, service_opts in service_defs.items():
         config.add_avro_route(service_name, **service_opts)
 
+    stats_path = options.get("stats_path")
+    if stats_path:
+        config.add_route("avro-stats", stats_path, request_method="GET")
+        config.add_view(metrics.stats_view, route_name="avro-stats")
+
     logger.debug("Finished preparing for avro services.")
 
 
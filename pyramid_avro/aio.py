@@ -0,0 +1,137 @@
+import atexit
+import logging
+import os
+import threading
+
+try:
+    import asyncio
+except ImportError:  # pragma: no cover
+    asyncio = None
+
+logger = logging.getLogger(__name__)
+
+
+def is_coroutine(obj):
+    """
+    Check whether obj is a coroutine, as returned by calling an "async def"
+    message implementation.
+
+    :param obj: a message implementation's return value.
+    :return: a bool.
+    """
+    return asyncio is not None and asyncio.iscoroutine(obj)
+
+
+class EventLoopThread(object):
+    """
+    An asyncio event loop running in a daemon thread of its own.
+
+    Coroutines from any number of WSGI worker threads are run on this one
+    loop, so while each worker waits for its own coroutine's result, the
+    I/O those coroutines wait on overlaps, instead of each handler holding
+    a worker for the whole of its I/O.
+
+    The loop is started on first use, and started afresh in a forked child
+    process, where the parent's loop thread doesn't exist.
+    """
+
+    def __init__(self, name="pyramid-avro-event-loop"):
+        """
+        :param name: the loop thread's name.
+        """
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        """Whether the loop is running in this process."""
+        return (
+            self._pid == os.getpid() and
+            self._thread is not None and
+            self._thread.is_alive()
+        )
+
+    @property
+    def loop(self):
+        """The running event loop, started if need be."""
+        if not self.running:
+            self.start()
+        return self._loop
+
+    def start(self):
+        """Start the loop thread, unless it's already running."""
+        if asyncio is None:  # pragma: no cover
+            raise RuntimeError("asyncio is not available.")
+
+        with self._lock:
+            if self.running:
+                return
+            loop = asyncio.new_event_loop()
+            started = threading.Event()
+            thread = threading.Thread(
+                target=self._run,
+                args=(loop, started),
+                name=self.name
+            )
+            thread.daemon = True
+            thread.start()
+            started.wait()
+            self._loop = loop
+            self._thread = thread
+            self._pid = os.getpid()
+            logger.debug("Started event loop thread {}.".format(self.name))
+
+    @staticmethod
+    def _run(loop, started):
+        asyncio.set_event_loop(loop)
+        loop.call_soon(started.set)
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def stop(self, timeout=None):
+        """
+        Stop the loop and wait for its thread to finish.
+
+        :param timeout: the most seconds to wait for the thread.
+        """
+        with self._lock:
+            if not self.running:
+                return
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = self._pid = None
+
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        logger.debug("Stopped event loop thread {}.".format(self.name))
+
+    def run(self, coroutine, timeout=None):
+        """
+        Run a coroutine on the loop, blocking the calling thread (but not the
+        loop) until it completes.
+
+        :param coroutine: a coroutine object.
+        :param timeout: the most seconds to wait for a result. On timeout the
+            coroutine is cancelled.
+        :return: the coroutine's result.
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+
+default_loop = EventLoopThread()
+atexit.register(default_loop.stop, 5)
+
+
+__all__ = [
+    EventLoopThread.__name__,
+    is_coroutine.__name__
+]
@@ -0,0 +1,557 @@
+import asyncio
+import collections
+import logging
+import ssl
+
+try:
+    from urllib import parse as urlparse
+except ImportError:  # pragma: no cover
+    import urlparse
+
+from avro import ipc as avro_ipc
+
+from . import client
+from . import handshake
+from . import routes
+
+logger = logging.getLogger(__name__)
+
+# The most connections a client opens to its service's host.
+MAX_CONNECTIONS = 4
+
+# The most requests sent on a connection before their responses are read.
+# 1 turns pipelining off, for servers that don't support it.
+MAX_PIPELINE = 1
+
+
+class ConnectionClosed(ConnectionError):
+    """Raised for requests on a connection the server closed."""
+
+
+class StaleConnection(ConnectionClosed):
+    """
+    Raised for requests the server can't have run: ones on a connection
+    that closed before they could be sent, or before any response to them
+    (or to the requests pipelined ahead of them) started. They can be sent
+    again on another connection.
+    """
+
+
+Response = collections.namedtuple(
+    "Response",
+    ["status", "reason", "headers", "body", "will_close"]
+)
+
+
+async def read_response(reader):
+    """
+    Read an HTTP/1.1 response.
+
+    :param reader: an asyncio.StreamReader.
+    :return: a Response. Header names are lower case.
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise StaleConnection("The server closed the connection.")
+    version, status, reason = (
+        status_line.decode("latin-1").rstrip("\r\n").split(" ", 2) + [""]
+    )[:3]
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    connection = headers.get("connection", "").lower()
+    will_close = connection == "close" or (
+        version == "HTTP/1.0" and connection != "keep-alive"
+    )
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if not size:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        # Skip any trailers.
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        body = b"".join(chunks)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    else:
+        body = await reader.read()
+        will_close = True
+    return Response(int(status), reason, headers, body, will_close)
+
+
+def _current_task():
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        # Not called from a task.
+        return None
+
+
+class AsyncConnection(object):
+    """
+    A keep-alive HTTP connection that can pipeline requests: each request
+    is written as soon as it's made, and responses are read back in order
+    by a task of the connection's own.
+
+    Like client.ConnectionPool connections, each remembers which services
+    it's completed a handshake with.
+    """
+
+    def __init__(self, reader, writer, read_timeout=client.READ_TIMEOUT,
+                 on_response=None):
+        """
+        :param reader: an asyncio.StreamReader.
+        :param writer: an asyncio.StreamWriter.
+        :param read_timeout: the most seconds to wait for each response.
+        :param on_response: an optional callable, called whenever a
+            response arrives or the connection closes.
+        """
+        self.reader = reader
+        self.writer = writer
+        self.read_timeout = read_timeout
+        self.on_response = on_response
+        self.handshakes = set()
+        self.pending = collections.deque()
+        self.requests = 0
+        self.closed = False
+        self._reader = None
+
+    async def request(self, request_bytes):
+        """
+        Send a request, waiting for its response.
+
+        :param request_bytes: a complete HTTP request.
+        :return: a Response.
+        """
+        if self.closed:
+            raise StaleConnection("The connection is closed.")
+        future = asyncio.get_event_loop().create_future()
+        # Responses come back in the order requests are written.
+        self.pending.append(future)
+        self.writer.write(request_bytes)
+        self.requests += 1
+        # The loop only keeps weak references to tasks: hold on to the
+        # reader, or it could be collected while responses are due.
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.ensure_future(self._read_responses())
+        try:
+            await self.writer.drain()
+        except Exception as ex:
+            self.close(ex)
+            # The failure is raised here rather than through the future.
+            future.exception()
+            raise StaleConnection(
+                "Failed to send the request: {}".format(ex)
+            )
+        return await future
+
+    async def _read_responses(self):
+        try:
+            while self.pending:
+                try:
+                    response = await asyncio.wait_for(
+                        read_response(self.reader),
+                        self.read_timeout
+                    )
+                except Exception as ex:
+                    self.close(ex)
+                    return
+                future = self.pending.popleft()
+                if not future.done():
+                    future.set_result(response)
+                if response.will_close:
+                    # The server won't read the requests pipelined behind
+                    # this one.
+                    self.close(
+                        StaleConnection("The server closed the connection.")
+                    )
+                    return
+                if self.on_response is not None:
+                    self.on_response()
+        except Exception as ex:
+            logger.exception("Failed to read responses.")
+            self.close(ex)
+        finally:
+            # Whatever stopped the reader, including being cancelled, no one
+            # is left to answer the requests still waiting.
+            if self.pending:
+                self.close()
+
+    def close(self, error=None):
+        """
+        Close the connection, failing any requests waiting on it.
+
+        :param error: the exception to fail them with.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        reader, self._reader = self._reader, None
+        if reader is not None and reader is not _current_task():
+            reader.cancel()
+        self.writer.close()
+        pending, self.pending = self.pending, collections.deque()
+        for future in pending:
+            if not future.done():
+                future.set_exception(
+                    error or ConnectionClosed("The connection was closed.")
+                )
+        if self.on_response is not None:
+            self.on_response()
+
+
+class AsyncConnectionPool(object):
+    """
+    Up to max_connections keep-alive connections to one host, shared by the
+    tasks of one event loop.
+
+    Requests go to an idle connection, then to a new one, then, with
+    pipelining, behind the fewest requests already in flight. Past that
+    they wait for a response to make room.
+    """
+
+    def __init__(self, host, port, ssl_context=None,
+                 max_connections=MAX_CONNECTIONS, max_pipeline=MAX_PIPELINE,
+                 connect_timeout=client.CONNECT_TIMEOUT,
+                 read_timeout=client.READ_TIMEOUT):
+        """
+        :param host: a host name.
+        :param port: a port.
+        :param ssl_context: an ssl.SSLContext, for https.
+        :param max_connections: the most connections to open.
+        :param max_pipeline: the most requests in flight on a connection.
+        :param connect_timeout: the most seconds to wait for a connection.
+        :param read_timeout: the most seconds to wait for each response.
+        """
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.max_connections = max_connections
+        self.max_pipeline = max_pipeline
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.connections = []
+        self.created = 0
+        self._opening = 0
+        self._waiters = collections.deque()
+
+    def _wake(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _connect(self):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                self.host,
+                self.port,
+                ssl=self.ssl_context
+            ),
+            self.connect_timeout
+        )
+        self.created += 1
+        return AsyncConnection(
+            reader,
+            writer,
+            read_timeout=self.read_timeout,
+            on_response=self._wake
+        )
+
+    async def acquire(self):
+        """
+        Pick a connection for a request, which must be made on it right
+        away.
+
+        :return: a tuple of (connection, whether it was used before).
+        """
+        while True:
+            self.connections = [
+                conn for conn in self.connections if not conn.closed
+            ]
+            least_busy = None
+            if self.connections:
+                least_busy = min(
+                    self.connections,
+                    key=lambda conn: len(conn.pending)
+                )
+                if not least_busy.pending:
+                    return least_busy, least_busy.requests > 0
+
+            opened = len(self.connections) + self._opening
+            if opened < self.max_connections:
+                self._opening += 1
+                try:
+                    conn = await self._connect()
+                    self.connections.append(conn)
+                finally:
+                    self._opening -= 1
+                    self._wake()
+                return conn, False
+
+            busy = len(least_busy.pending) if least_busy else None
+            if busy is not None and busy < self.max_pipeline:
+                return least_busy, True
+
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+    def close(self):
+        """Close every connection."""
+        connections, self.connections = self.connections, []
+        for conn in connections:
+            conn.close()
+
+    def stats(self):
+        """
+        Report the pool's gauges and counters.
+
+        :return: a dict.
+        """
+        return {
+            "connections": len(self.connections),
+            "in_flight": sum(len(conn.pending) for conn in self.connections),
+            "created": self.created
+        }
+
+
+class AsyncAvroClient(object):
+    """
+    An asyncio client for an avro service served over HTTP.
+
+    Any number of calls can be made concurrently from one event loop; they
+    share a pool of keep-alive connections (see AsyncConnectionPool). As
+    with client.AvroClient, a handshake is only sent on a connection's first
+    call to the service. Use from a single event loop.
+    """
+
+    def __init__(self, url, protocol, max_connections=MAX_CONNECTIONS,
+                 max_pipeline=MAX_PIPELINE,
+                 connect_timeout=client.CONNECT_TIMEOUT,
+                 read_timeout=client.READ_TIMEOUT, stateless=True,
+                 ssl_context=None):
+        """
+        :param url: the service's URL.
+        :param protocol: the client's avro protocol: an avro protocol, its
+            JSON, or a routes.IAvroServiceRoute to reuse the protocol of.
+        :param max_connections: the most connections to open.
+        :param max_pipeline: the most requests in flight on a connection.
+        :param connect_timeout: the most seconds to wait for a connection.
+        :param read_timeout: the most seconds to wait for each response.
+        :param stateless: whether to skip handshakes on connections that have
+            completed one. Only pyramid_avro servers support this.
+        :param ssl_context: an optional ssl.SSLContext for https URLs.
+        """
+        if routes.IAvroServiceRoute.providedBy(protocol):
+            protocol = protocol.protocol
+        parts = urlparse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError("Unsupported scheme: '{}'".format(parts.scheme))
+        if parts.scheme == "https" and ssl_context is None:
+            ssl_context = ssl.create_default_context()
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+
+        self.url = url
+        self.path = parts.path or "/"
+        if parts.query:
+            self.path = "{}?{}".format(self.path, parts.query)
+        self.host_header = parts.netloc.rpartition("@")[2]
+        self.pool = AsyncConnectionPool(
+            parts.hostname,
+            port,
+            ssl_context=ssl_context,
+            max_connections=max_connections,
+            max_pipeline=max_pipeline,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout
+        )
+        self.requestor = client.Requestor(protocol)
+        self.stateless = stateless
+
+    @classmethod
+    def for_service(cls, registry, service_name, url, **kwargs):
+        """
+        Build a client for a service registered with this application,
+        reusing its protocol.
+
+        :param registry: a pyramid registry.
+        :param service_name: a service added with add_avro_route.
+        :param url: the URL the service is served at.
+        :param kwargs: more AsyncAvroClient options.
+        :return: an AsyncAvroClient.
+        """
+        return cls(url, client.service_route(registry, service_name), **kwargs)
+
+    async def call(self, message_name, args):
+        """
+        Call a message.
+
+        :param message_name: an avro message name.
+        :param args: a dict of message arguments.
+        :return: the message's response.
+        :raises avro.ipc.AvroRemoteException: when the call failed.
+        """
+        return await self._send(
+            self.requestor.encode_call(message_name, args),
+            lambda body, stateless: self.requestor.read_call_body(
+                message_name,
+                body,
+                stateless
+            )
+        )
+
+    async def batch(self, calls):
+        """
+        Call many messages in one request (see the batch module).
+
+        :param calls: a sequence of (message name, arguments) pairs.
+        :return: a list with each call's response or, for calls that failed,
+            an avro.ipc.AvroRemoteException.
+        """
+        message_names = [message_name for message_name, _ in calls]
+        return await self._send(
+            self.requestor.encode_batch(calls),
+            lambda body, stateless: self.requestor.read_batch_body(
+                message_names,
+                body,
+                stateless
+            ),
+            is_batch=True
+        )
+
+    def _request_bytes(self, body, headers):
+        lines = [
+            "POST {} HTTP/1.1".format(self.path),
+            "Host: {}".format(self.host_header),
+            "Content-Length: {}".format(len(body))
+        ]
+        lines.extend(
+            "{}: {}".format(name, value) for name, value in headers.items()
+        )
+        lines.extend(["", ""])
+        return "\r\n".join(lines).encode("latin-1") + body
+
+    async def _send(self, encoded, decode, is_batch=False):
+        for _ in range(client.MAX_ATTEMPTS):
+            conn, reused = await self.pool.acquire()
+            stateless = self.stateless and self.path in conn.handshakes
+            body = self.requestor.encoded_body(encoded, stateless)
+            headers = self.requestor.headers(stateless, is_batch)
+            try:
+                response = await conn.request(
+                    self._request_bytes(body, headers)
+                )
+            except StaleConnection:
+                # Calls aren't idempotent: other failures may come after the
+                # server ran the call, and are raised.
+                if not reused:
+                    raise
+                logger.debug("Stale connection, retrying on another.")
+                continue
+
+            if response.status == 412 and stateless:
+                # The server has forgotten this client's protocol.
+                conn.handshakes.discard(self.path)
+                self.requestor.send_protocol = True
+                continue
+            if response.status != 200:
+                raise client.HTTPError(
+                    response.status,
+                    response.reason,
+                    response.body
+                )
+
+            try:
+                result = decode(response.body, stateless)
+            except client.HandshakeRequired:
+                continue
+            server_hash = handshake.SERVER_HASH_HEADER.lower()
+            if not stateless and server_hash in response.headers:
+                conn.handshakes.add(self.path)
+            return result
+
+        raise avro_ipc.AvroRemoteException(
+            "Failed to call {} after {} attempts.".format(
+                self.url,
+                client.MAX_ATTEMPTS
+            )
+        )
+
+    def close(self):
+        """Close the client's connections."""
+        self.pool.close()
+
+
+async def _indexed_call(index, avro_client, message_name, args,
+                        return_exceptions):
+    try:
+        return index, await avro_client.call(message_name, args)
+    except avro_ipc.AvroRemoteException as ex:
+        return index, ex
+    except Exception as ex:
+        if not return_exceptions:
+            raise
+        return index, ex
+
+
+def as_completed(calls, timeout=None, return_exceptions=False):
+    """
+    Fan calls out to any number of clients at once, yielding results as
+    they arrive.
+
+    :param calls: a sequence of (AsyncAvroClient, message name, arguments).
+    :param timeout: the most seconds to wait for every result.
+    :param return_exceptions: whether to yield transport errors too, rather
+        than raise them. Failed calls' AvroRemoteExceptions are always
+        yielded.
+    :return: an iterator of awaitables, each giving a tuple of (index of
+        the call, its response), in the order they complete.
+    """
+    return asyncio.as_completed(
+        [
+            _indexed_call(index, avro_client, message_name, args,
+                          return_exceptions)
+            for index, (avro_client, message_name, args) in enumerate(calls)
+        ],
+        timeout=timeout
+    )
+
+
+async def gather(calls, timeout=None, return_exceptions=False):
+    """
+    Fan calls out to any number of clients at once, collecting their
+    results.
+
+    :param calls: a sequence of (AsyncAvroClient, message name, arguments).
+    :param timeout: the most seconds to wait for every result.
+    :param return_exceptions: see as_completed.
+    :return: a list of responses, in the order of calls.
+    """
+    results = [None] * len(calls)
+    for next_result in as_completed(calls, timeout, return_exceptions):
+        index, result = await next_result
+        results[index] = result
+    return results
+
+
+__all__ = [
+    AsyncAvroClient.__name__,
+    AsyncConnection.__name__,
+    AsyncConnectionPool.__name__,
+    ConnectionClosed.__name__,
+    StaleConnection.__name__,
+    as_completed.__name__,
+    gather.__name__,
+    read_response.__name__
+]
@@ -0,0 +1,113 @@
+import logging
+import threading
+
+try:
+    from concurrent import futures
+except ImportError:  # pragma: no cover
+    futures = None
+
+from pyramid import threadlocal as p_threadlocal
+
+logger = logging.getLogger(__name__)
+
+# Many avro calls can be sent in one HTTP request, with an "Avro-Batch: 1"
+# header. The (framed) body then holds a handshake request, unless sent with
+# hash headers instead (see routes.AvroServiceRoute.stateless_remote), the
+# number of calls as an avro long, and that many call requests back to back.
+# The response likewise holds a handshake response, the number of calls, and
+# a call response for each call, in the order they were sent.
+BATCH_HEADER = "Avro-Batch"
+BATCH_VALUE = "1"
+
+
+def is_batch(request):
+    """
+    Check whether a request carries a batch of calls.
+
+    :param request: a webob request.
+    :return: a bool.
+    """
+    return request.headers.get(BATCH_HEADER, "").strip() == BATCH_VALUE
+
+
+class CallRequest(object):
+    """
+    A view of a batch's request for one of its calls.
+
+    Attributes are read from the underlying request, but set on the view,
+    so each call gets an "avro_data" of its own even when calls run
+    concurrently.
+    """
+
+    def __init__(self, request):
+        self._request = request
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+
+class BatchDispatcher(object):
+    """
+    Invokes the calls of a batch, in order or on a thread pool of its own.
+
+    Calls are handed to message implementations with a CallRequest as the
+    current request, in pyramid's threadlocals as well as in the call.
+    """
+
+    def __init__(self, workers=1):
+        """
+        :param workers: the most calls of a batch to invoke at once. 1
+            invokes them in order, on the request's thread.
+        """
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """The thread pool calls run on, created on first use."""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = futures.ThreadPoolExecutor(self.workers)
+        return self._executor
+
+    def dispatch(self, invoke, calls):
+        """
+        Invoke every call of a batch.
+
+        :param invoke: a callable accepting one call.
+        :param calls: the decoded calls.
+        :return: the results of invoke, in the order of calls.
+        """
+        env = p_threadlocal.manager.get()
+
+        def invoke_call(call):
+            call_env = dict(env, request=CallRequest(env.get("request")))
+            p_threadlocal.manager.push(call_env)
+            try:
+                return invoke(call)
+            finally:
+                p_threadlocal.manager.pop()
+
+        if self.workers == 1 or len(calls) == 1 or futures is None:
+            return [invoke_call(call) for call in calls]
+        return list(self.executor.map(invoke_call, calls))
+
+    def shutdown(self, wait=True):
+        """
+        Shut the thread pool down. It's recreated if needed again.
+
+        :param wait: whether to wait for running calls to finish.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait)
+
+
+__all__ = [
+    BatchDispatcher.__name__,
+    CallRequest.__name__,
+    is_batch.__name__
+]
@@ -0,0 +1,268 @@
+import collections
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import threading
+import types
+
+try:
+    import copyreg
+except ImportError:  # pragma: no cover
+    import copy_reg as copyreg
+
+from avro import protocol as avro_protocol
+from avro import schema as avro_schema
+
+from . import codecs
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+# The default number of client protocols a responder remembers.
+PROTOCOL_CACHE_SIZE = 64
+
+# Bumped whenever the contents of parse cache entries change.
+PARSE_CACHE_VERSION = 1
+
+# A parsed protocol, with what a responder precomputes from it.
+ParsedProtocol = collections.namedtuple(
+    "ParsedProtocol",
+    ["protocol", "handshake_responses"]
+)
+
+
+class ProtocolCache(object):
+    """
+    A bounded, thread-safe LRU cache of client protocols, keyed by protocol
+    hash.
+
+    avro.ipc.Responder remembers every client protocol it's ever been sent
+    in a plain dict, so a client sending a new protocol with every call grows
+    it without limit. This holds at most max_size entries, evicting the
+    least recently used, and counts hits, misses and evictions.
+    """
+
+    def __init__(self, max_size=PROTOCOL_CACHE_SIZE):
+        """
+        :param max_size: the most entries to hold.
+        """
+        if max_size <= 0:
+            raise ValueError("Cache size must be positive.")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """
+        Look up an entry, marking it as the most recently used.
+
+        :param key: a protocol hash.
+        :return: the cached value, or None.
+        """
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Add or replace an entry, evicting the least recently used entries
+        beyond max_size.
+
+        :param key: a protocol hash.
+        :param value: the value to cache.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_size:
+                evicted, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+                logger.debug("Evicted protocol {!r}.".format(evicted))
+
+    def clear(self):
+        """Drop every entry, keeping the counters."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Report the cache's size and counters.
+
+        :return: a dict.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+def _reduce_immutable_dict(value):
+    # ImmutableDict refuses the item assignments pickle restores dicts with.
+    return value.__class__, (dict(value),)
+
+
+def _reduce_generator(value):
+    # avro leaves request schemas' "fields" property an unused generator.
+    return iter, ((),)
+
+
+class _ProtocolPickler(pickle.Pickler):
+
+    dispatch_table = copyreg.dispatch_table.copy()
+    dispatch_table[types.GeneratorType] = _reduce_generator
+    if hasattr(avro_schema, "ImmutableDict"):
+        dispatch_table[avro_schema.ImmutableDict] = _reduce_immutable_dict
+
+
+def _avro_version():
+    version_file = os.path.join(
+        os.path.dirname(avro_protocol.__file__),
+        "VERSION.txt"
+    )
+    try:
+        with open(version_file) as _file:
+            return _file.read().strip()
+    except (IOError, OSError):
+        return "unknown"
+
+
+def parse_protocol(schema):
+    """
+    Parse a protocol and precompute what a responder needs from it.
+
+    :param schema: the avro protocol JSON.
+    :return: a ParsedProtocol.
+    """
+    protocol = avro_protocol.Parse(schema)
+    return ParsedProtocol(
+        protocol,
+        codecs.serialize_handshake_responses(protocol)
+    )
+
+
+def schema_fingerprint(schema):
+    """
+    Identify a protocol by its JSON contents.
+
+    :param schema: the avro protocol JSON.
+    :return: a hex digest.
+    """
+    if not isinstance(schema, bytes):
+        schema = schema.encode("utf-8")
+    return hashlib.sha256(schema).hexdigest()
+
+
+def parse_cache_key(schema):
+    """
+    Compute the parse cache key of a protocol: a hash of its JSON, and of
+    the python and avro versions its cache entry is only valid for.
+
+    :param schema: the avro protocol JSON.
+    :return: a hex digest.
+    """
+    digest = hashlib.sha256()
+    digest.update("pyramid_avro:{}:{}:{}\n".format(
+        PARSE_CACHE_VERSION,
+        ".".join(str(part) for part in sys.version_info[:2]),
+        _avro_version()
+    ).encode("utf-8"))
+    if not isinstance(schema, bytes):
+        schema = schema.encode("utf-8")
+    digest.update(schema)
+    return digest.hexdigest()
+
+
+def _read_entry(path):
+    try:
+        with open(path, "rb") as _file:
+            entry = pickle.load(_file)
+    except (IOError, OSError):
+        return None
+    except Exception:
+        logger.warning("Ignoring unreadable parse cache entry {}.".format(
+            path
+        ), exc_info=True)
+        return None
+    if not isinstance(entry, ParsedProtocol):
+        logger.warning("Ignoring invalid parse cache entry {}.".format(path))
+        return None
+    return entry
+
+
+def _write_entry(path, entry):
+    def write(tmp_path):
+        with open(tmp_path, "wb") as _file:
+            _ProtocolPickler(_file, pickle.HIGHEST_PROTOCOL).dump(entry)
+
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        utils.write_atomically(path, write)
+    except Exception:
+        logger.warning("Failed to write parse cache entry {}.".format(
+            path
+        ), exc_info=True)
+
+
+def load_protocol(schema, cache_dir=None):
+    """
+    Parse a protocol (see parse_protocol), through an on-disk cache of
+    pickled results when cache_dir is given.
+
+    Entries are keyed by the protocol's content (see parse_cache_key), so a
+    changed schema file is simply parsed again, and the entries of schemas
+    no longer in use are never read. Unreadable entries are replaced, and
+    failing to write one never fails the parse.
+
+    Entries are unpickled: cache_dir must only be writable by trusted users.
+
+    :param schema: the avro protocol JSON.
+    :param cache_dir: an optional directory to keep cache entries in,
+        created as needed.
+    :return: a ParsedProtocol.
+    """
+    if cache_dir is None:
+        return parse_protocol(schema)
+
+    path = os.path.join(
+        cache_dir,
+        "{}.pickle".format(parse_cache_key(schema))
+    )
+    entry = _read_entry(path)
+    if entry is not None:
+        logger.debug("Loaded parsed protocol from {}.".format(path))
+        return entry
+
+    entry = parse_protocol(schema)
+    _write_entry(path, entry)
+    return entry
+
+
+__all__ = [
+    ParsedProtocol.__name__,
+    ProtocolCache.__name__,
+    load_protocol.__name__,
+    parse_cache_key.__name__,
+    parse_protocol.__name__,
+    schema_fingerprint.__name__
+]
@@ -0,0 +1,742 @@
+import io
+import logging
+import socket
+import threading
+
+try:
+    from http import client as http_client
+except ImportError:  # pragma: no cover
+    import httplib as http_client
+try:
+    from urllib import parse as urlparse
+except ImportError:  # pragma: no cover
+    import urlparse
+
+from avro import ipc as avro_ipc
+from avro import protocol as avro_protocol
+from avro import schema as avro_schema
+
+from . import batch
+from . import codecs
+from . import framing
+from . import handshake
+from . import routes
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 30.0
+
+# The most idle connections kept open to a single host.
+MAX_IDLE_CONNECTIONS = 8
+
+# The most times a call is sent: stale keep-alive connections and handshakes
+# the server has forgotten each cost a retry.
+MAX_ATTEMPTS = 3
+
+
+class HandshakeRequired(avro_schema.AvroException):
+    """
+    Raised when the server didn't know the client's protocol. The requestor
+    will send its protocol along with the next handshake, so the call should
+    be retried.
+    """
+
+
+class Requestor(object):
+    """
+    Encodes avro call requests and decodes call responses for a client
+    protocol with compiled codecs, leaving the transport to the caller.
+
+    Request bodies and response bodies are the framed HTTP bodies of a
+    single call, or of a batch of calls (see the batch module). Calls can
+    be sent with a regular handshake or, once the server is known to have
+    the client's protocol, without one (see "headers").
+
+    The server's protocol is assumed to be the client's own until a
+    handshake says otherwise.
+
+    Calls made while serving a traced call carry its trace context, in
+    their metadata and in the HTTP headers (see the tracing module).
+    """
+
+    def __init__(self, protocol, server_protocol=None):
+        """
+        :param protocol: the client's avro protocol, or its JSON.
+        :param server_protocol: the server's avro protocol, if known.
+        """
+        if isinstance(protocol, basestring):
+            protocol = avro_protocol.Parse(protocol)
+        self.local_protocol = protocol
+        self.server_protocol = server_protocol or protocol
+        self.send_protocol = False
+        self._compiler = codecs.SchemaCompiler()
+        self._request_writers = {}
+        self._server_compiler = None
+        self._response_readers = {}
+
+    def _set_server_protocol(self, server_protocol):
+        if server_protocol.md5 != self.server_protocol.md5:
+            self.server_protocol = server_protocol
+            self._server_compiler = None
+            self._response_readers = {}
+
+    def headers(self, stateless=False, is_batch=False):
+        """
+        Produce the HTTP headers to send a request body with.
+
+        :param stateless: whether the body was encoded without a handshake.
+        :param is_batch: whether the body holds a batch of calls.
+        :return: a dict of headers, with the current trace context (see
+            tracing.current_context).
+        """
+        headers = {"Content-Type": "avro/binary"}
+        if stateless:
+            headers[handshake.CLIENT_HASH_HEADER] = handshake.encode_hash(
+                self.local_protocol.md5
+            )
+            headers[handshake.SERVER_HASH_HEADER] = handshake.encode_hash(
+                self.server_protocol.md5
+            )
+        if is_batch:
+            headers[batch.BATCH_HEADER] = batch.BATCH_VALUE
+        return tracing.inject_headers(tracing.current_context(), headers)
+
+    def write_handshake_request(self, out):
+        """
+        Append a handshake request to out.
+
+        :param out: a bytearray.
+        """
+        handshake_request = {
+            "clientHash": self.local_protocol.md5,
+            "serverHash": self.server_protocol.md5
+        }
+        if self.send_protocol:
+            handshake_request["clientProtocol"] = str(self.local_protocol)
+        codecs.write_handshake_request(handshake_request, out)
+
+    def read_handshake_response(self, buf, pos=0):
+        """
+        Read a handshake response, learning the server's protocol if it
+        sent one.
+
+        :param buf: the response bytes.
+        :param pos: an offset into buf.
+        :return: the next offset.
+        """
+        handshake_response, pos = codecs.decode(
+            codecs.read_handshake_response,
+            buf,
+            pos
+        )
+        match = handshake_response["match"]
+        server_protocol = handshake_response.get("serverProtocol")
+        if server_protocol is not None:
+            self._set_server_protocol(avro_protocol.Parse(server_protocol))
+
+        if match == "NONE":
+            self.send_protocol = True
+            raise HandshakeRequired(
+                "The server doesn't know this client's protocol."
+            )
+        self.send_protocol = False
+        return pos
+
+    def write_call_request(self, message_name, args, out, metadata=None):
+        """
+        Append a call request to out.
+
+        :param message_name: an avro message name.
+        :param args: a dict of message arguments.
+        :param out: a bytearray.
+        :param metadata: an optional call metadata map.
+        """
+        write_request = self._request_writers.get(message_name)
+        if write_request is None:
+            message = self.local_protocol.message_map.get(message_name)
+            if message is None:
+                raise avro_schema.AvroException(
+                    "Unknown message: {}".format(message_name)
+                )
+            write_request = self._compiler.writer(message.request)
+            self._request_writers[message_name] = write_request
+
+        codecs.write_metadata(metadata or {}, out)
+        codecs.write_utf8(message_name, out)
+        write_request(args, out)
+
+    def _readers(self, message_name):
+        readers = self._response_readers.get(message_name)
+        if readers is None:
+            local_message = self.local_protocol.message_map.get(message_name)
+            server_message = self.server_protocol.message_map.get(
+                message_name
+            )
+            if local_message is None or server_message is None:
+                raise avro_schema.AvroException(
+                    "Unknown message: {}".format(message_name)
+                )
+            if self._server_compiler is None:
+                self._server_compiler = codecs.SchemaCompiler()
+            readers = (
+                self._server_compiler.reader(
+                    server_message.response,
+                    local_message.response
+                ),
+                self._server_compiler.reader(
+                    server_message.errors,
+                    local_message.errors
+                )
+            )
+            self._response_readers[message_name] = readers
+        return readers
+
+    def read_call_response(self, message_name, buf, pos=0):
+        """
+        Read a call response.
+
+        :param message_name: the avro message called.
+        :param buf: the response bytes.
+        :param pos: the offset of the call response in buf.
+        :return: a tuple of (the call's response, next offset).
+        :raises avro.ipc.AvroRemoteException: when the call failed.
+        """
+        failed, datum, pos = self._read_call(message_name, buf, pos)
+        if failed:
+            raise avro_ipc.AvroRemoteException(datum)
+        return datum, pos
+
+    def _read_call(self, message_name, buf, pos):
+        _, pos = codecs.decode(codecs.read_metadata, buf, pos)
+        failed, pos = codecs.decode(codecs.read_boolean, buf, pos)
+        read_response, read_error = self._readers(message_name)
+        datum, pos = codecs.decode(
+            read_error if failed else read_response,
+            buf,
+            pos
+        )
+        return failed, datum, pos
+
+    def encode_call(self, message_name, args):
+        """
+        Encode a single call, without its handshake, so it can be sent (and
+        resent) with encoded_body. The call carries the current trace
+        context, if any.
+
+        :param message_name: an avro message name.
+        :param args: a dict of message arguments.
+        :return: the encoded call bytes.
+        """
+        out = bytearray()
+        self.write_call_request(
+            message_name,
+            args,
+            out,
+            tracing.inject_metadata(tracing.current_context())
+        )
+        return bytes(out)
+
+    def encode_batch(self, calls):
+        """
+        Encode a batch of calls, without its handshake, so it can be sent
+        (and resent) with encoded_body. Every call carries the current trace
+        context, if any.
+
+        :param calls: a sequence of (message name, arguments) pairs.
+        :return: the encoded batch bytes.
+        """
+        if not calls:
+            raise ValueError("A batch needs at least one call.")
+        metadata = tracing.inject_metadata(tracing.current_context())
+        out = bytearray()
+        codecs.write_long(len(calls), out)
+        for message_name, args in calls:
+            self.write_call_request(message_name, args, out, metadata)
+        return bytes(out)
+
+    def encoded_body(self, encoded, stateless=False):
+        """
+        Frame the HTTP body of an encoded call or batch, after a handshake
+        unless stateless.
+
+        :param encoded: bytes from encode_call or encode_batch.
+        :param stateless: whether to leave the handshake out, see "headers".
+        :return: the body bytes.
+        """
+        out = bytearray()
+        if not stateless:
+            self.write_handshake_request(out)
+        out += encoded
+        return b"".join(framing.FramedMessageIterator(out))
+
+    def call_body(self, message_name, args, stateless=False):
+        """
+        Encode the framed HTTP body of a single call.
+
+        :param message_name: an avro message name.
+        :param args: a dict of message arguments.
+        :param stateless: whether to leave the handshake out, see "headers".
+        :return: the body bytes.
+        """
+        return self.encoded_body(
+            self.encode_call(message_name, args),
+            stateless
+        )
+
+    def read_call_body(self, message_name, body, stateless=False):
+        """
+        Decode the framed HTTP response body of a single call.
+
+        :param message_name: the avro message called.
+        :param body: the response body bytes.
+        :param stateless: whether the call was sent without a handshake.
+        :return: the call's response.
+        :raises HandshakeRequired: when the call must be sent again.
+        :raises avro.ipc.AvroRemoteException: when the call failed.
+        """
+        buf = framing.FrameReader(io.BytesIO(body)).read_message()
+        pos = 0
+        if not stateless:
+            pos = self.read_handshake_response(buf, pos)
+        return self.read_call_response(message_name, buf, pos)[0]
+
+    def batch_body(self, calls, stateless=False):
+        """
+        Encode the framed HTTP body of a batch of calls, to be sent with the
+        headers from headers(is_batch=True).
+
+        :param calls: a sequence of (message name, arguments) pairs.
+        :param stateless: whether to leave the handshake out, see "headers".
+        :return: the body bytes.
+        """
+        return self.encoded_body(self.encode_batch(calls), stateless)
+
+    def read_batch_body(self, message_names, body, stateless=False):
+        """
+        Decode the framed HTTP response body of a batch of calls.
+
+        :param message_names: the avro message of each call, in order.
+        :param body: the response body bytes.
+        :param stateless: whether the batch was sent without a handshake.
+        :return: a list with each call's response or, for calls that failed,
+            an avro.ipc.AvroRemoteException.
+        :raises HandshakeRequired: when the batch must be sent again.
+        """
+        buf = framing.FrameReader(io.BytesIO(body)).read_message()
+        pos = 0
+        if not stateless:
+            pos = self.read_handshake_response(buf, pos)
+        count, pos = codecs.decode(codecs.read_long, buf, pos)
+        if count != len(message_names):
+            raise avro_schema.AvroException(
+                "Expected {} responses, got {}.".format(
+                    len(message_names),
+                    count
+                )
+            )
+
+        results = []
+        for message_name in message_names:
+            failed, datum, pos = self._read_call(message_name, buf, pos)
+            if failed:
+                datum = avro_ipc.AvroRemoteException(datum)
+            results.append(datum)
+        return results
+
+
+class HTTPError(avro_schema.AvroException):
+    """Raised when a service answers with an unexpected HTTP status."""
+
+    def __init__(self, status, reason, body=b""):
+        super(HTTPError, self).__init__(
+            "HTTP {} {}".format(status, reason)
+        )
+        self.status = status
+        self.reason = reason
+        self.body = body
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of keep-alive HTTP connections to a single host.
+
+    Connections are handed out one caller at a time and returned for reuse
+    unless the server asked to close them. Each remembers which services
+    it's completed a handshake with (see AvroClient).
+    """
+
+    def __init__(self, scheme, host, port=None,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_idle=MAX_IDLE_CONNECTIONS, ssl_context=None):
+        """
+        :param scheme: "http" or "https".
+        :param host: a host name.
+        :param port: an optional port.
+        :param connect_timeout: the most seconds to wait for a connection.
+        :param read_timeout: the most seconds to wait on a connection for
+            each read or write once connected.
+        :param max_idle: the most idle connections to keep open.
+        :param ssl_context: an optional ssl.SSLContext for https.
+        """
+        if scheme not in ("http", "https"):
+            raise ValueError("Unsupported scheme: '{}'".format(scheme))
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_idle = max_idle
+        self.ssl_context = ssl_context
+        self.created = 0
+        self.reused = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.scheme == "https":
+            conn = http_client.HTTPSConnection(
+                self.host,
+                self.port,
+                timeout=self.connect_timeout,
+                context=self.ssl_context
+            )
+        else:
+            conn = http_client.HTTPConnection(
+                self.host,
+                self.port,
+                timeout=self.connect_timeout
+            )
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        conn.avro_handshakes = set()
+        with self._lock:
+            self.created += 1
+        return conn
+
+    def acquire(self):
+        """
+        Take an idle connection, or open a new one.
+
+        :return: a tuple of (connection, whether it was reused).
+        """
+        with self._lock:
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def release(self, conn):
+        """
+        Return a connection for reuse, closing it if the pool is full.
+
+        :param conn: a connection from acquire.
+        """
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def discard(self, conn):
+        """
+        Close a connection from acquire rather than reusing it.
+
+        :param conn: a connection from acquire.
+        """
+        conn.close()
+
+    def close(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        """
+        Report the pool's counters.
+
+        :return: a dict.
+        """
+        with self._lock:
+            return {
+                "idle": len(self._idle),
+                "created": self.created,
+                "reused": self.reused
+            }
+
+
+class PoolManager(object):
+    """
+    Hands out one ConnectionPool per host and set of timeouts, so clients of
+    services on the same host share their connections.
+    """
+
+    def __init__(self, max_idle=MAX_IDLE_CONNECTIONS):
+        self.max_idle = max_idle
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def connection_pool(self, scheme, host, port=None,
+                        connect_timeout=CONNECT_TIMEOUT,
+                        read_timeout=READ_TIMEOUT, ssl_context=None):
+        """
+        Get the pool of connections to a host.
+
+        :return: a ConnectionPool.
+        """
+        key = (scheme, host, port, connect_timeout, read_timeout,
+               ssl_context)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(
+                    scheme,
+                    host,
+                    port,
+                    connect_timeout=connect_timeout,
+                    read_timeout=read_timeout,
+                    max_idle=self.max_idle,
+                    ssl_context=ssl_context
+                )
+                self._pools[key] = pool
+        return pool
+
+    def close(self):
+        """Close every pool's idle connections."""
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.close()
+
+
+default_pools = PoolManager()
+
+
+def _nothing_received(error):
+    # What getresponse raises when the server closed the connection without
+    # sending a byte of a response: a keep-alive connection it had closed
+    # before the request reached it.
+    if isinstance(error, getattr(http_client, "RemoteDisconnected", ())):
+        return True
+    return (
+        isinstance(error, http_client.BadStatusLine) and
+        error.line in ("", "''")
+    )
+
+
+def post_request(conn, path, body, headers, reused=False):
+    """
+    POST a request on a connection and read its response.
+
+    Avro calls aren't idempotent, so a failed request is only worth
+    retrying when the server can't have run it: when a reused connection
+    failed while the request was being sent, or closed without any
+    response. Failures once a response started, or on new connections, are
+    raised.
+
+    :param conn: an http_client.HTTPConnection.
+    :param path: the request path.
+    :param body: the request body.
+    :param headers: a dict of request headers.
+    :param reused: whether the connection served requests before.
+    :return: a tuple of (response, body), or None when the connection was
+        stale and the request can be sent again on another.
+    """
+    try:
+        conn.request("POST", path, body, headers)
+    except socket.timeout:
+        raise
+    except (socket.error, http_client.HTTPException):
+        if reused:
+            return None
+        raise
+    try:
+        response = conn.getresponse()
+    except socket.timeout:
+        raise
+    except (socket.error, http_client.HTTPException) as ex:
+        if reused and _nothing_received(ex):
+            return None
+        raise
+    return response, response.read()
+
+
+def service_route(registry, service_name):
+    """
+    Look up a service registered with an application, so clients can reuse
+    its protocol.
+
+    :param registry: a pyramid registry.
+    :param service_name: a service added with add_avro_route.
+    :return: the service's routes.IAvroServiceRoute.
+    """
+    route = registry.queryUtility(
+        routes.IAvroServiceRoute,
+        name="avro.{}".format(service_name)
+    )
+    if route is None:
+        raise ValueError(
+            "Service '{}' has no route defined.".format(service_name)
+        )
+    return route
+
+
+class AvroClient(object):
+    """
+    A thread-safe client for an avro service served over HTTP, such as a
+    pyramid_avro route.
+
+    Connections are kept alive and pooled per host (see PoolManager). A
+    handshake is only sent the first time each connection is used to call
+    this service; after that, calls go without one, identified by protocol
+    hash headers, until the server asks for a handshake again.
+    """
+
+    def __init__(self, url, protocol, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, pools=None, stateless=True,
+                 ssl_context=None):
+        """
+        :param url: the service's URL.
+        :param protocol: the client's avro protocol: an avro protocol, its
+            JSON, or a routes.IAvroServiceRoute to reuse the protocol of.
+        :param connect_timeout: the most seconds to wait for a connection.
+        :param read_timeout: the most seconds to wait for each read or write
+            on a connection.
+        :param pools: a PoolManager. Defaults to one shared by the process.
+        :param stateless: whether to skip handshakes on connections that have
+            completed one. Only pyramid_avro servers support this.
+        :param ssl_context: an optional ssl.SSLContext for https URLs.
+        """
+        if routes.IAvroServiceRoute.providedBy(protocol):
+            protocol = protocol.protocol
+        parts = urlparse.urlsplit(url)
+        self.url = url
+        self.path = parts.path or "/"
+        if parts.query:
+            self.path = "{}?{}".format(self.path, parts.query)
+        self.pool = (pools or default_pools).connection_pool(
+            parts.scheme,
+            parts.hostname,
+            parts.port,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            ssl_context=ssl_context
+        )
+        self.requestor = Requestor(protocol)
+        self.stateless = stateless
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_service(cls, registry, service_name, url, **kwargs):
+        """
+        Build a client for a service registered with this application,
+        reusing its protocol.
+
+        :param registry: a pyramid registry.
+        :param service_name: a service added with add_avro_route.
+        :param url: the URL the service is served at.
+        :param kwargs: more AvroClient options.
+        :return: an AvroClient.
+        """
+        return cls(url, service_route(registry, service_name), **kwargs)
+
+    def call(self, message_name, args):
+        """
+        Call a message.
+
+        :param message_name: an avro message name.
+        :param args: a dict of message arguments.
+        :return: the message's response.
+        :raises avro.ipc.AvroRemoteException: when the call failed.
+        """
+        return self._send(
+            self.requestor.encode_call(message_name, args),
+            lambda body, stateless: self.requestor.read_call_body(
+                message_name,
+                body,
+                stateless
+            )
+        )
+
+    def batch(self, calls):
+        """
+        Call many messages in one request (see the batch module).
+
+        :param calls: a sequence of (message name, arguments) pairs.
+        :return: a list with each call's response or, for calls that failed,
+            an avro.ipc.AvroRemoteException.
+        """
+        message_names = [message_name for message_name, _ in calls]
+        return self._send(
+            self.requestor.encode_batch(calls),
+            lambda body, stateless: self.requestor.read_batch_body(
+                message_names,
+                body,
+                stateless
+            ),
+            is_batch=True
+        )
+
+    def _send(self, encoded, decode, is_batch=False):
+        for _ in range(MAX_ATTEMPTS):
+            conn, reused = self.pool.acquire()
+            stateless = self.stateless and self.path in conn.avro_handshakes
+            body = self.requestor.encoded_body(encoded, stateless)
+            headers = self.requestor.headers(stateless, is_batch)
+            try:
+                result = post_request(conn, self.path, body, headers, reused)
+            except Exception:
+                self.pool.discard(conn)
+                raise
+            if result is None:
+                self.pool.discard(conn)
+                logger.debug("Stale connection, retrying on another.")
+                continue
+            response, payload = result
+
+            if response.will_close:
+                self.pool.discard(conn)
+            else:
+                self.pool.release(conn)
+
+            if response.status == 412 and stateless:
+                # The server has forgotten this client's protocol.
+                conn.avro_handshakes.discard(self.path)
+                self.requestor.send_protocol = True
+                continue
+            if response.status != 200:
+                raise HTTPError(response.status, response.reason, payload)
+
+            if stateless:
+                return decode(payload, stateless)
+            try:
+                # Handshakes update the requestor's idea of the server.
+                with self._lock:
+                    result = decode(payload, stateless)
+            except HandshakeRequired:
+                continue
+            if response.getheader(handshake.SERVER_HASH_HEADER):
+                conn.avro_handshakes.add(self.path)
+            return result
+
+        raise avro_schema.AvroException(
+            "Failed to call {} after {} attempts.".format(
+                self.url,
+                MAX_ATTEMPTS
+            )
+        )
+
+
+__all__ = [
+    AvroClient.__name__,
+    ConnectionPool.__name__,
+    HandshakeRequired.__name__,
+    HTTPError.__name__,
+    PoolManager.__name__,
+    Requestor.__name__,
+    post_request.__name__,
+    service_route.__name__
+]
@@ -0,0 +1,955 @@
+import copy
+import logging
+import struct
+import sys
+
+from avro import io as avro_io
+from avro import ipc as avro_ipc
+from avro import schema as avro_schema
+
+logger = logging.getLogger(__name__)
+
+PY2 = sys.version_info[0] == 2
+
+if PY2:
+    INTEGER_TYPES = (int, long)  # noqa: F821
+else:
+    INTEGER_TYPES = (int,)
+
+INT_MIN_VALUE = -(1 << 31)
+INT_MAX_VALUE = (1 << 31) - 1
+LONG_MIN_VALUE = -(1 << 63)
+LONG_MAX_VALUE = (1 << 63) - 1
+
+STRUCT_FLOAT = struct.Struct("<f")
+STRUCT_DOUBLE = struct.Struct("<d")
+
+RECORD_TYPES = frozenset(("record", "error", "request"))
+UNION_TYPES = frozenset(("union", "error_union"))
+
+
+def _bytes(buf, start, end):
+    """
+    Slice "end - start" bytes out of buf, complaining if buf is too short.
+
+    :param buf: a bytes-like buffer.
+    :param start: a start offset.
+    :param end: an end offset.
+    :return: the sliced bytes.
+    """
+    if end > len(buf):
+        raise avro_schema.AvroException(
+            "Expected {} bytes at offset {}, only {} available.".format(
+                end - start, start, len(buf) - start
+            )
+        )
+    if buf.__class__ is bytes:
+        return buf[start:end]
+    return memoryview(buf)[start:end].tobytes()
+
+
+def read_long(buf, pos):
+    """
+    Read a zig-zag encoded varint out of buf at pos.
+
+    :param buf: a bytes-like buffer.
+    :param pos: an offset into buf.
+    :return: a tuple of (value, next offset).
+    """
+    b = buf[pos]
+    pos += 1
+    n = b & 0x7F
+    shift = 7
+    while b & 0x80:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        shift += 7
+    return (n >> 1) ^ -(n & 1), pos
+
+
+def write_long(datum, out):
+    """
+    Append a zig-zag encoded varint to out.
+
+    :param datum: an integer.
+    :param out: a bytearray.
+    """
+    n = (datum << 1) ^ (datum >> 63)
+    while n & ~0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_null(buf, pos):
+    return None, pos
+
+
+def read_boolean(buf, pos):
+    return buf[pos] == 1, pos + 1
+
+
+def _read_float(buf, pos):
+    return STRUCT_FLOAT.unpack_from(buf, pos)[0], pos + 4
+
+
+def _read_double(buf, pos):
+    return STRUCT_DOUBLE.unpack_from(buf, pos)[0], pos + 8
+
+
+def _read_bytes(buf, pos):
+    size, pos = read_long(buf, pos)
+    end = pos + size
+    return _bytes(buf, pos, end), end
+
+
+def read_utf8(buf, pos):
+    size, pos = read_long(buf, pos)
+    end = pos + size
+    return _bytes(buf, pos, end).decode("utf-8"), end
+
+
+def _write_null(datum, out):
+    pass
+
+
+def _write_boolean(datum, out):
+    out.append(1 if datum else 0)
+
+
+def _write_float(datum, out):
+    out += STRUCT_FLOAT.pack(datum)
+
+
+def _write_double(datum, out):
+    out += STRUCT_DOUBLE.pack(datum)
+
+
+def _write_bytes(datum, out):
+    write_long(len(datum), out)
+    out += datum
+
+
+def _write_fixed(datum, out):
+    out += datum
+
+
+def write_utf8(datum, out):
+    datum = datum.encode("utf-8")
+    write_long(len(datum), out)
+    out += datum
+
+
+_PRIMITIVE_READERS = {
+    "null": _read_null,
+    "boolean": read_boolean,
+    "int": read_long,
+    "long": read_long,
+    "float": _read_float,
+    "double": _read_double,
+    "bytes": _read_bytes,
+    "string": read_utf8,
+}
+
+
+class SchemaCompiler(object):
+    """
+    Compiles avro schemas into specialized python closures.
+
+    Three kinds of functions are produced, each mirroring one of the generic
+    avro.io tree walks:
+
+        # validators: datum -> bool, equivalent to avro.io.Validate.
+        # writers: (datum, out) -> None, appending the binary encoding of
+          datum to the bytearray "out". Writers type check as they go and
+          raise avro.io.AvroTypeException on a mismatch.
+        # readers: (buf, pos) -> (datum, pos), decoding data written with a
+          writer's schema into the shape of a reader's schema.
+
+    Compiled functions are memoized per schema object so recursive named
+    types resolve to the same closure.
+
+    An unchecked compiler produces writers that skip the inline type checks
+    (union branches are still selected by type). Those are meant for callers
+    that have already validated their data, or have opted out of validation
+    entirely.
+    """
+
+    def __init__(self, checked=True):
+        self.checked = checked
+        self._validators = {}
+        self._writers = {}
+        self._readers = {}
+
+    # Validators.
+
+    def validator(self, schema):
+        """
+        Produce a function equivalent to avro.io.Validate for schema.
+
+        :param schema: an avro schema.
+        :return: a callable accepting a datum and returning a bool.
+        """
+        key = id(schema)
+        compiled = self._validators.get(key)
+        if compiled is None:
+            if schema.type in RECORD_TYPES:
+                # Allow recursive records to refer back to themselves.
+                cell = []
+                self._validators[key] = lambda datum: cell[0](datum)
+                compiled = self._compile_validator(schema)
+                cell.append(compiled)
+            else:
+                compiled = self._compile_validator(schema)
+            self._validators[key] = compiled
+        return compiled
+
+    def _compile_validator(self, schema):
+        schema_type = schema.type
+        if schema_type == "null":
+            return lambda datum: datum is None
+        elif schema_type == "boolean":
+            return lambda datum: isinstance(datum, bool)
+        elif schema_type == "string":
+            return lambda datum: isinstance(datum, basestring)
+        elif schema_type == "bytes":
+            return lambda datum: isinstance(datum, bytes)
+        elif schema_type == "int":
+            return lambda datum: (
+                isinstance(datum, INTEGER_TYPES) and
+                INT_MIN_VALUE <= datum <= INT_MAX_VALUE
+            )
+        elif schema_type == "long":
+            return lambda datum: (
+                isinstance(datum, INTEGER_TYPES) and
+                LONG_MIN_VALUE <= datum <= LONG_MAX_VALUE
+            )
+        elif schema_type in ("float", "double"):
+            number_types = INTEGER_TYPES + (float,)
+            return lambda datum: isinstance(datum, number_types)
+        elif schema_type == "fixed":
+            size = schema.size
+            return lambda datum: (
+                isinstance(datum, bytes) and len(datum) == size
+            )
+        elif schema_type == "enum":
+            symbols = frozenset(schema.symbols)
+
+            def validate_enum(datum):
+                try:
+                    return datum in symbols
+                except TypeError:
+                    return False
+            return validate_enum
+        elif schema_type == "array":
+            items = self.validator(schema.items)
+            return lambda datum: (
+                isinstance(datum, list) and all(items(el) for el in datum)
+            )
+        elif schema_type == "map":
+            values = self.validator(schema.values)
+            return lambda datum: (
+                isinstance(datum, dict) and
+                all(isinstance(key, basestring) for key in datum) and
+                all(values(val) for val in datum.values())
+            )
+        elif schema_type in UNION_TYPES:
+            branches = [self.validator(s) for s in schema.schemas]
+            return lambda datum: any(branch(datum) for branch in branches)
+        elif schema_type in RECORD_TYPES:
+            fields = [
+                (field.name, self.validator(field.type))
+                for field in schema.fields
+            ]
+
+            def validate_record(datum):
+                if not isinstance(datum, dict):
+                    return False
+                get = datum.get
+                for name, validate in fields:
+                    if not validate(get(name)):
+                        return False
+                return True
+            return validate_record
+
+        raise avro_schema.AvroException(
+            "Unknown Avro schema type: {}".format(schema_type)
+        )
+
+    # Writers.
+
+    def writer(self, schema):
+        """
+        Produce a function that appends the binary encoding of a datum for
+        schema to a bytearray.
+
+        :param schema: an avro schema.
+        :return: a callable accepting a datum and a bytearray.
+        """
+        key = id(schema)
+        compiled = self._writers.get(key)
+        if compiled is None:
+            if self.checked or schema.type in UNION_TYPES:
+                compile_writer = self._compile_writer
+            else:
+                compile_writer = self._compile_unchecked_writer
+
+            if schema.type in RECORD_TYPES:
+                cell = []
+                self._writers[key] = lambda datum, out: cell[0](datum, out)
+                compiled = compile_writer(schema)
+                cell.append(compiled)
+            else:
+                compiled = compile_writer(schema)
+            self._writers[key] = compiled
+        return compiled
+
+    def _compile_unchecked_writer(self, schema):
+        schema_type = schema.type
+        if schema_type == "null":
+            return _write_null
+        elif schema_type == "boolean":
+            return _write_boolean
+        elif schema_type in ("int", "long"):
+            return write_long
+        elif schema_type == "float":
+            return _write_float
+        elif schema_type == "double":
+            return _write_double
+        elif schema_type == "bytes":
+            return _write_bytes
+        elif schema_type == "string":
+            return write_utf8
+        elif schema_type == "fixed":
+            return _write_fixed
+        elif schema_type == "enum":
+            indexes = dict(
+                (symbol, index) for index, symbol in enumerate(schema.symbols)
+            )
+            return lambda datum, out: write_long(indexes[datum], out)
+        elif schema_type == "array":
+            items = self.writer(schema.items)
+
+            def write_array(datum, out):
+                if datum:
+                    write_long(len(datum), out)
+                    for item in datum:
+                        items(item, out)
+                out.append(0)
+            return write_array
+        elif schema_type == "map":
+            values = self.writer(schema.values)
+
+            def write_map(datum, out):
+                if datum:
+                    write_long(len(datum), out)
+                    for key, val in datum.items():
+                        write_utf8(key, out)
+                        values(val, out)
+                out.append(0)
+            return write_map
+        elif schema_type in RECORD_TYPES:
+            fields = [
+                (field.name, self.writer(field.type))
+                for field in schema.fields
+            ]
+
+            def write_record(datum, out):
+                get = datum.get
+                for name, write in fields:
+                    write(get(name), out)
+            return write_record
+
+        return self._compile_writer(schema)
+
+    def _compile_writer(self, schema):
+        schema_type = schema.type
+
+        def mismatch(datum):
+            return avro_io.AvroTypeException(schema, datum)
+
+        if schema_type == "null":
+            def write_null(datum, out):
+                if datum is not None:
+                    raise mismatch(datum)
+            return write_null
+        elif schema_type == "boolean":
+            def write_boolean(datum, out):
+                if not isinstance(datum, bool):
+                    raise mismatch(datum)
+                out.append(1 if datum else 0)
+            return write_boolean
+        elif schema_type in ("int", "long"):
+            if schema_type == "int":
+                low, high = INT_MIN_VALUE, INT_MAX_VALUE
+            else:
+                low, high = LONG_MIN_VALUE, LONG_MAX_VALUE
+
+            def write_integer(datum, out):
+                if not isinstance(datum, INTEGER_TYPES) or \
+                        not low <= datum <= high:
+                    raise mismatch(datum)
+                write_long(datum, out)
+            return write_integer
+        elif schema_type in ("float", "double"):
+            number_types = INTEGER_TYPES + (float,)
+            if schema_type == "float":
+                pack = STRUCT_FLOAT.pack
+            else:
+                pack = STRUCT_DOUBLE.pack
+
+            def write_number(datum, out):
+                if not isinstance(datum, number_types):
+                    raise mismatch(datum)
+                out += pack(datum)
+            return write_number
+        elif schema_type == "bytes":
+            def write_bytes(datum, out):
+                if not isinstance(datum, bytes):
+                    raise mismatch(datum)
+                write_long(len(datum), out)
+                out += datum
+            return write_bytes
+        elif schema_type == "string":
+            def write_utf8(datum, out):
+                if not isinstance(datum, basestring):
+                    raise mismatch(datum)
+                datum = datum.encode("utf-8")
+                write_long(len(datum), out)
+                out += datum
+            return write_utf8
+        elif schema_type == "fixed":
+            size = schema.size
+
+            def write_fixed(datum, out):
+                if not isinstance(datum, bytes) or len(datum) != size:
+                    raise mismatch(datum)
+                out += datum
+            return write_fixed
+        elif schema_type == "enum":
+            indexes = dict(
+                (symbol, index) for index, symbol in enumerate(schema.symbols)
+            )
+
+            def write_enum(datum, out):
+                try:
+                    index = indexes[datum]
+                except (KeyError, TypeError):
+                    raise mismatch(datum)
+                write_long(index, out)
+            return write_enum
+        elif schema_type == "array":
+            items = self.writer(schema.items)
+
+            def write_array(datum, out):
+                if not isinstance(datum, list):
+                    raise mismatch(datum)
+                if datum:
+                    write_long(len(datum), out)
+                    for item in datum:
+                        items(item, out)
+                out.append(0)
+            return write_array
+        elif schema_type == "map":
+            values = self.writer(schema.values)
+
+            def write_map(datum, out):
+                if not isinstance(datum, dict):
+                    raise mismatch(datum)
+                if datum:
+                    write_long(len(datum), out)
+                    for key, val in datum.items():
+                        if not isinstance(key, basestring):
+                            raise mismatch(datum)
+                        key = key.encode("utf-8")
+                        write_long(len(key), out)
+                        out += key
+                        values(val, out)
+                out.append(0)
+            return write_map
+        elif schema_type in UNION_TYPES:
+            branches = self._union_branches(schema)
+
+            def write_union(datum, out):
+                for index, matches, write in branches:
+                    if matches(datum):
+                        write_long(index, out)
+                        write(datum, out)
+                        return
+                raise mismatch(datum)
+            return write_union
+        elif schema_type in RECORD_TYPES:
+            fields = [
+                (field.name, self.writer(field.type))
+                for field in schema.fields
+            ]
+
+            def write_record(datum, out):
+                if not isinstance(datum, dict):
+                    raise mismatch(datum)
+                get = datum.get
+                for name, write in fields:
+                    write(get(name), out)
+            return write_record
+
+        raise avro_schema.AvroException(
+            "Unknown type: {}".format(schema_type)
+        )
+
+    def _union_branches(self, schema):
+        """
+        Build (index, predicate, writer) triples for each union branch.
+
+        Branches whose python representation can't be confused with any
+        other branch get a cheap type check; the rest fall back to a full
+        compiled validator, tried in declaration order.
+        """
+        shallow = [_shallow_kind(s) for s in schema.schemas]
+        branches = []
+        for index, branch in enumerate(schema.schemas):
+            kind = shallow[index]
+            if kind is not None and shallow.count(kind) == 1:
+                matches = _shallow_check(branch)
+            else:
+                matches = self.validator(branch)
+            branches.append((index, matches, self.writer(branch)))
+        return branches
+
+    # Readers.
+
+    def reader(self, writer_schema, reader_schema=None):
+        """
+        Produce a function that decodes data written with writer_schema into
+        the shape described by reader_schema, following the Avro schema
+        resolution rules.
+
+        :param writer_schema: the avro schema the data was written with.
+        :param reader_schema: an optional avro schema to resolve into.
+        :return: a callable accepting (buf, pos), returning (datum, pos).
+        """
+        if reader_schema is None:
+            reader_schema = writer_schema
+
+        key = (id(writer_schema), id(reader_schema))
+        compiled = self._readers.get(key)
+        if compiled is None:
+            if writer_schema.type in RECORD_TYPES:
+                cell = []
+                self._readers[key] = lambda buf, pos: cell[0](buf, pos)
+                compiled = self._compile_reader(writer_schema, reader_schema)
+                cell.append(compiled)
+            else:
+                compiled = self._compile_reader(writer_schema, reader_schema)
+            self._readers[key] = compiled
+        return compiled
+
+    def _compile_reader(self, writer_schema, reader_schema):
+        w_type = writer_schema.type
+        r_type = reader_schema.type
+
+        if not avro_io.DatumReader.match_schemas(writer_schema, reader_schema):
+            return _resolution_failure(writer_schema, reader_schema)
+
+        if w_type not in UNION_TYPES and r_type in UNION_TYPES:
+            for branch in reader_schema.schemas:
+                if avro_io.DatumReader.match_schemas(writer_schema, branch):
+                    return self.reader(writer_schema, branch)
+            return _resolution_failure(writer_schema, reader_schema)
+
+        if w_type in _PRIMITIVE_READERS:
+            read = _PRIMITIVE_READERS[w_type]
+            if w_type != r_type and r_type in ("float", "double"):
+                def read_promoted(buf, pos):
+                    datum, pos = read(buf, pos)
+                    return float(datum), pos
+                return read_promoted
+            return read
+        elif w_type == "fixed":
+            size = writer_schema.size
+
+            def read_fixed(buf, pos):
+                end = pos + size
+                return _bytes(buf, pos, end), end
+            return read_fixed
+        elif w_type == "enum":
+            symbols = list(writer_schema.symbols)
+            known = frozenset(reader_schema.symbols)
+
+            def read_enum(buf, pos):
+                index, pos = read_long(buf, pos)
+                if not 0 <= index < len(symbols):
+                    raise avro_io.SchemaResolutionException(
+                        "Can't access enum index {} for enum with {} "
+                        "symbols".format(index, len(symbols)),
+                        writer_schema, reader_schema
+                    )
+                symbol = symbols[index]
+                if symbol not in known:
+                    raise avro_io.SchemaResolutionException(
+                        "Symbol {} not present in Reader's Schema".format(
+                            symbol
+                        ),
+                        writer_schema, reader_schema
+                    )
+                return symbol, pos
+            return read_enum
+        elif w_type == "array":
+            items = self.reader(writer_schema.items, reader_schema.items)
+
+            def read_array(buf, pos):
+                result = []
+                append = result.append
+                count, pos = read_long(buf, pos)
+                while count:
+                    if count < 0:
+                        count = -count
+                        _, pos = read_long(buf, pos)
+                    for _ in range(count):
+                        item, pos = items(buf, pos)
+                        append(item)
+                    count, pos = read_long(buf, pos)
+                return result, pos
+            return read_array
+        elif w_type == "map":
+            values = self.reader(writer_schema.values, reader_schema.values)
+
+            def read_map(buf, pos):
+                result = {}
+                count, pos = read_long(buf, pos)
+                while count:
+                    if count < 0:
+                        count = -count
+                        _, pos = read_long(buf, pos)
+                    for _ in range(count):
+                        key, pos = read_utf8(buf, pos)
+                        result[key], pos = values(buf, pos)
+                    count, pos = read_long(buf, pos)
+                return result, pos
+            return read_map
+        elif w_type in UNION_TYPES:
+            branches = [
+                self.reader(branch, reader_schema)
+                for branch in writer_schema.schemas
+            ]
+
+            def read_union(buf, pos):
+                index, pos = read_long(buf, pos)
+                if not 0 <= index < len(branches):
+                    raise avro_io.SchemaResolutionException(
+                        "Can't access branch index {} for union with {} "
+                        "branches".format(index, len(branches)),
+                        writer_schema, reader_schema
+                    )
+                return branches[index](buf, pos)
+            return read_union
+        elif w_type in RECORD_TYPES:
+            return self._compile_record_reader(writer_schema, reader_schema)
+
+        raise avro_schema.AvroException(
+            "Cannot read unknown schema type: {}".format(w_type)
+        )
+
+    def _compile_record_reader(self, writer_schema, reader_schema):
+        reader_fields = dict(
+            (field.name, field) for field in reader_schema.fields
+        )
+        writer_names = set(field.name for field in writer_schema.fields)
+
+        steps = []
+        for field in writer_schema.fields:
+            reader_field = reader_fields.get(field.name)
+            if reader_field is None:
+                # Decode and discard fields the reader doesn't know about.
+                steps.append((None, self.reader(field.type)))
+            else:
+                steps.append(
+                    (field.name, self.reader(field.type, reader_field.type))
+                )
+
+        defaults = []
+        default_reader = avro_io.DatumReader()
+        for name, field in reader_fields.items():
+            if name in writer_names:
+                continue
+            if not field.has_default:
+                return _resolution_failure(
+                    writer_schema,
+                    reader_schema,
+                    "No default value for field {}".format(name)
+                )
+            defaults.append((
+                name,
+                default_reader._read_default_value(field.type, field.default)
+            ))
+
+        if not defaults and all(name is not None for name, _ in steps):
+            def read_record(buf, pos):
+                result = {}
+                for name, read in steps:
+                    result[name], pos = read(buf, pos)
+                return result, pos
+            return read_record
+
+        def read_resolved_record(buf, pos):
+            result = {}
+            for name, read in steps:
+                if name is None:
+                    _, pos = read(buf, pos)
+                else:
+                    result[name], pos = read(buf, pos)
+            for name, default in defaults:
+                result[name] = copy.deepcopy(default)
+            return result, pos
+        return read_resolved_record
+
+
+def _shallow_kind(schema):
+    """
+    A coarse python type family for schema, used to tell union branches apart
+    without a deep validation.
+    """
+    schema_type = schema.type
+    if schema_type in ("int", "long", "float", "double"):
+        return "number"
+    if schema_type in ("string", "enum"):
+        return "string"
+    if schema_type in ("bytes", "fixed"):
+        return "bytes"
+    if schema_type in ("map",) or schema_type in RECORD_TYPES:
+        return "dict"
+    if schema_type in UNION_TYPES:
+        return None
+    return schema_type
+
+
+def _shallow_check(schema):
+    schema_type = schema.type
+    if schema_type == "null":
+        return lambda datum: datum is None
+    if schema_type == "boolean":
+        return lambda datum: isinstance(datum, bool)
+    if schema_type in ("int", "long"):
+        return lambda datum: isinstance(datum, INTEGER_TYPES)
+    if schema_type in ("float", "double"):
+        number_types = INTEGER_TYPES + (float,)
+        return lambda datum: isinstance(datum, number_types)
+    if schema_type in ("string", "enum"):
+        return lambda datum: isinstance(datum, basestring)
+    if schema_type in ("bytes", "fixed"):
+        return lambda datum: isinstance(datum, bytes)
+    if schema_type == "array":
+        return lambda datum: isinstance(datum, list)
+    return lambda datum: isinstance(datum, dict)
+
+
+def _resolution_failure(writer_schema, reader_schema, message=None):
+    """
+    Produce a reader that raises a resolution error when used.
+
+    Unmatched branches are legal as long as the writer never selects them, so
+    the error is deferred until data actually needs them.
+    """
+    message = message or "Schemas do not match."
+
+    def fail(buf, pos):
+        raise avro_io.SchemaResolutionException(
+            message, writer_schema, reader_schema
+        )
+    return fail
+
+
+def decode(read, buf, pos=0):
+    """
+    Run a compiled reader over buf, normalizing truncated input into an
+    avro exception.
+
+    :param read: a compiled reader.
+    :param buf: a bytes-like buffer.
+    :param pos: an offset to start reading from.
+    :return: a tuple of (datum, next offset).
+    """
+    if PY2 and not isinstance(buf, bytearray):
+        buf = bytearray(buf)
+    try:
+        return read(buf, pos)
+    except (IndexError, struct.error):
+        raise avro_schema.AvroException(
+            "Unexpected end of input while decoding."
+        )
+
+
+def guard(write, schema):
+    """
+    Wrap an unchecked writer so that data it can't encode surfaces as an
+    avro.io.AvroTypeException, as a checked writer's would.
+
+    :param write: a compiled writer.
+    :param schema: the avro schema write was compiled from.
+    :return: a compiled writer.
+    """
+    def guarded(datum, out):
+        try:
+            write(datum, out)
+        except (TypeError, ValueError, AttributeError, KeyError,
+                struct.error) as ex:
+            logger.debug("Unchecked write failed: {}".format(ex))
+            raise avro_io.AvroTypeException(schema, datum)
+    return guarded
+
+
+class MessageCodec(object):
+    """
+    Compiled request reader, response writer and error writer for a single
+    protocol message.
+    """
+
+    def __init__(self, compiler, message, unchecked_compiler=None):
+        self.name = message.name
+        self.message = message
+        self.read_request = compiler.reader(message.request)
+        self.write_response = compiler.writer(message.response)
+        self.write_error = compiler.writer(message.errors)
+        self.validate_response = compiler.validator(message.response)
+        if unchecked_compiler is None:
+            self.write_response_unchecked = self.write_response
+        else:
+            self.write_response_unchecked = guard(
+                unchecked_compiler.writer(message.response),
+                message.response
+            )
+
+
+class ProtocolCodec(object):
+    """
+    Compiled codecs for every message of a local protocol.
+    """
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.compiler = SchemaCompiler()
+        self.unchecked_compiler = SchemaCompiler(checked=False)
+        self.messages = dict(
+            (name, MessageCodec(self.compiler, message,
+                                self.unchecked_compiler))
+            for name, message in protocol.message_map.items()
+        )
+        self.local = RemoteCodec(self, protocol)
+
+    def remote(self, remote_protocol):
+        """
+        Produce the codec for requests from clients speaking remote_protocol.
+
+        :param remote_protocol: the client's avro protocol.
+        :return: a RemoteCodec.
+        """
+        if remote_protocol.md5 == self.protocol.md5:
+            return self.local
+        return RemoteCodec(self, remote_protocol)
+
+
+class RemoteCodec(object):
+    """
+    Request readers for clients speaking a particular protocol.
+
+    Requests coming from clients speaking a different (but compatible)
+    protocol are decoded with readers resolved against the local message
+    definition. Those are compiled lazily, by a compiler of their own, so
+    they're released along with this codec.
+    """
+
+    def __init__(self, local_codec, protocol):
+        """
+        :param local_codec: the server's ProtocolCodec.
+        :param protocol: the client's avro protocol.
+        """
+        self.local_codec = local_codec
+        self.protocol = protocol
+        self.is_local = protocol.md5 == local_codec.protocol.md5
+        self._compiler = None
+        self._readers = {}
+
+    def request_reader(self, message_name):
+        """
+        Retrieve a compiled reader for a request to message_name written by
+        this client.
+
+        :param message_name: an avro message name.
+        :return: a tuple of (local message, compiled reader).
+        """
+        remote_message = self.protocol.message_map.get(message_name)
+        if remote_message is None:
+            raise avro_schema.AvroException(
+                "Unknown remote message: {}".format(message_name)
+            )
+        local_message = self.local_codec.protocol.message_map.get(
+            message_name
+        )
+        if local_message is None:
+            raise avro_schema.AvroException(
+                "Unknown local message: {}".format(message_name)
+            )
+
+        if self.is_local:
+            read = self.local_codec.messages[message_name].read_request
+            return local_message, read
+
+        read = self._readers.get(message_name)
+        if read is None:
+            if self._compiler is None:
+                self._compiler = SchemaCompiler()
+            read = self._compiler.reader(
+                remote_message.request,
+                local_message.request
+            )
+            self._readers[message_name] = read
+        return local_message, read
+
+
+_handshake_compiler = SchemaCompiler()
+read_handshake_request = _handshake_compiler.reader(
+    avro_ipc.HANDSHAKE_REQUEST_SCHEMA
+)
+write_handshake_request = _handshake_compiler.writer(
+    avro_ipc.HANDSHAKE_REQUEST_SCHEMA
+)
+read_handshake_response = _handshake_compiler.reader(
+    avro_ipc.HANDSHAKE_RESPONSE_SCHEMA
+)
+write_handshake_response = _handshake_compiler.writer(
+    avro_ipc.HANDSHAKE_RESPONSE_SCHEMA
+)
+read_metadata = _handshake_compiler.reader(avro_ipc.META_SCHEMA)
+write_metadata = _handshake_compiler.writer(avro_ipc.META_SCHEMA)
+write_system_error = _handshake_compiler.writer(avro_ipc.SYSTEM_ERROR_SCHEMA)
+
+
+def serialize_handshake_responses(protocol):
+    """
+    Encode the handshake responses a server speaking protocol sends: they
+    only depend on the match, not on the client.
+
+    :param protocol: the server's avro protocol.
+    :return: a dict of match -> serialized handshake response.
+    """
+    responses = {}
+    for match in ("BOTH", "CLIENT", "NONE"):
+        handshake_response = {"match": match}
+        if match != "BOTH":
+            handshake_response["serverProtocol"] = str(protocol)
+            handshake_response["serverHash"] = protocol.md5
+        out = bytearray()
+        write_handshake_response(handshake_response, out)
+        responses[match] = bytes(out)
+    return responses
+
+
+__all__ = [
+    SchemaCompiler.__name__,
+    MessageCodec.__name__,
+    ProtocolCodec.__name__,
+    RemoteCodec.__name__,
+    decode.__name__,
+    guard.__name__,
+    serialize_handshake_responses.__name__
+]
@@ -0,0 +1,349 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import re
+import subprocess
+import threading
+
+try:
+    from concurrent import futures
+except ImportError:  # pragma: no cover
+    futures = None
+
+from . import idl
+from . import settings
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the cache key's inputs or manifest format change.
+CACHE_VERSION = 1
+
+# Avro IDL imports: import idl|protocol|schema "path";
+IMPORT_PATTERN = re.compile(
+    r'\bimport\s+(idl|protocol|schema)\s+"((?:[^"\\]|\\.)*)"\s*;'
+)
+
+# Files are read for hashing in blocks of this many bytes.
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# The most java processes compiling at once.
+COMPILE_WORKERS = 4
+
+_jar_hashes = {}
+_jar_hashes_lock = threading.Lock()
+
+CompileJob = collections.namedtuple(
+    "CompileJob",
+    ["protocol", "schema", "jar_file"]
+)
+
+
+class CompileError(Exception):
+    """Raised when protocols fail to compile, listing every failure."""
+
+    def __init__(self, failures):
+        """
+        :param failures: a list of (protocol path, compiler output) pairs.
+        """
+        self.failures = failures
+        lines = ["{} protocol(s) failed to compile:".format(len(failures))]
+        for protocol, output in failures:
+            lines.append("{}:".format(protocol))
+            lines.extend(
+                "    {}".format(line)
+                for line in (output.splitlines() or ["(no output)"])
+            )
+        super(CompileError, self).__init__("\n".join(lines))
+
+
+def _hash_file(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, "rb") as _file:
+        for block in iter(lambda: _file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest
+
+
+def jar_hash(jar_file):
+    """
+    Hash a tools jar, remembering the result for as long as the file's size
+    and modification time are unchanged, so a jar shared by many services
+    is only read once.
+
+    :param jar_file: a jar file path.
+    :return: a hex digest.
+    """
+    stat = os.stat(jar_file)
+    key = (os.path.abspath(jar_file), stat.st_size, stat.st_mtime)
+    with _jar_hashes_lock:
+        digest = _jar_hashes.get(key)
+    if digest is None:
+        digest = _hash_file(jar_file).hexdigest()
+        with _jar_hashes_lock:
+            _jar_hashes[key] = digest
+    return digest
+
+
+def protocol_imports(protocol):
+    """
+    Find every file an IDL file imports, directly or through other imported
+    IDL files. Imports are resolved relative to the importing file; ones
+    that don't exist there are left for the compiler to report.
+
+    :param protocol: an avro IDL file path.
+    :return: a sorted list of absolute paths.
+    """
+    seen = set()
+    pending = [os.path.abspath(protocol)]
+    while pending:
+        path = pending.pop()
+        with open(path) as _file:
+            contents = _file.read()
+        directory = os.path.dirname(path)
+        for kind, name in IMPORT_PATTERN.findall(contents):
+            imported = os.path.abspath(os.path.join(directory, name))
+            if imported in seen or not os.path.exists(imported):
+                continue
+            seen.add(imported)
+            if kind == "idl":
+                pending.append(imported)
+    seen.discard(os.path.abspath(protocol))
+    return sorted(seen)
+
+
+def compile_key(protocol, jar_file):
+    """
+    Compute the cache key of a compile: a hash of the IDL file, everything
+    it imports and the tools jar.
+
+    :param protocol: an avro IDL file path.
+    :param jar_file: the tools jar file path, or None for the python
+        compiler (see the idl module).
+    :return: a hex digest.
+    """
+    digest = hashlib.sha256()
+    digest.update("pyramid_avro:{}\n".format(CACHE_VERSION).encode("utf-8"))
+    if jar_file is None:
+        compiler_id = "idl:{}".format(idl.IDL_COMPILER_VERSION)
+    else:
+        compiler_id = jar_hash(jar_file)
+    digest.update(compiler_id.encode("utf-8"))
+    for path in [os.path.abspath(protocol)] + protocol_imports(protocol):
+        digest.update(b"\0")
+        digest.update(path.encode("utf-8"))
+        digest.update(b"\0")
+        _hash_file(path, digest)
+    return digest.hexdigest()
+
+
+def manifest_path(schema):
+    """
+    The path of the manifest recording how a schema file was compiled. It's
+    kept beside the schema as a hidden file.
+
+    :param schema: a compiled schema file path.
+    :return: a file path.
+    """
+    directory, filename = os.path.split(os.path.abspath(schema))
+    return os.path.join(directory, ".{}.compile-cache".format(filename))
+
+
+def _read_manifest(schema):
+    try:
+        with open(manifest_path(schema)) as _file:
+            return json.load(_file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def is_fresh(protocol, schema, jar_file, key=None):
+    """
+    Check whether a schema was compiled from the current IDL, imports and
+    tools jar, and hasn't been changed since.
+
+    :param protocol: an avro IDL file path.
+    :param schema: the compiled schema file path.
+    :param jar_file: the tools jar file path.
+    :param key: the compile_key, if already computed.
+    :return: a bool.
+    """
+    if not os.path.exists(schema):
+        return False
+    manifest = _read_manifest(schema)
+    if manifest.get("key") != (key or compile_key(protocol, jar_file)):
+        return False
+    return manifest.get("output") == _hash_file(schema).hexdigest()
+
+
+def run_compile(protocol, schema, jar_file):
+    """
+    Compile an IDL file into a schema with a java process of its own,
+    collecting its output rather than echoing it.
+
+    :param protocol: an avro IDL file path.
+    :param schema: a file path to write the compiled schema.
+    :param jar_file: a jar file to use for the compilation.
+    :return: the compiler's output.
+    :raises CompileError: when the compile fails.
+    """
+    command = ["java", "-jar", jar_file, "idl", protocol, schema]
+    logger.debug("Compiling {} into {}".format(protocol, schema))
+    try:
+        proc = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+        )
+    except OSError as ex:
+        raise CompileError([(protocol, str(ex))])
+    output, _ = proc.communicate()
+    output = output.decode("utf-8", "replace")
+    if proc.returncode != 0:
+        raise CompileError([(protocol, output)])
+    return output
+
+
+def run_python_compile(protocol, schema, jar_file=None):
+    """
+    Compile an IDL file into a schema in this process (see the idl module).
+
+    :param protocol: an avro IDL file path.
+    :param schema: a file path to write the compiled schema.
+    :param jar_file: ignored.
+    :raises CompileError: when the compile fails.
+    """
+    try:
+        idl.compile_protocol(protocol, schema)
+    except idl.IdlError as ex:
+        raise CompileError([(protocol, str(ex))])
+
+
+def cached_compile(protocol, schema, jar_file, compile_fn=None):
+    """
+    Compile an IDL file into a schema with compile_fn, unless the schema is
+    already fresh (see is_fresh).
+
+    Schemas are compiled into a temporary file and moved into place, so a
+    failed or interrupted compile never leaves a partial schema behind.
+
+    :param protocol: an avro IDL file path.
+    :param schema: a file path to write the compiled schema.
+    :param jar_file: a jar file to use for the compilation, or None for
+        the python compiler.
+    :param compile_fn: a callable accepting the protocol, an output path and
+        the jar file. Defaults to run_compile.
+    :return: whether the schema was compiled.
+    """
+    if protocol is None or schema is None:
+        raise ValueError("Input must not be NoneType.")
+    if jar_file is None and compile_fn is None:
+        raise ValueError("Input must not be NoneType.")
+    compile_fn = compile_fn or run_compile
+
+    key = compile_key(protocol, jar_file)
+    if is_fresh(protocol, schema, jar_file, key):
+        logger.debug("{} is up to date, skipping compile.".format(schema))
+        return False
+
+    def write_schema(tmp_path):
+        compile_fn(protocol, tmp_path, jar_file)
+
+    def write_manifest(tmp_path):
+        manifest = {
+            "key": key,
+            "output": _hash_file(schema).hexdigest(),
+            "protocol": os.path.abspath(protocol)
+        }
+        with open(tmp_path, "w") as _file:
+            json.dump(manifest, _file, sort_keys=True)
+
+    utils.write_atomically(schema, write_schema)
+    utils.write_atomically(manifest_path(schema), write_manifest)
+    return True
+
+
+def compile_all(jobs, workers=COMPILE_WORKERS, cache=True,
+                backend=settings.COMPILER_JAVA):
+    """
+    Compile many IDL files at once: with the java backend, each with a
+    java process of its own (see run_compile), up to workers at a time;
+    with the python backend, one after the other in this process.
+
+    Every job is attempted before failures are reported, all together.
+
+    :param jobs: a sequence of CompileJob. Jobs writing the same schema are
+        only run once.
+    :param workers: the most compiles to run at once.
+    :param cache: whether to skip schemas that are fresh (see is_fresh).
+    :param backend: "java" or "python".
+    :return: a dict of schema path -> whether it was compiled.
+    :raises CompileError: when any compile fails.
+    """
+    if backend == settings.COMPILER_PYTHON:
+        compile_fn = run_python_compile
+        # Compiling in process is quick, and threads wouldn't speed it up.
+        workers = 1
+        jobs = [job._replace(jar_file=None) for job in jobs]
+    else:
+        compile_fn = run_compile
+    unique_jobs = collections.OrderedDict(
+        (os.path.abspath(job.schema), job) for job in jobs
+    )
+
+    def run_job(job):
+        try:
+            if cache:
+                compiled = cached_compile(
+                    job.protocol,
+                    job.schema,
+                    job.jar_file,
+                    compile_fn=compile_fn
+                )
+            else:
+                utils.write_atomically(
+                    job.schema,
+                    lambda tmp_path: compile_fn(
+                        job.protocol,
+                        tmp_path,
+                        job.jar_file
+                    )
+                )
+                compiled = True
+        except CompileError as ex:
+            return job, None, ex.failures
+        except (IOError, OSError) as ex:
+            return job, None, [(job.protocol, str(ex))]
+        return job, compiled, []
+
+    workers = min(workers, len(unique_jobs))
+    if workers > 1 and futures is not None:
+        with futures.ThreadPoolExecutor(workers) as executor:
+            outcomes = list(executor.map(run_job, unique_jobs.values()))
+    else:
+        outcomes = [run_job(job) for job in unique_jobs.values()]
+
+    results = {}
+    failures = []
+    for job, compiled, job_failures in outcomes:
+        failures.extend(job_failures)
+        if not job_failures:
+            results[job.schema] = compiled
+    if failures:
+        raise CompileError(failures)
+    return results
+
+
+__all__ = [
+    CompileError.__name__,
+    CompileJob.__name__,
+    cached_compile.__name__,
+    compile_all.__name__,
+    compile_key.__name__,
+    is_fresh.__name__,
+    protocol_imports.__name__,
+    run_compile.__name__,
+    run_python_compile.__name__
+]
@@ -0,0 +1,392 @@
+import logging
+import time
+import zlib
+
+from avro import ipc as avro_ipc
+from webob import request as webob_request
+from zope import interface as zi
+
+logger = logging.getLogger(__name__)
+
+ACCEPT_ENCODING = "Accept-Encoding"
+CONTENT_ENCODING = "Content-Encoding"
+
+# The content codings built in.
+GZIP = "gzip"
+DEFLATE = "deflate"
+IDENTITY = "identity"
+
+# Responses smaller than this many bytes aren't worth compressing.
+MIN_SIZE = 1024
+
+# The default most bytes a compressed request body may inflate to.
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+# The most compressed bytes read from a request at once.
+READ_CHUNK_SIZE = 16 * 1024
+
+# zlib window bits of each built in coding: gzip has a gzip header and
+# trailer, and HTTP's "deflate" is the zlib format.
+_zlib_wbits = {GZIP: 16 + zlib.MAX_WBITS, DEFLATE: zlib.MAX_WBITS}
+
+cpu_clock = getattr(
+    time,
+    "thread_time",
+    getattr(time, "process_time", getattr(time, "clock", None))
+)
+
+
+class ICompressionCodec(zi.Interface):
+
+    name = zi.Attribute("""The content coding, as in Content-Encoding.""")
+
+    def compressor():
+        """
+        Start compressing a body: return an object with "compress(data)"
+        and "flush()" methods returning compressed bytes, like the ones
+        zlib.compressobj returns.
+        """
+
+    def decompressor():
+        """
+        Start decompressing a body: return an object like the ones
+        zlib.decompressobj returns, with a "decompress(data, max_length)"
+        method holding input back in "unconsumed_tail" rather than
+        producing more than max_length bytes, a "flush()" method, and,
+        ideally, an "eof" attribute (else the end is found from
+        "unused_data", or from the body running out). Only needed to accept
+        compressed requests.
+        """
+
+
+class UnsupportedEncoding(ValueError):
+    """Raised for requests compressed with a coding that isn't accepted."""
+
+
+class DecompressedTooLarge(avro_ipc.ConnectionClosedException):
+    """Raised when a compressed request inflates past its limit."""
+
+
+@zi.implementer(ICompressionCodec)
+class ZlibCodec(object):
+    """
+    The gzip and deflate content codings.
+    """
+
+    def __init__(self, name, level=zlib.Z_DEFAULT_COMPRESSION):
+        """
+        :param name: GZIP or DEFLATE.
+        :param level: the zlib compression level, from 0 (none) to 9
+            (best), or -1 for zlib's default.
+        """
+        if name not in _zlib_wbits:
+            raise ValueError("Unknown zlib coding: '{}'".format(name))
+        if not -1 <= level <= 9:
+            raise ValueError("Compression level must be from -1 to 9.")
+        self.name = name
+        self.level = level
+
+    def compressor(self):
+        return zlib.compressobj(
+            self.level,
+            zlib.DEFLATED,
+            _zlib_wbits[self.name]
+        )
+
+    def decompressor(self):
+        return zlib.decompressobj(_zlib_wbits[self.name])
+
+
+def make_codec(name, level=None, resolve=None, options=None):
+    """
+    Build a codec named by the "compression" setting.
+
+    :param name: GZIP, DEFLATE, or the dotted name of a callable accepting
+        the avro settings and returning an ICompressionCodec.
+    :param level: the compression level of the built in codecs, if not
+        zlib's default.
+    :param resolve: a callable resolving dotted names, such as
+        Configurator.maybe_dotted.
+    :param options: the avro settings, for codec factories.
+    :return: an ICompressionCodec.
+    """
+    if name in _zlib_wbits:
+        if level is None:
+            return ZlibCodec(name)
+        return ZlibCodec(name, level)
+    if resolve is None:
+        raise ValueError("Unknown compression codec: '{}'".format(name))
+    return resolve(name)(options or {})
+
+
+def parse_accept_encoding(header):
+    """
+    Parse an Accept-Encoding header.
+
+    :param header: the header value, or None.
+    :return: a dict of lower case content coding -> quality.
+    """
+    accepted = {}
+    for part in (header or "").split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+class ResponseCompression(object):
+    """
+    Picks how a service's responses are compressed, from the codecs it
+    offers and what each request accepts.
+    """
+
+    def __init__(self, codecs, min_size=MIN_SIZE):
+        """
+        :param codecs: ICompressionCodecs, by preference.
+        :param min_size: the smallest response body compressed, in bytes.
+        """
+        self.codecs = list(codecs)
+        self.min_size = min_size
+
+    def negotiate(self, request, size):
+        """
+        Pick a codec for a response: of the codecs the request's
+        Accept-Encoding accepts (explicitly, or through "*"), the one it
+        prefers most, breaking ties by the service's preference.
+
+        :param request: a webob request.
+        :param size: the response body's size.
+        :return: an ICompressionCodec, or None to leave the body as is.
+        """
+        if size < self.min_size:
+            return None
+        header = request.headers.get(ACCEPT_ENCODING)
+        if not header:
+            return None
+        accepted = parse_accept_encoding(header)
+        wildcard = accepted.get("*", 0.0)
+        best, best_quality = None, 0.0
+        for codec in self.codecs:
+            quality = accepted.get(codec.name, wildcard)
+            if quality > best_quality:
+                best, best_quality = codec, quality
+        return best
+
+
+class RequestDecompression(object):
+    """
+    Decompresses the bodies of a service's requests sent with a
+    Content-Encoding, as they're read.
+    """
+
+    def __init__(self, codecs, max_size=MAX_DECOMPRESSED_SIZE):
+        """
+        :param codecs: the ICompressionCodecs requests may be compressed
+            with.
+        :param max_size: the most bytes a request body may inflate to.
+        """
+        self.codecs = dict((codec.name, codec) for codec in codecs)
+        self.max_size = max_size
+
+    def stream(self, request, stream):
+        """
+        Wrap a request body stream to decompress it, if it's compressed.
+
+        :param request: a webob request.
+        :param stream: the request body stream.
+        :return: a tuple of (the stream to read the request from, its size
+            if known).
+        :raises UnsupportedEncoding: when the request is compressed with a
+            coding that isn't accepted.
+        """
+        coding = content_coding(request)
+        if coding is None:
+            return stream, request.content_length
+        codec = self.codecs.get(coding)
+        if codec is None:
+            raise UnsupportedEncoding(
+                "Unsupported Content-Encoding: '{}'".format(coding)
+            )
+        if request.content_length is not None:
+            # Never read past the body, into whatever follows it on the
+            # connection.
+            stream = webob_request.LimitedLengthFile(
+                stream,
+                request.content_length
+            )
+        return DecompressingStream(stream, codec, self.max_size), None
+
+
+# Accepts uncompressed requests only.
+NO_DECOMPRESSION = RequestDecompression(())
+
+
+def content_coding(request):
+    """
+    :param request: a webob request.
+    :return: the lower case coding of a compressed request body, or None.
+    """
+    coding = (request.headers.get(CONTENT_ENCODING) or "").strip().lower()
+    if not coding or coding == IDENTITY:
+        return None
+    return coding
+
+
+def _at_eof(decompressor):
+    # Python 2's zlib decompressors have no "eof", but keep any bytes after
+    # the end of the compressed stream in "unused_data".
+    eof = getattr(decompressor, "eof", None)
+    if eof is None:
+        return bool(getattr(decompressor, "unused_data", b""))
+    return eof
+
+
+class DecompressingStream(object):
+    """
+    A file-like object inflating a compressed stream as it's read, so a
+    request is decompressed straight into the frame reader (see
+    framing.FrameReader) without ever holding its compressed body.
+
+    Each read inflates no more than it returns, and reading past max_size
+    raises DecompressedTooLarge, so a small body can't expand into an
+    unbounded amount of memory.
+    """
+
+    def __init__(self, stream, codec, max_size=MAX_DECOMPRESSED_SIZE,
+                 chunk_size=READ_CHUNK_SIZE):
+        """
+        :param stream: a file-like object of compressed bytes.
+        :param codec: the ICompressionCodec they're compressed with.
+        :param max_size: the most bytes the stream may inflate to.
+        :param chunk_size: the most compressed bytes read at once.
+        """
+        self.stream = stream
+        self.name = codec.name
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.size = 0
+        self._decompressor = codec.decompressor()
+        self._pending = b""
+        self._done = False
+
+    def read(self, size=-1):
+        """
+        :param size: the most bytes to read, or -1 for the rest.
+        :return: the bytes read; less than size only at the end.
+        """
+        parts = []
+        remaining = size if size >= 0 else None
+        while remaining is None or remaining > 0:
+            data = self._inflate(remaining or self.chunk_size)
+            if not data:
+                break
+            parts.append(data)
+            if remaining is not None:
+                remaining -= len(data)
+        return b"".join(parts)
+
+    def _inflate(self, max_length):
+        # Up to max_length more bytes, or b"" at the end. One byte over the
+        # limit is allowed through to tell a body at the limit from one
+        # past it.
+        max_length = min(max_length, self.max_size - self.size + 1)
+        decompressor = self._decompressor
+        while not self._done:
+            try:
+                if self._pending:
+                    data = decompressor.decompress(self._pending, max_length)
+                else:
+                    compressed = self.stream.read(self.chunk_size)
+                    if compressed:
+                        data = decompressor.decompress(compressed, max_length)
+                    else:
+                        data = decompressor.flush()
+                        self._done = True
+            except zlib.error as ex:
+                raise avro_ipc.ConnectionClosedException(
+                    "Invalid {} request body: {}".format(self.name, ex)
+                )
+            self._pending = decompressor.unconsumed_tail
+            if _at_eof(decompressor) and not self._pending:
+                self._done = True
+            if data:
+                self.size += len(data)
+                if self.size > self.max_size:
+                    raise DecompressedTooLarge(
+                        "Request body inflates past {} bytes.".format(
+                            self.max_size
+                        )
+                    )
+                return data
+        return b""
+
+
+class CompressedIterator(object):
+    """
+    Compresses a WSGI app_iter chunk by chunk, so a compressed body is
+    streamed just like the framed one (see framing.FramedMessageIterator)
+    rather than built up in memory.
+
+    Once every chunk was compressed, "on_done" is called with the body's
+    size before and after, and the CPU seconds spent compressing it.
+    """
+
+    def __init__(self, app_iter, compressor, on_done=None):
+        """
+        :param app_iter: an iterable of bytes.
+        :param compressor: a compressor from ICompressionCodec.compressor.
+        :param on_done: an optional callable accepting the uncompressed
+            size, the compressed size and the CPU seconds taken.
+        """
+        self.app_iter = app_iter
+        self.compressor = compressor
+        self.on_done = on_done
+
+    def __iter__(self):
+        compressor = self.compressor
+        size = compressed_size = 0
+        cpu_seconds = 0.0
+        for chunk in self.app_iter:
+            started = cpu_clock()
+            data = compressor.compress(chunk)
+            cpu_seconds += cpu_clock() - started
+            size += len(chunk)
+            if data:
+                compressed_size += len(data)
+                yield data
+        started = cpu_clock()
+        data = compressor.flush()
+        cpu_seconds += cpu_clock() - started
+        compressed_size += len(data)
+        if data:
+            yield data
+        if self.on_done is not None:
+            try:
+                self.on_done(size, compressed_size, cpu_seconds)
+            except Exception:
+                logger.exception("Failed to record a compressed response.")
+
+
+__all__ = [
+    CompressedIterator.__name__,
+    DecompressedTooLarge.__name__,
+    DecompressingStream.__name__,
+    ICompressionCodec.__name__,
+    RequestDecompression.__name__,
+    ResponseCompression.__name__,
+    UnsupportedEncoding.__name__,
+    ZlibCodec.__name__,
+    content_coding.__name__,
+    make_codec.__name__,
+    parse_accept_encoding.__name__
+]
@@ -0,0 +1,117 @@
+try:
+    from collections import abc as collections_abc
+except ImportError:  # pragma: no cover
+    import collections as collections_abc
+
+
+class ReadOnlyDict(collections_abc.Mapping):
+    """
+    A read-only view over a decoded avro record or map.
+
+    Nothing is copied: nested records, maps and arrays are wrapped in
+    read-only views as they are accessed.
+    """
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, key):
+        return read_only(self._data[key])
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self._data)
+
+    def copy(self):
+        """
+        Produce a mutable deep copy of the underlying data.
+
+        :return: a dict.
+        """
+        return mutable_copy(self._data)
+
+
+class ReadOnlyList(collections_abc.Sequence):
+    """
+    A read-only view over a decoded avro array.
+    """
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data):
+        self._data = data
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ReadOnlyList(self._data[index])
+        return read_only(self._data[index])
+
+    def __len__(self):
+        return len(self._data)
+
+    def __eq__(self, other):
+        if isinstance(other, ReadOnlyList):
+            other = other._data
+        return self._data == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self._data)
+
+    def copy(self):
+        """
+        Produce a mutable deep copy of the underlying data.
+
+        :return: a list.
+        """
+        return mutable_copy(self._data)
+
+
+def read_only(datum):
+    """
+    Wrap decoded avro data in a read-only view, if it's a container.
+
+    :param datum: decoded avro data.
+    :return: a read-only view or the (immutable) datum itself.
+    """
+    if isinstance(datum, dict):
+        return ReadOnlyDict(datum)
+    if isinstance(datum, list):
+        return ReadOnlyList(datum)
+    return datum
+
+
+def mutable_copy(datum):
+    """
+    Deep copy decoded avro data.
+
+    Decoded data only ever consists of dicts, lists and immutable scalars,
+    so this is considerably cheaper than copy.deepcopy.
+
+    :param datum: decoded avro data.
+    :return: a copy of datum.
+    """
+    if isinstance(datum, (dict, ReadOnlyDict)):
+        return dict((key, mutable_copy(val)) for key, val in datum.items())
+    if isinstance(datum, (list, ReadOnlyList)):
+        return [mutable_copy(val) for val in datum]
+    return datum
+
+
+__all__ = [
+    ReadOnlyDict.__name__,
+    ReadOnlyList.__name__,
+    read_only.__name__,
+    mutable_copy.__name__
+]
@@ -0,0 +1,217 @@
+import logging
+import sys
+import time
+
+from avro import ipc as avro_ipc
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER = avro_ipc.UINT32_BE
+
+# The most we'll ask a stream for at once while reading a frame.
+READ_CHUNK_SIZE = 64 * 1024
+
+# The default largest frame written in a response.
+FRAME_SIZE = 64 * 1024
+
+END_OF_MESSAGE = FRAME_HEADER.pack(0)
+
+clock = getattr(time, "perf_counter", time.time)
+
+if sys.version_info[0] == 2:
+    def _join(parts):
+        return b"".join(
+            part if isinstance(part, bytes) else part.tobytes()
+            for part in parts
+        )
+else:
+    _join = b"".join
+
+
+class FrameReader(object):
+    """
+    Reads an avro framed message straight off of a (non-seekable) stream.
+
+    Frames are read as they arrive, in bounded chunks, and appended to a
+    single buffer. Unlike avro.ipc.FramedReader, which collects frames in a
+    BytesIO and then copies them out with getvalue(), the message is held in
+    memory exactly once, no matter how the sender framed it.
+
+    The framing itself delimits the message, so neither a content-length nor
+    an EOF is needed to know when to stop reading. This makes chunked
+    request bodies work just like sized ones.
+    """
+
+    def __init__(self, stream, content_length=None,
+                 chunk_size=READ_CHUNK_SIZE):
+        """
+        :param stream: a file-like object to read from.
+        :param content_length: an optional number of bytes available on
+            stream. When known, frames claiming to be larger than what's left
+            are rejected up front instead of blocking on a read.
+        :param chunk_size: the most to read from stream at once.
+        """
+        self.stream = stream
+        self.remaining = content_length
+        self.chunk_size = chunk_size
+
+    def _expect(self, size):
+        if self.remaining is not None and size > self.remaining:
+            raise avro_ipc.ConnectionClosedException(
+                "FrameReader: expecting {} bytes, only {} remain in the "
+                "request body.".format(size, self.remaining)
+            )
+
+    def _read(self, size):
+        data = self.stream.read(size)
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    def read_frame_header(self):
+        """
+        Read a frame header.
+
+        :return: the size of the following frame. 0 marks the end of a
+            message.
+        """
+        self._expect(FRAME_HEADER.size)
+        header = self._read(FRAME_HEADER.size)
+        while header and len(header) < FRAME_HEADER.size:
+            # Tolerate short reads from socket-backed streams.
+            data = self._read(FRAME_HEADER.size - len(header))
+            if not data:
+                break
+            header += data
+        if len(header) != FRAME_HEADER.size:
+            raise avro_ipc.ConnectionClosedException(
+                "Invalid header: {!r}".format(header)
+            )
+        return FRAME_HEADER.unpack(header)[0]
+
+    def read_frame_into(self, frame_size, message):
+        """
+        Read a frame of frame_size bytes onto the end of message.
+
+        :param frame_size: a frame size from a frame header.
+        :param message: a bytearray.
+        """
+        self._expect(frame_size)
+        remaining = frame_size
+        while remaining > 0:
+            data = self._read(min(remaining, self.chunk_size))
+            if not data:
+                raise avro_ipc.ConnectionClosedException(
+                    "FrameReader: expecting {} more bytes in frame of size "
+                    "{}, got 0.".format(remaining, frame_size)
+                )
+            message += data
+            remaining -= len(data)
+
+    def read_message(self):
+        """
+        Read one framed message.
+
+        :return: the message as a bytearray.
+        """
+        message = bytearray()
+        frame_size = self.read_frame_header()
+        while frame_size > 0:
+            self.read_frame_into(frame_size, message)
+            frame_size = self.read_frame_header()
+        return message
+
+
+class FramedMessageIterator(object):
+    """
+    Frames a serialized message lazily, for use as a WSGI app_iter.
+
+    Each chunk produced is one complete frame: a length header followed by
+    up to frame_size bytes of the message. Frames are sliced from a
+    memoryview over the message, so only one frame's worth of bytes is
+    copied at a time, instead of building a second, framed copy of the
+    whole message up front.
+
+    Given "on_done", it's called with the seconds from the first frame being
+    asked for to the last frame being taken, or iteration being abandoned:
+    the time spent framing and sending the response.
+    """
+
+    def __init__(self, message, frame_size=FRAME_SIZE, on_done=None):
+        """
+        :param message: a bytes-like serialized message.
+        :param frame_size: the largest frame to produce.
+        :param on_done: an optional callable accepting the seconds taken to
+            frame and send the message.
+        """
+        if frame_size <= 0:
+            raise ValueError("Frame size must be positive.")
+        self.message = message
+        self.frame_size = frame_size
+        self.on_done = on_done
+
+    @property
+    def frame_count(self):
+        """The number of data frames, not counting the final empty frame."""
+        return (len(self.message) + self.frame_size - 1) // self.frame_size
+
+    @property
+    def content_length(self):
+        """The total size of the framed message."""
+        headers = (self.frame_count + 1) * FRAME_HEADER.size
+        return len(self.message) + headers
+
+    def __iter__(self):
+        if self.on_done is None:
+            return self._frames()
+        return self._timed_frames()
+
+    def _timed_frames(self):
+        started = clock()
+        try:
+            for frame in self._frames():
+                yield frame
+        finally:
+            try:
+                self.on_done(clock() - started)
+            except Exception:
+                logger.exception("Failed to record a sent response.")
+
+    def _frames(self):
+        view = memoryview(self.message)
+        size = len(view)
+        frame_size = self.frame_size
+        if size == 0:
+            yield END_OF_MESSAGE
+            return
+
+        if size <= frame_size:
+            # Don't bother splitting small messages into a separate end frame.
+            yield _join((FRAME_HEADER.pack(size), view, END_OF_MESSAGE))
+            return
+
+        for start in range(0, size, frame_size):
+            frame = view[start:start + frame_size]
+            yield _join((FRAME_HEADER.pack(len(frame)), frame))
+        yield END_OF_MESSAGE
+
+
+def request_stream(request):
+    """
+    Get the stream to read a request body from without having WebOb make a
+    seekable copy of it first.
+
+    :param request: a webob request.
+    :return: a file-like object.
+    """
+    stream = request.body_file_raw
+    if request.is_body_seekable:
+        stream.seek(0)
+    return stream
+
+
+__all__ = [
+    FrameReader.__name__,
+    FramedMessageIterator.__name__,
+    request_stream.__name__
+]
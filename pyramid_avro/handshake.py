@@ -0,0 +1,65 @@
+import binascii
+
+# Sent by a client skipping the in-body handshake: the hex MD5 of the
+# protocol it speaks.
+CLIENT_HASH_HEADER = "Avro-Client-Hash"
+
+# Optionally sent by such a client, naming the server protocol it expects.
+# Always sent back by the server, so clients can tell when it changes.
+SERVER_HASH_HEADER = "Avro-Server-Hash"
+
+# Sent back, with a 412, when a client must fall back to a full handshake.
+HANDSHAKE_HEADER = "Avro-Handshake"
+HANDSHAKE_REQUIRED = "required"
+
+HASH_SIZE = 16
+
+
+def encode_hash(md5):
+    """
+    Produce the header form of a protocol MD5.
+
+    :param md5: a 16 byte protocol hash.
+    :return: the hash as a lowercase hex string.
+    """
+    return binascii.hexlify(md5).decode("ascii")
+
+
+def decode_hash(value):
+    """
+    Parse a protocol MD5 from a header.
+
+    :param value: a hex string.
+    :return: the 16 byte hash.
+    """
+    try:
+        md5 = binascii.unhexlify(value.strip())
+    except (TypeError, ValueError):
+        md5 = None
+    if md5 is None or len(md5) != HASH_SIZE:
+        raise ValueError("Invalid protocol hash: '{}'".format(value))
+    return md5
+
+
+def requested_hashes(headers):
+    """
+    Read the protocol hashes a stateless call request was sent with.
+
+    :param headers: request headers.
+    :return: a tuple of (client hash, server hash), either of which may be
+        None when not sent.
+    """
+    client_hash = headers.get(CLIENT_HASH_HEADER)
+    server_hash = headers.get(SERVER_HASH_HEADER)
+    if client_hash is not None:
+        client_hash = decode_hash(client_hash)
+    if server_hash is not None:
+        server_hash = decode_hash(server_hash)
+    return client_hash, server_hash
+
+
+__all__ = [
+    encode_hash.__name__,
+    decode_hash.__name__,
+    requested_hashes.__name__
+]
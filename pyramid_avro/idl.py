@@ -0,0 +1,672 @@
+import collections
+import io
+import json
+import logging
+import os
+import re
+
+from avro import protocol as avro_protocol
+
+logger = logging.getLogger(__name__)
+
+# Part of the compile cache key of schemas compiled here; bumped whenever
+# the output for the same input changes.
+IDL_COMPILER_VERSION = 1
+
+PRIMITIVE_TYPES = frozenset((
+    "null",
+    "boolean",
+    "int",
+    "long",
+    "float",
+    "double",
+    "bytes",
+    "string"
+))
+
+# IDL type names standing for logical types.
+LOGICAL_TYPES = {
+    "date": ("int", "date"),
+    "time_ms": ("int", "time-millis"),
+    "timestamp_ms": ("long", "timestamp-millis")
+}
+
+_TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<space>\s+)
+    |(?P<doc>/\*\*(?!/).*?\*/)
+    |(?P<comment>//[^\n]*|/\*.*?\*/)
+    |(?P<string>"(?:[^"\\]|\\.)*")
+    |(?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+    |(?P<ident>`[^`]+`|[A-Za-z_]\w*(?:[.-][A-Za-z_]\w*)*)
+    |(?P<punct>[{}()<>\[\],;=@:])
+    """,
+    re.DOTALL | re.VERBOSE
+)
+
+Token = collections.namedtuple(
+    "Token",
+    ["kind", "value", "line", "doc", "escaped"]
+)
+
+
+class IdlError(avro_protocol.ProtocolParseException):
+    """Raised for IDL that can't be compiled."""
+
+    def __init__(self, message, path=None, line=None):
+        location = path or "<idl>"
+        if line is not None:
+            location = "{}:{}".format(location, line)
+        super(IdlError, self).__init__("{}: {}".format(location, message))
+
+
+def _clean_doc(comment):
+    lines = comment[3:-2].strip().splitlines()
+    cleaned = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith("*"):
+            line = line[1:].strip()
+        cleaned.append(line)
+    return "\n".join(cleaned).strip()
+
+
+def tokenize(text, path=None):
+    """
+    Split IDL text into tokens. A doc comment is attached to the token that
+    follows it.
+
+    :param text: avro IDL.
+    :param path: the IDL's file path, for errors.
+    :return: a list of Token.
+    """
+    tokens = []
+    pos = 0
+    line = 1
+    doc = None
+    while pos < len(text):
+        match = _TOKEN_PATTERN.match(text, pos)
+        if match is None:
+            raise IdlError(
+                "Unexpected character {!r}".format(text[pos]),
+                path,
+                line
+            )
+        kind, value = match.lastgroup, match.group()
+        if kind == "doc":
+            doc = _clean_doc(value)
+        elif kind not in ("space", "comment"):
+            escaped = kind == "ident" and value.startswith("`")
+            if escaped:
+                value = value[1:-1]
+            tokens.append(Token(kind, value, line, doc, escaped))
+            doc = None
+        line += value.count("\n")
+        pos = match.end()
+    tokens.append(Token("eof", None, line, None, False))
+    return tokens
+
+
+def _split_name(full_name):
+    namespace, _, name = full_name.rpartition(".")
+    return namespace or None, name
+
+
+def _named_definitions(schema, namespace):
+    # Yield the (full name, namespace) of every named type defined in schema.
+    if isinstance(schema, list):
+        for branch in schema:
+            for definition in _named_definitions(branch, namespace):
+                yield definition
+        return
+    if not isinstance(schema, dict):
+        return
+    schema_type = schema.get("type")
+    if schema_type in ("record", "error", "enum", "fixed"):
+        name = schema["name"]
+        if "." in name:
+            namespace, _ = _split_name(name)
+        else:
+            namespace = schema.get("namespace", namespace) or None
+            name = ".".join(part for part in (namespace, name) if part)
+        yield name, namespace
+        for field in schema.get("fields", []):
+            for definition in _named_definitions(field["type"], namespace):
+                yield definition
+    elif schema_type == "array":
+        for definition in _named_definitions(schema["items"], namespace):
+            yield definition
+    elif schema_type == "map":
+        for definition in _named_definitions(schema["values"], namespace):
+            yield definition
+
+
+def _qualify(schema, namespace):
+    # Write the short names of references in schema as full names.
+    if isinstance(schema, list):
+        return [_qualify(branch, namespace) for branch in schema]
+    if isinstance(schema, dict):
+        schema = collections.OrderedDict(schema)
+        schema_type = schema.get("type")
+        if schema_type == "array":
+            schema["items"] = _qualify(schema["items"], namespace)
+        elif schema_type == "map":
+            schema["values"] = _qualify(schema["values"], namespace)
+        elif schema_type not in ("record", "error", "enum", "fixed"):
+            schema["type"] = _qualify(schema_type, namespace)
+        return schema
+    if schema in PRIMITIVE_TYPES or "." in schema or not namespace:
+        return schema
+    return "{}.{}".format(namespace, schema)
+
+
+class IdlParser(object):
+    """
+    Parses avro IDL into the JSON form of its protocol, as written to .avpr
+    files by avro-tools.
+
+    Supports imports (of IDL, protocol and schema files, resolved relative
+    to the importing file), records, errors, enums, fixed types, messages
+    with "throws" and "oneway", doc comments, annotations, default values
+    and the date, time_ms, timestamp_ms and decimal logical types.
+    """
+
+    def __init__(self, text, path=None, imported=None):
+        """
+        :param text: avro IDL.
+        :param path: the IDL's file path, to resolve imports and for errors.
+        :param imported: the absolute paths already imported, shared with
+            the parsers of imported files.
+        """
+        self.path = path
+        self.tokens = tokenize(text, path)
+        self.pos = 0
+        self.imported = imported if imported is not None else set()
+        if path is not None:
+            self.imported.add(os.path.abspath(path))
+        self.namespace = None
+        self.types = []
+        self.messages = collections.OrderedDict()
+        # Full name -> namespace of every named type defined so far.
+        self.names = {}
+        self._context = None
+
+    # Token handling.
+
+    def error(self, message, token=None):
+        token = token or self.peek()
+        return IdlError(message, self.path, token.line)
+
+    def peek(self):
+        return self.tokens[self.pos]
+
+    def next(self):
+        token = self.tokens[self.pos]
+        if token.kind != "eof":
+            self.pos += 1
+        return token
+
+    def at(self, value):
+        token = self.peek()
+        return (
+            token.kind in ("punct", "ident") and
+            not token.escaped and
+            token.value == value
+        )
+
+    def accept(self, value):
+        if self.at(value):
+            return self.next()
+        return None
+
+    def expect(self, value):
+        token = self.next()
+        if token.kind not in ("punct", "ident") or token.value != value:
+            raise self.error(
+                "Expected '{}', found {!r}".format(value, token.value),
+                token
+            )
+        return token
+
+    def identifier(self):
+        token = self.next()
+        if token.kind != "ident":
+            raise self.error(
+                "Expected a name, found {!r}".format(token.value),
+                token
+            )
+        return token.value
+
+    def string(self):
+        token = self.next()
+        if token.kind != "string":
+            raise self.error(
+                "Expected a string, found {!r}".format(token.value),
+                token
+            )
+        return json.loads(token.value)
+
+    def integer(self):
+        token = self.next()
+        if token.kind != "number" or not token.value.lstrip("-").isdigit():
+            raise self.error(
+                "Expected an integer, found {!r}".format(token.value),
+                token
+            )
+        return int(token.value)
+
+    def json_value(self):
+        token = self.next()
+        if token.kind in ("string", "number"):
+            return json.loads(token.value)
+        if token.kind == "ident" and token.value in ("true", "false", "null"):
+            return json.loads(token.value)
+        if token.kind == "punct" and token.value == "[":
+            values = []
+            while not self.accept("]"):
+                values.append(self.json_value())
+                if not self.at("]"):
+                    self.expect(",")
+            return values
+        if token.kind == "punct" and token.value == "{":
+            values = collections.OrderedDict()
+            while not self.accept("}"):
+                key = self.string()
+                self.expect(":")
+                values[key] = self.json_value()
+                if not self.at("}"):
+                    self.expect(",")
+            return values
+        raise self.error(
+            "Expected a JSON value, found {!r}".format(token.value),
+            token
+        )
+
+    def annotations(self):
+        props = collections.OrderedDict()
+        while self.accept("@"):
+            name = self.identifier()
+            self.expect("(")
+            props[name] = self.json_value()
+            self.expect(")")
+        return props
+
+    # Names.
+
+    def _define(self, name, namespace):
+        full_name = name if "." in name else ".".join(
+            part for part in (namespace, name) if part
+        )
+        if full_name in self.names:
+            raise self.error("Type '{}' is already defined".format(full_name))
+        namespace, _ = _split_name(full_name)
+        self.names[full_name] = namespace
+        return full_name, namespace
+
+    def reference(self, name):
+        """
+        Resolve a reference to a named type, as it should be written where
+        the type is referenced.
+        """
+        if "." in name:
+            candidates = [name]
+        else:
+            candidates = [
+                ".".join(part for part in (namespace, name) if part)
+                for namespace in (self._context, self.namespace, None)
+            ]
+        for full_name in candidates:
+            if full_name in self.names:
+                namespace, short_name = _split_name(full_name)
+                if namespace == self._context:
+                    return short_name
+                return full_name
+        raise self.error("Undefined name: '{}'".format(name))
+
+    def _set_namespace(self, definition, namespace):
+        if namespace != self.namespace:
+            definition["namespace"] = namespace or ""
+
+    # Declarations.
+
+    def parse(self):
+        """
+        Parse the IDL.
+
+        :return: the protocol's JSON form, as a dict.
+        """
+        doc = self.peek().doc
+        props = self.annotations()
+        doc = doc or self.peek().doc
+        self.expect("protocol")
+        name = self.identifier()
+        self.namespace = props.pop("namespace", None) or None
+        self._context = self.namespace
+        self.expect("{")
+        while not self.accept("}"):
+            if self.peek().kind == "eof":
+                raise self.error("Unexpected end of file")
+            self.declaration()
+        if self.peek().kind != "eof":
+            raise self.error(
+                "Unexpected {!r} after the protocol".format(self.peek().value)
+            )
+
+        protocol = collections.OrderedDict()
+        protocol["protocol"] = name
+        protocol["namespace"] = self.namespace
+        if doc:
+            protocol["doc"] = doc
+        protocol.update(props)
+        protocol["types"] = self.types
+        protocol["messages"] = self.messages
+        return protocol
+
+    def declaration(self):
+        doc = self.peek().doc
+        props = self.annotations()
+        doc = doc or self.peek().doc
+        if self.accept("import"):
+            self.import_()
+        elif self.at("record") or self.at("error"):
+            self.record(doc, props)
+        elif self.accept("enum"):
+            self.enum(doc, props)
+        elif self.accept("fixed"):
+            self.fixed(doc, props)
+        else:
+            self.message(doc, props)
+
+    def import_(self):
+        kind = self.identifier()
+        if kind not in ("idl", "protocol", "schema"):
+            raise self.error("Unknown import type: '{}'".format(kind))
+        filename = self.string()
+        self.expect(";")
+
+        directory = os.path.dirname(os.path.abspath(self.path or "."))
+        path = os.path.abspath(os.path.join(directory, filename))
+        if path in self.imported:
+            return
+        if not os.path.exists(path):
+            raise self.error("No such file or directory '{}'".format(path))
+        self.imported.add(path)
+
+        with io.open(path, encoding="utf-8") as _file:
+            contents = _file.read()
+        try:
+            if kind == "idl":
+                imported = IdlParser(contents, path, self.imported).parse()
+            else:
+                imported = json.loads(
+                    contents,
+                    object_pairs_hook=collections.OrderedDict
+                )
+        except ValueError as ex:
+            raise self.error("Bad JSON in '{}': {}".format(path, ex))
+
+        if kind == "schema":
+            self.add_types([imported], None)
+        else:
+            self.add_types(
+                imported.get("types", []),
+                imported.get("namespace") or None
+            )
+            namespace = imported.get("namespace") or None
+            for name, message in imported.get("messages", {}).items():
+                if namespace != self.namespace:
+                    message = self.qualify_message(message, namespace)
+                self.messages.setdefault(name, message)
+
+    def qualify_message(self, message, namespace):
+        """
+        Rewrite an imported message's type references, relative to
+        namespace, as full names.
+        """
+        message = collections.OrderedDict(message)
+        message["request"] = [
+            collections.OrderedDict(
+                param,
+                type=_qualify(param["type"], namespace)
+            )
+            for param in message.get("request", [])
+        ]
+        message["response"] = _qualify(message["response"], namespace)
+        if "errors" in message:
+            message["errors"] = _qualify(message["errors"], namespace)
+        return message
+
+    def add_types(self, types, namespace):
+        """
+        Add imported type definitions, declared in namespace.
+        """
+        for schema in types:
+            if isinstance(schema, dict) and "name" in schema:
+                schema_namespace = namespace
+                if "." in schema["name"]:
+                    schema_namespace, _ = _split_name(schema["name"])
+                elif "namespace" in schema:
+                    schema_namespace = schema["namespace"] or None
+                self._set_namespace(schema, schema_namespace)
+            for full_name, type_namespace in _named_definitions(
+                    schema, namespace):
+                self.names.setdefault(full_name, type_namespace)
+            self.types.append(schema)
+
+    def _named(self, type_name, doc, props):
+        name = self.identifier()
+        namespace = props.pop("namespace", None) or self.namespace
+        full_name, namespace = self._define(name, namespace)
+        definition = collections.OrderedDict()
+        definition["type"] = type_name
+        definition["name"] = _split_name(full_name)[1]
+        self._set_namespace(definition, namespace)
+        if doc:
+            definition["doc"] = doc
+        return definition, namespace
+
+    def record(self, doc, props):
+        record_type = self.identifier()
+        definition, namespace = self._named(record_type, doc, props)
+        context, self._context = self._context, namespace
+        try:
+            fields = []
+            self.expect("{")
+            while not self.accept("}"):
+                fields.extend(self.fields())
+        finally:
+            self._context = context
+        definition["fields"] = fields
+        definition.update(props)
+        self.types.append(definition)
+
+    def fields(self):
+        doc = self.peek().doc
+        field_type = self.type_()
+        fields = []
+        while True:
+            field_props = self.annotations()
+            field = collections.OrderedDict()
+            field["name"] = self.identifier()
+            field["type"] = field_type
+            if doc:
+                field["doc"] = doc
+            if self.accept("="):
+                field["default"] = self.json_value()
+            field.update(field_props)
+            fields.append(field)
+            if not self.accept(","):
+                break
+        self.expect(";")
+        return fields
+
+    def enum(self, doc, props):
+        definition, _ = self._named("enum", doc, props)
+        symbols = []
+        self.expect("{")
+        while not self.accept("}"):
+            symbols.append(self.identifier())
+            if not self.at("}"):
+                self.expect(",")
+        definition["symbols"] = symbols
+        if self.accept("="):
+            definition["default"] = self.identifier()
+            self.expect(";")
+        definition.update(props)
+        self.types.append(definition)
+
+    def fixed(self, doc, props):
+        definition, _ = self._named("fixed", doc, props)
+        self.expect("(")
+        definition["size"] = self.integer()
+        self.expect(")")
+        self.expect(";")
+        definition.update(props)
+        self.types.append(definition)
+
+    def message(self, doc, props):
+        if self.accept("void"):
+            response = "null"
+        else:
+            response = self.type_()
+        name = self.identifier()
+
+        request = []
+        self.expect("(")
+        while not self.accept(")"):
+            param_doc = self.peek().doc
+            param = collections.OrderedDict()
+            param_type = self.type_()
+            param_props = self.annotations()
+            param["name"] = self.identifier()
+            param["type"] = param_type
+            if param_doc:
+                param["doc"] = param_doc
+            if self.accept("="):
+                param["default"] = self.json_value()
+            param.update(param_props)
+            request.append(param)
+            if not self.at(")"):
+                self.expect(",")
+
+        message = collections.OrderedDict()
+        if doc:
+            message["doc"] = doc
+        message.update(props)
+        message["request"] = request
+        message["response"] = response
+        if self.accept("oneway"):
+            if response != "null":
+                raise self.error("One-way message '{}' must return void"
+                                 .format(name))
+            message["one-way"] = True
+        if self.accept("throws"):
+            errors = [self.reference(self.identifier())]
+            while self.accept(","):
+                errors.append(self.reference(self.identifier()))
+            message["errors"] = errors
+        self.expect(";")
+
+        if name in self.messages:
+            raise self.error("Message '{}' is already defined".format(name))
+        self.messages[name] = message
+
+    # Types.
+
+    def type_(self):
+        props = self.annotations()
+        token = self.peek()
+        name = self.identifier()
+        if name == "array" and not token.escaped:
+            self.expect("<")
+            schema = collections.OrderedDict(
+                [("type", "array"), ("items", self.type_())]
+            )
+            self.expect(">")
+        elif name == "map" and not token.escaped:
+            self.expect("<")
+            schema = collections.OrderedDict(
+                [("type", "map"), ("values", self.type_())]
+            )
+            self.expect(">")
+        elif name == "union" and not token.escaped:
+            self.expect("{")
+            schema = [self.type_()]
+            while self.accept(","):
+                schema.append(self.type_())
+            self.expect("}")
+            if props:
+                raise self.error("Unions can't have properties", token)
+            return schema
+        elif name == "decimal" and not token.escaped:
+            self.expect("(")
+            precision = self.integer()
+            self.expect(",")
+            scale = self.integer()
+            self.expect(")")
+            schema = collections.OrderedDict([
+                ("type", "bytes"),
+                ("logicalType", "decimal"),
+                ("precision", precision),
+                ("scale", scale)
+            ])
+        elif name in LOGICAL_TYPES and not token.escaped:
+            base_type, logical_type = LOGICAL_TYPES[name]
+            schema = collections.OrderedDict(
+                [("type", base_type), ("logicalType", logical_type)]
+            )
+        elif name in PRIMITIVE_TYPES:
+            schema = name
+        else:
+            schema = self.reference(name)
+
+        if props:
+            if not isinstance(schema, dict):
+                schema = collections.OrderedDict([("type", schema)])
+            schema.update(props)
+        return schema
+
+
+def parse(text, path=None):
+    """
+    Compile avro IDL into the JSON form of its protocol.
+
+    :param text: avro IDL.
+    :param path: the IDL's file path, to resolve imports and for errors.
+    :return: the protocol, as a dict.
+    :raises IdlError: for IDL that can't be compiled.
+    """
+    protocol = IdlParser(text, path).parse()
+    try:
+        avro_protocol.Parse(json.dumps(protocol))
+    except Exception as ex:
+        raise IdlError("Invalid protocol: {}".format(ex), path)
+    return protocol
+
+
+def compile_protocol(protocol, schema, jar_file=None):
+    """
+    Compile an avro IDL file into a protocol schema file, like
+    utils.compile_protocol does with avro-tools, but without a JVM.
+
+    :param protocol: an avro IDL file path.
+    :param schema: a file path to write the compiled schema.
+    :param jar_file: ignored, for compatibility with utils.compile_protocol.
+    :raises IdlError: for IDL that can't be compiled.
+    """
+    if protocol is None or schema is None:
+        raise ValueError("Input must not be NoneType.")
+    logger.debug("Compiling {} into {}".format(protocol, schema))
+    with io.open(protocol, encoding="utf-8") as _file:
+        compiled = parse(_file.read(), protocol)
+    with io.open(schema, "w", encoding="utf-8") as _file:
+        _file.write(u"{}\n".format(json.dumps(compiled, indent=2)))
+
+
+__all__ = [
+    IdlError.__name__,
+    IdlParser.__name__,
+    compile_protocol.__name__,
+    parse.__name__,
+    tokenize.__name__
+]
@@ -0,0 +1,557 @@
+import collections
+import json
+import logging
+import random
+import string
+import threading
+import time
+
+try:
+    from urllib import parse as urlparse
+except ImportError:  # pragma: no cover
+    import urlparse
+
+from avro import io as avro_io
+from webob import request as webob_request
+
+from . import client
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# The defaults of a load run: calls in flight at once, and seconds run for.
+CONCURRENCY = 8
+DURATION = 10.0
+
+# The number of distinct random calls encoded per message.
+PAYLOADS = 64
+
+# Bounds on random data: the most items in an array or map, the longest
+# string or bytes, and how deep records nest before recursive unions pick
+# null and collections are left empty.
+MAX_ITEMS = 8
+MAX_LENGTH = 32
+MAX_DEPTH = 8
+
+_chars = string.ascii_letters + string.digits
+
+_int_range = (-(1 << 31), (1 << 31) - 1)
+_long_range = (-(1 << 63), (1 << 63) - 1)
+
+
+def _random_string(rng, length):
+    return "".join(rng.choice(_chars) for _ in range(length))
+
+
+def _random_bytes(rng, length):
+    return bytes(bytearray(rng.getrandbits(8) for _ in range(length)))
+
+
+def random_datum(schema, rng=random, depth=0):
+    """
+    Produce a random value of an avro schema.
+
+    :param schema: an avro schema, such as a message's request.
+    :param rng: a random.Random.
+    :param depth: how deep in records the value is.
+    :return: the value.
+    """
+    schema_type = schema.type
+    if schema_type == "null":
+        return None
+    if schema_type == "boolean":
+        return rng.random() < 0.5
+    if schema_type == "int":
+        return rng.randint(*_int_range)
+    if schema_type == "long":
+        return rng.randint(*_long_range)
+    if schema_type in ("float", "double"):
+        return rng.uniform(-1e6, 1e6)
+    if schema_type == "string":
+        return _random_string(rng, rng.randint(0, MAX_LENGTH))
+    if schema_type == "bytes":
+        return _random_bytes(rng, rng.randint(0, MAX_LENGTH))
+    if schema_type == "fixed":
+        return _random_bytes(rng, schema.size)
+    if schema_type == "enum":
+        return rng.choice(schema.symbols)
+
+    deep = depth >= MAX_DEPTH
+    if schema_type == "array":
+        size = 0 if deep else rng.randint(0, MAX_ITEMS)
+        return [
+            random_datum(schema.items, rng, depth + 1) for _ in range(size)
+        ]
+    if schema_type == "map":
+        size = 0 if deep else rng.randint(0, MAX_ITEMS)
+        return dict(
+            (
+                _random_string(rng, rng.randint(1, MAX_LENGTH)),
+                random_datum(schema.values, rng, depth + 1)
+            )
+            for _ in range(size)
+        )
+    if schema_type in ("union", "error_union"):
+        branches = schema.schemas
+        nulls = [branch for branch in branches if branch.type == "null"]
+        if deep and nulls:
+            return None
+        return random_datum(rng.choice(branches), rng, depth)
+    if schema_type in ("record", "error", "request"):
+        return dict(
+            (field.name, random_datum(field.type, rng, depth + 1))
+            for field in schema.fields
+        )
+    raise ValueError("Unknown avro schema type: '{}'".format(schema_type))
+
+
+def _branch_name(schema):
+    return getattr(schema, "fullname", None) or schema.type
+
+
+def from_json(schema, value):
+    """
+    Read a value of an avro schema from its avro JSON encoding, where bytes
+    are strings of code points 0-255 and non-null union values are wrapped
+    in a {"<branch type name>": value} object.
+
+    :param schema: an avro schema.
+    :param value: the value decoded from JSON.
+    :return: the value.
+    """
+    schema_type = schema.type
+    if schema_type in ("bytes", "fixed"):
+        if not isinstance(value, basestring):
+            raise ValueError("Expected a string of bytes: {!r}".format(value))
+        return value.encode("latin-1")
+    if schema_type in ("float", "double"):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return float(value)
+        return value
+    if schema_type == "array":
+        if not isinstance(value, list):
+            raise ValueError("Expected an array: {!r}".format(value))
+        return [from_json(schema.items, item) for item in value]
+    if schema_type == "map":
+        if not isinstance(value, dict):
+            raise ValueError("Expected a map: {!r}".format(value))
+        return dict(
+            (key, from_json(schema.values, item))
+            for key, item in value.items()
+        )
+    if schema_type in ("union", "error_union"):
+        branches = dict(
+            (_branch_name(branch), branch) for branch in schema.schemas
+        )
+        if value is None and "null" in branches:
+            return None
+        if not isinstance(value, dict) or len(value) != 1:
+            raise ValueError(
+                "Expected a union value like {{\"<type>\": value}}: "
+                "{!r}".format(value)
+            )
+        (name, item), = value.items()
+        branch = branches.get(name)
+        if branch is None:
+            raise ValueError("Not a branch of the union: '{}'".format(name))
+        return from_json(branch, item)
+    if schema_type in ("record", "error", "request"):
+        if not isinstance(value, dict):
+            raise ValueError("Expected a record: {!r}".format(value))
+        record = {}
+        for field in schema.fields:
+            if field.name in value:
+                record[field.name] = from_json(field.type, value[field.name])
+            elif field.has_default:
+                record[field.name] = from_json(field.type, field.default)
+        return record
+    return value
+
+
+def load_fixtures(path, protocol):
+    """
+    Read call arguments from a JSON file mapping message names to a list of
+    argument objects (or a single one), in the avro JSON encoding (see
+    from_json).
+
+    :param path: the fixtures file.
+    :param protocol: the avro protocol the messages belong to.
+    :return: a dict of message name -> list of argument dicts.
+    """
+    with open(path) as _file:
+        fixtures = json.load(_file)
+    if not isinstance(fixtures, dict):
+        raise ValueError(
+            "Fixtures must map message names to arguments: {}".format(path)
+        )
+
+    calls = {}
+    for message_name, arg_list in fixtures.items():
+        message = protocol.message_map.get(message_name)
+        if message is None:
+            raise ValueError("Unknown message: '{}'".format(message_name))
+        if not isinstance(arg_list, list):
+            arg_list = [arg_list]
+        calls[message_name] = []
+        for json_args in arg_list:
+            try:
+                args = from_json(message.request, json_args)
+            except ValueError as ex:
+                raise ValueError("Invalid arguments of {}: {}".format(
+                    message_name,
+                    ex
+                ))
+            if not avro_io.Validate(message.request, args):
+                raise ValueError("Invalid arguments of {}: {!r}".format(
+                    message_name,
+                    json_args
+                ))
+            calls[message_name].append(args)
+    return calls
+
+
+def build_calls(protocol, messages=None, fixtures=None, count=PAYLOADS,
+                seed=None):
+    """
+    Build the calls of a load run: fixture arguments for the messages that
+    have them, random arguments for the others.
+
+    :param protocol: the avro protocol served.
+    :param messages: the messages to call. Defaults to the messages with
+        fixtures or, without fixtures, to every message.
+    :param fixtures: arguments from load_fixtures, if any.
+    :param count: the number of random calls built per message.
+    :param seed: a seed for the random arguments.
+    :return: a list of (message name, arguments) pairs.
+    """
+    fixtures = fixtures or {}
+    if messages is None:
+        messages = sorted(fixtures or protocol.message_map)
+    rng = random.Random(seed)
+    calls = []
+    for message_name in messages:
+        message = protocol.message_map.get(message_name)
+        if message is None:
+            raise ValueError("Unknown message: '{}'".format(message_name))
+        if message_name in fixtures:
+            calls.extend(
+                (message_name, args) for args in fixtures[message_name]
+            )
+            continue
+        calls.extend(
+            (message_name, random_datum(message.request, rng))
+            for _ in range(count)
+        )
+    rng.shuffle(calls)
+    return calls
+
+
+class WSGITransport(object):
+    """
+    Posts request bodies to a WSGI application in process.
+    """
+
+    def __init__(self, app, path):
+        """
+        :param app: a WSGI application.
+        :param path: the service's path.
+        """
+        self.app = app
+        self.path = path
+
+    def post(self, body, headers):
+        """
+        :param body: the request body.
+        :param headers: a dict of request headers.
+        :return: a tuple of (HTTP status, response body).
+        """
+        request = webob_request.Request.blank(
+            self.path,
+            method="POST",
+            headers=headers,
+            body=body
+        )
+        response = request.get_response(self.app)
+        return response.status_code, response.body
+
+    def close(self):
+        pass
+
+
+class HTTPTransport(object):
+    """
+    Posts request bodies to a service URL over keep-alive connections.
+    """
+
+    def __init__(self, url, connect_timeout=client.CONNECT_TIMEOUT,
+                 read_timeout=client.READ_TIMEOUT, max_idle=CONCURRENCY):
+        """
+        :param url: the service's URL.
+        :param connect_timeout: the most seconds to wait for a connection.
+        :param read_timeout: the most seconds to wait for each read or write
+            on a connection.
+        :param max_idle: the most idle connections to keep open, at least
+            the concurrency of the run.
+        """
+        parts = urlparse.urlsplit(url)
+        self.path = parts.path or "/"
+        if parts.query:
+            self.path = "{}?{}".format(self.path, parts.query)
+        self.pool = client.ConnectionPool(
+            parts.scheme,
+            parts.hostname,
+            parts.port,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            max_idle=max_idle
+        )
+
+    def post(self, body, headers):
+        """
+        :param body: the request body.
+        :param headers: a dict of request headers.
+        :return: a tuple of (HTTP status, response body).
+        """
+        while True:
+            conn, reused = self.pool.acquire()
+            try:
+                result = client.post_request(
+                    conn,
+                    self.path,
+                    body,
+                    headers,
+                    reused
+                )
+            except Exception:
+                self.pool.discard(conn)
+                raise
+            if result is None:
+                # A stale keep-alive connection, retry on another.
+                self.pool.discard(conn)
+                continue
+            response, payload = result
+            if response.will_close:
+                self.pool.discard(conn)
+            else:
+                self.pool.release(conn)
+            return response.status, payload
+
+    def close(self):
+        self.pool.close()
+
+
+class LoadReport(object):
+    """
+    The outcome of a load run: its throughput, the latencies of the calls
+    that succeeded, and a count of the calls that failed by reason.
+    """
+
+    def __init__(self, latencies, errors, elapsed, concurrency, rate=None):
+        """
+        :param latencies: the seconds each successful call took.
+        :param errors: a dict of failure reason -> count.
+        :param elapsed: the seconds the run took.
+        :param concurrency: the calls in flight at once.
+        :param rate: the target calls per second, if any.
+        """
+        self.latencies = latencies
+        self.errors = errors
+        self.elapsed = elapsed
+        self.concurrency = concurrency
+        self.rate = rate
+
+    @property
+    def requests(self):
+        return len(self.latencies) + sum(self.errors.values())
+
+    @property
+    def throughput(self):
+        if not self.elapsed:
+            return 0.0
+        return self.requests / self.elapsed
+
+    def summary(self):
+        """
+        :return: the report as a dict.
+        """
+        return {
+            "requests": self.requests,
+            "errors": dict(self.errors),
+            "elapsed": self.elapsed,
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "throughput": self.throughput,
+            "latency": metrics.summarize(self.latencies)
+        }
+
+    def format(self):
+        """
+        :return: the report as text, with latencies in milliseconds.
+        """
+        lines = [
+            "requests:    {} in {:.2f}s, {} at once{}".format(
+                self.requests,
+                self.elapsed,
+                self.concurrency,
+                "" if self.rate is None else ", {:g}/s targeted".format(
+                    self.rate
+                )
+            ),
+            "throughput:  {:.1f} requests/s".format(self.throughput)
+        ]
+        latency = metrics.summarize(self.latencies)
+        if latency:
+            lines.append("latency ms:  " + "  ".join(
+                "{} {:.3f}".format(name, latency[name] * 1e3)
+                for name in ("mean", "p50", "p90", "p99", "p999", "max")
+            ))
+        error_count = sum(self.errors.values())
+        lines.append("errors:      {}".format(error_count))
+        for reason, count in sorted(self.errors.items()):
+            lines.append("  {}: {}".format(reason, count))
+        return "\n".join(lines) + "\n"
+
+
+class LoadGenerator(object):
+    """
+    Drives a service with calls from a number of worker threads, each
+    sending its next call once the last one is answered (a closed loop).
+
+    With a target rate, calls are instead scheduled at even intervals and
+    each worker sends the next call due. A call's latency is then measured
+    from when it was due rather than when it was sent, so a server that
+    falls behind is charged for the calls it held up.
+
+    Calls are encoded once, up front, and sent in turn. Responses are
+    decoded, so calls that fail count as errors.
+    """
+
+    def __init__(self, transport, protocol, calls, concurrency=CONCURRENCY,
+                 rate=None, duration=DURATION, requests=None,
+                 stateless=True):
+        """
+        :param transport: a WSGITransport or HTTPTransport.
+        :param protocol: the avro protocol served.
+        :param calls: a list of (message name, arguments) pairs.
+        :param concurrency: the number of worker threads.
+        :param rate: the target calls per second, if any.
+        :param duration: the most seconds to run for.
+        :param requests: the most calls to send, if limited.
+        :param stateless: whether to send calls without a handshake,
+            identified by protocol hash headers. Only pyramid_avro servers
+            support this.
+        """
+        if not calls:
+            raise ValueError("No calls to send.")
+        self.transport = transport
+        self.requestor = client.Requestor(protocol)
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = duration
+        self.requests = requests
+        self.stateless = stateless
+        self.headers = self.requestor.headers(stateless)
+        self.bodies = [
+            (
+                message_name,
+                self.requestor.call_body(message_name, args, stateless)
+            )
+            for message_name, args in calls
+        ]
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._started = None
+        self._deadline = None
+        self._latencies = []
+        self._errors = collections.Counter()
+
+    def _next_call(self):
+        # The index and due time of the next call, or None once done.
+        with self._lock:
+            if self.requests is not None and self._sent >= self.requests:
+                return None
+            now = metrics.clock()
+            due = now
+            if self.rate is not None:
+                due = self._started + self._sent / float(self.rate)
+            if max(now, due) >= self._deadline:
+                return None
+            index = self._sent
+            self._sent += 1
+        return index, due
+
+    def _send(self, index):
+        message_name, body = self.bodies[index % len(self.bodies)]
+        status, payload = self.transport.post(body, self.headers)
+        if status != 200:
+            return "HTTP {}".format(status)
+        try:
+            self.requestor.read_call_body(
+                message_name,
+                payload,
+                self.stateless
+            )
+        except Exception as ex:
+            return ex.__class__.__name__
+        return None
+
+    def _work(self):
+        latencies = []
+        errors = collections.Counter()
+        while True:
+            call = self._next_call()
+            if call is None:
+                break
+            index, due = call
+            wait = due - metrics.clock()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                error = self._send(index)
+            except Exception as ex:
+                logger.debug("Failed to send a call.", exc_info=True)
+                error = ex.__class__.__name__
+            if error is None:
+                latencies.append(metrics.clock() - due)
+            else:
+                errors[error] += 1
+        with self._lock:
+            self._latencies.extend(latencies)
+            self._errors.update(errors)
+
+    def run(self):
+        """
+        Run the load, until the duration is up or every call was sent.
+
+        :return: a LoadReport.
+        """
+        self._started = metrics.clock()
+        self._deadline = self._started + self.duration
+        workers = [
+            threading.Thread(target=self._work, name="pyramid-avro-load")
+            for _ in range(self.concurrency)
+        ]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return LoadReport(
+            self._latencies,
+            self._errors,
+            metrics.clock() - self._started,
+            self.concurrency,
+            self.rate
+        )
+
+
+__all__ = [
+    HTTPTransport.__name__,
+    LoadGenerator.__name__,
+    LoadReport.__name__,
+    WSGITransport.__name__,
+    build_calls.__name__,
+    from_json.__name__,
+    load_fixtures.__name__,
+    random_datum.__name__
+]
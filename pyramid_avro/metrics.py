@@ -0,0 +1,415 @@
+import collections
+import json
+import threading
+import time
+
+from pyramid import response as p_response
+from zope import interface as zi
+
+from . import pools
+
+# The request phases timed.
+PHASE_READ = "read"
+PHASE_HANDSHAKE = "handshake"
+PHASE_DECODE = "decode"
+PHASE_HANDLER = "handler"
+PHASE_VALIDATE = "validate"
+PHASE_ENCODE = "encode"
+PHASE_TOTAL = "total"
+PHASE_WRITE = "write"
+PHASES = (
+    PHASE_READ,
+    PHASE_HANDSHAKE,
+    PHASE_DECODE,
+    PHASE_HANDLER,
+    PHASE_VALIDATE,
+    PHASE_ENCODE,
+    PHASE_TOTAL,
+    PHASE_WRITE
+)
+
+# The request and response sizes recorded, in bytes.
+REQUEST_BYTES = "request_bytes"
+RESPONSE_BYTES = "response_bytes"
+
+# What's recorded of compressed responses: their size in bytes, how many
+# times smaller than the framed response they were, and the CPU seconds
+# spent compressing them.
+COMPRESSED_BYTES = "compressed_bytes"
+COMPRESSION_RATIO = "compression_ratio"
+COMPRESS_CPU_SECONDS = "compress_cpu_seconds"
+
+# What request-wide metrics are recorded under, for requests that aren't a
+# single call.
+BATCH_MESSAGE = "(batch)"
+NO_MESSAGE = "(none)"
+
+# What executor pool gauges are reported under by the stats route.
+POOLS = "(pools)"
+
+# The executor pool stats reported to prometheus: gauges of the pool's
+# size and load, and counters of what happened to its calls.
+POOL_GAUGES = ("max_workers", "max_queue", "active", "queued")
+POOL_COUNTERS = ("rejected", "caller_runs", "completed")
+
+# The default number of recent values summarized per metric.
+WINDOW_SIZE = 1024
+
+# Summary names of the percentiles reported.
+PERCENTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("p999", 0.999))
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+clock = getattr(time, "perf_counter", time.time)
+
+
+class IAvroRouteMetrics(zi.Interface):
+
+    service = zi.Attribute("""The service name.""")
+
+
+class Window(object):
+    """
+    A ring buffer of a metric's most recent values, with running totals of
+    every value ever added.
+    """
+
+    def __init__(self, size=WINDOW_SIZE):
+        """
+        :param size: the most values kept.
+        """
+        self.size = size
+        self.count = 0
+        self.sum = 0.0
+        self._values = [0.0] * size
+        self._lock = threading.Lock()
+
+    def add(self, value):
+        with self._lock:
+            self._values[self.count % self.size] = value
+            self.count += 1
+            self.sum += value
+
+    def summary(self):
+        """
+        Summarize the metric: totals, and the mean, percentiles and maximum
+        of the recent values.
+
+        :return: a dict.
+        """
+        with self._lock:
+            count, total = self.count, self.sum
+            values = self._values[:min(count, self.size)]
+        summary = summarize(values)
+        summary.update({"count": count, "sum": total, "window": len(values)})
+        return summary
+
+
+def summarize(values):
+    """
+    Summarize a sample of values by their mean, PERCENTILES and maximum.
+
+    :param values: a sequence of numbers.
+    :return: a dict, empty when there are no values.
+    """
+    values = sorted(values)
+    if not values:
+        return {}
+    summary = {"mean": sum(values) / len(values), "max": values[-1]}
+    for name, percentile in PERCENTILES:
+        index = min(len(values) - 1, int(percentile * len(values)))
+        summary[name] = values[index]
+    return summary
+
+
+class RequestTimer(object):
+    """
+    Collects the phase timings of a single request as it's served.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def start(self):
+        """
+        :return: a start time, for "stop".
+        """
+        return clock()
+
+    def stop(self, phase, started, message=None):
+        """
+        Record the time a phase took.
+
+        :param phase: one of PHASES.
+        :param started: the phase's start time, from "start".
+        :param message: the message the phase is part of, if any.
+        """
+        self.records.append((message, phase, clock() - started))
+
+    def request_message(self, is_batch=False):
+        """
+        Name the message request-wide metrics of the request are recorded
+        under: the message called, BATCH_MESSAGE for batches, or NO_MESSAGE
+        when no call was decoded.
+
+        :param is_batch: whether the request was a batch.
+        :return: a message name.
+        """
+        if is_batch:
+            return BATCH_MESSAGE
+        messages = set(
+            message for message, _, _ in self.records if message is not None
+        )
+        if len(messages) == 1:
+            return messages.pop()
+        return NO_MESSAGE
+
+
+class _NullTimer(object):
+    # Stands in for a RequestTimer when timings aren't collected.
+
+    def start(self):
+        return 0
+
+    def stop(self, phase, started, message=None):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+@zi.implementer(IAvroRouteMetrics)
+class RouteMetrics(object):
+    """
+    Phase timings and request/response sizes of a service, per message,
+    kept in Windows.
+
+    Request-wide metrics (reading the request, the handshake, the total time,
+    sizes and compression) are recorded under the message called,
+    BATCH_MESSAGE for batches, or NO_MESSAGE when no call was decoded.
+    """
+
+    def __init__(self, service, window_size=WINDOW_SIZE):
+        """
+        :param service: the service name.
+        :param window_size: the number of recent values summarized per
+            metric.
+        """
+        self.service = service
+        self.window_size = window_size
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def window(self, message, metric):
+        """
+        Get the Window of a metric, creating it as needed.
+
+        :param message: a message name.
+        :param metric: a phase, REQUEST_BYTES, RESPONSE_BYTES, or one of
+            the compression metrics.
+        :return: a Window.
+        """
+        key = (message, metric)
+        window = self._windows.get(key)
+        if window is None:
+            with self._lock:
+                window = self._windows.get(key)
+                if window is None:
+                    window = self._windows[key] = Window(self.window_size)
+        return window
+
+    def record(self, timer, request_size, response_size, is_batch=False):
+        """
+        Record a request.
+
+        :param timer: the request's RequestTimer.
+        :param request_size: the request message size.
+        :param response_size: the response message size.
+        :param is_batch: whether the request was a batch.
+        """
+        request_message = timer.request_message(is_batch)
+        for message, phase, seconds in timer.records:
+            self.window(message or request_message, phase).add(seconds)
+        self.window(request_message, REQUEST_BYTES).add(request_size)
+        self.window(request_message, RESPONSE_BYTES).add(response_size)
+
+    def record_write(self, message, seconds):
+        """
+        Record the time taken to frame and send a response, once it was
+        sent.
+
+        :param message: what the request's metrics are recorded under (see
+            RequestTimer.request_message).
+        :param seconds: the time taken.
+        """
+        self.window(message, PHASE_WRITE).add(seconds)
+
+    def record_compression(self, message, size, compressed_size,
+                           cpu_seconds):
+        """
+        Record a compressed response, once it was sent.
+
+        :param message: what the request's metrics are recorded under (see
+            RequestTimer.request_message).
+        :param size: the framed response size.
+        :param compressed_size: the compressed response size.
+        :param cpu_seconds: the CPU seconds spent compressing it.
+        """
+        self.window(message, COMPRESSED_BYTES).add(compressed_size)
+        if compressed_size:
+            self.window(message, COMPRESSION_RATIO).add(
+                size / float(compressed_size)
+            )
+        self.window(message, COMPRESS_CPU_SECONDS).add(cpu_seconds)
+
+    def summary(self):
+        """
+        Summarize every metric.
+
+        :return: a dict of message -> metric -> Window.summary.
+        """
+        with self._lock:
+            windows = list(self._windows.items())
+        summary = {}
+        for (message, metric), window in windows:
+            summary.setdefault(message, {})[metric] = window.summary()
+        return summary
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace(
+        "\n", "\\n"
+    )
+
+
+def prometheus_text(route_metrics):
+    """
+    Write metrics in the prometheus text exposition format, as summaries.
+
+    :param route_metrics: an iterable of RouteMetrics.
+    :return: the text.
+    """
+    families = collections.OrderedDict([
+        ("pyramid_avro_phase_seconds", []),
+        ("pyramid_avro_request_bytes", []),
+        ("pyramid_avro_response_bytes", []),
+        ("pyramid_avro_compressed_bytes", []),
+        ("pyramid_avro_compression_ratio", []),
+        ("pyramid_avro_compress_cpu_seconds", [])
+    ])
+    for metrics in sorted(route_metrics, key=lambda m: m.service):
+        summary = metrics.summary()
+        for message in sorted(summary):
+            for metric in sorted(summary[message]):
+                labels = [
+                    ("service", metrics.service),
+                    ("message", message)
+                ]
+                if metric in PHASES:
+                    family = "pyramid_avro_phase_seconds"
+                    labels.append(("phase", metric))
+                else:
+                    family = "pyramid_avro_{}".format(metric)
+                families[family].append((labels, summary[message][metric]))
+
+    lines = []
+    for family, samples in families.items():
+        lines.append("# TYPE {} summary".format(family))
+        for labels, summary in samples:
+            label_text = ",".join(
+                '{}="{}"'.format(name, _escape_label(value))
+                for name, value in labels
+            )
+            if summary["window"]:
+                for name, percentile in PERCENTILES:
+                    lines.append('{}{{{},quantile="{}"}} {!r}'.format(
+                        family,
+                        label_text,
+                        percentile,
+                        float(summary[name])
+                    ))
+            lines.append("{}_sum{{{}}} {!r}".format(
+                family,
+                label_text,
+                float(summary["sum"])
+            ))
+            lines.append("{}_count{{{}}} {}".format(
+                family,
+                label_text,
+                summary["count"]
+            ))
+    return "\n".join(lines) + "\n"
+
+
+def prometheus_pool_text(pool_stats):
+    """
+    Write executor pool stats in the prometheus text exposition format.
+
+    :param pool_stats: a dict of pool name -> stats, as pools.pool_stats
+        returns.
+    :return: the text.
+    """
+    lines = []
+    for stat, kind, family_format in (
+        [(stat, "gauge", "pyramid_avro_pool_{}") for stat in POOL_GAUGES] +
+        [(stat, "counter", "pyramid_avro_pool_{}_total")
+         for stat in POOL_COUNTERS]
+    ):
+        family = family_format.format(stat)
+        lines.append("# TYPE {} {}".format(family, kind))
+        for name in sorted(pool_stats):
+            lines.append('{}{{pool="{}"}} {}'.format(
+                family,
+                _escape_label(name),
+                pool_stats[name][stat]
+            ))
+    return "\n".join(lines) + "\n"
+
+
+def stats_view(request):
+    """
+    Report the metrics of every service, and the gauges of every executor
+    pool (under POOLS): as JSON, or in the prometheus text format given a
+    "format=prometheus" query parameter.
+
+    :param request: a pyramid request.
+    :return: a pyramid response.
+    """
+    route_metrics = [
+        metrics for _, metrics
+        in request.registry.getUtilitiesFor(IAvroRouteMetrics)
+    ]
+    pool_stats = pools.pool_stats(request.registry)
+    if request.params.get("format") == "prometheus":
+        text = prometheus_text(route_metrics)
+        if pool_stats:
+            text += prometheus_pool_text(pool_stats)
+        return p_response.Response(
+            text,
+            content_type=PROMETHEUS_CONTENT_TYPE,
+            charset="utf-8"
+        )
+
+    summaries = dict(
+        (metrics.service, metrics.summary()) for metrics in route_metrics
+    )
+    if pool_stats:
+        summaries[POOLS] = pool_stats
+    body = json.dumps(summaries, sort_keys=True)
+    return p_response.Response(
+        body,
+        content_type="application/json",
+        charset="utf-8"
+    )
+
+
+__all__ = [
+    IAvroRouteMetrics.__name__,
+    RequestTimer.__name__,
+    RouteMetrics.__name__,
+    Window.__name__,
+    prometheus_pool_text.__name__,
+    prometheus_text.__name__,
+    stats_view.__name__,
+    summarize.__name__
+]
@@ -0,0 +1,239 @@
+import logging
+import os
+import threading
+
+try:
+    from concurrent import futures
+except ImportError:  # pragma: no cover
+    futures = None
+
+from avro import ipc as avro_ipc
+from zope import interface as zi
+
+from . import aio
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PoolRejected(avro_ipc.AvroRemoteException):
+    """Raised when a pool is full and its rejection policy gives up."""
+
+
+class IAvroExecutorPool(zi.Interface):
+
+    name = zi.Attribute("""The pool's name.""")
+
+
+class MessageRequest(object):
+    """
+    The stand-in request handed to implementations run in a process pool.
+
+    Pyramid requests can't be sent to another process, so these carry only
+    the message name and its decoded arguments.
+    """
+
+    def __init__(self, message, avro_data):
+        self.message = message
+        self.avro_data = avro_data
+
+
+def call_in_process(message_impl, message, avro_data):
+    """
+    Call a message implementation in a process pool worker.
+
+    :param message_impl: a picklable message implementation.
+    :param message: an avro message name.
+    :param avro_data: the decoded message arguments.
+    :return: the implementation's response.
+    """
+    response = message_impl(MessageRequest(message, avro_data))
+    if aio.is_coroutine(response):
+        loop = aio.asyncio.new_event_loop()
+        try:
+            response = loop.run_until_complete(response)
+        finally:
+            loop.close()
+    return response
+
+
+@zi.implementer(IAvroExecutorPool)
+class ExecutorPool(object):
+    """
+    A named, bounded pool of threads or processes that message
+    implementations can be bound to.
+
+    At most max_workers calls run at once and at most max_queue more wait
+    for a worker. Calls beyond that are handled according to the rejection
+    policy:
+
+        # reject: fail the call right away.
+        # caller_runs: run the call in the requesting thread instead.
+        # block: wait up to block_timeout seconds for room, then reject.
+
+    Binding slow or bursty messages to pools of their own keeps them from
+    tying up every worker thread of a service. Gauges of calls running,
+    waiting and rejected are available from stats().
+    """
+
+    def __init__(self, name, kind=settings.POOL_THREAD, max_workers=4,
+                 max_queue=0, rejection=settings.POOL_REJECT,
+                 block_timeout=None):
+        """
+        :param name: the pool's name.
+        :param kind: "thread" or "process".
+        :param max_workers: the most calls to run at once.
+        :param max_queue: the most calls to hold waiting for a worker.
+        :param rejection: "reject", "caller_runs" or "block".
+        :param block_timeout: the most seconds a "block" pool waits for
+            room. None waits indefinitely.
+        """
+        if futures is None:  # pragma: no cover
+            raise RuntimeError(
+                "Executor pools require concurrent.futures ('futures' on "
+                "python 2)."
+            )
+        self.name = name
+        self.kind = settings.parse_pool_kind(kind)
+        self.max_workers = settings.parse_positive_int(
+            max_workers,
+            "max_workers"
+        )
+        self.max_queue = settings.parse_non_negative_int(
+            max_queue,
+            "max_queue"
+        )
+        self.rejection = settings.parse_rejection_policy(rejection)
+        self.block_timeout = None
+        if block_timeout is not None:
+            self.block_timeout = settings.parse_non_negative_float(
+                block_timeout,
+                "block_timeout"
+            )
+
+        self.in_flight = 0
+        self.rejected = 0
+        self.caller_runs = 0
+        self.completed = 0
+        self._slots = threading.Semaphore(self.max_workers + self.max_queue)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    @property
+    def executor(self):
+        """The underlying executor, created on first use in each process."""
+        pid = os.getpid()
+        if self._executor is None or self._pid != pid:
+            with self._lock:
+                if self._executor is None or self._pid != pid:
+                    if self.kind == settings.POOL_PROCESS:
+                        executor_class = futures.ProcessPoolExecutor
+                    else:
+                        executor_class = futures.ThreadPoolExecutor
+                    self._executor = executor_class(self.max_workers)
+                    self._pid = pid
+        return self._executor
+
+    def _acquire(self):
+        if self._slots.acquire(False):
+            return True
+        if self.rejection != settings.POOL_BLOCK:
+            return False
+        if self.block_timeout is None:
+            return self._slots.acquire()
+        return self._slots.acquire(True, self.block_timeout)
+
+    def _done(self, future):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def run(self, fn, *args):
+        """
+        Run fn(*args) on the pool, waiting for its result.
+
+        :param fn: a callable. For process pools, fn and args must be
+            picklable.
+        :param args: arguments for fn.
+        :return: fn's result.
+        """
+        if not self._acquire():
+            if self.rejection == settings.POOL_CALLER_RUNS:
+                with self._lock:
+                    self.caller_runs += 1
+                return fn(*args)
+            with self._lock:
+                self.rejected += 1
+            raise PoolRejected(
+                "Pool '{}' is full ({} running, {} queued).".format(
+                    self.name,
+                    self.max_workers,
+                    self.max_queue
+                )
+            )
+
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future.result()
+
+    def stats(self):
+        """
+        Report the pool's gauges and counters.
+
+        :return: a dict.
+        """
+        with self._lock:
+            in_flight = self.in_flight
+            return {
+                "name": self.name,
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "active": min(in_flight, self.max_workers),
+                "queued": max(in_flight - self.max_workers, 0),
+                "rejected": self.rejected,
+                "caller_runs": self.caller_runs,
+                "completed": self.completed
+            }
+
+    def shutdown(self, wait=True):
+        """
+        Shut the underlying executor down. It's recreated if the pool is
+        used again.
+
+        :param wait: whether to wait for running calls to finish.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait)
+
+
+def pool_stats(registry):
+    """
+    Report the gauges of every pool registered with a pyramid registry.
+
+    :param registry: a pyramid registry.
+    :return: a dict of pool name -> stats.
+    """
+    return dict(
+        (name, pool.stats())
+        for name, pool in registry.getUtilitiesFor(IAvroExecutorPool)
+    )
+
+
+__all__ = [
+    IAvroExecutorPool.__name__,
+    ExecutorPool.__name__,
+    MessageRequest.__name__,
+    PoolRejected.__name__,
+    pool_stats.__name__
+]
@@ -0,0 +1,331 @@
+import collections
+import hmac
+import itertools
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+try:
+    import cProfile
+except ImportError:  # pragma: no cover
+    cProfile = None
+
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+# Requests carrying this header with the "profile_secret" as its value are
+# profiled.
+PROFILE_HEADER = "Avro-Profile"
+
+# The default seconds between stack samples. Samples can't be taken more
+# often than the interpreter switches threads (sys.getswitchinterval).
+SAMPLE_INTERVAL = 0.005
+
+_unsafe_re = re.compile(r"[^\w.-]")
+
+
+def _file_part(name):
+    return _unsafe_re.sub("_", name)
+
+
+def frame_label(frame):
+    """
+    :param frame: a stack frame.
+    :return: the frame's function, as a collapsed stack entry.
+    """
+    code = frame.f_code
+    return "{} ({}:{})".format(
+        code.co_name,
+        code.co_filename,
+        code.co_firstlineno
+    )
+
+
+def _thread_id():
+    get_ident = getattr(threading, "get_ident", None)
+    if get_ident is None:  # pragma: no cover
+        import thread
+        get_ident = thread.get_ident
+    return get_ident()
+
+
+class StackSampler(object):
+    """
+    Samples the stacks of every registered SamplingProfiler's thread from
+    one thread of its own, every interval seconds, however many requests
+    are profiled at once. The thread runs while profilers are registered.
+
+    Samples are taken at a steady rate rather than from each profile's
+    start, so a request shorter than the interval is sampled in proportion
+    to its length: summed over many requests, short ones show up as often
+    as the time they take.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        """
+        :param interval: the seconds between samples.
+        """
+        self.interval = interval
+        self.profilers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def register(self, profiler):
+        """
+        Start sampling a profiler's thread.
+
+        :param profiler: a SamplingProfiler.
+        """
+        with self._lock:
+            pid = os.getpid()
+            if self._pid != pid:
+                # A forked child, where the parent's threads don't exist.
+                self.profilers = set()
+                self._thread = None
+            self.profilers.add(profiler)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run,
+                    name="pyramid-avro-profiler"
+                )
+                self._thread.daemon = True
+                self._thread.start()
+                self._pid = pid
+
+    def unregister(self, profiler):
+        """
+        Stop sampling a profiler's thread. No samples are taken for it once
+        this returns.
+
+        :param profiler: a SamplingProfiler.
+        """
+        with self._lock:
+            self.profilers.discard(profiler)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self.profilers:
+                    self._thread = None
+                    return
+                frames = sys._current_frames()
+                for profiler in self.profilers:
+                    profiler.sample(frames)
+
+
+_samplers = {}
+_samplers_lock = threading.Lock()
+
+
+def stack_sampler(interval):
+    """
+    :param interval: the seconds between samples.
+    :return: the StackSampler shared by profilers sampling at interval.
+    """
+    with _samplers_lock:
+        sampler = _samplers.get(interval)
+        if sampler is None:
+            sampler = _samplers[interval] = StackSampler(interval)
+        return sampler
+
+
+class SamplingProfiler(object):
+    """
+    Profiles a thread by having its stack sampled from another thread (see
+    StackSampler), counting how often each stack is seen. The profiled
+    thread runs untouched in between samples.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, thread_id=None):
+        """
+        :param interval: the seconds between samples.
+        :param thread_id: the thread to profile. Defaults to the thread
+            calling "start".
+        """
+        self.interval = interval
+        self.thread_id = thread_id
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._sampler = None
+
+    def start(self):
+        if self.thread_id is None:
+            self.thread_id = _thread_id()
+        self._sampler = stack_sampler(self.interval)
+        self._sampler.register(self)
+
+    def stop(self):
+        self._sampler.unregister(self)
+
+    def sample(self, frames=None):
+        """
+        Take one sample of the profiled thread's stack.
+
+        :param frames: sys._current_frames(), if already taken.
+        """
+        if frames is None:
+            frames = sys._current_frames()
+        frame = frames.get(self.thread_id)
+        labels = []
+        while frame is not None:
+            labels.append(frame_label(frame))
+            frame = frame.f_back
+        if labels:
+            self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """
+        :return: the sampled stacks, in the collapsed stack format.
+        """
+        return "".join(
+            "{} {}\n".format(stack, count)
+            for stack, count in sorted(self.stacks.items())
+        )
+
+
+class RouteProfiler(object):
+    """
+    Decides which requests to a service are profiled, profiles them, and
+    writes each profile to a directory, per service and message.
+
+    A request is profiled when profiling is always on, when it carries the
+    secret in a PROFILE_HEADER header, or when it's picked at the sampling
+    rate. Collapsed stacks of a message are appended to one
+    "<service>.<message>.collapsed" file; pstats are written to a
+    "<service>.<message>.<pid>.<n>.pstats" file per request.
+    """
+
+    def __init__(self, service, directory,
+                 output=settings.PROFILE_COLLAPSED, always=False,
+                 sample_rate=0.0, secret=None, messages=frozenset(),
+                 interval=SAMPLE_INTERVAL):
+        """
+        :param service: the service name.
+        :param directory: the directory profiles are written to.
+        :param output: settings.PROFILE_COLLAPSED, for stacks sampled from
+            another thread, folded one per line ("frame;frame;frame count",
+            as flamegraph tools read them), or settings.PROFILE_PSTATS, for
+            cProfile's deterministic pstats.
+        :param always: whether to profile every request.
+        :param sample_rate: the fraction of requests to profile.
+        :param secret: the PROFILE_HEADER value that has a request
+            profiled, if any.
+        :param messages: the messages to keep profiles of. Profiles of
+            other messages are dropped; all are kept by default.
+        :param interval: the seconds between stack samples.
+        """
+        pstats = output == settings.PROFILE_PSTATS
+        if pstats and cProfile is None:  # pragma: no cover
+            raise ValueError("cProfile is not available.")
+        self.service = service
+        self.directory = directory
+        self.output = output
+        self.always = always
+        self.sample_rate = sample_rate
+        self.secret = secret
+        self.messages = messages
+        self.interval = interval
+        self._count = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def should_profile(self, request):
+        """
+        :param request: a webob request.
+        :return: whether to profile the request.
+        """
+        if self.always:
+            return True
+        if self.secret is not None:
+            token = request.headers.get(PROFILE_HEADER)
+            if token is not None and hmac.compare_digest(
+                token.encode("utf-8"),
+                self.secret.encode("utf-8")
+            ):
+                return True
+        return random.random() < self.sample_rate
+
+    def start(self):
+        """
+        Start profiling the calling thread.
+
+        :return: a profile for "stop", or None if it couldn't be started.
+        """
+        if self.output == settings.PROFILE_PSTATS:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is active on this thread.
+                logger.warning("Failed to start profiling.", exc_info=True)
+                return None
+            return profile
+
+        profile = SamplingProfiler(self.interval)
+        profile.start()
+        return profile
+
+    def stop(self, profile, message):
+        """
+        Stop a profile from "start" and write it out. Failures to write are
+        logged, not raised.
+
+        :param profile: the profile, or None.
+        :param message: the message profiled (see
+            metrics.RequestTimer.request_message).
+        :return: the file written, or None.
+        """
+        if profile is None:
+            return None
+        if self.output == settings.PROFILE_PSTATS:
+            profile.disable()
+        else:
+            profile.stop()
+        if self.messages and message not in self.messages:
+            return None
+        if self.output == settings.PROFILE_COLLAPSED:
+            if not profile.samples:
+                return None
+
+        prefix = os.path.join(
+            self.directory,
+            "{}.{}".format(_file_part(self.service), _file_part(message))
+        )
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            if self.output == settings.PROFILE_PSTATS:
+                path = "{}.{}.{}.pstats".format(
+                    prefix,
+                    os.getpid(),
+                    next(self._count)
+                )
+                profile.dump_stats(path)
+            else:
+                path = prefix + ".collapsed"
+                with self._lock:
+                    with open(path, "a") as _file:
+                        _file.write(profile.collapsed())
+        except (IOError, OSError):
+            logger.exception("Failed to write profile of {} {}.".format(
+                self.service,
+                message
+            ))
+            return None
+        return path
+
+
+__all__ = [
+    RouteProfiler.__name__,
+    SamplingProfiler.__name__,
+    StackSampler.__name__,
+    frame_label.__name__,
+    stack_sampler.__name__
+]
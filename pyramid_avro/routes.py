@@ -1,6 +1,8 @@
 import copy
-import io
+import functools
 import logging
+import random
+import threading
 import traceback
 
 from avro import io as avro_io
@@ -12,46 +14,525 @@ from pyramid import threadlocal as p_threadlocal
 from webob import exc as http_exc
 from zope import interface as zi
 
+from . import aio
+from . import batch
+from . import cache
+from . import codecs
+from . import compression
+from . import data
+from . import framing
+from . import handshake
+from . import metrics
+from . import pools
+from . import settings
+from . import tracing
+
 logger = logging.getLogger(__name__)
 
 
 class ServiceResponder(avro_ipc.Responder):
     """
     An Avro service responder which executes a callback to get a response.
+
+    Requests and responses are decoded and encoded with codecs compiled from
+    the local protocol up front, rather than walking the schema with the
+    generic avro.io DatumReader/DatumWriter on every call.
+
+    Responses are checked against the local protocol according to a
+    validation mode, set for the whole responder and optionally overridden
+    per message:
+
+        # full: validate every response before encoding it.
+        # sampled: validate a random fraction of responses.
+        # encode: skip the validation pass, type checking while encoding.
+        # off: skip validation, encoding without type checks.
     """
 
+    response_mismatch = "Server response did not conform to its local schema."
+
     def __init__(self, executor, *args, **kwargs):
         """
         Overridden init to add an executor callback.
 
         :param executor: a callback to use for retrieving a response.
         :param args: regular avro.ipc.Responder args.
-        :param kwargs: regular avro.ipc.Responder kwargs.
+        :param kwargs: regular avro.ipc.Responder kwargs, plus optional
+            "validate_response", "validate_sample_rate",
+            "validate_messages" and "protocol_cache_size" options, and
+            "handshake_responses" already serialized for the local protocol
+            (see cache.ParsedProtocol).
         """
         self.executor = executor
+        handshake_responses = kwargs.pop("handshake_responses", None)
+        self.protocol_cache = cache.ProtocolCache(
+            settings.parse_positive_int(
+                kwargs.pop(
+                    "protocol_cache_size",
+                    cache.PROTOCOL_CACHE_SIZE
+                ),
+                "protocol_cache_size"
+            )
+        )
+        self.validate_response = settings.parse_validation_mode(
+            kwargs.pop("validate_response", settings.VALIDATE_FULL)
+        )
+        self.validate_sample_rate = settings.parse_sample_rate(
+            kwargs.pop(
+                "validate_sample_rate",
+                settings.CONFIG_DEFAULTS["validate_sample_rate"]
+            )
+        )
+        self.validate_messages = settings.parse_message_options(
+            kwargs.pop("validate_messages", None),
+            settings.parse_validation_mode
+        )
         super(ServiceResponder, self).__init__(*args, **kwargs)
+        self.codec = codecs.ProtocolCodec(self.local_protocol)
+        self.handshake_responses = (
+            handshake_responses or self.serialize_handshake_responses()
+        )
+
+        for message_name in self.validate_messages:
+            if message_name not in self.codec.messages:
+                raise avro_schema.AvroException(
+                    "Message '{}' not defined.".format(message_name)
+                )
+
+    def validation_mode(self, message_name):
+        """
+        Get the response validation mode for a message.
+
+        :param message_name: an avro message name.
+        :return: a validation mode.
+        """
+        return self.validate_messages.get(
+            message_name,
+            self.validate_response
+        )
+
+    def should_validate(self, message_name):
+        """
+        Decide whether this response to message_name gets a validation pass.
+
+        :param message_name: an avro message name.
+        :return: a bool.
+        """
+        mode = self.validation_mode(message_name)
+        if mode == settings.VALIDATE_FULL:
+            return True
+        if mode == settings.VALIDATE_SAMPLED:
+            return random.random() < self.validate_sample_rate
+        return False
+
+    def mismatch_error(self, response, schema):
+        """
+        Log and produce the error sent back for a non-conforming response.
+
+        :param response: the offending response.
+        :param schema: the schema it failed to conform to.
+        :return: an avro.ipc.AvroRemoteException.
+        """
+        logger.error(
+            "{}; Response: {}, Schema: {}".format(
+                self.response_mismatch, response, schema
+            )
+        )
+        return avro_ipc.AvroRemoteException(self.response_mismatch)
+
+    def get_protocol_cache(self, hash):
+        """
+        Overridden to look client protocols up in this responder's bounded
+        protocol cache.
+
+        :param hash: a protocol MD5.
+        :return: an avro protocol, or None.
+        """
+        remote = self.known_remote(hash)
+        return None if remote is None else remote.protocol
+
+    def set_protocol_cache(self, hash, protocol):
+        """
+        Overridden to remember client protocols in this responder's bounded
+        protocol cache. The local protocol is always known, and never cached.
+
+        :param hash: a protocol MD5.
+        :param protocol: an avro protocol.
+        """
+        if hash == self._local_hash:
+            return
+        self.protocol_cache.put(hash, self.codec.remote(protocol))
+
+    def known_remote(self, client_hash):
+        """
+        Look up a client protocol this responder has already seen, by hash.
+
+        :param client_hash: a 16 byte protocol MD5.
+        :return: a codecs.RemoteCodec, or None.
+        """
+        if client_hash == self._local_hash:
+            return self.codec.local
+        return self.protocol_cache.get(client_hash)
+
+    def serialize_handshake_responses(self):
+        """
+        Encode the handshake responses this responder sends up front: they
+        only depend on the match, not on the client.
+
+        :return: a dict of match -> serialized handshake response.
+        """
+        return codecs.serialize_handshake_responses(self.local_protocol)
+
+    def process_handshake(self, buf, pos, out):
+        """
+        Read a handshake request from buf and append the handshake response
+        to out.
+
+        Client protocols are only parsed the first time they're seen, then
+        remembered (up to protocol_cache_size of them) along with the
+        request readers compiled against them.
+
+        :param buf: the call request bytes.
+        :param pos: an offset into buf.
+        :param out: a bytearray to write the handshake response to.
+        :return: a tuple of (codecs.RemoteCodec or None, next offset).
+        """
+        handshake_request, pos = codecs.decode(
+            codecs.read_handshake_request, buf, pos
+        )
+        client_hash = handshake_request.get("clientHash")
+        client_protocol = handshake_request.get("clientProtocol")
+        remote = self.known_remote(client_hash)
+        if remote is None and client_protocol is not None:
+            remote = self.codec.remote(avro_protocol.Parse(client_protocol))
+            self.protocol_cache.put(client_hash, remote)
+
+        if remote is None:
+            match = "NONE"
+        elif self._local_hash == handshake_request.get("serverHash"):
+            match = "BOTH"
+        else:
+            match = "CLIENT"
+
+        out += self.handshake_responses[match]
+        return remote, pos
+
+    def Respond(self, call_request, timer=metrics.NULL_TIMER,
+                trace=tracing.NULL_TRACE):
+        """
+        Process one call request, producing the serialized call response.
+
+        This mirrors avro.ipc.Responder's implementation, using this
+        responder's compiled codecs for the handshake, request and response.
 
-    def invoke(self, msg, req):
+        :param call_request: serialized call request bytes.
+        :param timer: a metrics.RequestTimer to time each phase with.
+        :param trace: a tracing.RequestTrace to trace the call with.
+        :return: the serialized call response, as a bytearray.
+        """
+        out = bytearray()
+        started = timer.start()
+        try:
+            remote, pos = self.process_handshake(call_request, 0, out)
+        except avro_schema.AvroException as ex:
+            del out[:]
+            self.write_system_error(ex, out)
+            return out
+        timer.stop(metrics.PHASE_HANDSHAKE, started)
+
+        if remote is not None:
+            self.respond_call(remote, call_request, pos, out, timer, trace)
+        return out
+
+    def respond_stateless(self, call_request, remote,
+                          timer=metrics.NULL_TIMER, trace=tracing.NULL_TRACE):
+        """
+        Process one call request sent without a handshake, producing the
+        serialized call response, also without a handshake.
+
+        :param call_request: serialized call request bytes, starting with the
+            call metadata.
+        :param remote: the client's codecs.RemoteCodec, from known_remote.
+        :param timer: a metrics.RequestTimer to time each phase with.
+        :param trace: a tracing.RequestTrace to trace the call with.
+        :return: the serialized call response, as a bytearray.
+        """
+        out = bytearray()
+        self.respond_call(remote, call_request, 0, out, timer, trace)
+        return out
+
+    def respond_call(self, remote, buf, pos, out, timer=metrics.NULL_TIMER,
+                     trace=tracing.NULL_TRACE):
+        """
+        Read the call following a handshake (if any) from buf, invoke it,
+        and append the call response to out.
+
+        Failures to process the call replace anything written past the
+        handshake response with a system error.
+
+        :param remote: the client's codecs.RemoteCodec.
+        :param buf: the call request bytes.
+        :param pos: the offset of the call metadata in buf.
+        :param out: a bytearray to write the call response to.
+        :param timer: a metrics.RequestTimer to time each phase with.
+        :param trace: a tracing.RequestTrace to trace the call with.
+        """
+        handshake_end = len(out)
+        span = tracing.NULL_SPAN
+        error = None
+        try:
+            started = timer.start()
+            span_started = trace.start()
+            metadata, local_message, request, pos = self.read_call(
+                remote,
+                buf,
+                pos
+            )
+            timer.stop(metrics.PHASE_DECODE, started, local_message.name)
+            span = trace.start_span(local_message.name, metadata, span_started)
+            response, error, checked = self.invoke_call(
+                (local_message, request, span),
+                timer
+            )
+            started = timer.start()
+            span_started = span.start()
+            self.write_call_response(
+                local_message,
+                response,
+                error,
+                out,
+                span.metadata,
+                checked
+            )
+            timer.stop(metrics.PHASE_ENCODE, started, local_message.name)
+            span.stop(metrics.PHASE_ENCODE, span_started)
+        except avro_schema.AvroException as ex:
+            del out[handshake_end:]
+            self.write_system_error(ex, out)
+            error = ex
+        span.finish(error)
+
+    def respond_batch(self, call_request, remote=None, dispatch=None,
+                      max_calls=None, timer=metrics.NULL_TIMER,
+                      trace=tracing.NULL_TRACE):
+        """
+        Process a batch of calls sent in one request, producing a batch of
+        call responses (see the batch module for the format).
+
+        Every call is decoded before any is invoked. A batch that can't be
+        decoded gets the same system error for every call.
+
+        :param call_request: serialized batch request bytes.
+        :param remote: the client's codecs.RemoteCodec, for batches sent
+            without a handshake.
+        :param dispatch: a callable like batch.dispatch_calls, used to invoke
+            every call. Defaults to invoking them in order.
+        :param max_calls: the most calls a batch may hold.
+        :param timer: a metrics.RequestTimer to time each phase with.
+        :param trace: a tracing.RequestTrace to trace each call with.
+        :return: the serialized batch response, as a bytearray.
+        """
+        out = bytearray()
+        pos = 0
+        if remote is None:
+            started = timer.start()
+            remote, pos = self.process_handshake(call_request, 0, out)
+            timer.stop(metrics.PHASE_HANDSHAKE, started)
+            if remote is None:
+                return out
+
+        count, pos = codecs.decode(codecs.read_long, call_request, pos)
+        if count <= 0 or (max_calls is not None and count > max_calls):
+            raise avro_schema.AvroException(
+                "Invalid batch size: {}".format(count)
+            )
+        codecs.write_long(count, out)
+
+        calls = []
+        try:
+            while len(calls) < count:
+                started = timer.start()
+                span_started = trace.start()
+                metadata, local_message, request, pos = self.read_call(
+                    remote,
+                    call_request,
+                    pos
+                )
+                timer.stop(metrics.PHASE_DECODE, started, local_message.name)
+                span = trace.start_span(
+                    local_message.name,
+                    metadata,
+                    span_started
+                )
+                calls.append((local_message, request, span))
+        except avro_schema.AvroException as ex:
+            for _ in range(count):
+                self.write_system_error(ex, out)
+            for _, _, span in calls:
+                span.finish(ex)
+            return out
+
+        def invoke_call(call):
+            return self.invoke_call(call, timer)
+
+        if dispatch is None:
+            results = [invoke_call(call) for call in calls]
+        else:
+            results = dispatch(invoke_call, calls)
+
+        for (local_message, _, span), result in zip(calls, results):
+            response, error, checked = result
+            response_start = len(out)
+            try:
+                started = timer.start()
+                span_started = span.start()
+                self.write_call_response(
+                    local_message,
+                    response,
+                    error,
+                    out,
+                    span.metadata,
+                    checked
+                )
+                timer.stop(metrics.PHASE_ENCODE, started, local_message.name)
+                span.stop(metrics.PHASE_ENCODE, span_started)
+            except avro_schema.AvroException as ex:
+                del out[response_start:]
+                self.write_system_error(ex, out)
+                error = ex
+            span.finish(error)
+        return out
+
+    def read_call(self, remote, buf, pos):
+        """
+        Read one call request: metadata, message name and arguments.
+
+        :param remote: the client's codecs.RemoteCodec.
+        :param buf: the call request bytes.
+        :param pos: the offset of the call metadata in buf.
+        :return: a tuple of (metadata map, local message, decoded arguments,
+            next offset).
+        """
+        metadata, pos = codecs.decode(codecs.read_metadata, buf, pos)
+        message_name, pos = codecs.decode(codecs.read_utf8, buf, pos)
+        local_message, read_request = remote.request_reader(message_name)
+        request, pos = codecs.decode(read_request, buf, pos)
+        return metadata, local_message, request, pos
+
+    def invoke_call(self, call, timer=metrics.NULL_TIMER):
+        """
+        Invoke a decoded call, capturing any error.
+
+        :param call: a tuple of (local message, decoded arguments,
+            tracing.Span).
+        :param timer: a metrics.RequestTimer to time each phase with.
+        :return: a tuple of (response, avro_ipc.AvroRemoteException or None,
+            whether to encode the response with type checks).
+        """
+        local_message, request, span = call
+        validate = self.should_validate(local_message.name)
+        # Responses validated, or left to encoding to check, are encoded
+        # with type checks; responses of "off" mode, or that weren't drawn
+        # for validation in "sampled" mode, are encoded without.
+        checked = validate or (
+            self.validation_mode(local_message.name) ==
+            settings.VALIDATE_ENCODE
+        )
+        try:
+            response = self.invoke(local_message, request, timer, span,
+                                   validate)
+            return response, None, checked
+        except avro_ipc.AvroRemoteException as ex:
+            return None, ex, checked
+        except Exception as ex:
+            return None, avro_ipc.AvroRemoteException(str(ex)), checked
+
+    def write_call_response(self, local_message, response, error, out,
+                            metadata=None, checked=None):
+        """
+        Append a call response carrying either a response or an error to
+        out.
+
+        :param local_message: the avro message called.
+        :param response: the call's response.
+        :param error: the call's error, or None.
+        :param out: a bytearray.
+        :param metadata: an optional response metadata map.
+        :param checked: whether to encode the response with type checks (see
+            invoke_call). Defaults to checking unless the message's
+            validation mode is "off".
+        """
+        message_codec = self.codec.messages[local_message.name]
+        codecs.write_metadata(metadata or {}, out)
+        if error is None:
+            if checked is None:
+                checked = (
+                    self.validation_mode(local_message.name) !=
+                    settings.VALIDATE_OFF
+                )
+            if checked:
+                write_response = message_codec.write_response
+            else:
+                write_response = message_codec.write_response_unchecked
+
+            response_start = len(out)
+            out.append(0)
+            try:
+                write_response(response, out)
+            except avro_io.AvroTypeException:
+                del out[response_start:]
+                error = self.mismatch_error(response, local_message.response)
+
+        if error is not None:
+            out.append(1)
+            message_codec.write_error(str(error), out)
+
+    def write_system_error(self, error, out):
+        """
+        Append a call response carrying a system error to out.
+
+        :param error: the exception to report.
+        :param out: a bytearray.
+        """
+        codecs.write_metadata({}, out)
+        out.append(1)
+        codecs.write_system_error(str(error), out)
+
+    def invoke(self, msg, req, timer=metrics.NULL_TIMER,
+               span=tracing.NULL_SPAN, validate=None):
         """
         Call self.executor, then verify that the response fits the protocol
-        that this knows how to speak.
+        that this knows how to speak, if this message's validation mode calls
+        for a validation pass.
+
+        The call's span is the current span (see tracing.current_span) while
+        self.executor runs.
 
         :param msg: an avro message.
         :param req: request arguments.
+        :param timer: a metrics.RequestTimer to time each phase with.
+        :param span: the call's tracing.Span.
+        :param validate: whether to validate the response, if already
+            decided (see should_validate).
         :return: an avro response.
         """
-        response = self.executor(msg.name, **req)
-        local_message = self.local_protocol.message_map.get(msg.name)
-        local_response = local_message.response
-        is_valid = avro_io.Validate(local_response, response)
-        if not is_valid:
-            err = "Server response did not conform to its local schema."
-            logging.error(
-                "{}; Response: {}, Schema: {}".format(
-                    err, response, local_response
-                )
-            )
-            raise avro_ipc.AvroRemoteException(err)
+        if validate is None:
+            validate = self.should_validate(msg.name)
+        started = timer.start()
+        span_started = span.start()
+        token = span.activate()
+        try:
+            response = self.executor(msg.name, **req)
+        finally:
+            span.deactivate(token)
+            span.stop(metrics.PHASE_HANDLER, span_started)
+            timer.stop(metrics.PHASE_HANDLER, started, msg.name)
+        if validate:
+            started = timer.start()
+            message_codec = self.codec.messages[msg.name]
+            valid = message_codec.validate_response(response)
+            timer.stop(metrics.PHASE_VALIDATE, started, msg.name)
+            if not valid:
+                raise self.mismatch_error(response, msg.response)
         return response
 
     def Invoke(self, msg, req):
@@ -70,41 +551,233 @@ class AvroServiceRoute(object):
 
     protocol = None
     responder = None
+    decompression = compression.NO_DECOMPRESSION
 
-    def __init__(self, path, schema):
+    def __init__(self, path, schema, request_data=settings.REQUEST_DATA_DIRECT,
+                 response_frame_size=framing.FRAME_SIZE,
+                 stateless_handshake=True, event_loop=None, batch_workers=1,
+                 batch_max_calls=1000, metrics=None, tracer=None,
+                 profiler=None, compression=None, decompression=None,
+                 **responder_options):
+        """
+        Parse the protocol and build the responder for a service.
+
+        :param path: a route name.
+        :param schema: the avro protocol JSON, or a cache.ParsedProtocol
+            already parsed from it (see cache.load_protocol).
+        :param request_data: how decoded arguments are handed to message
+            implementations by default, one of settings.REQUEST_DATA_MODES.
+        :param response_frame_size: the largest avro frame to write in a
+            response.
+        :param stateless_handshake: whether to accept calls sent without an
+            avro handshake, identified by protocol hash headers instead (see
+            "stateless_remote").
+        :param event_loop: an aio.EventLoopThread to run "async def" message
+            implementations on. Defaults to a loop shared by every route in
+            the process.
+        :param batch_workers: the most calls of a batch to invoke at once.
+        :param batch_max_calls: the most calls a batch may hold.
+        :param metrics: an optional metrics.RouteMetrics to record the phase
+            timings and sizes of every request in.
+        :param tracer: an optional tracing.Tracer to trace every call with.
+        :param profiler: an optional profiling.RouteProfiler to profile
+            requests with.
+        :param compression: an optional compression.ResponseCompression to
+            compress responses with, as requests accept.
+        :param decompression: an optional compression.RequestDecompression
+            to read compressed requests with. Without it, only uncompressed
+            requests are accepted.
+        :param responder_options: optional ServiceResponder options.
+        """
         self.path = path
+        self.metrics = metrics
+        self.tracer = tracer
+        self.profiler = profiler
+        self.compression = compression
+        if decompression is not None:
+            self.decompression = decompression
+        self.response_frame_size = settings.parse_positive_int(
+            response_frame_size,
+            "response_frame_size"
+        )
+        self.stateless_handshake = stateless_handshake
+        self.event_loop = event_loop or aio.default_loop
+        self.batch_dispatcher = batch.BatchDispatcher(
+            settings.parse_positive_int(batch_workers, "batch_workers")
+        )
+        self.batch_max_calls = settings.parse_positive_int(
+            batch_max_calls,
+            "batch_max_calls"
+        )
         self.dispatch = {}
-        self.protocol = avro_protocol.Parse(schema)
-        self.responder = ServiceResponder(self.execute_command, self.protocol)
+        self.request_data = settings.parse_request_data_mode(request_data)
+        self.request_data_modes = {}
+        self.message_pools = {}
+        if not isinstance(schema, cache.ParsedProtocol):
+            schema = cache.parse_protocol(schema)
+        self.protocol = schema.protocol
+        self.responder = ServiceResponder(
+            self.execute_command,
+            self.protocol,
+            handshake_responses=schema.handshake_responses,
+            **responder_options
+        )
+        self.hash_headers = []
+        if stateless_handshake:
+            self.hash_headers.append((
+                handshake.SERVER_HASH_HEADER,
+                handshake.encode_hash(self.protocol.md5)
+            ))
 
-    def register_message_impl(self, message, message_impl):
+    def register_message_impl(self, message, message_impl, request_data=None,
+                              pool=None):
+        """
+        Register a callable as the implementation of a protocol message.
+
+        :param message: an avro message name.
+        :param message_impl: a callable accepting a request.
+        :param request_data: an optional override of this route's
+            request_data mode for this message.
+        :param pool: an optional pools.ExecutorPool to run message_impl on.
+        """
         if self.protocol.message_map.get(message) is None:
             raise avro_schema.AvroException(
                 "Message '{}' not defined.".format(message)
             )
 
         self.dispatch[message] = message_impl
+        if request_data is None:
+            self.request_data_modes.pop(message, None)
+        else:
+            self.request_data_modes[message] = \
+                settings.parse_request_data_mode(request_data)
+        if pool is None:
+            self.message_pools.pop(message, None)
+        else:
+            self.message_pools[message] = pool
+
+    def prepare_request_data(self, command, command_args):
+        """
+        Produce the "avro_data" handed to a message implementation.
+
+        Decoded arguments are freshly built for every call and owned by
+        nobody else, so by default they are handed over as-is. Handlers may
+        instead opt into a read-only view or a private deep copy.
+
+        :param command: an avro message name.
+        :param command_args: decoded avro message arguments.
+        :return: the data to attach to the request.
+        """
+        mode = self.request_data_modes.get(command, self.request_data)
+        if mode == settings.REQUEST_DATA_READONLY:
+            return data.ReadOnlyDict(command_args)
+        if mode == settings.REQUEST_DATA_COPY:
+            return copy.deepcopy(command_args)
+        return command_args
 
     def validate_request(self, request):
         """
         Place for validating an incoming request.
 
-        Right now, it simply verifies that there is a non-zero content-length.
+        Right now, it simply verifies that there is a body to read: either a
+        non-zero content-length, or a chunked (or otherwise terminated) body
+        without one.
 
         Any additional validation required will be added here in the future.
 
         :param request: a webob request.
         """
-        content_length = int(request.headers["content-length"])
-        if request.body_file is None or content_length == 0:
+        if request.body_file_raw is None:
+            raise http_exc.HTTPBadRequest()
+
+        content_length = request.content_length
+        if content_length is None:
+            transfer_encoding = request.headers.get("Transfer-Encoding", "")
+            chunked = "chunked" in transfer_encoding.lower()
+            if not (chunked or request.is_body_readable):
+                raise http_exc.HTTPBadRequest()
+        elif content_length == 0:
             raise http_exc.HTTPBadRequest()
 
+    def stateless_remote(self, request):
+        """
+        Find the client protocol for a call sent without an avro handshake.
+
+        Every avro call over HTTP normally starts with a handshake, often
+        repeating the client's whole protocol. Instead, a client may send the
+        hex MD5 of its protocol in an "Avro-Client-Hash" header (and,
+        optionally, the server protocol MD5 it expects in "Avro-Server-Hash"),
+        leaving the handshake out of the body. The server's response then
+        carries no handshake either.
+
+        This works whenever the server already knows the client's protocol:
+        it's the server's own, or an earlier handshake from that client
+        reached this process. Otherwise, or if the server protocol isn't the
+        one expected, the call is refused with a 412 and an
+        "Avro-Handshake: required" header, and the client should retry with
+        a regular handshake.
+
+        :param request: a webob request.
+        :return: the client's codecs.RemoteCodec, or None for a regular
+            call.
+        """
+        try:
+            client_hash, server_hash = handshake.requested_hashes(
+                request.headers
+            )
+        except ValueError:
+            logger.exception("Invalid protocol hash header.")
+            raise http_exc.HTTPBadRequest()
+
+        if client_hash is None:
+            return None
+
+        remote = None
+        if self.stateless_handshake:
+            if server_hash is None or server_hash == self.protocol.md5:
+                remote = self.responder.known_remote(client_hash)
+
+        if remote is None:
+            raise http_exc.HTTPPreconditionFailed(
+                headers=[(
+                    handshake.HANDSHAKE_HEADER,
+                    handshake.HANDSHAKE_REQUIRED
+                )] + self.hash_headers
+            )
+        return remote
+
     def __call__(self, request):
         """
         Reads the avro request data, then call our responder to respond.
 
+        The request body is read frame by frame straight from the WSGI input
+        (see framing.FrameReader), so the message is only held in memory once.
+        Likewise, the response is framed lazily as the response app_iter
+        (see framing.FramedMessageIterator) rather than copied into a body.
+
+        Calls may skip the avro handshake altogether, see
+        "stateless_remote". Requests may also carry a batch of calls, see
+        the batch module.
+
         This will end up executing "execute_command" below.
 
+        With metrics, each phase of the request is timed, and recorded along
+        with the request and response sizes (see metrics.RouteMetrics).
+        Framing and sending the response is recorded once it was sent.
+
+        With a tracer, each call gets a span continuing the trace context
+        found in its metadata or in the HTTP headers (see the tracing
+        module).
+
+        With a profiler, requests it picks are profiled from the handshake
+        to the encoded response (see profiling.RouteProfiler).
+
+        With compression, responses are compressed with a codec the request
+        accepts (see compression.ResponseCompression), frame by frame as
+        they're sent. Requests with a Content-Encoding are decompressed as
+        they're read (see compression.RequestDecompression); unsupported
+        codings get a 415, and bodies inflating past the limit a 413.
+
         After getting a response from the responder, form a pyramid response
         and return it.
 
@@ -117,33 +790,126 @@ class AvroServiceRoute(object):
         :param request: a pyramid request.
         :return: a pyramid response.
         """
+        route_metrics = self.metrics
+        profiler = self.profiler
+        profiled = profiler is not None and profiler.should_profile(request)
+        if route_metrics is None and not profiled:
+            timer = metrics.NULL_TIMER
+        else:
+            timer = metrics.RequestTimer()
+        request_started = timer.start()
+        if self.tracer is None:
+            trace = tracing.NULL_TRACE
+        else:
+            trace = self.tracer.request_trace(request.headers)
+
         self.validate_request(request)
-        reader = avro_ipc.FramedReader(request.body_file)
+        remote = self.stateless_remote(request)
+        try:
+            stream, content_length = self.decompression.stream(
+                request,
+                framing.request_stream(request)
+            )
+        except compression.UnsupportedEncoding as ex:
+            logger.warning("Rejected request: %s", ex)
+            return http_exc.HTTPUnsupportedMediaType(str(ex))
+        reader = framing.FrameReader(stream, content_length)
         try:
-            request_data = reader.Read()
+            started = timer.start()
+            request_data = reader.read_message()
+            timer.stop(metrics.PHASE_READ, started)
+        except compression.DecompressedTooLarge as ex:
+            logger.warning("Rejected request: %s", ex)
+            return http_exc.HTTPRequestEntityTooLarge(str(ex))
         except avro_ipc.ConnectionClosedException:
             logger.exception("Failed to process request.")
             return http_exc.HTTPBadRequest()
 
+        is_batch = batch.is_batch(request)
+        profile = profiler.start() if profiled else None
         try:
-            rpc_response = self.responder.Respond(request_data)
+            if is_batch:
+                rpc_response = self.responder.respond_batch(
+                    request_data,
+                    remote,
+                    self.batch_dispatcher.dispatch,
+                    self.batch_max_calls,
+                    timer,
+                    trace
+                )
+            elif remote is None:
+                rpc_response = self.responder.Respond(
+                    request_data,
+                    timer,
+                    trace
+                )
+            else:
+                rpc_response = self.responder.respond_stateless(
+                    request_data,
+                    remote,
+                    timer,
+                    trace
+                )
+        except avro_schema.AvroException:
+            logger.exception("Failed to decode request.")
+            return http_exc.HTTPBadRequest()
         except http_exc.HTTPException as ex:
             logger.exception("HTTP exception while processing message.")
             return ex
         except Exception:
             logger.exception("Error processing RPC content.")
             return http_exc.HTTPInternalServerError()
+        finally:
+            if profiled:
+                profiler.stop(profile, timer.request_message(is_batch))
 
-        with io.BytesIO() as _body_file:
-            writer = avro_ipc.FramedWriter(_body_file)
-            writer.Write(rpc_response)
-            response_body = _body_file.getvalue()
-
+        on_sent = None
+        if route_metrics is not None:
+            on_sent = functools.partial(
+                route_metrics.record_write,
+                timer.request_message(is_batch)
+            )
+        frames = framing.FramedMessageIterator(
+            rpc_response,
+            self.response_frame_size,
+            on_sent
+        )
+        app_iter = frames
+        content_length = frames.content_length
+        headers = [("Content-Type", "avro/binary")] + self.hash_headers
+        if is_batch:
+            headers.append((batch.BATCH_HEADER, batch.BATCH_VALUE))
+        if self.compression is not None:
+            headers.append(("Vary", compression.ACCEPT_ENCODING))
+            codec = self.compression.negotiate(request, content_length)
+            if codec is not None:
+                on_done = None
+                if route_metrics is not None:
+                    on_done = functools.partial(
+                        route_metrics.record_compression,
+                        timer.request_message(is_batch)
+                    )
+                app_iter = compression.CompressedIterator(
+                    frames,
+                    codec.compressor(),
+                    on_done
+                )
+                content_length = None
+                headers.append((compression.CONTENT_ENCODING, codec.name))
+        if route_metrics is not None:
+            timer.stop(metrics.PHASE_TOTAL, request_started)
+            route_metrics.record(
+                timer,
+                len(request_data),
+                len(rpc_response),
+                is_batch
+            )
         logger.debug("Finished request. Returning response.")
         return p_response.Response(
             status=200,
-            body=response_body,
-            headerlist=[("Content-Type", "avro/binary")]
+            app_iter=app_iter,
+            content_length=content_length,
+            headerlist=headers
         )
 
     def execute_command(self, command, **command_args):
@@ -152,7 +918,20 @@ class AvroServiceRoute(object):
         message callback and execute it.
 
         Prior to executing the registered callback, attach the provided
-        arguments as an "avro_data" attribute on the request object.
+        arguments as an "avro_data" attribute on the request object (see
+        "prepare_request_data"), and the call's tracing.Span, if traced, as
+        "avro_span".
+
+        Callbacks bound to an executor pool are run there (see
+        pools.ExecutorPool); implementations bound to process pools are
+        handed a pools.MessageRequest instead of the pyramid request.
+
+        Callbacks may be coroutine functions ("async def"). Their coroutines
+        are run on this route's event loop (see aio.EventLoopThread), shared
+        with every other request in the process, while the calling worker
+        thread waits for the result. They run outside of the worker thread,
+        so they must use the request they're given rather than pyramid's
+        threadlocals.
 
         :param command: an avro message name.
         :param command_args: avro message arguments.
@@ -171,13 +950,223 @@ class AvroServiceRoute(object):
         try:
             logger.debug("Invoking handler {}".format(handler))
             request = p_threadlocal.get_current_request()
-            request.avro_data = copy.deepcopy(command_args)
-            response = handler(request)
+            request.avro_data = self.prepare_request_data(
+                command,
+                command_args
+            )
+            request.avro_span = tracing.current_span()
+            pool = self.message_pools.get(command)
+            if pool is None:
+                response = self.invoke_handler(handler, request)
+            elif pool.kind == settings.POOL_PROCESS:
+                response = pool.run(
+                    pools.call_in_process,
+                    handler,
+                    command,
+                    request.avro_data
+                )
+            else:
+                response = pool.run(
+                    tracing.call_in_span,
+                    request.avro_span,
+                    self.invoke_handler,
+                    handler,
+                    request
+                )
+        except pools.PoolRejected as ex:
+            logger.warning("Rejected {}: {}".format(command, ex))
+            raise
         except Exception:
             logging.exception("Error handling request: {}".format(command))
             raise avro_ipc.AvroRemoteException(traceback.format_exc())
 
         return response
 
+    def invoke_handler(self, handler, request):
+        """
+        Call a message implementation, running it to completion on this
+        route's event loop if it's a coroutine function.
+
+        :param handler: a message implementation.
+        :param request: the request to hand it.
+        :return: the implementation's response.
+        """
+        response = handler(request)
+        if aio.is_coroutine(response):
+            response = self.event_loop.run(response)
+        return response
+
+
+@zi.implementer(IAvroServiceRoute)
+class LazyAvroServiceRoute(object):
+    """
+    Stands in for an AvroServiceRoute, only building it (parsing its
+    protocol and compiling its codecs) the first time it's needed: usually,
+    the first request to the service.
+
+    Message implementations registered before then are kept and registered
+    with the route once it's built, so unknown messages are only reported
+    then.
+
+    Once built, the route can be rebuilt from a changed schema file, see
+    "reload".
+    """
+
+    def __init__(self, path, schema_file, fingerprint=None,
+                 parse_cache_dir=None, **route_options):
+        """
+        :param path: a route name.
+        :param schema_file: the avro protocol JSON file path.
+        :param fingerprint: the schema's cache.schema_fingerprint when the
+            application was configured, to warn when it changed since.
+        :param parse_cache_dir: an optional parse cache directory, see
+            cache.load_protocol.
+        :param route_options: optional AvroServiceRoute options.
+        """
+        self.path = path
+        self.schema_file = schema_file
+        self.fingerprint = fingerprint
+        self.parse_cache_dir = parse_cache_dir
+        self.route_options = route_options
+        # An optional watch.FileWatcher reloading the route, started in
+        # each process serving it.
+        self.watcher = None
+        self._route = None
+        self._messages = []
+        self._lock = threading.Lock()
+
+    @property
+    def is_materialized(self):
+        return self._route is not None
+
+    @property
+    def protocol(self):
+        return self.materialize().protocol
+
+    @property
+    def responder(self):
+        return self.materialize().responder
+
+    def materialize(self):
+        """
+        Build the route, unless it already was. Threads calling this at the
+        same time wait for a single build.
+
+        :return: the AvroServiceRoute.
+        """
+        route = self._route
+        if route is not None:
+            return route
+
+        with self._lock:
+            if self._route is not None:
+                return self._route
+
+            logger.debug("Building avro route {}.".format(self.path))
+            with open(self.schema_file) as _file:
+                schema = _file.read()
+            fingerprint = cache.schema_fingerprint(schema)
+            if self.fingerprint not in (None, fingerprint):
+                logger.warning(
+                    "{} changed since the application was configured."
+                    .format(self.schema_file)
+                )
+            route = AvroServiceRoute(
+                self.path,
+                cache.load_protocol(schema, self.parse_cache_dir),
+                **self.route_options
+            )
+            for args, kwargs in self._messages:
+                route.register_message_impl(*args, **kwargs)
+            del self._messages[:]
+            self.fingerprint = fingerprint
+            self._route = route
+        return route
+
+    def reload(self):
+        """
+        Rebuild the route if its schema file changed, and swap it in.
+
+        The new route is built without holding up requests, then replaces
+        the old one in a single assignment: requests already being served
+        finish with the old route, later ones get the new route. The new
+        route shares the old one's message implementations (its "dispatch"
+        table, request_data modes and pools).
+
+        A route that wasn't built yet is left to be built from the changed
+        file.
+
+        :return: whether the route was rebuilt.
+        """
+        with open(self.schema_file) as _file:
+            schema = _file.read()
+        fingerprint = cache.schema_fingerprint(schema)
+        if fingerprint == self.fingerprint or self._route is None:
+            return False
+
+        route = AvroServiceRoute(
+            self.path,
+            cache.load_protocol(schema, self.parse_cache_dir),
+            **self.route_options
+        )
+        with self._lock:
+            old_route = self._route
+            route.dispatch = old_route.dispatch
+            route.request_data_modes = old_route.request_data_modes
+            route.message_pools = old_route.message_pools
+            self.fingerprint = fingerprint
+            self._route = route
+
+        for message in sorted(route.dispatch):
+            if message not in route.protocol.message_map:
+                logger.warning(
+                    "Message '{}' of {} is no longer defined.".format(
+                        message,
+                        self.path
+                    )
+                )
+        return True
+
+    def register_message_impl(self, message, message_impl, request_data=None,
+                              pool=None):
+        """
+        Register a callable as the implementation of a protocol message,
+        see AvroServiceRoute.register_message_impl.
+
+        :param message: an avro message name.
+        :param message_impl: a callable accepting a request.
+        :param request_data: an optional request_data mode override.
+        :param pool: an optional pools.ExecutorPool to run message_impl on.
+        """
+        args = (message, message_impl)
+        kwargs = {"request_data": request_data, "pool": pool}
+        with self._lock:
+            if self._route is None:
+                self._messages.append((args, kwargs))
+                return
+        self._route.register_message_impl(*args, **kwargs)
+
+    def __call__(self, request):
+        """
+        Build the route if need be, then serve the request with it.
+
+        :param request: a pyramid request.
+        :return: a pyramid response.
+        """
+        if self.watcher is not None:
+            self.watcher.ensure_started()
+        try:
+            route = self.materialize()
+        except Exception:
+            logger.exception("Failed to build avro route {}.".format(
+                self.path
+            ))
+            return http_exc.HTTPInternalServerError()
+        return route(request)
+
 
-__all__ = [IAvroServiceRoute.__name__, AvroServiceRoute.__name__]
+__all__ = [
+    IAvroServiceRoute.__name__,
+    AvroServiceRoute.__name__,
+    LazyAvroServiceRoute.__name__
+]
@@ -0,0 +1,366 @@
+import argparse
+import json
+import logging
+import os
+import sys
+
+from . import cache
+from . import compiler
+from . import loadgen
+from . import routes
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+
+def find_protocols(path):
+    """
+    Find the IDL files at a path.
+
+    :param path: an IDL file, or a directory searched recursively.
+    :return: a sorted list of IDL file paths.
+    """
+    if not os.path.isdir(path):
+        return [path]
+    protocols = []
+    for directory, _, filenames in os.walk(path):
+        protocols.extend(
+            os.path.join(directory, filename)
+            for filename in filenames
+            if filename.endswith(".avdl")
+        )
+    return sorted(protocols)
+
+
+def load_settings(config_uri):
+    """
+    Read pyramid-avro's settings from an application's config file.
+
+    :param config_uri: a paste config file, like "development.ini#main".
+    :return: a dict of settings, see settings.get_config_options.
+    """
+    from pyramid import paster
+
+    return settings.get_config_options(paster.get_appsettings(config_uri))
+
+
+def config_jobs(avro_settings, base_dir, tools_jar=None):
+    """
+    Gather the protocols of every service defined in an application's
+    settings.
+
+    Unlike at config time, where they're relative to the application's
+    package, relative paths are taken relative to base_dir.
+
+    :param avro_settings: settings from load_settings.
+    :param base_dir: the directory relative paths are in.
+    :param tools_jar: the tools jar, instead of the "avro.tools_jar" setting.
+    :return: a list of compiler.CompileJob.
+    """
+    tools_jar = tools_jar or avro_settings["tools_jar"]
+    protocol_dir = avro_settings["protocol_dir"]
+    if protocol_dir is not None:
+        base_dir = os.path.join(base_dir, protocol_dir)
+
+    jobs = []
+    for service_def in avro_settings["service"].values():
+        protocol, schema = settings.derive_service_files(
+            service_def.get("protocol"),
+            service_def.get("schema"),
+            base_dir
+        )
+        if protocol is not None:
+            jobs.append(compiler.CompileJob(protocol, schema, tools_jar))
+    return jobs
+
+
+def compile_main(argv=None, out=None):
+    """
+    Compile avro IDL files into schemas: the pyramid-avro-compile command.
+
+    :param argv: the command line arguments, after the program name.
+    :param out: where to report progress. Defaults to stdout.
+    :return: an exit code.
+    """
+    out = out or sys.stdout
+    parser = argparse.ArgumentParser(
+        prog="pyramid-avro-compile",
+        description="Compile avro IDL (.avdl) files into protocol schemas "
+                    "(.avpr), in parallel."
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="IDL files, or directories to find them in. Each is compiled "
+             "into a schema beside it."
+    )
+    parser.add_argument(
+        "-c", "--config",
+        help="An application's config file (e.g. development.ini) whose "
+             "avro services should be compiled."
+    )
+    parser.add_argument(
+        "--base-dir",
+        help="The directory the config's relative paths are in (default: "
+             "the config file's)."
+    )
+    parser.add_argument(
+        "--tools-jar",
+        help="The avro-tools jar (default: the config's avro.tools_jar)."
+    )
+    parser.add_argument(
+        "--compiler",
+        choices=sorted(settings.COMPILERS),
+        help="The IDL compiler: java (avro-tools) or python (default: the "
+             "config's avro.compiler, or java)."
+    )
+    parser.add_argument(
+        "-j", "--workers",
+        type=int,
+        default=compiler.COMPILE_WORKERS,
+        help="The most compiles to run at once (default: %(default)s)."
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Compile even the schemas that are up to date."
+    )
+    args = parser.parse_args(argv)
+
+    jobs = []
+    backend = args.compiler
+    if args.config:
+        avro_settings = load_settings(args.config)
+        base_dir = args.base_dir or os.path.dirname(
+            os.path.abspath(args.config.split("#")[0])
+        )
+        jobs.extend(config_jobs(avro_settings, base_dir, args.tools_jar))
+        backend = backend or avro_settings["compiler"]
+    backend = backend or settings.COMPILER_JAVA
+    for path in args.paths:
+        for protocol in find_protocols(path):
+            _, schema = settings.derive_service_files(protocol)
+            jobs.append(compiler.CompileJob(
+                os.path.abspath(protocol),
+                schema,
+                args.tools_jar
+            ))
+
+    if not jobs:
+        parser.error("No protocols to compile.")
+    java = backend == settings.COMPILER_JAVA
+    if java and any(job.jar_file is None for job in jobs):
+        parser.error("No tools jar: pass --tools-jar or --compiler python.")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1.")
+
+    try:
+        results = compiler.compile_all(
+            jobs,
+            workers=args.workers,
+            cache=not args.force,
+            backend=backend
+        )
+    except compiler.CompileError as ex:
+        out.write("{}\n".format(ex))
+        return 1
+
+    for schema, compiled in sorted(results.items()):
+        out.write("{} {}\n".format(
+            "compiled" if compiled else "up to date",
+            schema
+        ))
+    return 0
+
+
+def app_service(app, service_name=None):
+    """
+    Find a service of an application, to load it in process.
+
+    :param app: a pyramid WSGI application.
+    :param service_name: a service added with add_avro_route. May be left
+        out when the application has a single service.
+    :return: a tuple of (the service's protocol, its path).
+    """
+    from pyramid import interfaces as p_interfaces
+
+    registry = app.registry
+    names = sorted(
+        name for name, _ in registry.getUtilitiesFor(routes.IAvroServiceRoute)
+    )
+    if service_name is None:
+        if len(names) != 1:
+            raise ValueError("Pick a service: {}".format(", ".join(
+                name.split(".", 1)[1] for name in names
+            ) or "none found"))
+        route_name = names[0]
+    else:
+        route_name = ".".join(["avro", service_name])
+        if route_name not in names:
+            raise ValueError(
+                "Service '{}' has no route defined.".format(service_name)
+            )
+    route = registry.getUtility(routes.IAvroServiceRoute, name=route_name)
+    mapper = registry.getUtility(p_interfaces.IRoutesMapper)
+    return route.protocol, mapper.get_route(route_name).pattern
+
+
+def load_main(argv=None, out=None):
+    """
+    Drive an avro service with calls and report its throughput and latency:
+    the pyramid-avro-load command.
+
+    :param argv: the command line arguments, after the program name.
+    :param out: where to write the report. Defaults to stdout.
+    :return: an exit code: 1 when any call failed.
+    """
+    out = out or sys.stdout
+    parser = argparse.ArgumentParser(
+        prog="pyramid-avro-load",
+        description="Call an avro service from many threads at once, with "
+                    "random or fixture arguments, and report its throughput "
+                    "and latency."
+    )
+    parser.add_argument(
+        "target",
+        help="A service URL, or an application's config file (e.g. "
+             "development.ini) to load in process."
+    )
+    parser.add_argument(
+        "-s", "--service",
+        help="The service of an application to call (default: its only "
+             "one)."
+    )
+    parser.add_argument(
+        "--schema",
+        help="The protocol schema (.avpr) of a service called by URL."
+    )
+    parser.add_argument(
+        "-m", "--message",
+        action="append",
+        dest="messages",
+        help="A message to call; may be repeated (default: the messages "
+             "with fixtures, or every message)."
+    )
+    parser.add_argument(
+        "--fixtures",
+        help="A JSON file of message name -> list of arguments, in the avro "
+             "JSON encoding, to call messages with instead of random ones."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="A seed for the random arguments."
+    )
+    parser.add_argument(
+        "-c", "--concurrency",
+        type=int,
+        default=loadgen.CONCURRENCY,
+        help="The calls in flight at once (default: %(default)s)."
+    )
+    parser.add_argument(
+        "-r", "--rate",
+        type=float,
+        help="The calls per second to send, instead of each call as soon "
+             "as the last is answered."
+    )
+    parser.add_argument(
+        "-d", "--duration",
+        type=float,
+        default=loadgen.DURATION,
+        help="The most seconds to run for (default: %(default)s)."
+    )
+    parser.add_argument(
+        "-n", "--requests",
+        type=int,
+        help="The most calls to send."
+    )
+    parser.add_argument(
+        "--handshake",
+        action="store_true",
+        help="Send an avro handshake with every call, for servers that "
+             "don't accept calls without one."
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Write the report as JSON."
+    )
+    args = parser.parse_args(argv)
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1.")
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive.")
+    if args.duration <= 0:
+        parser.error("--duration must be positive.")
+    if args.requests is not None and args.requests < 1:
+        parser.error("--requests must be at least 1.")
+
+    is_url = args.target.startswith(("http://", "https://"))
+    try:
+        if is_url:
+            if args.schema is None:
+                parser.error("--schema is required to call a URL.")
+            with open(args.schema) as _file:
+                protocol = cache.parse_protocol(_file.read()).protocol
+            transport = loadgen.HTTPTransport(
+                args.target,
+                max_idle=args.concurrency
+            )
+        else:
+            from pyramid import paster
+
+            app = paster.get_app(args.target)
+            protocol, path = app_service(app, args.service)
+            transport = loadgen.WSGITransport(app, path)
+
+        fixtures = None
+        if args.fixtures:
+            fixtures = loadgen.load_fixtures(args.fixtures, protocol)
+        calls = loadgen.build_calls(
+            protocol,
+            args.messages,
+            fixtures,
+            seed=args.seed
+        )
+    except (IOError, ValueError) as ex:
+        parser.error(str(ex))
+
+    generator = loadgen.LoadGenerator(
+        transport,
+        protocol,
+        calls,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        duration=args.duration,
+        requests=args.requests,
+        stateless=not args.handshake
+    )
+    try:
+        report = generator.run()
+    finally:
+        transport.close()
+
+    if args.json:
+        out.write(json.dumps(report.summary(), sort_keys=True) + "\n")
+    else:
+        out.write(report.format())
+    return 1 if report.errors else 0
+
+
+def main():  # pragma: no cover
+    sys.exit(compile_main())
+
+
+def load():  # pragma: no cover
+    sys.exit(load_main())
+
+
+__all__ = [
+    app_service.__name__,
+    compile_main.__name__,
+    config_jobs.__name__,
+    find_protocols.__name__,
+    load_main.__name__,
+    load_settings.__name__
+]
@@ -1,4 +1,5 @@
 import logging
+import os
 
 from pyramid import config as p_config
 from pyramid import settings as p_settings
@@ -7,18 +8,116 @@ logger = logging.getLogger(__name__)
 
 CONFIG_PREFIX = "avro."
 
+# Response validation modes.
+VALIDATE_FULL = "full"
+VALIDATE_SAMPLED = "sampled"
+VALIDATE_OFF = "off"
+VALIDATE_ENCODE = "encode"
+VALIDATION_MODES = frozenset((
+    VALIDATE_FULL,
+    VALIDATE_SAMPLED,
+    VALIDATE_OFF,
+    VALIDATE_ENCODE
+))
+
+# How decoded message arguments are handed to message implementations.
+REQUEST_DATA_DIRECT = "direct"
+REQUEST_DATA_READONLY = "readonly"
+REQUEST_DATA_COPY = "copy"
+REQUEST_DATA_MODES = frozenset((
+    REQUEST_DATA_DIRECT,
+    REQUEST_DATA_READONLY,
+    REQUEST_DATA_COPY
+))
+
+# Executor pool kinds and rejection policies.
+POOL_THREAD = "thread"
+POOL_PROCESS = "process"
+POOL_KINDS = frozenset((POOL_THREAD, POOL_PROCESS))
+
+POOL_REJECT = "reject"
+POOL_CALLER_RUNS = "caller_runs"
+POOL_BLOCK = "block"
+REJECTION_POLICIES = frozenset((POOL_REJECT, POOL_CALLER_RUNS, POOL_BLOCK))
+
+# Backends compiling avro IDL into protocol schemas.
+COMPILER_JAVA = "java"
+COMPILER_PYTHON = "python"
+COMPILERS = frozenset((COMPILER_JAVA, COMPILER_PYTHON))
+
+# Request profile output formats.
+PROFILE_COLLAPSED = "collapsed"
+PROFILE_PSTATS = "pstats"
+PROFILE_FORMATS = frozenset((PROFILE_COLLAPSED, PROFILE_PSTATS))
+
 CONFIG_DEFAULTS = {
     "default_path_prefix": None,
     "protocol_dir": None,
     "auto_compile": False,
+    "compile_cache": True,
+    "compile_workers": 4,
+    "compiler": COMPILER_JAVA,
     "tools_jar": None,
-    "service": {}
+    "parse_cache_dir": None,
+    "lazy_routes": False,
+    "eager_services": (),
+    "reload_schemas": False,
+    "reload_interval": 1.0,
+    "metrics": False,
+    "metrics_window": 1024,
+    "stats_path": None,
+    "tracing": False,
+    "trace_exporter": "none",
+    "trace_file": None,
+    "profile": False,
+    "profile_sample_rate": 0.0,
+    "profile_secret": None,
+    "profile_messages": (),
+    "profile_dir": None,
+    "profile_format": PROFILE_COLLAPSED,
+    "profile_interval": 0.005,
+    "compression": (),
+    "compression_min_size": 1024,
+    "compression_level": None,
+    "request_compression": ("gzip", "deflate"),
+    "max_decompressed_size": 64 * 1024 * 1024,
+    "validate_response": VALIDATE_FULL,
+    "validate_sample_rate": 0.1,
+    "request_data": REQUEST_DATA_DIRECT,
+    "response_frame_size": 64 * 1024,
+    "stateless_handshake": True,
+    "protocol_cache_size": 64,
+    "batch_workers": 1,
+    "batch_max_calls": 1000,
+    "service": {},
+    "pool": {}
 }
 
 SERVICE_DEF_PROPERTIES = frozenset((
     "protocol",
     "schema",
-    "pattern"
+    "pattern",
+    "validate_response",
+    "validate_sample_rate",
+    "validate_messages",
+    "request_data",
+    "response_frame_size",
+    "stateless_handshake",
+    "protocol_cache_size",
+    "batch_workers",
+    "batch_max_calls",
+    "compression",
+    "request_compression",
+    "max_decompressed_size",
+    "lazy"
+))
+
+POOL_DEF_PROPERTIES = frozenset((
+    "kind",
+    "max_workers",
+    "max_queue",
+    "rejection",
+    "block_timeout"
 ))
 
 
@@ -42,25 +141,11 @@ def get_config_options(configuration):
     for key in parsed_options.keys():
         val = parsed_options[key]
         if key.startswith("service."):
-            if not isinstance(val, basestring) or not val:
-                raise p_config.ConfigurationError(
-                    "Service definition must have one on {}".format(
-                        list(SERVICE_DEF_PROPERTIES)
-                    )
-                )
-            service_name = key.replace("service.", "")
-            services = options.get("service") or {}
-            service_def_parts = [el for el in val.split('\n') if el]
-            service_def = {}
-            for part in service_def_parts:
-                opt, value = part.split("=")
-                opt = opt.strip()
-                if opt not in SERVICE_DEF_PROPERTIES:
-                    raise p_config.ConfigurationError(
-                        "Unrecognized service property: '{}'".format(opt)
-                    )
-                value = value.strip()
-                service_def[opt] = value
+            service_def = _parse_definition(
+                val,
+                SERVICE_DEF_PROPERTIES,
+                "Service"
+            )
             defined_protocol = "protocol" in service_def
             defined_schema = "schema" in service_def
             if not (defined_protocol or defined_schema):
@@ -68,14 +153,390 @@ def get_config_options(configuration):
                     "Service must have either protocol or schema defined."
                 )
 
+            service_name = key.replace("service.", "")
+            services = options.get("service") or {}
             services[service_name] = service_def
             key = "service"
             val = services
+        elif key.startswith("pool."):
+            pool_def = _parse_definition(val, POOL_DEF_PROPERTIES, "Pool")
+            pool_name = key.replace("pool.", "")
+            pools = options.get("pool") or {}
+            pools[pool_name] = parse_pool_options(pool_def)
+            key = "pool"
+            val = pools
         options[key] = val
     options["auto_compile"] = p_settings.asbool(options.get("auto_compile"))
+    options["compile_cache"] = p_settings.asbool(options["compile_cache"])
+    options["lazy_routes"] = p_settings.asbool(options["lazy_routes"])
+    options["eager_services"] = parse_name_list(options["eager_services"])
+    options["reload_schemas"] = p_settings.asbool(options["reload_schemas"])
+    options["reload_interval"] = parse_positive_float(
+        options["reload_interval"],
+        "reload_interval"
+    )
+    options["compiler"] = parse_compiler(options["compiler"])
+    options["validate_response"] = parse_validation_mode(
+        options["validate_response"]
+    )
+    options["validate_sample_rate"] = parse_sample_rate(
+        options["validate_sample_rate"]
+    )
+    options["request_data"] = parse_request_data_mode(options["request_data"])
+    options["response_frame_size"] = parse_positive_int(
+        options["response_frame_size"],
+        "response_frame_size"
+    )
+    options["stateless_handshake"] = p_settings.asbool(
+        options["stateless_handshake"]
+    )
+    options["metrics"] = p_settings.asbool(options["metrics"])
+    options["tracing"] = p_settings.asbool(options["tracing"])
+    options["profile"] = p_settings.asbool(options["profile"])
+    options["profile_sample_rate"] = parse_sample_rate(
+        options["profile_sample_rate"]
+    )
+    options["profile_messages"] = parse_name_list(options["profile_messages"])
+    options["profile_format"] = parse_profile_format(options["profile_format"])
+    options["profile_interval"] = parse_positive_float(
+        options["profile_interval"],
+        "profile_interval"
+    )
+    options["compression"] = parse_codings(options["compression"])
+    options["compression_min_size"] = parse_non_negative_int(
+        options["compression_min_size"],
+        "compression_min_size"
+    )
+    options["compression_level"] = parse_compression_level(
+        options["compression_level"]
+    )
+    options["request_compression"] = parse_codings(
+        options["request_compression"]
+    )
+    for key in ("compile_workers", "protocol_cache_size", "batch_workers",
+                "batch_max_calls", "metrics_window",
+                "max_decompressed_size"):
+        options[key] = parse_positive_int(options[key], key)
     return options
 
 
+def _parse_definition(value, properties, description):
+    if not isinstance(value, basestring) or not value:
+        raise p_config.ConfigurationError(
+            "{} definition must have one of {}".format(
+                description,
+                sorted(properties)
+            )
+        )
+    definition = {}
+    for part in [el for el in value.split('\n') if el]:
+        opt, value = part.split("=")
+        opt = opt.strip()
+        if opt not in properties:
+            raise p_config.ConfigurationError(
+                "Unrecognized {} property: '{}'".format(
+                    description.lower(),
+                    opt
+                )
+            )
+        definition[opt] = value.strip()
+    return definition
+
+
+def _parse_choice(value, choices, description):
+    if isinstance(value, basestring):
+        value = value.strip().lower()
+    if value not in choices:
+        raise p_config.ConfigurationError(
+            "Unrecognized {}: '{}'. Expected one of {}".format(
+                description,
+                value,
+                sorted(choices)
+            )
+        )
+    return value
+
+
+def parse_compiler(compiler):
+    """
+    Normalize and verify an IDL compiler backend.
+
+    :param compiler: one of COMPILERS.
+    :return: the normalized backend.
+    """
+    return _parse_choice(compiler, COMPILERS, "compiler")
+
+
+def parse_profile_format(output):
+    """
+    Normalize and verify a request profile output format.
+
+    :param output: one of PROFILE_FORMATS.
+    :return: the normalized format.
+    """
+    return _parse_choice(output, PROFILE_FORMATS, "profile format")
+
+
+def parse_validation_mode(mode):
+    """
+    Normalize and verify a response validation mode.
+
+    :param mode: one of VALIDATION_MODES.
+    :return: the normalized mode.
+    """
+    return _parse_choice(mode, VALIDATION_MODES, "validation mode")
+
+
+def parse_request_data_mode(mode):
+    """
+    Normalize and verify a request data mode.
+
+    :param mode: one of REQUEST_DATA_MODES.
+    :return: the normalized mode.
+    """
+    return _parse_choice(mode, REQUEST_DATA_MODES, "request data mode")
+
+
+def parse_pool_kind(kind):
+    """
+    Normalize and verify an executor pool kind.
+
+    :param kind: one of POOL_KINDS.
+    :return: the normalized kind.
+    """
+    return _parse_choice(kind, POOL_KINDS, "pool kind")
+
+
+def parse_rejection_policy(policy):
+    """
+    Normalize and verify an executor pool rejection policy.
+
+    :param policy: one of REJECTION_POLICIES.
+    :return: the normalized policy.
+    """
+    return _parse_choice(policy, REJECTION_POLICIES, "rejection policy")
+
+
+def parse_pool_options(options):
+    """
+    Normalize and verify the options of an executor pool definition.
+
+    :param options: a dict of POOL_DEF_PROPERTIES.
+    :return: a dict of pools.ExecutorPool keyword arguments.
+    """
+    unknown = set(options) - POOL_DEF_PROPERTIES
+    if unknown:
+        raise p_config.ConfigurationError(
+            "Unrecognized pool property: '{}'".format(sorted(unknown)[0])
+        )
+
+    parsed = {}
+    if options.get("kind") is not None:
+        parsed["kind"] = parse_pool_kind(options["kind"])
+    if options.get("max_workers") is not None:
+        parsed["max_workers"] = parse_positive_int(
+            options["max_workers"],
+            "max_workers"
+        )
+    if options.get("max_queue") is not None:
+        parsed["max_queue"] = parse_non_negative_int(
+            options["max_queue"],
+            "max_queue"
+        )
+    if options.get("rejection") is not None:
+        parsed["rejection"] = parse_rejection_policy(options["rejection"])
+    if options.get("block_timeout") is not None:
+        parsed["block_timeout"] = parse_non_negative_float(
+            options["block_timeout"],
+            "block_timeout"
+        )
+    return parsed
+
+
+def parse_sample_rate(rate):
+    """
+    Normalize and verify a sampling rate between 0 and 1.
+
+    :param rate: a number or numeric string.
+    :return: the rate as a float.
+    """
+    try:
+        rate = float(rate)
+    except (TypeError, ValueError):
+        rate = None
+    if rate is None or not 0.0 <= rate <= 1.0:
+        raise p_config.ConfigurationError(
+            "Sample rate must be a number between 0 and 1."
+        )
+    return rate
+
+
+def parse_positive_int(value, name):
+    """
+    Normalize and verify a positive integer option.
+
+    :param value: an integer or numeric string.
+    :param name: the option's name, for error reporting.
+    :return: the value as an int.
+    """
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        value = None
+    if value is None or value <= 0:
+        raise p_config.ConfigurationError(
+            "{} must be a positive integer.".format(name)
+        )
+    return value
+
+
+def parse_non_negative_int(value, name):
+    """
+    Normalize and verify a non-negative integer option.
+
+    :param value: an integer or numeric string.
+    :param name: the option's name, for error reporting.
+    :return: the value as an int.
+    """
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        value = None
+    if value is None or value < 0:
+        raise p_config.ConfigurationError(
+            "{} must be a non-negative integer.".format(name)
+        )
+    return value
+
+
+def parse_positive_float(value, name):
+    """
+    Normalize and verify a positive number option.
+
+    :param value: a number or numeric string.
+    :param name: the option's name, for error reporting.
+    :return: the value as a float.
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        value = None
+    if value is None or not value > 0:
+        raise p_config.ConfigurationError(
+            "{} must be a positive number.".format(name)
+        )
+    return value
+
+
+def parse_non_negative_float(value, name):
+    """
+    Normalize and verify a non-negative number option.
+
+    :param value: a number or numeric string.
+    :param name: the option's name, for error reporting.
+    :return: the value as a float.
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        value = None
+    if value is None or not value >= 0:
+        raise p_config.ConfigurationError(
+            "{} must be a non-negative number.".format(name)
+        )
+    return value
+
+
+def parse_name_list(names):
+    """
+    Normalize a list of names, given as an iterable or as a string of names
+    separated by whitespace or commas.
+
+    :param names: an iterable, a string, or None.
+    :return: a frozenset of names.
+    """
+    if not names:
+        return frozenset()
+    if isinstance(names, basestring):
+        names = names.replace(",", " ").split()
+    return frozenset(names)
+
+
+def parse_codings(codings):
+    """
+    Normalize a list of compression codecs, in order of preference, given
+    as an iterable or as a string of names separated by whitespace or
+    commas.
+
+    :param codings: an iterable, a string, or None.
+    :return: a tuple of names.
+    """
+    if not codings:
+        return ()
+    if isinstance(codings, basestring):
+        codings = codings.replace(",", " ").split()
+    parsed = []
+    for coding in codings:
+        if coding not in parsed:
+            parsed.append(coding)
+    return tuple(parsed)
+
+
+def parse_compression_level(level):
+    """
+    Normalize and verify a zlib compression level.
+
+    :param level: an integer from -1 (zlib's default) to 9, a numeric
+        string, or None.
+    :return: the level as an int, or None.
+    """
+    if level is None:
+        return None
+    try:
+        level = int(level)
+    except (TypeError, ValueError):
+        level = None
+    if level is None or not -1 <= level <= 9:
+        raise p_config.ConfigurationError(
+            "compression_level must be an integer from -1 to 9."
+        )
+    return level
+
+
+def parse_message_options(options, parse=None):
+    """
+    Normalize per-message options into a dict of message name -> value.
+
+    Options can be provided as a dict, or as a string of "message:value"
+    pairs separated by whitespace or commas, as is convenient in an ini file::
+
+        validate_messages = get:off, put:encode
+
+    :param options: a dict, a string, or None.
+    :param parse: an optional callable to normalize each value.
+    :return: a dict of message options.
+    """
+    if not options:
+        return {}
+
+    if isinstance(options, basestring):
+        pairs = {}
+        for part in options.replace(",", " ").split():
+            message, sep, value = part.partition(":")
+            if not sep or not message or not value:
+                raise p_config.ConfigurationError(
+                    "Message options must be 'message:value' pairs, "
+                    "got '{}'".format(part)
+                )
+            pairs[message] = value
+        options = pairs
+
+    if parse is None:
+        return dict(options)
+
+    return dict((key, parse(val)) for key, val in options.items())
+
+
 def derive_service_path(service_name, url_pattern=None, path_prefix=None):
     """
     Given a service name, existing url_pattern, and url path prefix, derive a
@@ -111,4 +572,25 @@ def derive_service_path(service_name, url_pattern=None, path_prefix=None):
     return url_pattern
 
 
+def derive_service_files(protocol=None, schema=None, base_dir=None):
+    """
+    Given a service's protocol and/or schema file, derive absolute paths for
+    both. Relative paths are taken relative to base_dir, and a missing
+    schema path is the protocol's, with an ".avpr" extension.
+
+    :param protocol: an optional avro protocol file path.
+    :param schema: an optional avro schema file path.
+    :param base_dir: the directory relative paths are in.
+    :return: a tuple of (protocol path, schema path).
+    """
+    base_dir = base_dir or os.getcwd()
+    if protocol is not None:
+        protocol = os.path.join(base_dir, protocol)
+        if schema is None:
+            schema = os.path.splitext(protocol)[0] + ".avpr"
+    if schema is not None:
+        schema = os.path.join(base_dir, schema)
+    return protocol, schema
+
+
 __all__ = [get_config_options.__name__]
@@ -0,0 +1,542 @@
+import collections
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+try:
+    import contextvars
+except ImportError:  # pragma: no cover
+    contextvars = None
+
+from zope import interface as zi
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Trace context is carried as a W3C "traceparent"
+# (https://www.w3.org/TR/trace-context/): in the metadata map of each avro
+# call request, and in an HTTP header of the same name covering every call
+# of the request. Call metadata wins, so calls of a batch may each carry
+# their own. Responses carry the traceparent of the server's span.
+TRACEPARENT = "traceparent"
+TRACE_VERSION = "00"
+SAMPLED = 0x01
+
+# Span kinds: a call served, and the phases of serving it.
+SPAN_SERVER = "server"
+SPAN_INTERNAL = "internal"
+
+# The spans recorded for each call, as children of the call's span.
+SPAN_PHASES = (metrics.PHASE_DECODE, metrics.PHASE_HANDLER,
+               metrics.PHASE_ENCODE)
+
+# The spans an InMemoryExporter keeps by default.
+MEMORY_SPANS = 10000
+
+# Built-in exporters, see make_exporter.
+EXPORTER_NONE = "none"
+EXPORTER_MEMORY = "memory"
+EXPORTER_FILE = "file"
+
+_traceparent_re = re.compile(
+    r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?$"
+)
+
+SpanContext = collections.namedtuple(
+    "SpanContext",
+    ["trace_id", "span_id", "sampled"]
+)
+
+
+def new_trace_id():
+    """
+    :return: a random 32 digit hex trace id.
+    """
+    return "{:032x}".format(random.getrandbits(128) or 1)
+
+
+def new_span_id():
+    """
+    :return: a random 16 digit hex span id.
+    """
+    return "{:016x}".format(random.getrandbits(64) or 1)
+
+
+def parse_traceparent(value):
+    """
+    Parse a traceparent. Invalid ones are ignored, as the W3C spec asks:
+    the callee starts a new trace instead.
+
+    :param value: a traceparent, as text or bytes, or None.
+    :return: a SpanContext, or None.
+    """
+    if not value:
+        return None
+    if isinstance(value, bytes):
+        try:
+            value = value.decode("ascii")
+        except UnicodeDecodeError:
+            return None
+    match = _traceparent_re.match(value.strip())
+    if match is None:
+        return None
+    version, trace_id, span_id, flags, rest = match.groups()
+    if version == "ff" or (version == TRACE_VERSION and rest):
+        return None
+    if trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return SpanContext(trace_id, span_id, bool(int(flags, 16) & SAMPLED))
+
+
+def format_traceparent(context):
+    """
+    :param context: a SpanContext.
+    :return: its traceparent.
+    """
+    return "{}-{}-{}-{:02x}".format(
+        TRACE_VERSION,
+        context.trace_id,
+        context.span_id,
+        SAMPLED if context.sampled else 0
+    )
+
+
+def inject_metadata(context, metadata=None):
+    """
+    Add a span context to avro call metadata.
+
+    :param context: a SpanContext, or None to leave metadata as it is.
+    :param metadata: an optional metadata map to add to.
+    :return: the metadata map.
+    """
+    if metadata is None:
+        metadata = {}
+    if context is not None:
+        metadata[TRACEPARENT] = format_traceparent(context).encode("ascii")
+    return metadata
+
+
+def inject_headers(context, headers):
+    """
+    Add a span context to HTTP request headers.
+
+    :param context: a SpanContext, or None to leave headers as they are.
+    :param headers: a dict of headers.
+    :return: headers.
+    """
+    if context is not None:
+        headers[TRACEPARENT] = format_traceparent(context)
+    return headers
+
+
+class ISpanExporter(zi.Interface):
+
+    def export(spans):
+        """Export a call's finished spans: its own, then its phases'."""
+
+
+class Span(object):
+    """
+    A timed unit of work of a trace: a call served by a service, or one of
+    the phases of serving it (see SPAN_PHASES).
+
+    Times are wall clock seconds; durations are measured with metrics.clock.
+    """
+
+    def __init__(self, name, context, parent_id=None, kind=SPAN_SERVER,
+                 service=None, started=None, tracer=None):
+        """
+        :param name: the span's name, such as the message called.
+        :param context: the span's SpanContext.
+        :param parent_id: the span id of the span's parent, if any.
+        :param kind: SPAN_SERVER or SPAN_INTERNAL.
+        :param service: the service the span belongs to.
+        :param started: the metrics.clock time the span started, if not
+            now.
+        :param tracer: the Tracer to export the span with once finished.
+        """
+        now = metrics.clock()
+        if started is None:
+            started = now
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.service = service
+        self.start_time = time.time() - (now - started)
+        self.duration = None
+        self.error = None
+        self.attributes = {}
+        self.children = []
+        self.tracer = tracer
+        self._started = started
+
+    @property
+    def trace_id(self):
+        return self.context.trace_id
+
+    @property
+    def span_id(self):
+        return self.context.span_id
+
+    @property
+    def metadata(self):
+        """The call response metadata carrying this span's context."""
+        return inject_metadata(self.context)
+
+    def start(self):
+        """
+        :return: a start time for "stop".
+        """
+        return metrics.clock()
+
+    def stop(self, phase, started):
+        """
+        Record a phase of this span as a child span.
+
+        :param phase: one of SPAN_PHASES.
+        :param started: the phase's start time, from "start".
+        :return: the child Span.
+        """
+        child = Span(
+            phase,
+            SpanContext(self.trace_id, new_span_id(), self.context.sampled),
+            parent_id=self.span_id,
+            kind=SPAN_INTERNAL,
+            service=self.service,
+            started=started
+        )
+        # Timed against this span's start, so children line up with it.
+        child.start_time = self.start_time + (started - self._started)
+        child.duration = metrics.clock() - started
+        self.children.append(child)
+        return child
+
+    def activate(self):
+        """
+        Make this the current span (see current_span) until "deactivate".
+
+        :return: a token for "deactivate".
+        """
+        return _activate(self)
+
+    def deactivate(self, token):
+        """
+        Restore the span current before "activate".
+
+        :param token: the token from "activate".
+        """
+        _deactivate(token)
+
+    def finish(self, error=None):
+        """
+        End the span, and export it along with its children if it has a
+        tracer.
+
+        :param error: the call's error, if it failed.
+        """
+        self.duration = metrics.clock() - self._started
+        if error is not None:
+            self.error = str(error)
+        if self.tracer is not None:
+            self.tracer.export(self)
+
+    def to_dict(self):
+        """
+        :return: the span as a JSON-serializable dict.
+        """
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "service": self.service,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration": self.duration,
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+
+class _NullSpan(object):
+    # Stands in for a Span when calls aren't traced.
+
+    metadata = {}
+
+    def start(self):
+        return 0
+
+    def stop(self, phase, started):
+        pass
+
+    def activate(self):
+        return None
+
+    def deactivate(self, token):
+        pass
+
+    def finish(self, error=None):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+if contextvars is not None:
+    # Context variables follow coroutines onto the event loop thread, so
+    # "async def" implementations see their call's span too.
+    _current_span = contextvars.ContextVar("pyramid_avro_span", default=None)
+
+    def current_span():
+        """
+        :return: the Span of the call being served, or None.
+        """
+        return _current_span.get()
+
+    def _activate(span):
+        return _current_span.set(span)
+
+    def _deactivate(token):
+        _current_span.reset(token)
+
+else:  # pragma: no cover
+    _local = threading.local()
+
+    def current_span():
+        """
+        :return: the Span of the call being served, or None.
+        """
+        return getattr(_local, "span", None)
+
+    def _activate(span):
+        token = current_span()
+        _local.span = span
+        return token
+
+    def _deactivate(token):
+        _local.span = token
+
+
+def current_context():
+    """
+    The span context outgoing calls carry: that of the call being served.
+
+    :return: a SpanContext, or None.
+    """
+    span = current_span()
+    return None if span is None else span.context
+
+
+def call_in_span(span, fn, *args):
+    """
+    Call fn(*args) with span as the current span, such as on a thread other
+    than the one serving the call.
+
+    :param span: a Span, or None.
+    :param fn: a callable.
+    :param args: arguments for fn.
+    :return: fn's result.
+    """
+    if span is None:
+        return fn(*args)
+    token = span.activate()
+    try:
+        return fn(*args)
+    finally:
+        span.deactivate(token)
+
+
+class Tracer(object):
+    """
+    Starts a span for every call a service serves, and hands finished spans
+    to an exporter.
+    """
+
+    def __init__(self, service, exporter=None):
+        """
+        :param service: the service name.
+        :param exporter: an optional ISpanExporter. Without one, calls are
+            still traced, so their context propagates, but spans are
+            dropped.
+        """
+        self.service = service
+        self.exporter = exporter
+
+    def request_trace(self, headers):
+        """
+        :param headers: the HTTP request headers.
+        :return: a RequestTrace for the request's calls.
+        """
+        return RequestTrace(self, parse_traceparent(headers.get(TRACEPARENT)))
+
+    def export(self, span):
+        """
+        Export a finished call span and its children. Exporter failures are
+        logged rather than failing the call.
+
+        :param span: a Span.
+        """
+        if self.exporter is None:
+            return
+        try:
+            self.exporter.export([span] + span.children)
+        except Exception:
+            logger.exception("Failed to export spans.")
+
+
+class RequestTrace(object):
+    """
+    Traces the calls of one HTTP request.
+    """
+
+    def __init__(self, tracer, parent=None):
+        """
+        :param tracer: the service's Tracer.
+        :param parent: the SpanContext from the request's HTTP headers, for
+            calls without one in their metadata.
+        """
+        self.tracer = tracer
+        self.parent = parent
+
+    def start(self):
+        """
+        :return: a start time for "start_span".
+        """
+        return metrics.clock()
+
+    def start_span(self, message_name, metadata, started):
+        """
+        Start the span of a decoded call, continuing the caller's trace if
+        it sent one, and record decoding it.
+
+        :param message_name: the avro message called.
+        :param metadata: the call's metadata map.
+        :param started: when decoding started, from "start".
+        :return: a Span, to be finished once the call response is written.
+        """
+        parent = parse_traceparent(metadata.get(TRACEPARENT)) or self.parent
+        if parent is None:
+            context = SpanContext(new_trace_id(), new_span_id(), True)
+            parent_id = None
+        else:
+            context = SpanContext(
+                parent.trace_id,
+                new_span_id(),
+                parent.sampled
+            )
+            parent_id = parent.span_id
+        span = Span(
+            message_name,
+            context,
+            parent_id=parent_id,
+            service=self.tracer.service,
+            started=started,
+            tracer=self.tracer
+        )
+        span.stop(metrics.PHASE_DECODE, started)
+        return span
+
+
+class _NullTrace(object):
+    # Stands in for a RequestTrace when calls aren't traced.
+
+    def start(self):
+        return 0
+
+    def start_span(self, message_name, metadata, started):
+        return NULL_SPAN
+
+
+NULL_TRACE = _NullTrace()
+
+
+@zi.implementer(ISpanExporter)
+class InMemoryExporter(object):
+    """
+    Keeps the most recent spans in memory, for tests and debugging.
+    """
+
+    def __init__(self, max_spans=MEMORY_SPANS):
+        """
+        :param max_spans: the most spans kept.
+        """
+        self.spans = collections.deque(maxlen=max_spans)
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+    def clear(self):
+        self.spans.clear()
+
+
+@zi.implementer(ISpanExporter)
+class FileExporter(object):
+    """
+    Appends spans to a file, one JSON object (see Span.to_dict) per line.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: the file path.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = "".join(
+            json.dumps(span.to_dict(), sort_keys=True) + "\n"
+            for span in spans
+        )
+        with self._lock:
+            with open(self.path, "a") as _file:
+                _file.write(lines)
+
+
+def make_exporter(name, path=None, resolve=None, options=None):
+    """
+    Build the exporter named by the "trace_exporter" setting.
+
+    :param name: EXPORTER_NONE, EXPORTER_MEMORY, EXPORTER_FILE, or the
+        dotted name of a callable accepting the avro settings and returning
+        an ISpanExporter.
+    :param path: the file EXPORTER_FILE writes to.
+    :param resolve: a callable resolving dotted names, such as
+        Configurator.maybe_dotted.
+    :param options: the avro settings, for exporter factories.
+    :return: an ISpanExporter, or None.
+    """
+    if name is None or name == EXPORTER_NONE:
+        return None
+    if name == EXPORTER_MEMORY:
+        return InMemoryExporter()
+    if name == EXPORTER_FILE:
+        if not path:
+            raise ValueError("The file trace exporter needs a trace_file.")
+        return FileExporter(path)
+    if resolve is None:
+        raise ValueError("Unknown trace exporter: '{}'".format(name))
+    return resolve(name)(options or {})
+
+
+__all__ = [
+    FileExporter.__name__,
+    ISpanExporter.__name__,
+    InMemoryExporter.__name__,
+    RequestTrace.__name__,
+    Span.__name__,
+    SpanContext.__name__,
+    Tracer.__name__,
+    call_in_span.__name__,
+    current_context.__name__,
+    current_span.__name__,
+    format_traceparent.__name__,
+    inject_headers.__name__,
+    inject_metadata.__name__,
+    make_exporter.__name__,
+    parse_traceparent.__name__
+]
@@ -3,11 +3,19 @@ import os
 import shlex
 import subprocess
 import sys
+import tempfile
 
 from avro import protocol as avro_protocol
 
 logger = logging.getLogger(__name__)
 
+# Files written atomically get the permissions of the file they replace, or
+# these.
+DEFAULT_FILE_MODE = 0o644
+
+# os.rename isn't atomic over an existing file on windows, os.replace is.
+_replace = getattr(os, "replace", os.rename)
+
 
 def run_subprocess_command(command, out_buffer=sys.stdout, exit_on_error=True):
     """
@@ -66,10 +74,17 @@ def compile_protocol(protocol, schema, jar_file):
     Given the provided protocol path, schema path, and jar file path, attempt
     to compile the protocol file into an avro schema.
 
+    Compiles with compiler.run_compile, raising rather than exiting the
+    process when the compile fails.
+
     :param protocol: an avro protocol file path.
     :param schema: a file path to write the compiled schema.
     :param jar_file: a jar file to use for the compilation.
+    :return: the compiler's output.
+    :raises compiler.CompileError: when the compile fails.
     """
+    # The compiler module builds on this one.
+    from . import compiler
 
     if None in [protocol, schema, jar_file]:
         raise ValueError("Input must not be NoneType.")
@@ -80,16 +95,31 @@ def compile_protocol(protocol, schema, jar_file):
     if not os.path.exists(protocol):
         raise OSError("No such file or directory {}".format(protocol))
 
-    logger.debug("Compiling {} into {}".format(protocol, schema))
-    command = [
-        "java",
-        "-jar",
-        jar_file,
-        "idl",
-        protocol,
-        schema
-    ]
-    run_subprocess_command(command)
+    return compiler.run_compile(protocol, schema, jar_file)
+
+
+def write_atomically(path, write):
+    """
+    Write a file by writing a temporary file beside it, then moving it into
+    place, so readers never see a partial file.
+
+    :param path: the file path to write.
+    :param write: a callable accepting the temporary file path to write.
+    """
+    directory, filename = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(prefix=".{}.".format(filename),
+                                    dir=directory or os.curdir)
+    os.close(fd)
+    try:
+        write(tmp_path)
+        mode = DEFAULT_FILE_MODE
+        if os.path.exists(path):
+            mode = os.stat(path).st_mode & 0o777
+        os.chmod(tmp_path, mode)
+        _replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 def get_protocol_from_file(schema_path):
@@ -113,4 +143,4 @@ def get_protocol_from_file(schema_path):
     return protocol
 
 
-__all__ = [compile_protocol.__name__]
+__all__ = [compile_protocol.__name__, write_atomically.__name__]
@@ -0,0 +1,353 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+
+from . import compiler
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of watched files when polling. Watchers using
+# inotify are woken by changes instead, and only check this often whether
+# they were stopped.
+POLL_INTERVAL = 1.0
+
+# inotify(7) flags: files written, created or moved into a directory.
+_IN_CLOEXEC = 0o2000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOSE_WRITE = 0x08
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+
+# An inotify event: wd, mask, cookie and name length, followed by the name.
+_EVENT_HEADER = struct.Struct("iIII")
+
+_READ_SIZE = 64 * 1024
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6",
+            use_errno=True
+        )
+        # Only present from glibc 2.9.
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+class Inotify(object):
+    """
+    A minimal inotify(7) instance, watching directories for files written,
+    created or moved into them.
+    """
+
+    def __init__(self):
+        if _libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available.")
+        self.fd = _libc.inotify_init1(_IN_CLOEXEC | _IN_NONBLOCK)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self.directories = {}
+
+    def watch(self, directory):
+        """
+        Watch a directory.
+
+        :param directory: a directory path.
+        """
+        path = directory
+        if not isinstance(path, bytes):
+            path = path.encode(sys.getfilesystemencoding())
+        wd = _libc.inotify_add_watch(self.fd, path, _IN_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), directory)
+        self.directories[wd] = directory
+
+    def read(self, timeout, wake_fd=None):
+        """
+        Wait for changes.
+
+        :param timeout: the most seconds to wait.
+        :param wake_fd: an optional file descriptor which, when readable,
+            stops the wait early.
+        :return: a set of the changed file paths, empty after a timeout.
+        """
+        fds = [self.fd] if wake_fd is None else [self.fd, wake_fd]
+        readable, _, _ = select.select(fds, [], [], timeout)
+        if self.fd not in readable:
+            return set()
+        try:
+            data = os.read(self.fd, _READ_SIZE)
+        except OSError as ex:
+            if ex.errno == errno.EAGAIN:
+                return set()
+            raise
+
+        paths = set()
+        pos = 0
+        while pos + _EVENT_HEADER.size <= len(data):
+            wd, _, _, size = _EVENT_HEADER.unpack_from(data, pos)
+            pos += _EVENT_HEADER.size
+            name = data[pos:pos + size].rstrip(b"\0")
+            pos += size
+            directory = self.directories.get(wd)
+            if directory is not None and name:
+                paths.add(os.path.join(
+                    directory,
+                    name.decode(sys.getfilesystemencoding())
+                ))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size, stat.st_ino
+
+
+class FileWatcher(object):
+    """
+    Watches files from a thread of its own, calling back with those that
+    changed.
+
+    Changes are noticed with inotify where available, by watching the
+    files' directories, so files replaced by moving a new one into place
+    are noticed too. Elsewhere, files are polled every interval seconds.
+    Either way, a file only counts as changed when its modification time,
+    size or inode changed.
+
+    The thread doesn't survive a fork: "ensure_started" starts it afresh in
+    a forked child process.
+    """
+
+    def __init__(self, paths, callback, interval=POLL_INTERVAL,
+                 use_inotify=True):
+        """
+        :param paths: the file paths to watch.
+        :param callback: a callable accepting a sorted list of the paths
+            that changed.
+        :param interval: seconds between polls.
+        :param use_inotify: whether to use inotify where available.
+        """
+        self.paths = frozenset(os.path.abspath(path) for path in paths)
+        self.callback = callback
+        self.interval = interval
+        self.use_inotify = use_inotify
+        self.backend = None
+        self._stats = dict((path, _stat(path)) for path in self.paths)
+        self._stopped = threading.Event()
+        self._thread = None
+        self._wake_fd = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        """Whether the watcher thread is running in this process."""
+        return (
+            self._pid == os.getpid() and
+            self._thread is not None and
+            self._thread.is_alive()
+        )
+
+    def check(self):
+        """
+        Find the watched files that changed since the last check.
+
+        :return: a sorted list of file paths.
+        """
+        changed = []
+        for path in sorted(self.paths):
+            stat = _stat(path)
+            if stat != self._stats[path]:
+                self._stats[path] = stat
+                changed.append(path)
+        return changed
+
+    def start(self):
+        """Start watching, in a daemon thread."""
+        inotify = None
+        if self.use_inotify:
+            try:
+                inotify = Inotify()
+                for directory in sorted(set(
+                        os.path.dirname(path) for path in self.paths)):
+                    inotify.watch(directory)
+            except OSError:
+                logger.info("Can't use inotify, polling instead.",
+                            exc_info=True)
+                if inotify is not None:
+                    inotify.close()
+                inotify = None
+        self.backend = "poll" if inotify is None else "inotify"
+        wake_fd = None
+        if inotify is not None:
+            # Closing the pipe's write end wakes the thread to stop.
+            wake_fd, self._wake_fd = os.pipe()
+
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(inotify, wake_fd),
+            name="pyramid-avro-watcher"
+        )
+        self._thread.daemon = True
+        self._thread.start()
+        self._pid = os.getpid()
+
+    def ensure_started(self):
+        """
+        Start watching unless already watching in this process, or stopped:
+        in a forked child, the parent's thread doesn't exist.
+        """
+        if self.running or self._stopped.is_set():
+            return
+        with self._lock:
+            if self.running or self._stopped.is_set():
+                return
+            if self._pid is not None:
+                logger.debug("Restarting the watcher in process {}.".format(
+                    os.getpid()
+                ))
+                # The parent's pipe end, which this process doesn't need.
+                wake_fd, self._wake_fd = self._wake_fd, None
+                if wake_fd is not None:
+                    os.close(wake_fd)
+            self.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop watching.
+
+        :param timeout: the most seconds to wait for the thread to finish.
+        """
+        self._stopped.set()
+        wake_fd, self._wake_fd = self._wake_fd, None
+        if wake_fd is not None:
+            os.close(wake_fd)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self, inotify, wake_fd):
+        try:
+            while not self._stopped.is_set():
+                if inotify is None:
+                    self._stopped.wait(self.interval)
+                else:
+                    changed = inotify.read(self.interval, wake_fd)
+                    if not changed & self.paths:
+                        continue
+                changed = self.check()
+                if changed:
+                    try:
+                        self.callback(changed)
+                    except Exception:
+                        logger.exception("Failed to handle changed files.")
+        finally:
+            if inotify is not None:
+                inotify.close()
+                os.close(wake_fd)
+
+
+def _imports(protocol):
+    try:
+        return compiler.protocol_imports(protocol)
+    except (IOError, OSError):
+        # A protocol yet to be written has no imports.
+        return []
+
+
+class SchemaReloader(object):
+    """
+    Rebuilds the routes whose schema files changed (see
+    routes.LazyAvroServiceRoute.reload), a FileWatcher callback.
+
+    Given compile jobs, changed protocols are compiled first, so editing an
+    IDL file, or a file it imports, reloads its service too. Imports are
+    found when the reloader is made (see compiler.protocol_imports).
+    """
+
+    def __init__(self, routes, jobs=(), **compile_options):
+        """
+        :param routes: a dict of schema path -> list of
+            routes.LazyAvroServiceRoute.
+        :param jobs: compiler.CompileJob to run when their protocol changes.
+        :param compile_options: compiler.compile_all options.
+        """
+        self.routes = dict(
+            (os.path.abspath(schema), list(schema_routes))
+            for schema, schema_routes in routes.items()
+        )
+        self.jobs = {}
+        for job in jobs:
+            for path in [job.protocol] + _imports(job.protocol):
+                self.jobs.setdefault(os.path.abspath(path), []).append(job)
+        self.compile_options = compile_options
+
+    @property
+    def paths(self):
+        return sorted(set(self.routes) | set(self.jobs))
+
+    def __call__(self, paths):
+        """
+        Handle changed files.
+
+        Failures are logged, leaving the affected routes as they were.
+
+        :param paths: the changed file paths.
+        """
+        schemas = set()
+        jobs = []
+        for path in paths:
+            for job in self.jobs.get(path, ()):
+                if job not in jobs:
+                    jobs.append(job)
+        if jobs:
+            try:
+                compiler.compile_all(jobs, **self.compile_options)
+            except compiler.CompileError:
+                logger.exception("Failed to recompile changed protocols.")
+            schemas.update(os.path.abspath(job.schema) for job in jobs)
+        schemas.update(path for path in paths if path in self.routes)
+
+        for schema in sorted(schemas):
+            for route in self.routes.get(schema, ()):
+                try:
+                    if route.reload():
+                        logger.info("Reloaded {} from {}.".format(
+                            route.path,
+                            schema
+                        ))
+                except Exception:
+                    logger.exception("Failed to reload {} from {}.".format(
+                        route.path,
+                        schema
+                    ))
+
+
+__all__ = [
+    FileWatcher.__name__,
+    Inotify.__name__,
+    SchemaReloader.__name__
+]
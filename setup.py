@@ -75,11 +75,17 @@ setup(
     author_email="alex@amilstead.com",
     url="http://github.com/packagelib/pyramid-avro",
     keywords="pyramid avro",
-    packages=find_packages(exclude=["tests"]),
+    packages=find_packages(exclude=["tests", "benchmarks"]),
     include_package_data=True,
     zip_safe=False,
     install_requires=REQUIREMENTS,
     tests_require=TEST_REQUIREMENTS,
     test_suite="tests",
-    cmdclass={"test": PyTest}
+    cmdclass={"test": PyTest},
+    entry_points={
+        "console_scripts": [
+            "pyramid-avro-compile = pyramid_avro.scripts:main",
+            "pyramid-avro-load = pyramid_avro.scripts:load"
+        ]
+    }
 )
@@ -1,4 +1,13 @@
 import os
+import sys
+import threading
+
+try:
+    from http import server as http_server
+    import socketserver
+except ImportError:  # pragma: no cover
+    import BaseHTTPServer as http_server
+    import SocketServer as socketserver
 
 import pytest
 import webtest
@@ -21,6 +30,12 @@ test_db = os.path.abspath(
 if os.path.exists(test_db):
     os.remove(test_db)
 
+# Tests using "async def" can't even be parsed before python 3.5.
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.append("test_aio.py")
+    collect_ignore.append("test_aioclient.py")
+
 
 def get_impl(request):
     return "{}".format(request.avro_data["arg1"])
@@ -49,3 +64,60 @@ def default_test_app(settings):
 @pytest.fixture(scope="class")
 def initialize_application(request, default_test_app):
     request.cls.app = default_test_app
+
+
+class AvroHandler(http_server.BaseHTTPRequestHandler):
+    """Serves POSTs with the test app, keeping connections alive."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.server.requests += 1
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        headers = dict(
+            (name, value) for name, value in self.headers.items()
+            if name.lower().startswith("avro-")
+        )
+        response = self.server.app.post(
+            self.path,
+            body,
+            headers=headers,
+            expect_errors=True
+        )
+        self.send_response(response.status_int)
+        for name, value in response.headerlist:
+            if name.lower() != "content-length":
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(response.body)))
+        self.end_headers()
+        self.wfile.write(response.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class CountingServer(socketserver.ThreadingMixIn, http_server.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, app):
+        http_server.HTTPServer.__init__(self, ("127.0.0.1", 0), AvroHandler)
+        self.app = app
+        self.requests = 0
+        self.connections = 0
+
+    def get_request(self):
+        self.connections += 1
+        return http_server.HTTPServer.get_request(self)
+
+
+@pytest.fixture
+def avro_http_server(request, default_test_app):
+    server = CountingServer(default_test_app)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    request.instance.server = server
+    yield server
+    server.shutdown()
+    server.server_close()
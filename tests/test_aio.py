@@ -0,0 +1,127 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+import unittest
+
+import mock
+
+from pyramid_avro import aio
+from pyramid_avro import routes as pa_routes
+
+here = os.path.abspath(os.path.dirname(__file__))
+dummy_protocol_file = os.path.join(here, "protocols", "test.avpr")
+with open(dummy_protocol_file) as _file:
+    dummy_protocol = _file.read()
+
+
+class EventLoopThreadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.event_loop = aio.EventLoopThread()
+        self.addCleanup(self.event_loop.stop, 5)
+
+    def test_run(self):
+        async def double(value):
+            await asyncio.sleep(0)
+            return value * 2
+
+        self.assertFalse(self.event_loop.running)
+        self.assertEqual(4, self.event_loop.run(double(2)))
+        self.assertTrue(self.event_loop.running)
+
+        # Stopped loops start again on demand.
+        self.event_loop.stop(5)
+        self.assertFalse(self.event_loop.running)
+        self.assertEqual(6, self.event_loop.run(double(3)))
+
+    def test_run_exception(self):
+        async def fail():
+            raise ValueError("Nope.")
+
+        self.assertRaises(ValueError, self.event_loop.run, fail())
+
+    def test_run_timeout(self):
+        cancelled = threading.Event()
+
+        async def hang():
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        self.assertRaises(
+            concurrent.futures.TimeoutError,
+            self.event_loop.run,
+            hang(),
+            0.01
+        )
+        self.assertTrue(cancelled.wait(5))
+
+    def test_concurrent_callers(self):
+        # Each coroutine waits on the other, so they only complete if they
+        # share the loop concurrently.
+        events = {}
+
+        async def meet(name, other):
+            events.setdefault(name, asyncio.Event()).set()
+            while other not in events:
+                await asyncio.sleep(0.001)
+            await events[other].wait()
+            return name
+
+        with concurrent.futures.ThreadPoolExecutor(2) as pool:
+            futures = [
+                pool.submit(self.event_loop.run, meet(*names), 5)
+                for names in [("a", "b"), ("b", "a")]
+            ]
+            results = [future.result() for future in futures]
+        self.assertEqual(["a", "b"], results)
+
+    def test_is_coroutine(self):
+        async def impl():
+            return None
+
+        coroutine = impl()
+        self.assertTrue(aio.is_coroutine(coroutine))
+        self.assertFalse(aio.is_coroutine(impl))
+        self.assertFalse(aio.is_coroutine(None))
+        coroutine.close()
+
+
+class AsyncMessageImplTest(unittest.TestCase):
+
+    def test_execute_async_impl(self):
+        event_loop = aio.EventLoopThread()
+        self.addCleanup(event_loop.stop, 5)
+        route = pa_routes.AvroServiceRoute(
+            "/foo",
+            dummy_protocol,
+            event_loop=event_loop
+        )
+
+        async def get(request):
+            await asyncio.sleep(0)
+            return request.avro_data["arg1"]
+
+        async def get2(request):
+            raise ValueError("Nope.")
+
+        route.register_message_impl("get", get)
+        route.register_message_impl("get2", get2)
+        request = mock.Mock()
+        with mock.patch(
+            "pyramid.threadlocal.get_current_request",
+            return_value=request
+        ):
+            self.assertEqual(
+                "arg",
+                route.execute_command("get", arg1="arg")
+            )
+            self.assertRaises(
+                pa_routes.avro_ipc.AvroRemoteException,
+                route.execute_command,
+                "get2",
+                arg1="arg"
+            )
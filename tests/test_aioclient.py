@@ -0,0 +1,292 @@
+import asyncio
+import os
+import unittest
+
+import pytest
+
+from pyramid_avro import aioclient as pa_aioclient
+from pyramid_avro import client as pa_client
+
+here = os.path.abspath(os.path.dirname(__file__))
+dummy_protocol_file = os.path.join(here, "protocols", "test.avpr")
+with open(dummy_protocol_file) as _file:
+    dummy_protocol = _file.read()
+
+
+class ReadResponseTest(unittest.TestCase):
+
+    def read(self, data):
+        loop = asyncio.new_event_loop()
+        try:
+            reader = asyncio.StreamReader(loop=loop)
+            reader.feed_data(data)
+            reader.feed_eof()
+            return loop.run_until_complete(pa_aioclient.read_response(reader))
+        finally:
+            loop.close()
+
+    def test_content_length(self):
+        response = self.read(
+            b"HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\nabcdef"
+        )
+        self.assertEqual(200, response.status)
+        self.assertEqual("OK", response.reason)
+        self.assertEqual(b"abc", response.body)
+        self.assertFalse(response.will_close)
+
+    def test_chunked(self):
+        response = self.read(
+            b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"3\r\nabc\r\n2;ext=1\r\nde\r\n0\r\nTrailer: x\r\n\r\n"
+        )
+        self.assertEqual(b"abcde", response.body)
+
+    def test_close(self):
+        response = self.read(b"HTTP/1.0 404 Not Found\r\n\r\nmissing")
+        self.assertEqual(404, response.status)
+        self.assertEqual(b"missing", response.body)
+        self.assertTrue(response.will_close)
+
+        self.assertRaises(pa_aioclient.ConnectionClosed, self.read, b"")
+
+
+class FakeWriter(object):
+
+    def __init__(self):
+        self.written = []
+        self.closed = False
+
+    def write(self, data):
+        self.written.append(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class AsyncConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_reader_failure(self):
+        def on_response():
+            raise RuntimeError("Boom.")
+
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(
+                b"HTTP/1.1 200 OK\r\nContent-Length: 1\r\n\r\na" * 2
+            )
+            connection = pa_aioclient.AsyncConnection(
+                reader,
+                FakeWriter(),
+                on_response=on_response
+            )
+            return await asyncio.gather(
+                connection.request(b"1"),
+                connection.request(b"2"),
+                return_exceptions=True
+            ), connection
+
+        (first, second), connection = self.loop.run_until_complete(run())
+        self.assertEqual(b"a", first.body)
+        # The pipelined request fails rather than waiting forever.
+        self.assertIsInstance(second, RuntimeError)
+        self.assertTrue(connection.closed)
+
+    def test_close(self):
+        async def run():
+            writer = FakeWriter()
+            connection = pa_aioclient.AsyncConnection(
+                asyncio.StreamReader(),
+                writer
+            )
+            request = asyncio.ensure_future(connection.request(b"1"))
+            await asyncio.sleep(0)
+            reader = connection._reader
+            self.assertFalse(reader.done())
+            connection.close()
+            with self.assertRaises(pa_aioclient.ConnectionClosed):
+                await request
+            await asyncio.sleep(0)
+            self.assertTrue(reader.cancelled())
+            self.assertTrue(writer.closed)
+
+        self.loop.run_until_complete(run())
+
+    def request_all(self, data, count=2):
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            connection = pa_aioclient.AsyncConnection(reader, FakeWriter())
+            return await asyncio.gather(
+                *[connection.request(b"x") for _ in range(count)],
+                return_exceptions=True
+            )
+
+        return self.loop.run_until_complete(run())
+
+    def test_stale(self):
+        # Nothing came back: neither request can have run.
+        first, second = self.request_all(b"")
+        self.assertIsInstance(first, pa_aioclient.StaleConnection)
+        self.assertIsInstance(second, pa_aioclient.StaleConnection)
+
+        # The server answered the first and closed before the second.
+        first, second = self.request_all(
+            b"HTTP/1.1 200 OK\r\nContent-Length: 1\r\n"
+            b"Connection: close\r\n\r\na"
+        )
+        self.assertEqual(b"a", first.body)
+        self.assertIsInstance(second, pa_aioclient.StaleConnection)
+
+    def test_dropped_response(self):
+        # The first response was cut off: either request may have run.
+        first, second = self.request_all(
+            b"HTTP/1.1 200 OK\r\nContent-Length: 3\r\n\r\na"
+        )
+        self.assertNotIsInstance(first, pa_aioclient.StaleConnection)
+        self.assertNotIsInstance(second, pa_aioclient.StaleConnection)
+        self.assertIsInstance(first, Exception)
+        self.assertIsInstance(second, Exception)
+
+
+@pytest.mark.usefixtures("initialize_application", "avro_http_server")
+class AsyncAvroClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.url = "http://127.0.0.1:{}/foo".format(self.server.server_port)
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_client(self, coroutine_fn, **kwargs):
+        async def run():
+            avro_client = pa_aioclient.AsyncAvroClient(
+                self.url,
+                dummy_protocol,
+                **kwargs
+            )
+            try:
+                return await coroutine_fn(avro_client)
+            finally:
+                avro_client.close()
+        return self.loop.run_until_complete(run())
+
+    def test_call(self):
+        async def calls(avro_client):
+            results = []
+            for value in ("a", "b"):
+                result = await avro_client.call("get", {"arg1": value})
+                results.append(result)
+            results.append(await avro_client.batch([
+                ("get", {"arg1": "c"}),
+                ("get", {"arg1": "d"})
+            ]))
+            return results, avro_client.pool.connections[0].handshakes
+
+        results, handshakes = self.run_client(calls)
+        self.assertEqual(["a", "b", ["c", "d"]], results)
+        self.assertEqual({"/foo"}, handshakes)
+        self.assertEqual(3, self.server.requests)
+        self.assertEqual(1, self.server.connections)
+
+    def test_fan_out(self):
+        async def fan_out(avro_client):
+            calls = [
+                (avro_client, "get", {"arg1": str(index)})
+                for index in range(20)
+            ]
+            return (
+                await pa_aioclient.gather(calls),
+                avro_client.pool.stats()
+            )
+
+        results, stats = self.run_client(fan_out, max_connections=3)
+        self.assertEqual([str(index) for index in range(20)], results)
+        self.assertEqual(3, stats["created"])
+        self.assertEqual(20, self.server.requests)
+
+    def test_pipelining(self):
+        async def fan_out(avro_client):
+            calls = [
+                (avro_client, "get", {"arg1": str(index)})
+                for index in range(10)
+            ]
+            completed = []
+            for next_result in pa_aioclient.as_completed(calls):
+                completed.append(await next_result)
+            return completed
+
+        completed = self.run_client(
+            fan_out,
+            max_connections=1,
+            max_pipeline=4
+        )
+        self.assertEqual(
+            [(index, str(index)) for index in range(10)],
+            sorted(completed)
+        )
+        self.assertEqual(10, self.server.requests)
+        self.assertEqual(1, self.server.connections)
+
+    def test_stale_connection(self):
+        async def calls(avro_client):
+            first = await avro_client.call("get", {"arg1": "a"})
+            # Drop the idle connection as a server would.
+            avro_client.pool.connections[0].writer.transport.abort()
+            return first, await avro_client.call("get", {"arg1": "b"})
+
+        self.assertEqual(("a", "b"), self.run_client(calls))
+        self.assertEqual(2, self.server.connections)
+
+    def test_http_error(self):
+        self.url += "/missing"
+
+        async def call(avro_client):
+            return await avro_client.call("get", {"arg1": "a"})
+
+        with pytest.raises(pa_client.HTTPError) as info:
+            self.run_client(call)
+        self.assertEqual(404, info.value.status)
+
+        async def fan_out(avro_client):
+            return await pa_aioclient.gather(
+                [(avro_client, "get", {"arg1": "a"})],
+                return_exceptions=True
+            )
+
+        result, = self.run_client(fan_out)
+        self.assertIsInstance(result, pa_client.HTTPError)
+
+
+class ClientOptionsTest(unittest.TestCase):
+
+    def test_url(self):
+        avro_client = pa_aioclient.AsyncAvroClient(
+            "http://user@example.com/avro/foo?x=1",
+            dummy_protocol
+        )
+        self.assertEqual("/avro/foo?x=1", avro_client.path)
+        self.assertEqual("example.com", avro_client.host_header)
+        self.assertEqual(80, avro_client.pool.port)
+        self.assertIn(
+            b"POST /avro/foo?x=1 HTTP/1.1\r\nHost: example.com\r\n",
+            avro_client._request_bytes(b"", {})
+        )
+        self.assertRaises(
+            ValueError,
+            pa_aioclient.AsyncAvroClient,
+            "ftp://example.com/foo",
+            dummy_protocol
+        )
@@ -0,0 +1,47 @@
+import threading
+import unittest
+
+import mock
+from pyramid import threadlocal as p_threadlocal
+
+from pyramid_avro import batch as pa_batch
+
+
+class BatchDispatcherTest(unittest.TestCase):
+
+    def _dispatch(self, workers, calls):
+        dispatcher = pa_batch.BatchDispatcher(workers)
+        self.addCleanup(dispatcher.shutdown)
+        request = mock.Mock(path="/foo")
+        barrier = threading.Barrier(len(calls)) if workers > 1 else None
+
+        def invoke(call):
+            if barrier is not None:
+                # Only passes if every call runs at once.
+                barrier.wait(5)
+            current = p_threadlocal.get_current_request()
+            current.avro_data = call
+            return current.path, current.avro_data, current
+
+        p_threadlocal.manager.push({"request": request, "registry": None})
+        try:
+            results = dispatcher.dispatch(invoke, calls)
+        finally:
+            p_threadlocal.manager.pop()
+        self.assertEqual([("/foo", call) for call in calls],
+                         [result[:2] for result in results])
+        # Each call had a request view of its own.
+        self.assertEqual(len(calls), len(set(id(r[2]) for r in results)))
+        self.assertFalse(isinstance(request.avro_data, int))
+
+    def test_sequential(self):
+        self._dispatch(1, [1, 2, 3])
+
+    def test_parallel(self):
+        self._dispatch(3, [1, 2, 3])
+
+    def test_is_batch(self):
+        self.assertTrue(pa_batch.is_batch(
+            mock.Mock(headers={"Avro-Batch": "1"})
+        ))
+        self.assertFalse(pa_batch.is_batch(mock.Mock(headers={})))
@@ -0,0 +1,82 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks import pipeline
+
+
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_run(self):
+        results = pipeline.run(iterations=2, repeat=1)
+        self.assertEqual(
+            sorted(case.name for case in pipeline.bench_cases()),
+            sorted(results["cases"])
+        )
+        for name, case in results["cases"].items():
+            for phase in pipeline.REPORTED_PHASES:
+                if phase == "handshake" and name == "scalar-stateless":
+                    self.assertNotIn(phase, case)
+                else:
+                    self.assertGreater(case[phase], 0, (name, phase))
+        self.assertRaises(ValueError, pipeline.run, ["missing"])
+
+    def test_compare(self):
+        baseline = {
+            "calibration": 1.0,
+            "cases": {
+                "scalar": {"decode": 0.001, "encode": 0.001},
+                "gone": {"decode": 0.001}
+            }
+        }
+        results = {
+            "calibration": 2.0,
+            "cases": {
+                "scalar": {"decode": 0.0024, "encode": 0.0028},
+                "new": {"decode": 0.001}
+            }
+        }
+        rows = pipeline.compare(results, baseline, tolerance=0.25)
+        self.assertEqual(
+            [
+                ("scalar", "decode", 0.001, 0.002, 0.0024, False),
+                ("scalar", "encode", 0.001, 0.002, 0.0028, True)
+            ],
+            rows
+        )
+        # Slowdowns under min_regression are noise.
+        rows = pipeline.compare(
+            results,
+            baseline,
+            tolerance=0.25,
+            min_regression=0.001
+        )
+        self.assertFalse(any(row[5] for row in rows))
+
+    def test_main(self):
+        path = os.path.join(self.dir, "baseline.json")
+        out = io.StringIO()
+        argv = ["scalar", "-n", "2", "-r", "1"]
+        code = pipeline.main(argv + ["--baseline", "", "--save", path], out)
+        self.assertEqual(0, code)
+        self.assertIn("scalar", out.getvalue())
+
+        with open(path) as _file:
+            baseline = json.load(_file)
+        for phase in baseline["cases"]["scalar"]:
+            baseline["cases"]["scalar"][phase] /= 1000.0
+        with open(path, "w") as _file:
+            json.dump(baseline, _file)
+        out = io.StringIO()
+        code = pipeline.main(argv + ["--baseline", path, "--check"], out)
+        self.assertEqual(1, code)
+        self.assertIn("regressed", out.getvalue())
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from pyramid_avro import cache as pa_cache
+from pyramid_avro import codecs as pa_codecs
+
+here = os.path.abspath(os.path.dirname(__file__))
+dummy_schema_file = os.path.join(here, "protocols", "test.avpr")
+with open(dummy_schema_file) as _file:
+    dummy_schema = _file.read()
+
+
+class ProtocolCacheTest(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        protocol_cache = pa_cache.ProtocolCache(max_size=2)
+        protocol_cache.put(b"a", 1)
+        protocol_cache.put(b"b", 2)
+        self.assertEqual(1, protocol_cache.get(b"a"))
+
+        # "b" is now the least recently used.
+        protocol_cache.put(b"c", 3)
+        self.assertNotIn(b"b", protocol_cache)
+        self.assertIsNone(protocol_cache.get(b"b"))
+        self.assertEqual(3, protocol_cache.get(b"c"))
+        self.assertEqual(2, len(protocol_cache))
+
+        # Replacing an entry doesn't evict anything.
+        protocol_cache.put(b"a", 4)
+        self.assertEqual(4, protocol_cache.get(b"a"))
+        self.assertEqual(
+            {
+                "size": 2,
+                "max_size": 2,
+                "hits": 3,
+                "misses": 1,
+                "evictions": 1
+            },
+            protocol_cache.stats()
+        )
+
+        protocol_cache.clear()
+        self.assertEqual(0, len(protocol_cache))
+        self.assertEqual(3, protocol_cache.stats()["hits"])
+
+    def test_invalid_size(self):
+        self.assertRaises(ValueError, pa_cache.ProtocolCache, 0)
+
+
+class LoadProtocolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.dir, "parsed")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_uncached(self):
+        parsed = pa_cache.load_protocol(dummy_schema)
+        self.assertIsInstance(parsed, pa_cache.ParsedProtocol)
+        self.assertEqual(
+            pa_codecs.serialize_handshake_responses(parsed.protocol),
+            parsed.handshake_responses
+        )
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_cached(self):
+        parsed = pa_cache.load_protocol(dummy_schema, self.cache_dir)
+        key = pa_cache.parse_cache_key(dummy_schema)
+        self.assertEqual(["{}.pickle".format(key)], os.listdir(self.cache_dir))
+
+        with mock.patch("avro.protocol.Parse") as parse:
+            loaded = pa_cache.load_protocol(dummy_schema, self.cache_dir)
+        self.assertFalse(parse.called)
+        self.assertEqual(parsed.protocol.md5, loaded.protocol.md5)
+        self.assertEqual(str(parsed.protocol), str(loaded.protocol))
+        self.assertEqual(
+            sorted(parsed.protocol.message_map),
+            sorted(loaded.protocol.message_map)
+        )
+        self.assertEqual(parsed.handshake_responses,
+                         loaded.handshake_responses)
+        # The loaded protocol is good for compiling codecs.
+        pa_codecs.ProtocolCodec(loaded.protocol)
+
+        # A changed schema gets an entry of its own.
+        changed = dummy_schema.replace("arg1", "arg3")
+        self.assertNotEqual(key, pa_cache.parse_cache_key(changed))
+        changed_parsed = pa_cache.load_protocol(changed, self.cache_dir)
+        self.assertNotEqual(parsed.protocol.md5, changed_parsed.protocol.md5)
+        self.assertEqual(2, len(os.listdir(self.cache_dir)))
+
+    def test_bad_entry(self):
+        key = pa_cache.parse_cache_key(dummy_schema)
+        os.mkdir(self.cache_dir)
+        path = os.path.join(self.cache_dir, "{}.pickle".format(key))
+        with open(path, "wb") as _file:
+            _file.write(b"garbage")
+
+        parsed = pa_cache.load_protocol(dummy_schema, self.cache_dir)
+        self.assertIsNotNone(parsed.protocol.message_map.get("get"))
+        # The entry was replaced.
+        with mock.patch("avro.protocol.Parse") as parse:
+            pa_cache.load_protocol(dummy_schema, self.cache_dir)
+        self.assertFalse(parse.called)
+
+    def test_unwritable_cache_dir(self):
+        with open(self.cache_dir, "w") as _file:
+            _file.write("not a directory")
+        parsed = pa_cache.load_protocol(dummy_schema, self.cache_dir)
+        self.assertIsNotNone(parsed.protocol.message_map.get("get"))
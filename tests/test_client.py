@@ -0,0 +1,332 @@
+import io
+import os
+import socket
+import threading
+import unittest
+
+import pytest
+try:
+    from http import client as http_client
+except ImportError:  # pragma: no cover
+    import httplib as http_client
+
+from avro import ipc as avro_ipc
+from avro import protocol as avro_protocol
+from avro import schema as avro_schema
+
+from pyramid_avro import client as pa_client
+from pyramid_avro import framing
+from pyramid_avro import handshake
+from pyramid_avro import routes as pa_routes
+
+here = os.path.abspath(os.path.dirname(__file__))
+dummy_protocol_file = os.path.join(here, "protocols", "test.avpr")
+with open(dummy_protocol_file) as _file:
+    dummy_protocol = _file.read()
+dummy_avro_protocol = avro_protocol.Parse(dummy_protocol)
+
+
+def echo(command, **args):
+    if command == "get2":
+        raise avro_ipc.AvroRemoteException("No get2.")
+    return args["arg1"]
+
+
+def respond(responder, body, is_batch=False, client_hash=None):
+    """Play the part of the HTTP route for a requestor's body."""
+    message = framing.FrameReader(io.BytesIO(body)).read_message()
+    remote = None
+    if client_hash is not None:
+        remote = responder.known_remote(client_hash)
+    if is_batch:
+        out = responder.respond_batch(message, remote)
+    elif remote is not None:
+        out = responder.respond_stateless(message, remote)
+    else:
+        out = responder.Respond(message)
+    return b"".join(framing.FramedMessageIterator(out))
+
+
+class RequestorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.responder = pa_routes.ServiceResponder(echo, dummy_avro_protocol)
+
+    def test_call(self):
+        requestor = pa_client.Requestor(dummy_protocol)
+        body = requestor.call_body("get", {"arg1": "arg"})
+        response = respond(self.responder, body)
+        self.assertEqual("arg", requestor.read_call_body("get", response))
+
+        body = requestor.call_body("get2", {"arg1": "arg"})
+        response = respond(self.responder, body)
+        self.assertRaises(
+            avro_ipc.AvroRemoteException,
+            requestor.read_call_body,
+            "get2",
+            response
+        )
+
+        self.assertRaises(
+            avro_schema.AvroException,
+            requestor.call_body,
+            "missing",
+            {}
+        )
+
+    def test_handshake_required(self):
+        client_protocol = avro_protocol.Parse(
+            dummy_protocol.replace('"get2"', '"get3"')
+        )
+        requestor = pa_client.Requestor(client_protocol)
+        body = requestor.call_body("get", {"arg1": "arg"})
+        response = respond(self.responder, body)
+        self.assertRaises(
+            pa_client.HandshakeRequired,
+            requestor.read_call_body,
+            "get",
+            response
+        )
+        # The server protocol was learned, and the client's will be sent.
+        self.assertEqual(
+            dummy_avro_protocol.md5,
+            requestor.server_protocol.md5
+        )
+        self.assertTrue(requestor.send_protocol)
+
+        body = requestor.call_body("get", {"arg1": "arg"})
+        response = respond(self.responder, body)
+        self.assertEqual("arg", requestor.read_call_body("get", response))
+        self.assertFalse(requestor.send_protocol)
+
+        # Now known to the server, calls can skip the handshake.
+        headers = requestor.headers(stateless=True)
+        self.assertEqual(
+            handshake.encode_hash(client_protocol.md5),
+            headers["Avro-Client-Hash"]
+        )
+        body = requestor.call_body("get", {"arg1": "arg"}, stateless=True)
+        response = respond(
+            self.responder,
+            body,
+            client_hash=client_protocol.md5
+        )
+        self.assertEqual(
+            "arg",
+            requestor.read_call_body("get", response, stateless=True)
+        )
+
+    def test_batch(self):
+        requestor = pa_client.Requestor(dummy_protocol)
+        calls = [
+            ("get", {"arg1": "a"}),
+            ("get2", {"arg1": "b"}),
+            ("get", {"arg1": "c"})
+        ]
+        names = [name for name, _ in calls]
+        self.assertEqual("1", requestor.headers(is_batch=True)["Avro-Batch"])
+
+        for client_hash in (None, dummy_avro_protocol.md5):
+            stateless = client_hash is not None
+            body = requestor.batch_body(calls, stateless=stateless)
+            response = respond(
+                self.responder,
+                body,
+                is_batch=True,
+                client_hash=client_hash
+            )
+            results = requestor.read_batch_body(
+                names,
+                response,
+                stateless=stateless
+            )
+            self.assertEqual("a", results[0])
+            self.assertIsInstance(results[1], avro_ipc.AvroRemoteException)
+            self.assertEqual("c", results[2])
+
+        self.assertRaises(
+            avro_schema.AvroException,
+            requestor.read_batch_body,
+            names[:2],
+            response,
+            stateless=True
+        )
+        self.assertRaises(ValueError, requestor.batch_body, [])
+
+
+@pytest.mark.usefixtures("initialize_application", "avro_http_server")
+class AvroClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.url = "http://127.0.0.1:{}/foo".format(self.server.server_port)
+        self.pools = pa_client.PoolManager()
+
+    def tearDown(self):
+        self.pools.close()
+
+    def test_keep_alive(self):
+        avro_client = pa_client.AvroClient(
+            self.url,
+            dummy_protocol,
+            pools=self.pools
+        )
+        for value in ("a", "b", "c"):
+            self.assertEqual(value, avro_client.call("get", {"arg1": value}))
+        self.assertEqual(
+            ["a", "b"],
+            avro_client.batch([("get", {"arg1": "a"}), ("get", {"arg1": "b"})])
+        )
+        self.assertEqual(4, self.server.requests)
+        self.assertEqual(1, self.server.connections)
+        self.assertEqual(
+            {"idle": 1, "created": 1, "reused": 3},
+            avro_client.pool.stats()
+        )
+        # Only the first call on the connection sent a handshake.
+        conn, _ = avro_client.pool.acquire()
+        self.assertEqual({"/foo"}, conn.avro_handshakes)
+        avro_client.pool.release(conn)
+
+    def test_stale_connection(self):
+        avro_client = pa_client.AvroClient(
+            self.url,
+            dummy_protocol,
+            pools=self.pools
+        )
+        self.assertEqual("a", avro_client.call("get", {"arg1": "a"}))
+        # The server dropping an idle connection costs a retry.
+        conn, _ = avro_client.pool.acquire()
+        conn.sock.shutdown(socket.SHUT_RDWR)
+        avro_client.pool.release(conn)
+        self.assertEqual("b", avro_client.call("get", {"arg1": "b"}))
+        self.assertEqual(2, self.server.connections)
+
+    def test_forgotten_handshake(self):
+        avro_client = pa_client.AvroClient(
+            self.url,
+            dummy_protocol.replace('"get2"', '"get3"'),
+            pools=self.pools
+        )
+        # The server learns the client's protocol on a second attempt.
+        self.assertEqual("a", avro_client.call("get", {"arg1": "a"}))
+        self.assertEqual(2, self.server.requests)
+        route = self.app.app.registry.getUtility(
+            pa_routes.IAvroServiceRoute,
+            name="avro.foo"
+        )
+        route.responder.protocol_cache.clear()
+        # A 412 from the server re-sends the handshake on the same connection.
+        self.assertEqual("b", avro_client.call("get", {"arg1": "b"}))
+        self.assertEqual(4, self.server.requests)
+        self.assertEqual(1, self.server.connections)
+
+    def test_for_service(self):
+        avro_client = pa_client.AvroClient.for_service(
+            self.app.app.registry,
+            "foo",
+            self.url,
+            pools=self.pools
+        )
+        self.assertEqual("a", avro_client.call("get", {"arg1": "a"}))
+        self.assertRaises(
+            ValueError,
+            pa_client.AvroClient.for_service,
+            self.app.app.registry,
+            "bar",
+            self.url
+        )
+
+    def test_http_error(self):
+        avro_client = pa_client.AvroClient(
+            self.url + "/missing",
+            dummy_protocol,
+            pools=self.pools
+        )
+        with pytest.raises(pa_client.HTTPError) as info:
+            avro_client.call("get", {"arg1": "a"})
+        self.assertEqual(404, info.value.status)
+
+    def test_read_timeout(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        try:
+            avro_client = pa_client.AvroClient(
+                "http://127.0.0.1:{}/foo".format(listener.getsockname()[1]),
+                dummy_protocol,
+                read_timeout=0.1,
+                pools=self.pools
+            )
+            self.assertRaises(
+                socket.timeout,
+                avro_client.call,
+                "get",
+                {"arg1": "a"}
+            )
+            self.assertEqual(0, avro_client.pool.stats()["idle"])
+        finally:
+            listener.close()
+
+    def test_dropped_response(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(2)
+        handled = []
+
+        def serve():
+            conn, _ = listener.accept()
+            rfile = conn.makefile("rb")
+            try:
+                while rfile.readline():
+                    headers = {}
+                    line = rfile.readline()
+                    while line not in (b"\r\n", b""):
+                        name, _, value = line.decode("latin-1").partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                        line = rfile.readline()
+                    body = rfile.read(int(headers["content-length"]))
+                    response = self.app.post("/foo", body, headers=dict(
+                        (name, value) for name, value in headers.items()
+                        if name.startswith("avro-")
+                    ))
+                    handled.append(body)
+                    head = (
+                        "HTTP/1.1 200 OK\r\nContent-Type: avro/binary\r\n"
+                        "Content-Length: {}\r\n\r\n".format(
+                            len(response.body)
+                        )
+                    ).encode("latin-1")
+                    if len(handled) == 1:
+                        conn.sendall(head + response.body)
+                    else:
+                        # The call ran, but its response is cut short.
+                        conn.sendall(head + response.body[:1])
+                        return
+            finally:
+                rfile.close()
+                conn.close()
+
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+        try:
+            avro_client = pa_client.AvroClient(
+                "http://127.0.0.1:{}/foo".format(listener.getsockname()[1]),
+                dummy_protocol,
+                read_timeout=1,
+                pools=self.pools
+            )
+            self.assertEqual("a", avro_client.call("get", {"arg1": "a"}))
+            # A reused connection failing once the server ran the call isn't
+            # retried: the call would run twice.
+            self.assertRaises(
+                http_client.HTTPException,
+                avro_client.call,
+                "get",
+                {"arg1": "b"}
+            )
+            thread.join(5)
+            self.assertEqual(2, len(handled))
+            self.assertEqual(0, avro_client.pool.stats()["idle"])
+        finally:
+            listener.close()
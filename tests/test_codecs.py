@@ -0,0 +1,209 @@
+import io
+import json
+import unittest
+
+from avro import io as avro_io
+from avro import schema as avro_schema
+
+from pyramid_avro import codecs as pa_codecs
+
+
+def parse_schema(definition):
+    parse = getattr(avro_schema, "Parse", getattr(avro_schema, "parse", None))
+    return parse(json.dumps(definition))
+
+
+nested_record = {
+    "type": "record",
+    "name": "Outer",
+    "fields": [
+        {"name": "null_field", "type": "null"},
+        {"name": "bool_field", "type": "boolean"},
+        {"name": "int_field", "type": "int"},
+        {"name": "long_field", "type": "long"},
+        {"name": "float_field", "type": "float"},
+        {"name": "double_field", "type": "double"},
+        {"name": "bytes_field", "type": "bytes"},
+        {"name": "string_field", "type": "string"},
+        {"name": "fixed_field",
+         "type": {"type": "fixed", "name": "Four", "size": 4}},
+        {"name": "enum_field",
+         "type": {"type": "enum", "name": "Color",
+                  "symbols": ["RED", "GREEN"]}},
+        {"name": "array_field", "type": {"type": "array", "items": "long"}},
+        {"name": "map_field", "type": {"type": "map", "values": "string"}},
+        {"name": "union_field", "type": ["null", "string", "long"]},
+        {"name": "inner", "type": {
+            "type": "record",
+            "name": "Inner",
+            "fields": [
+                {"name": "values",
+                 "type": {"type": "array", "items": {
+                     "type": "map", "values": ["null", "double"]}}}
+            ]
+        }}
+    ]
+}
+
+nested_datum = {
+    "null_field": None,
+    "bool_field": True,
+    "int_field": -12345,
+    "long_field": 1 << 40,
+    "float_field": 1.5,
+    "double_field": -2.25,
+    "bytes_field": b"\x00\x01\x02",
+    "string_field": u"héllo",
+    "fixed_field": b"abcd",
+    "enum_field": "GREEN",
+    "array_field": [0, -1, 1, 63, -64, 64, 1 << 62],
+    "map_field": {"a": "b", "c": ""},
+    "union_field": 42,
+    "inner": {"values": [{"x": 1.0, "y": None}, {}]}
+}
+
+linked_list = {
+    "type": "record",
+    "name": "Node",
+    "fields": [
+        {"name": "value", "type": "int"},
+        {"name": "next", "type": ["null", "Node"]}
+    ]
+}
+
+
+def avro_encode(schema, datum):
+    with io.BytesIO() as _buffer:
+        encoder = avro_io.BinaryEncoder(_buffer)
+        avro_io.DatumWriter(schema).write(datum, encoder)
+        return _buffer.getvalue()
+
+
+def avro_decode(schema, data):
+    with io.BytesIO(data) as _buffer:
+        reader = avro_io.DatumReader(schema)
+        return reader.read(avro_io.BinaryDecoder(_buffer))
+
+
+def compiled_encode(schema, datum):
+    out = bytearray()
+    pa_codecs.SchemaCompiler().writer(schema)(datum, out)
+    return bytes(out)
+
+
+class SchemaCompilerTest(unittest.TestCase):
+
+    def test_round_trip_matches_generic_walk(self):
+        schema = parse_schema(nested_record)
+        encoded = compiled_encode(schema, nested_datum)
+        self.assertEqual(avro_encode(schema, nested_datum), encoded)
+
+        read = pa_codecs.SchemaCompiler().reader(schema)
+        datum, pos = pa_codecs.decode(read, encoded)
+        self.assertEqual(len(encoded), pos)
+        self.assertEqual(avro_decode(schema, encoded), datum)
+
+    def test_recursive_schema(self):
+        schema = parse_schema(linked_list)
+        datum = {"value": 1, "next": {"value": 2, "next": None}}
+        encoded = compiled_encode(schema, datum)
+        self.assertEqual(avro_encode(schema, datum), encoded)
+
+        read = pa_codecs.SchemaCompiler().reader(schema)
+        self.assertEqual(datum, pa_codecs.decode(read, encoded)[0])
+
+    def test_validator(self):
+        schema = parse_schema(nested_record)
+        validate = pa_codecs.SchemaCompiler().validator(schema)
+        self.assertTrue(validate(nested_datum))
+
+        bad_datum = dict(nested_datum, enum_field="BLUE")
+        self.assertFalse(validate(bad_datum))
+        self.assertFalse(avro_io.Validate(schema, bad_datum))
+
+        bad_datum = dict(nested_datum, int_field=1 << 40)
+        self.assertFalse(validate(bad_datum))
+        self.assertFalse(validate([]))
+
+    def test_writer_type_mismatch(self):
+        schema = parse_schema(nested_record)
+        write = pa_codecs.SchemaCompiler().writer(schema)
+        for key, value in [
+            ("string_field", 1),
+            ("union_field", 1.5),
+            ("fixed_field", b"abc"),
+            ("array_field", ["a"]),
+            ("inner", None)
+        ]:
+            self.assertRaises(
+                avro_io.AvroTypeException,
+                write,
+                dict(nested_datum, **{key: value}),
+                bytearray()
+            )
+
+    def test_schema_resolution(self):
+        writer_schema = parse_schema({
+            "type": "record",
+            "name": "Thing",
+            "fields": [
+                {"name": "dropped", "type": {"type": "array",
+                                             "items": "string"}},
+                {"name": "promoted", "type": "int"},
+                {"name": "kept", "type": "string"}
+            ]
+        })
+        reader_schema = parse_schema({
+            "type": "record",
+            "name": "Thing",
+            "fields": [
+                {"name": "kept", "type": "string"},
+                {"name": "promoted", "type": "double"},
+                {"name": "added", "type": {"type": "array", "items": "int"},
+                 "default": [1, 2]}
+            ]
+        })
+        datum = {"dropped": ["a", "b"], "promoted": 3, "kept": "yes"}
+        encoded = avro_encode(writer_schema, datum)
+        read = pa_codecs.SchemaCompiler().reader(writer_schema, reader_schema)
+        first, pos = pa_codecs.decode(read, encoded)
+        self.assertEqual(len(encoded), pos)
+        self.assertEqual(
+            {"kept": "yes", "promoted": 3.0, "added": [1, 2]},
+            first
+        )
+        self.assertIsInstance(first["promoted"], float)
+
+        # Defaults must not be shared between decoded records.
+        first["added"].append(3)
+        second, _ = pa_codecs.decode(read, encoded)
+        self.assertEqual([1, 2], second["added"])
+
+    def test_resolution_failure(self):
+        writer_schema = parse_schema({
+            "type": "record", "name": "Thing", "fields": []
+        })
+        reader_schema = parse_schema({
+            "type": "record",
+            "name": "Thing",
+            "fields": [{"name": "required", "type": "string"}]
+        })
+        read = pa_codecs.SchemaCompiler().reader(writer_schema, reader_schema)
+        self.assertRaises(
+            avro_io.SchemaResolutionException,
+            pa_codecs.decode,
+            read,
+            b""
+        )
+
+    def test_truncated_input(self):
+        schema = parse_schema(nested_record)
+        encoded = compiled_encode(schema, nested_datum)
+        read = pa_codecs.SchemaCompiler().reader(schema)
+        for end in (0, 5, len(encoded) - 1):
+            self.assertRaises(
+                avro_schema.AvroException,
+                pa_codecs.decode,
+                read,
+                encoded[:end]
+            )
@@ -0,0 +1,213 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from pyramid_avro import compiler as pa_compiler
+
+compile_fn = "pyramid_avro.compiler.run_compile"
+
+idl = """
+@namespace("test")
+protocol Test {
+    import idl "common.avdl";
+    import schema "types/thing.avsc";
+    import protocol "missing.avpr";
+}
+"""
+
+
+class CompilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, "types"))
+        self.protocol = self.write("test.avdl", idl)
+        self.write(
+            "common.avdl",
+            'protocol Common { import idl "test.avdl"; }'
+        )
+        self.write("types/thing.avsc", '"string"')
+        self.jar = self.write("tools.jar", "jar")
+        self.schema = os.path.join(self.dir, "test.avpr")
+        self.compiles = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, contents):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as _file:
+            _file.write(contents)
+        return path
+
+    def compile(self):
+        return pa_compiler.cached_compile(self.protocol, self.schema, self.jar)
+
+    def fake_compile(self, protocol, schema, jar_file):
+        self.compiles += 1
+        self.assertEqual(self.dir, os.path.dirname(schema))
+        self.assertNotEqual(self.schema, schema)
+        with open(schema, "w") as _file:
+            _file.write('{{"n": {}}}'.format(self.compiles))
+
+    def test_imports(self):
+        self.assertEqual(
+            [
+                os.path.join(self.dir, "common.avdl"),
+                os.path.join(self.dir, "types", "thing.avsc")
+            ],
+            pa_compiler.protocol_imports(self.protocol)
+        )
+
+    def test_key(self):
+        key = pa_compiler.compile_key(self.protocol, self.jar)
+        same_key = pa_compiler.compile_key(self.protocol, self.jar)
+        self.assertEqual(key, same_key)
+        for name in ("common.avdl", "types/thing.avsc", "test.avdl"):
+            path = os.path.join(self.dir, name)
+            with open(path, "a") as _file:
+                _file.write("\n")
+            new_key = pa_compiler.compile_key(self.protocol, self.jar)
+            self.assertNotEqual(key, new_key)
+            key = new_key
+
+        # A rebuilt jar (new size or mtime) is hashed again.
+        with open(self.jar, "a") as _file:
+            _file.write("2")
+        new_key = pa_compiler.compile_key(self.protocol, self.jar)
+        self.assertNotEqual(key, new_key)
+
+    def test_cached_compile(self):
+        with mock.patch(compile_fn, side_effect=self.fake_compile):
+            self.assertTrue(self.compile())
+            self.assertFalse(self.compile())
+            self.assertEqual(1, self.compiles)
+            self.assertTrue(
+                os.path.exists(pa_compiler.manifest_path(self.schema))
+            )
+            self.assertEqual(0o644, os.stat(self.schema).st_mode & 0o777)
+
+            # Changed imports recompile.
+            self.write("types/thing.avsc", '"int"')
+            self.assertTrue(self.compile())
+            # So does an edited or deleted output.
+            self.write("test.avpr", "{}")
+            self.assertTrue(self.compile())
+            os.remove(self.schema)
+            self.assertTrue(self.compile())
+            self.assertEqual(4, self.compiles)
+            with open(self.schema) as _file:
+                self.assertIn('"n": 4', _file.read())
+
+        self.assertRaises(
+            ValueError,
+            pa_compiler.cached_compile,
+            None,
+            self.schema,
+            self.jar
+        )
+
+    def test_failed_compile(self):
+        self.write("test.avpr", "old")
+        failure = pa_compiler.CompileError([(self.protocol, "Nope.")])
+        with mock.patch(compile_fn, side_effect=failure):
+            self.assertRaises(
+                pa_compiler.CompileError,
+                pa_compiler.cached_compile,
+                self.protocol,
+                self.schema,
+                self.jar
+            )
+        # The old output is untouched and no temporary files are left.
+        with open(self.schema) as _file:
+            self.assertEqual("old", _file.read())
+        self.assertEqual(
+            ["common.avdl", "test.avdl", "test.avpr", "tools.jar", "types"],
+            sorted(os.listdir(self.dir))
+        )
+
+    def test_compile_all(self):
+        other = self.write("other.avdl", "protocol Other {}")
+        bad = self.write("bad.avdl", "protocol Bad {")
+
+        def fake_run_compile(protocol, schema, jar_file):
+            if protocol == bad:
+                raise pa_compiler.CompileError([(protocol, "Syntax error.")])
+            self.fake_compile(protocol, schema, jar_file)
+            return ""
+
+        jobs = [
+            pa_compiler.CompileJob(self.protocol, self.schema, self.jar),
+            pa_compiler.CompileJob(
+                other,
+                os.path.join(self.dir, "other.avpr"),
+                self.jar
+            ),
+            # The same output twice is compiled once.
+            pa_compiler.CompileJob(self.protocol, self.schema, self.jar)
+        ]
+        run_fn = "pyramid_avro.compiler.run_compile"
+        with mock.patch(run_fn, side_effect=fake_run_compile):
+            results = pa_compiler.compile_all(jobs, workers=2)
+            self.assertEqual(
+                {self.schema: True, jobs[1].schema: True},
+                results
+            )
+            self.assertEqual(2, self.compiles)
+
+            # Every job runs before the failures are reported together.
+            jobs.append(pa_compiler.CompileJob(
+                bad,
+                os.path.join(self.dir, "bad.avpr"),
+                self.jar
+            ))
+            jobs.append(pa_compiler.CompileJob(
+                os.path.join(self.dir, "missing.avdl"),
+                os.path.join(self.dir, "missing.avpr"),
+                self.jar
+            ))
+            with self.assertRaises(pa_compiler.CompileError) as info:
+                pa_compiler.compile_all(jobs, workers=1)
+            self.assertEqual(
+                [bad, jobs[-1].protocol],
+                [protocol for protocol, _ in info.exception.failures]
+            )
+            self.assertIn("Syntax error.", str(info.exception))
+            # Fresh schemas were skipped; uncached compiles always run.
+            self.assertEqual(2, self.compiles)
+            pa_compiler.compile_all(jobs[:2], cache=False)
+            self.assertEqual(4, self.compiles)
+
+    def test_run_compile(self):
+        with mock.patch("pyramid_avro.compiler.subprocess") as subprocess:
+            proc = subprocess.Popen.return_value
+            proc.communicate.return_value = (b"Compiled.\n", None)
+            proc.returncode = 0
+            self.assertEqual(
+                "Compiled.\n",
+                pa_compiler.run_compile(self.protocol, self.schema, self.jar)
+            )
+            self.assertEqual(
+                ["java", "-jar", self.jar, "idl", self.protocol, self.schema],
+                subprocess.Popen.call_args[0][0]
+            )
+
+            proc.returncode = 1
+            with self.assertRaises(pa_compiler.CompileError) as info:
+                pa_compiler.run_compile(self.protocol, self.schema, self.jar)
+            self.assertEqual(
+                [(self.protocol, "Compiled.\n")],
+                info.exception.failures
+            )
+
+            subprocess.Popen.side_effect = OSError("No java.")
+            self.assertRaises(
+                pa_compiler.CompileError,
+                pa_compiler.run_compile,
+                self.protocol,
+                self.schema,
+                self.jar
+            )
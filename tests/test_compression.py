@@ -0,0 +1,396 @@
+import io
+import os
+import unittest
+import zlib
+
+import mock
+from avro import ipc as avro_ipc
+from pyramid import config as p_config
+from webob import request as webob_request
+from zope import interface as zi
+
+from pyramid_avro import client
+from pyramid_avro import compression
+from pyramid_avro import metrics
+
+here = os.path.abspath(os.path.dirname(__file__))
+dummy_schema_file = os.path.join(here, "protocols", "test.avpr")
+with open(dummy_schema_file) as _file:
+    dummy_protocol = _file.read()
+
+
+def get_impl(request):
+    return request.avro_data["arg1"]
+
+
+@zi.implementer(compression.ICompressionCodec)
+class AliasCodec(object):
+    # Stands in for a faster codec: gzip, under another name.
+
+    name = "x-alias"
+
+    def compressor(self):
+        return compression.ZlibCodec(compression.GZIP).compressor()
+
+
+def make_codec(options):
+    return AliasCodec()
+
+
+class NegotiateTest(unittest.TestCase):
+
+    def negotiate(self, header, size=2048, codecs=None):
+        response_compression = compression.ResponseCompression(
+            codecs or [
+                compression.ZlibCodec(compression.GZIP),
+                compression.ZlibCodec(compression.DEFLATE)
+            ]
+        )
+        request = mock.Mock(headers={})
+        if header is not None:
+            request.headers[compression.ACCEPT_ENCODING] = header
+        codec = response_compression.negotiate(request, size)
+        return None if codec is None else codec.name
+
+    def test_parse(self):
+        self.assertEqual(
+            {"gzip": 1.0, "deflate": 0.5, "*": 0.0, "br": 0.0},
+            compression.parse_accept_encoding(
+                "GZIP, deflate;q=0.5 , *;q=0, br;q=bad,"
+            )
+        )
+        self.assertEqual({}, compression.parse_accept_encoding(None))
+
+    def test_negotiate(self):
+        self.assertEqual("gzip", self.negotiate("gzip, deflate"))
+        self.assertEqual("gzip", self.negotiate("deflate, gzip"))
+        self.assertEqual("deflate", self.negotiate("gzip;q=0.5, deflate"))
+        self.assertEqual("deflate", self.negotiate("gzip;q=0, *"))
+        self.assertEqual("gzip", self.negotiate("*"))
+        self.assertIsNone(self.negotiate("br"))
+        self.assertIsNone(self.negotiate("identity"))
+        self.assertIsNone(self.negotiate(None))
+        self.assertIsNone(self.negotiate("gzip", size=100))
+
+
+class CompressedIteratorTest(unittest.TestCase):
+
+    def test_stream(self):
+        chunks = [b"a" * 1000, b"", b"b" * 1000, b"c"]
+        done = mock.Mock()
+        for name, wbits in ((compression.GZIP, 31), (compression.DEFLATE, 15)):
+            codec = compression.ZlibCodec(name, level=9)
+            parts = list(compression.CompressedIterator(
+                chunks,
+                codec.compressor(),
+                done
+            ))
+            body = b"".join(parts)
+            self.assertTrue(all(parts))
+            self.assertEqual(b"".join(chunks), zlib.decompress(body, wbits))
+            size, compressed_size, cpu_seconds = done.call_args[0]
+            self.assertEqual(2001, size)
+            self.assertEqual(len(body), compressed_size)
+            self.assertGreaterEqual(cpu_seconds, 0)
+
+        self.assertRaises(ValueError, compression.ZlibCodec, "br")
+        self.assertRaises(
+            ValueError,
+            compression.ZlibCodec,
+            compression.GZIP,
+            10
+        )
+
+
+class DecompressingStreamTest(unittest.TestCase):
+
+    def stream(self, body, name=compression.GZIP, max_size=1024 * 1024):
+        codec = compression.ZlibCodec(name)
+        compressor = codec.compressor()
+        compressed = compressor.compress(body) + compressor.flush()
+        return compression.DecompressingStream(
+            io.BytesIO(compressed),
+            codec,
+            max_size,
+            chunk_size=100
+        )
+
+    def test_read(self):
+        body = os.urandom(3000) + b"a" * 5000
+        for name in (compression.GZIP, compression.DEFLATE):
+            stream = self.stream(body, name)
+            self.assertEqual(body[:10], stream.read(10))
+            self.assertEqual(body[10:4000], stream.read(3990))
+            self.assertEqual(body[4000:], stream.read())
+            self.assertEqual(b"", stream.read(10))
+            self.assertEqual(len(body), stream.size)
+
+        # Exactly at the limit is fine.
+        self.assertEqual(body, self.stream(body, max_size=len(body)).read())
+
+    def test_bomb(self):
+        stream = self.stream(b"\0" * (16 * 1024 * 1024), max_size=4096)
+        self.assertRaises(compression.DecompressedTooLarge, stream.read)
+        # Inflating stopped right past the limit.
+        self.assertEqual(4097, stream.size)
+
+    def test_invalid(self):
+        stream = compression.DecompressingStream(
+            io.BytesIO(b"not gzip at all"),
+            compression.ZlibCodec(compression.GZIP)
+        )
+        self.assertRaises(avro_ipc.ConnectionClosedException, stream.read, 10)
+
+    def test_request_stream(self):
+        decompression = compression.RequestDecompression(
+            [compression.ZlibCodec(compression.GZIP)]
+        )
+        body = io.BytesIO(b"body")
+        for header in (None, "identity", " "):
+            request = mock.Mock(headers={}, content_length=4)
+            if header is not None:
+                request.headers[compression.CONTENT_ENCODING] = header
+            self.assertEqual((body, 4), decompression.stream(request, body))
+
+        request = mock.Mock(
+            headers={compression.CONTENT_ENCODING: "GZIP"},
+            content_length=None
+        )
+        stream, content_length = decompression.stream(request, body)
+        self.assertIsInstance(stream, compression.DecompressingStream)
+        self.assertIsNone(content_length)
+
+        request.headers[compression.CONTENT_ENCODING] = "deflate"
+        self.assertRaises(
+            compression.UnsupportedEncoding,
+            decompression.stream,
+            request,
+            body
+        )
+
+    def test_trailing_bytes(self):
+        decompression = compression.RequestDecompression(
+            [compression.ZlibCodec(compression.GZIP)]
+        )
+        compressor = compression.ZlibCodec(compression.GZIP).compressor()
+        compressed = compressor.compress(b"body") + compressor.flush()
+        # The next request on the connection follows the body.
+        raw = io.BytesIO(compressed + b"POST /foo HTTP/1.1\r\n")
+        request = mock.Mock(
+            headers={compression.CONTENT_ENCODING: "gzip"},
+            content_length=len(compressed)
+        )
+        stream, _ = decompression.stream(request, raw)
+        self.assertEqual(b"body", stream.read())
+        self.assertEqual(len(compressed), raw.tell())
+
+    def test_no_eof(self):
+        class Decompressor(object):
+            # As Python 2's zlib decompressors, without "eof".
+            def __init__(self):
+                self._decompressor = zlib.decompressobj(31)
+
+            def __getattr__(self, name):
+                if name == "eof":
+                    raise AttributeError(name)
+                return getattr(self._decompressor, name)
+
+        codec = compression.ZlibCodec(compression.GZIP)
+        compressor = codec.compressor()
+        compressed = compressor.compress(b"body") + compressor.flush()
+        with mock.patch.object(codec, "decompressor", Decompressor):
+            stream = compression.DecompressingStream(
+                io.BytesIO(compressed + b"trailing"),
+                codec
+            )
+            self.assertEqual(b"body", stream.read())
+            self.assertEqual(b"", stream.read())
+
+            stream = compression.DecompressingStream(
+                io.BytesIO(compressed),
+                codec
+            )
+            self.assertEqual(b"body", stream.read())
+
+
+class RouteCompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.requestor = client.Requestor(dummy_protocol)
+
+    def make_app(self, **settings):
+        config = p_config.Configurator(settings=settings)
+        config.registry.registerUtility(
+            AliasCodec(),
+            compression.ICompressionCodec,
+            name="x-alias"
+        )
+        config.include("pyramid_avro")
+        config.add_avro_route("foo", schema=dummy_schema_file)
+        config.register_avro_message("foo", get_impl, "get")
+        return config, config.make_wsgi_app()
+
+    def call(self, app, value, accept=None):
+        headers = self.requestor.headers()
+        if accept is not None:
+            headers[compression.ACCEPT_ENCODING] = accept
+        response = webob_request.Request.blank(
+            "/foo",
+            method="POST",
+            headers=headers,
+            body=self.requestor.call_body("get", {"arg1": value})
+        ).get_response(app)
+        self.assertEqual(200, response.status_code)
+        return response
+
+    def test_compress(self):
+        config, app = self.make_app(**{
+            "avro.compression": "x-alias gzip deflate",
+            "avro.compression_min_size": "512",
+            "avro.compression_level": "9",
+            "avro.metrics": "true"
+        })
+        value = "abc" * 1000
+
+        response = self.call(app, value, "gzip, deflate")
+        self.assertEqual("gzip", response.headers["Content-Encoding"])
+        self.assertEqual("Accept-Encoding", response.headers["Vary"])
+        self.assertNotIn("Content-Length", response.headers)
+        body = zlib.decompress(response.body, 31)
+        self.assertLess(len(response.body), len(body) // 10)
+        self.assertEqual(value, self.requestor.read_call_body("get", body))
+
+        response = self.call(app, value, "deflate")
+        self.assertEqual("deflate", response.headers["Content-Encoding"])
+        body = zlib.decompress(response.body)
+        self.assertEqual(value, self.requestor.read_call_body("get", body))
+
+        response = self.call(app, value, "x-alias")
+        self.assertEqual("x-alias", response.headers["Content-Encoding"])
+        # Compression is recorded once the body is sent.
+        zlib.decompress(response.body, 31)
+
+        # Small responses, and requests accepting none of the codecs, are
+        # left uncompressed.
+        for response in (self.call(app, "a", "gzip"), self.call(app, value)):
+            self.assertNotIn("Content-Encoding", response.headers)
+            self.assertEqual("Accept-Encoding", response.headers["Vary"])
+            self.requestor.read_call_body("get", response.body)
+
+        route_metrics = config.registry.getUtility(
+            metrics.IAvroRouteMetrics,
+            name="avro.foo"
+        )
+        summary = route_metrics.summary()["get"]
+        self.assertEqual(3, summary[metrics.COMPRESSED_BYTES]["count"])
+        self.assertGreater(summary[metrics.COMPRESSION_RATIO]["p50"], 10)
+        self.assertEqual(3, summary[metrics.COMPRESS_CPU_SECONDS]["count"])
+        text = metrics.prometheus_text([route_metrics])
+        self.assertIn("pyramid_avro_compression_ratio_count", text)
+
+    def test_off(self):
+        _, app = self.make_app()
+        response = self.call(app, "abc" * 1000, "gzip")
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertNotIn("Vary", response.headers)
+
+    def test_config(self):
+        config = p_config.Configurator(settings={
+            "avro.compression": "tests.test_compression.make_codec"
+        })
+        config.include("pyramid_avro")
+        config.add_avro_route("foo", schema=dummy_schema_file)
+        config.register_avro_message("foo", get_impl, "get")
+        app = config.make_wsgi_app()
+        response = self.call(app, "abc" * 1000, "x-alias")
+        self.assertEqual("x-alias", response.headers["Content-Encoding"])
+
+        for settings in (
+            {"avro.compression": "br"},
+            {"avro.compression": "tests.test_compression.missing"}
+        ):
+            config = p_config.Configurator(settings=settings)
+            config.include("pyramid_avro")
+            self.assertRaises(
+                p_config.ConfigurationError,
+                config.add_avro_route,
+                "foo",
+                schema=dummy_schema_file
+            )
+        config = p_config.Configurator(settings={
+            "avro.compression_level": "11"
+        })
+        self.assertRaises(
+            p_config.ConfigurationError,
+            config.include,
+            "pyramid_avro"
+        )
+
+
+class RouteDecompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.requestor = client.Requestor(dummy_protocol)
+
+    def make_app(self, **settings):
+        config = p_config.Configurator(settings=settings)
+        config.include("pyramid_avro")
+        config.add_avro_route("foo", schema=dummy_schema_file)
+        config.register_avro_message("foo", get_impl, "get")
+        return config.make_wsgi_app()
+
+    def post(self, app, body, coding=None, wbits=None):
+        headers = self.requestor.headers()
+        if coding is not None:
+            headers[compression.CONTENT_ENCODING] = coding
+        if wbits is not None:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, wbits)
+            body = compressor.compress(body) + compressor.flush()
+        return webob_request.Request.blank(
+            "/foo",
+            method="POST",
+            headers=headers,
+            body=body
+        ).get_response(app)
+
+    def test_decompress(self):
+        app = self.make_app()
+        value = "abc" * 1000
+        body = self.requestor.call_body("get", {"arg1": value})
+        for coding, wbits in (("gzip", 31), ("deflate", 15), (None, None)):
+            response = self.post(app, body, coding, wbits)
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(
+                value,
+                self.requestor.read_call_body("get", response.body)
+            )
+
+        self.assertEqual(415, self.post(app, body, "br").status_code)
+        self.assertEqual(400, self.post(app, body, "gzip").status_code)
+
+    def test_limit(self):
+        app = self.make_app(**{"avro.max_decompressed_size": "1000"})
+        body = self.requestor.call_body("get", {"arg1": "abc" * 1000})
+        self.assertEqual(413, self.post(app, body, "gzip", 31).status_code)
+        # The limit is on decompressed bodies only.
+        self.assertEqual(200, self.post(app, body).status_code)
+
+    def test_config(self):
+        app = self.make_app(**{"avro.request_compression": ""})
+        body = self.requestor.call_body("get", {"arg1": "a"})
+        self.assertEqual(415, self.post(app, body, "gzip", 31).status_code)
+        self.assertEqual(
+            200,
+            self.post(app, body, "identity").status_code
+        )
+
+        config = p_config.Configurator(settings={
+            "avro.request_compression": "tests.test_compression.make_codec"
+        })
+        config.include("pyramid_avro")
+        self.assertRaises(
+            p_config.ConfigurationError,
+            config.add_avro_route,
+            "foo",
+            schema=dummy_schema_file
+        )
@@ -1,11 +1,16 @@
 import os
+import shutil
+import tempfile
 import unittest
 
 import mock
+import pytest
 from avro import schema as avro_schema
 from pyramid import config as p_config
 
 import pyramid_avro as pa
+from pyramid_avro import compiler as pa_compiler
+from pyramid_avro import pools as pa_pools
 from pyramid_avro import routes as pa_routes
 
 
@@ -97,12 +102,13 @@ class AddAvroRouteAutoCompileTest(unittest.TestCase):
         # Actually test compilation.
         settings = {
             "avro.auto_compile": True,
+            "avro.compile_cache": False,
             "avro.tools_jar": dummy_tools_jar
         }
         config = p_config.Configurator(settings=settings)
         pa.add_avro_route(config, "foo", protocol=dummy_protocol_file)
 
-        compile_fn = "pyramid_avro.utils.compile_protocol"
+        compile_fn = "pyramid_avro.compiler.compile_all"
 
         # The derived schema should be the same name/dir as protocol:
         directory, filename = os.path.split(dummy_protocol_file)
@@ -113,15 +119,21 @@ class AddAvroRouteAutoCompileTest(unittest.TestCase):
             config.commit()
             _mocked_compile.assert_called()
             _mocked_compile.assert_called_with(
-                dummy_protocol_file,
-                expected_schema,
-                dummy_tools_jar
+                [pa_compiler.CompileJob(
+                    dummy_protocol_file,
+                    expected_schema,
+                    dummy_tools_jar
+                )],
+                workers=4,
+                cache=False,
+                backend="java"
             )
 
     def test_explicit_schema(self):
         # Actually test compilation.
         settings = {
             "avro.auto_compile": True,
+            "avro.compile_cache": False,
             "avro.tools_jar": dummy_tools_jar
         }
         config = p_config.Configurator(settings=settings)
@@ -133,7 +145,7 @@ class AddAvroRouteAutoCompileTest(unittest.TestCase):
             schema=schema_file
         )
 
-        compile_fn = "pyramid_avro.utils.compile_protocol"
+        compile_fn = "pyramid_avro.compiler.compile_all"
         with mock.patch(compile_fn) as _mocked_compile:
             with open(dummy_schema_file) as _file:
                 with open(schema_file, "w") as _new_file:
@@ -141,11 +153,61 @@ class AddAvroRouteAutoCompileTest(unittest.TestCase):
             config.commit()
             _mocked_compile.assert_called()
             _mocked_compile.assert_called_with(
-                dummy_protocol_file,
-                schema_file,
-                dummy_tools_jar
+                [pa_compiler.CompileJob(
+                    dummy_protocol_file,
+                    schema_file,
+                    dummy_tools_jar
+                )],
+                workers=4,
+                cache=False,
+                backend="java"
             )
 
+    def test_compile_phase(self):
+        settings = {
+            "avro.auto_compile": True,
+            "avro.compile_workers": "2",
+            "avro.tools_jar": dummy_tools_jar
+        }
+        config = p_config.Configurator(settings=settings)
+        pa.add_avro_route(
+            config,
+            "foo",
+            protocol=dummy_protocol_file,
+            schema=dummy_schema_file
+        )
+        pa.add_avro_route(
+            config,
+            "bar",
+            protocol=dummy_protocol_file,
+            schema=dummy_schema_file
+        )
+
+        # Every service is compiled in one go, cached by default.
+        compile_fn = "pyramid_avro.compiler.compile_all"
+        job = pa_compiler.CompileJob(
+            dummy_protocol_file,
+            dummy_schema_file,
+            dummy_tools_jar
+        )
+        with mock.patch(compile_fn) as _mocked_compile:
+            config.commit()
+            _mocked_compile.assert_called_once_with(
+                [job, job],
+                workers=2,
+                cache=True,
+                backend="java"
+            )
+
+        # Failures are configuration errors.
+        config = p_config.Configurator(settings=settings)
+        pa.add_avro_route(config, "foo", protocol=dummy_protocol_file)
+        error = pa_compiler.CompileError([(dummy_protocol_file, "Bad idl.")])
+        with mock.patch(compile_fn, side_effect=error):
+            with pytest.raises(p_config.ConfigurationError) as info:
+                config.commit()
+        self.assertIn("Bad idl.", str(info.value))
+
 
 class AddAvroRouteTest(unittest.TestCase):
 
@@ -298,6 +360,98 @@ class AddAvroRouteTest(unittest.TestCase):
         )
         self.assertIsNotNone(utility)
 
+    def test_validation_options(self):
+        settings = {
+            "avro.validate_response": "sampled",
+            "avro.validate_sample_rate": "0.5"
+        }
+        config = p_config.Configurator(settings=settings)
+        pa.add_avro_route(config, "foo", schema=dummy_schema_file)
+        pa.add_avro_route(
+            config,
+            "bar",
+            schema=dummy_schema_file,
+            validate_response="encode",
+            validate_messages="get:off"
+        )
+        config.commit()
+
+        registry = config.registry
+        foo = registry.queryUtility(pa_routes.IAvroServiceRoute, "avro.foo")
+        self.assertEqual("sampled", foo.responder.validate_response)
+        self.assertEqual(0.5, foo.responder.validate_sample_rate)
+
+        bar = registry.queryUtility(pa_routes.IAvroServiceRoute, "avro.bar")
+        self.assertEqual("encode", bar.responder.validation_mode("get2"))
+        self.assertEqual("off", bar.responder.validation_mode("get"))
+
+        self.assertRaises(
+            p_config.ConfigurationError,
+            pa.add_avro_route,
+            p_config.Configurator(settings={}),
+            "foo",
+            schema=dummy_schema_file,
+            validate_response="bogus"
+        )
+
+    def test_protocol_cache_size(self):
+        config = p_config.Configurator(
+            settings={"avro.protocol_cache_size": "4"}
+        )
+        pa.add_avro_route(config, "foo", schema=dummy_schema_file)
+        pa.add_avro_route(
+            config,
+            "bar",
+            schema=dummy_schema_file,
+            protocol_cache_size=2
+        )
+        config.commit()
+
+        registry = config.registry
+        foo = registry.queryUtility(pa_routes.IAvroServiceRoute, "avro.foo")
+        self.assertEqual(4, foo.responder.protocol_cache.max_size)
+        bar = registry.queryUtility(pa_routes.IAvroServiceRoute, "avro.bar")
+        self.assertEqual(2, bar.responder.protocol_cache.max_size)
+
+    def test_parse_cache_dir(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        config = p_config.Configurator(
+            settings={"avro.parse_cache_dir": cache_dir}
+        )
+        pa.add_avro_route(config, "foo", schema=dummy_schema_file)
+        config.commit()
+
+        self.assertEqual(1, len(os.listdir(cache_dir)))
+        registry = config.registry
+        foo = registry.queryUtility(pa_routes.IAvroServiceRoute, "avro.foo")
+        self.assertIsNotNone(foo.protocol.message_map.get("get"))
+
+    def test_lazy_routes(self):
+        config = p_config.Configurator(settings={
+            "avro.lazy_routes": "true",
+            "avro.eager_services": "bar"
+        })
+        pa.add_avro_route(config, "foo", schema=dummy_schema_file)
+        pa.add_avro_route(config, "bar", schema=dummy_schema_file)
+        pa.add_avro_route(
+            config,
+            "baz",
+            schema=dummy_schema_file,
+            lazy=False
+        )
+        config.commit()
+
+        registry = config.registry
+        foo = registry.queryUtility(pa_routes.IAvroServiceRoute, "avro.foo")
+        self.assertIsInstance(foo, pa_routes.LazyAvroServiceRoute)
+        self.assertFalse(foo.is_materialized)
+        for name in ("avro.bar", "avro.baz"):
+            self.assertIsInstance(
+                registry.queryUtility(pa_routes.IAvroServiceRoute, name),
+                pa_routes.AvroServiceRoute
+            )
+
 
 class RegisterAvroMessageTest(unittest.TestCase):
 
@@ -365,3 +519,63 @@ class RegisterAvroMessageTest(unittest.TestCase):
             self.assertIn(expected_err, str(ex.evalue))
         else:
             self.assertTrue(False, "Configuration error not raised.")
+
+    def test_with_pool(self):
+        config = p_config.Configurator(
+            settings={"avro.pool.fast": "max_workers = 8"}
+        )
+        config.include("pyramid_avro")
+        pa.add_avro_route(config, "foo", schema=dummy_schema_file)
+        pa.register_avro_message(
+            config,
+            "foo",
+            fqdn_fn,
+            message="get",
+            pool="slow"
+        )
+        pa.register_avro_message(
+            config,
+            "foo",
+            fqdn_fn,
+            message="get2",
+            pool="fast"
+        )
+        # Pools are registered ahead of messages regardless of call order.
+        pa.add_avro_pool(config, "slow", max_workers=1, max_queue=2)
+        config.commit()
+
+        route = config.registry.queryUtility(
+            pa_routes.IAvroServiceRoute,
+            name="avro.foo",
+        )
+        self.assertEqual("slow", route.message_pools["get"].name)
+        self.assertEqual(1, route.message_pools["get"].max_workers)
+        self.assertEqual(8, route.message_pools["get2"].max_workers)
+        self.assertEqual(
+            ["fast", "slow"],
+            sorted(pa_pools.pool_stats(config.registry))
+        )
+
+        config = p_config.Configurator(settings={})
+        pa.add_avro_route(config, "foo", schema=dummy_schema_file)
+        pa.register_avro_message(
+            config,
+            "foo",
+            fqdn_fn,
+            message="get",
+            pool="missing"
+        )
+        try:
+            config.commit()
+        except p_config.ConfigurationExecutionError as ex:
+            self.assertIn("No avro pool named 'missing'.", str(ex.evalue))
+        else:
+            self.assertTrue(False, "Configuration error not raised.")
+
+        self.assertRaises(
+            p_config.ConfigurationError,
+            pa.add_avro_pool,
+            config,
+            "bad",
+            rejection="drop"
+        )
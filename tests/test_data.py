@@ -0,0 +1,50 @@
+import operator
+import unittest
+
+from pyramid_avro import data as pa_data
+
+
+class ReadOnlyViewTest(unittest.TestCase):
+
+    def setUp(self):
+        self.decoded = {
+            "name": "foo",
+            "tags": ["a", "b"],
+            "children": [{"name": "bar", "tags": []}]
+        }
+        self.view = pa_data.read_only(self.decoded)
+
+    def test_access(self):
+        self.assertEqual("foo", self.view["name"])
+        self.assertEqual(["a", "b"], self.view["tags"])
+        self.assertEqual("bar", self.view["children"][0]["name"])
+        self.assertEqual(3, len(self.view))
+        self.assertEqual(self.decoded, self.view)
+        self.assertEqual(["a"], self.view["tags"][:1])
+        self.assertEqual(1, pa_data.read_only(1))
+
+    def test_not_copied(self):
+        self.decoded["tags"].append("c")
+        self.assertEqual(["a", "b", "c"], self.view["tags"])
+
+    def test_immutable(self):
+        self.assertRaises(
+            TypeError,
+            operator.setitem,
+            self.view,
+            "name",
+            "bar"
+        )
+        self.assertRaises(AttributeError, getattr, self.view["tags"], "append")
+        child = self.view["children"][0]
+        self.assertRaises(TypeError, operator.setitem, child, "name", "baz")
+
+    def test_copy(self):
+        copied = self.view.copy()
+        self.assertIsInstance(copied, dict)
+        self.assertIsInstance(copied["children"][0], dict)
+        self.assertEqual(self.decoded, copied)
+
+        copied["children"][0]["tags"].append("x")
+        self.assertEqual([], self.decoded["children"][0]["tags"])
+        self.assertEqual(["a", "b"], self.view["tags"].copy())
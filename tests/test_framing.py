@@ -0,0 +1,113 @@
+import io
+import unittest
+
+from avro import ipc as avro_ipc
+
+from pyramid_avro import framing as pa_framing
+
+
+def frame(*chunks):
+    with io.BytesIO() as _buffer:
+        for chunk in chunks:
+            _buffer.write(pa_framing.FRAME_HEADER.pack(len(chunk)))
+            _buffer.write(chunk)
+        _buffer.write(pa_framing.FRAME_HEADER.pack(0))
+        return _buffer.getvalue()
+
+
+class TrickleStream(io.BytesIO):
+    """A stream that never returns more than a few bytes per read."""
+
+    def read(self, size=-1):
+        return super(TrickleStream, self).read(min(size, 3))
+
+
+class FrameReaderTest(unittest.TestCase):
+
+    def test_read_message(self):
+        body = frame(b"hello ", b"framed ", b"world")
+        reader = pa_framing.FrameReader(io.BytesIO(body + b"trailing"))
+        message = reader.read_message()
+        self.assertIsInstance(message, bytearray)
+        self.assertEqual(b"hello framed world", message)
+
+    def test_chunked_reads(self):
+        payload = bytes(bytearray(range(256))) * 10
+        reader = pa_framing.FrameReader(
+            TrickleStream(frame(payload)),
+            chunk_size=7
+        )
+        self.assertEqual(payload, reader.read_message())
+
+    def test_content_length(self):
+        body = frame(b"abc")
+        reader = pa_framing.FrameReader(io.BytesIO(body), len(body))
+        self.assertEqual(b"abc", reader.read_message())
+        self.assertEqual(0, reader.remaining)
+
+        # A frame bigger than the body is rejected without reading it.
+        reader = pa_framing.FrameReader(io.BytesIO(body), len(body) - 1)
+        self.assertRaises(
+            avro_ipc.ConnectionClosedException,
+            reader.read_message
+        )
+
+    def test_truncated(self):
+        body = frame(b"abcdef")
+        for end in (0, 2, 6, len(body) - 1):
+            reader = pa_framing.FrameReader(io.BytesIO(body[:end]))
+            self.assertRaises(
+                avro_ipc.ConnectionClosedException,
+                reader.read_message
+            )
+
+
+class FramedMessageIteratorTest(unittest.TestCase):
+
+    def read_back(self, frames):
+        body = b"".join(frames)
+        self.assertEqual(frames.content_length, len(body))
+        return pa_framing.FrameReader(io.BytesIO(body)).read_message()
+
+    def test_single_frame(self):
+        frames = pa_framing.FramedMessageIterator(bytearray(b"abc"))
+        chunks = list(frames)
+        self.assertEqual(1, len(chunks))
+        self.assertIsInstance(chunks[0], bytes)
+        self.assertEqual(frame(b"abc"), chunks[0])
+        self.assertEqual(b"abc", self.read_back(frames))
+
+    def test_many_frames(self):
+        message = bytearray(b"0123456789")
+        frames = pa_framing.FramedMessageIterator(message, frame_size=4)
+        self.assertEqual(3, frames.frame_count)
+        chunks = list(frames)
+        self.assertEqual(4, len(chunks))
+        self.assertTrue(all(isinstance(chunk, bytes) for chunk in chunks))
+        self.assertEqual(frame(b"0123", b"4567", b"89"), b"".join(chunks))
+        self.assertEqual(message, self.read_back(frames))
+
+    def test_empty(self):
+        frames = pa_framing.FramedMessageIterator(b"")
+        self.assertEqual([pa_framing.END_OF_MESSAGE], list(frames))
+        self.assertEqual(b"", self.read_back(frames))
+        self.assertRaises(
+            ValueError,
+            pa_framing.FramedMessageIterator,
+            b"",
+            0
+        )
+
+    def test_on_done(self):
+        sent = []
+        message = bytearray(b"0123456789")
+        frames = pa_framing.FramedMessageIterator(message, 4, sent.append)
+        self.assertEqual(frame(b"0123", b"4567", b"89"), b"".join(frames))
+        self.assertEqual(1, len(sent))
+        self.assertGreaterEqual(sent[0], 0)
+
+        # Abandoned iteration, as when a client goes away, is recorded too.
+        chunks = iter(frames)
+        next(chunks)
+        chunks.close()
+        self.assertEqual(2, len(sent))
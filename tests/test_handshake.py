@@ -0,0 +1,28 @@
+import unittest
+
+from pyramid_avro import handshake
+
+
+class HandshakeHeadersTest(unittest.TestCase):
+
+    def test_hash_round_trip(self):
+        md5 = bytes(bytearray(range(16)))
+        encoded = handshake.encode_hash(md5)
+        self.assertEqual("000102030405060708090a0b0c0d0e0f", encoded)
+        self.assertEqual(md5, handshake.decode_hash(encoded))
+        self.assertEqual(md5, handshake.decode_hash(encoded.upper() + " "))
+
+    def test_invalid_hash(self):
+        for value in ["", "abc", "zz" * 16, "00" * 15, "00" * 17, u"é"]:
+            self.assertRaises(ValueError, handshake.decode_hash, value)
+
+    def test_requested_hashes(self):
+        self.assertEqual((None, None), handshake.requested_hashes({}))
+        headers = {
+            "Avro-Client-Hash": "00" * 16,
+            "Avro-Server-Hash": "ff" * 16
+        }
+        self.assertEqual(
+            (b"\x00" * 16, b"\xff" * 16),
+            handshake.requested_hashes(headers)
+        )
@@ -0,0 +1,273 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from avro import protocol as avro_protocol
+
+from pyramid_avro import compiler as pa_compiler
+from pyramid_avro import idl as pa_idl
+
+here = os.path.abspath(os.path.dirname(__file__))
+dummy_protocol_file = os.path.join(here, "protocols", "test.avdl")
+
+sample_idl = """
+/**
+ * The sample protocol.
+ * Two lines.
+ */
+@namespace("org.example")
+protocol Sample {
+    /** A kind. */
+    enum Kind { A, B, C }
+    fixed MD5(16);
+
+    @namespace("org.other")
+    record Other {
+        org.example.Kind kind;
+        Other next;
+    }
+
+    @aliases(["OldThing"])
+    record Thing {
+        /** The id. */
+        long id = 0;
+        @java-class("java.util.ArrayList") array<string> tags;
+        union { null, org.other.Other } other = null;
+        map<Thing> children;
+        string @order("descending") a, b = "x";
+        decimal(9, 2) price;
+        date day;
+        timestamp_ms at;
+        MD5 hash;
+        string `error`;
+    }
+
+    error Oops { string message; }
+
+    /** Get one. */
+    Thing get(long id, Kind kind = "B") throws Oops;
+    void ping() oneway; // Fire and forget.
+    /* Maybe. */
+    union { null, string } maybe(MD5 hash);
+}
+"""
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_sample(self):
+        protocol = pa_idl.parse(sample_idl)
+        self.assertEqual("Sample", protocol["protocol"])
+        self.assertEqual("org.example", protocol["namespace"])
+        self.assertEqual("The sample protocol.\nTwo lines.", protocol["doc"])
+
+        types = dict((schema["name"], schema) for schema in protocol["types"])
+        self.assertEqual(
+            ["Kind", "MD5", "Other", "Thing", "Oops"],
+            [schema["name"] for schema in protocol["types"]]
+        )
+        self.assertEqual("A kind.", types["Kind"]["doc"])
+        self.assertEqual(["A", "B", "C"], types["Kind"]["symbols"])
+        self.assertEqual(16, types["MD5"]["size"])
+        self.assertEqual("org.other", types["Other"]["namespace"])
+        # References are written relative to the enclosing namespace.
+        self.assertEqual(
+            ["org.example.Kind", "Other"],
+            [field["type"] for field in types["Other"]["fields"]]
+        )
+        self.assertEqual("error", types["Oops"]["type"])
+
+        thing = types["Thing"]
+        fields = dict((field["name"], field) for field in thing["fields"])
+        self.assertEqual(["OldThing"], thing["aliases"])
+        self.assertEqual(
+            {"name": "id", "type": "long", "doc": "The id.", "default": 0},
+            fields["id"]
+        )
+        self.assertEqual(
+            {
+                "type": "array",
+                "items": "string",
+                "java-class": "java.util.ArrayList"
+            },
+            fields["tags"]["type"]
+        )
+        self.assertEqual(["null", "org.other.Other"], fields["other"]["type"])
+        self.assertIsNone(fields["other"]["default"])
+        self.assertEqual(
+            {"type": "map", "values": "Thing"},
+            fields["children"]["type"]
+        )
+        self.assertEqual("descending", fields["a"]["order"])
+        self.assertEqual("x", fields["b"]["default"])
+        self.assertEqual("string", fields["b"]["type"])
+        self.assertEqual(
+            {
+                "type": "bytes",
+                "logicalType": "decimal",
+                "precision": 9,
+                "scale": 2
+            },
+            fields["price"]["type"]
+        )
+        self.assertEqual("date", fields["day"]["type"]["logicalType"])
+        self.assertEqual(
+            "timestamp-millis",
+            fields["at"]["type"]["logicalType"]
+        )
+        self.assertIn("error", fields)
+
+        messages = protocol["messages"]
+        self.assertEqual(["get", "ping", "maybe"], list(messages))
+        self.assertEqual(
+            {
+                "doc": "Get one.",
+                "request": [
+                    {"name": "id", "type": "long"},
+                    {"name": "kind", "type": "Kind", "default": "B"}
+                ],
+                "response": "Thing",
+                "errors": ["Oops"]
+            },
+            messages["get"]
+        )
+        self.assertEqual(
+            {"request": [], "response": "null", "one-way": True},
+            messages["ping"]
+        )
+        self.assertEqual(["null", "string"], messages["maybe"]["response"])
+
+        parsed = avro_protocol.Parse(json.dumps(protocol))
+        self.assertEqual("Sample", parsed.name)
+
+    def test_test_protocol(self):
+        with open(dummy_protocol_file) as _file:
+            protocol = pa_idl.parse(_file.read(), dummy_protocol_file)
+        parsed = avro_protocol.Parse(json.dumps(protocol))
+        self.assertEqual(["get", "get2"], sorted(parsed.message_map))
+        self.assertIsNone(protocol["namespace"])
+
+    def test_errors(self):
+        cases = [
+            ("protocol P { string get(; }", ":1: Expected a name"),
+            ("protocol P {\n Missing get(); }", ":2: Undefined name"),
+            ("protocol P { string ping() oneway; }", "must return void"),
+            ("protocol P { fixed F(1); fixed F(2); }", "already defined"),
+            ("protocol P { void a(); void a(); }", "already defined"),
+            ("protocol P { record R { @p(1) union { int } x; } }", "can't"),
+            ("protocol P { import foo \"x\"; }", "Unknown import type"),
+            ("protocol P { void a(); } extra", "after the protocol"),
+            ("protocol P { void a();", "Unexpected end of file"),
+            ("protocol P { # }", "Unexpected character"),
+            ("record R {}", "Expected 'protocol'"),
+            ("protocol P { enum E { A, A } }", "Invalid protocol")
+        ]
+        for text, message in cases:
+            with self.assertRaises(pa_idl.IdlError) as info:
+                pa_idl.parse(text, "p.avdl")
+            self.assertIn(message, str(info.exception))
+            self.assertTrue(str(info.exception).startswith("p.avdl"))
+
+
+class ImportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, "shared"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, contents):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as _file:
+            _file.write(contents)
+        return path
+
+    def test_imports(self):
+        self.write("shared/common.avdl", """
+            @namespace("org.common")
+            protocol Common {
+                import schema "id.avsc";
+                record Audit { org.common.Id by; }
+                void audit(Audit audit);
+            }
+        """)
+        self.write("shared/id.avsc", json.dumps({
+            "type": "fixed",
+            "name": "Id",
+            "namespace": "org.common",
+            "size": 8
+        }))
+        self.write("legacy.avpr", json.dumps({
+            "protocol": "Legacy",
+            "namespace": "org.legacy",
+            "types": [{
+                "type": "record",
+                "name": "Old",
+                "fields": [{
+                    "name": "inner",
+                    "type": {"type": "enum", "name": "Flag", "symbols": ["X"]}
+                }]
+            }],
+            "messages": {"old": {"request": [], "response": "Old"}}
+        }))
+        path = self.write("main.avdl", """
+            @namespace("org.main")
+            protocol Main {
+                import idl "shared/common.avdl";
+                import protocol "legacy.avpr";
+                import idl "shared/common.avdl";
+                record Entry {
+                    org.common.Audit audit;
+                    org.legacy.Old old;
+                    org.legacy.Flag flag;
+                }
+                Entry get();
+            }
+        """)
+        with open(path) as _file:
+            protocol = pa_idl.parse(_file.read(), path)
+
+        self.assertEqual(
+            ["Id", "Audit", "Old", "Entry"],
+            [schema["name"] for schema in protocol["types"]]
+        )
+        self.assertEqual(
+            ["org.common", "org.common", "org.legacy"],
+            [schema["namespace"] for schema in protocol["types"][:3]]
+        )
+        self.assertEqual(["audit", "old", "get"], list(protocol["messages"]))
+        parsed = avro_protocol.Parse(json.dumps(protocol))
+        self.assertEqual("org.main", parsed.namespace)
+
+        missing = self.write("missing.avdl", """
+            protocol Missing { import idl "nowhere.avdl"; }
+        """)
+        self.assertRaises(
+            pa_idl.IdlError,
+            pa_idl.compile_protocol,
+            missing,
+            os.path.join(self.dir, "missing.avpr")
+        )
+
+    def test_compile_all(self):
+        protocol = self.write("main.avdl", "protocol Main { int get(); }")
+        bad = self.write("bad.avdl", "protocol Bad { int get(; }")
+        schema = os.path.join(self.dir, "main.avpr")
+        job = pa_compiler.CompileJob(protocol, schema, None)
+
+        results = pa_compiler.compile_all([job], backend="python")
+        self.assertEqual({schema: True}, results)
+        with open(schema) as _file:
+            parsed = avro_protocol.Parse(_file.read())
+        self.assertEqual(["get"], list(parsed.message_map))
+        results = pa_compiler.compile_all([job], backend="python")
+        self.assertEqual({schema: False}, results)
+
+        bad_job = pa_compiler.CompileJob(bad, bad + ".avpr", "ignored.jar")
+        with self.assertRaises(pa_compiler.CompileError) as info:
+            pa_compiler.compile_all([job, bad_job], backend="python")
+        self.assertIn("bad.avdl:1: Expected a name", str(info.exception))
@@ -0,0 +1,225 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import pytest
+from avro import io as avro_io
+from avro import protocol as avro_protocol
+from pyramid import config as p_config
+
+from pyramid_avro import loadgen
+
+here = os.path.abspath(os.path.dirname(__file__))
+dummy_schema_file = os.path.join(here, "protocols", "test.avpr")
+with open(dummy_schema_file) as _file:
+    dummy_protocol = avro_protocol.Parse(_file.read())
+
+shapes_protocol = avro_protocol.Parse(json.dumps({
+    "protocol": "Shapes",
+    "namespace": "shapes",
+    "types": [
+        {"type": "enum", "name": "Color", "symbols": ["RED", "BLUE"]},
+        {"type": "fixed", "name": "Id", "size": 4},
+        {
+            "type": "record",
+            "name": "Node",
+            "fields": [
+                {"name": "value", "type": "long"},
+                {"name": "child", "type": ["null", "Node"]},
+                {"name": "children", "type": {
+                    "type": "array",
+                    "items": "Node"
+                }}
+            ]
+        }
+    ],
+    "messages": {
+        "draw": {
+            "request": [
+                {"name": "id", "type": "Id"},
+                {"name": "color", "type": "Color"},
+                {"name": "scale", "type": "double"},
+                {"name": "data", "type": "bytes"},
+                {"name": "tags", "type": {"type": "map", "values": "int"}},
+                {"name": "root", "type": "Node"},
+                {"name": "label", "type": ["null", "string"],
+                 "default": None}
+            ],
+            "response": "null"
+        }
+    }
+}))
+
+
+def get_impl(request):
+    return request.avro_data["arg1"]
+
+
+def failing_impl(request):
+    raise ValueError("Nope.")
+
+
+class PayloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_fixtures(self, fixtures):
+        path = os.path.join(self.dir, "fixtures.json")
+        with open(path, "w") as _file:
+            json.dump(fixtures, _file)
+        return path
+
+    def test_random_datum(self):
+        request = shapes_protocol.message_map["draw"].request
+        rng = random.Random(7)
+        for _ in range(20):
+            datum = loadgen.random_datum(request, rng)
+            self.assertTrue(avro_io.Validate(request, datum))
+        self.assertEqual(
+            loadgen.random_datum(request, random.Random(7)),
+            loadgen.random_datum(request, random.Random(7))
+        )
+
+    def test_build_calls(self):
+        calls = loadgen.build_calls(dummy_protocol, count=3, seed=1)
+        self.assertEqual(6, len(calls))
+        self.assertEqual(
+            ["get", "get", "get", "get2", "get2", "get2"],
+            sorted(message_name for message_name, _ in calls)
+        )
+        self.assertRaises(
+            ValueError,
+            loadgen.build_calls,
+            dummy_protocol,
+            ["missing"]
+        )
+
+    def test_fixtures(self):
+        path = self.write_fixtures({
+            "draw": {
+                "id": "\u00ff\u0000ab",
+                "color": "BLUE",
+                "scale": 2,
+                "data": "",
+                "tags": {"a": 1},
+                "root": {
+                    "value": 1,
+                    "child": {"shapes.Node": {
+                        "value": 2,
+                        "child": None,
+                        "children": []
+                    }},
+                    "children": []
+                }
+            }
+        })
+        fixtures = loadgen.load_fixtures(path, shapes_protocol)
+        args = fixtures["draw"][0]
+        self.assertEqual(b"\xff\x00ab", args["id"])
+        self.assertEqual(2.0, args["scale"])
+        self.assertEqual(2, args["root"]["child"]["value"])
+        self.assertIsNone(args["label"])
+
+        # Messages with fixtures are the ones called by default.
+        calls = loadgen.build_calls(shapes_protocol, fixtures=fixtures)
+        self.assertEqual([("draw", args)], calls)
+
+        invalid = [
+            {"missing": {}},
+            {"draw": {"id": "ab"}},
+            {"draw": dict(args, color="GREEN", id="abcd", data="")},
+            {"draw": {"root": {"value": 1, "child": {"Other": {}}}}}
+        ]
+        for fixture in invalid:
+            self.assertRaises(
+                ValueError,
+                loadgen.load_fixtures,
+                self.write_fixtures(fixture),
+                shapes_protocol
+            )
+
+
+class LoadGeneratorTest(unittest.TestCase):
+
+    def make_app(self):
+        config = p_config.Configurator()
+        config.include("pyramid_avro")
+        config.add_avro_route("foo", schema=dummy_schema_file)
+        config.register_avro_message("foo", get_impl, "get")
+        config.register_avro_message("foo", failing_impl, "get2")
+        return config.make_wsgi_app()
+
+    def test_run(self):
+        transport = loadgen.WSGITransport(self.make_app(), "/foo")
+        for stateless in (True, False):
+            generator = loadgen.LoadGenerator(
+                transport,
+                dummy_protocol,
+                loadgen.build_calls(dummy_protocol, ["get"], count=4),
+                concurrency=3,
+                requests=20,
+                stateless=stateless
+            )
+            report = generator.run()
+            self.assertEqual(20, report.requests)
+            self.assertEqual({}, dict(report.errors))
+            self.assertEqual(20, len(report.latencies))
+            summary = report.summary()
+            self.assertEqual(20, summary["requests"])
+            self.assertGreater(summary["latency"]["p999"], 0)
+            self.assertIn("throughput:", report.format())
+
+    def test_rate_and_errors(self):
+        transport = loadgen.WSGITransport(self.make_app(), "/foo")
+        generator = loadgen.LoadGenerator(
+            transport,
+            dummy_protocol,
+            loadgen.build_calls(dummy_protocol, count=2),
+            concurrency=2,
+            rate=200,
+            duration=0.1
+        )
+        report = generator.run()
+        # Calls are due every 5ms, for 100ms.
+        self.assertLessEqual(report.requests, 20)
+        self.assertGreater(report.requests, 0)
+        self.assertGreater(report.errors["AvroRemoteException"], 0)
+        self.assertIn("AvroRemoteException", report.format())
+
+        transport = loadgen.WSGITransport(self.make_app(), "/missing")
+        report = loadgen.LoadGenerator(
+            transport,
+            dummy_protocol,
+            loadgen.build_calls(dummy_protocol, ["get"], count=1),
+            requests=5
+        ).run()
+        self.assertEqual({"HTTP 404": 5}, dict(report.errors))
+
+
+@pytest.mark.usefixtures("initialize_application", "avro_http_server")
+class HTTPTransportTest(unittest.TestCase):
+
+    def test_run(self):
+        transport = loadgen.HTTPTransport(
+            "http://127.0.0.1:{}/foo".format(self.server.server_port),
+            max_idle=2
+        )
+        generator = loadgen.LoadGenerator(
+            transport,
+            dummy_protocol,
+            loadgen.build_calls(dummy_protocol, ["get"], count=2),
+            concurrency=2,
+            requests=10
+        )
+        report = generator.run()
+        transport.close()
+        self.assertEqual(10, report.requests)
+        self.assertEqual({}, dict(report.errors))
+        self.assertLessEqual(self.server.connections, 2)
@@ -0,0 +1,179 @@
+import json
+import os
+import unittest
+
+import webtest
+from pyramid import config as p_config
+
+from pyramid_avro import client
+from pyramid_avro import metrics as pa_metrics
+
+here = os.path.abspath(os.path.dirname(__file__))
+dummy_schema_file = os.path.join(here, "protocols", "test.avpr")
+with open(dummy_schema_file) as _file:
+    dummy_protocol = _file.read()
+
+
+def get_impl(request):
+    return request.avro_data["arg1"]
+
+
+class WindowTest(unittest.TestCase):
+
+    def test_summary(self):
+        window = pa_metrics.Window(size=100)
+        self.assertEqual(
+            {"count": 0, "sum": 0.0, "window": 0},
+            window.summary()
+        )
+        for value in range(1, 201):
+            window.add(value)
+        summary = window.summary()
+        # Totals cover every value, the rest only the last 100.
+        self.assertEqual(200, summary["count"])
+        self.assertEqual(20100, summary["sum"])
+        self.assertEqual(100, summary["window"])
+        self.assertEqual(150.5, summary["mean"])
+        self.assertEqual(151, summary["p50"])
+        self.assertEqual(191, summary["p90"])
+        self.assertEqual(200, summary["p99"])
+        self.assertEqual(200, summary["p999"])
+        self.assertEqual(200, summary["max"])
+
+
+class RouteMetricsTest(unittest.TestCase):
+
+    def test_record(self):
+        route_metrics = pa_metrics.RouteMetrics("foo")
+        timer = pa_metrics.RequestTimer()
+        timer.stop(pa_metrics.PHASE_READ, timer.start())
+        timer.stop(pa_metrics.PHASE_DECODE, timer.start(), "get")
+        route_metrics.record(timer, 10, 20)
+
+        timer = pa_metrics.RequestTimer()
+        timer.stop(pa_metrics.PHASE_DECODE, timer.start(), "get")
+        timer.stop(pa_metrics.PHASE_DECODE, timer.start(), "get2")
+        route_metrics.record(timer, 30, 40, is_batch=True)
+
+        route_metrics.record(pa_metrics.RequestTimer(), 5, 6)
+
+        summary = route_metrics.summary()
+        self.assertEqual(
+            ["(batch)", "(none)", "get", "get2"],
+            sorted(summary)
+        )
+        self.assertEqual(
+            ["decode", "read", "request_bytes", "response_bytes"],
+            sorted(summary["get"])
+        )
+        self.assertEqual(2, summary["get"]["decode"]["count"])
+        self.assertEqual(10, summary["get"]["request_bytes"]["sum"])
+        self.assertEqual(40, summary["(batch)"]["response_bytes"]["sum"])
+        self.assertEqual(5, summary["(none)"]["request_bytes"]["sum"])
+
+    def test_prometheus_text(self):
+        route_metrics = pa_metrics.RouteMetrics('fo"o')
+        route_metrics.window("get", pa_metrics.PHASE_TOTAL).add(0.5)
+        route_metrics.window("get", pa_metrics.REQUEST_BYTES).add(12)
+        text = pa_metrics.prometheus_text([route_metrics])
+        self.assertIn("# TYPE pyramid_avro_phase_seconds summary\n", text)
+        self.assertIn(
+            'pyramid_avro_phase_seconds{service="fo\\"o",message="get",'
+            'phase="total",quantile="0.99"} 0.5\n',
+            text
+        )
+        self.assertIn(
+            'pyramid_avro_request_bytes_count{service="fo\\"o",'
+            'message="get"} 1\n',
+            text
+        )
+        self.assertIn("# TYPE pyramid_avro_response_bytes summary\n", text)
+
+
+class StatsViewTest(unittest.TestCase):
+
+    def make_app(self, **settings):
+        config = p_config.Configurator(settings=settings)
+        config.include("pyramid_avro")
+        config.add_avro_route("foo", schema=dummy_schema_file)
+        config.register_avro_message("foo", get_impl, "get")
+        return webtest.TestApp(config.make_wsgi_app())
+
+    def test_stats(self):
+        app = self.make_app(**{
+            "avro.metrics": "true",
+            "avro.stats_path": "/_stats"
+        })
+        requestor = client.Requestor(dummy_protocol)
+        for stateless in (False, True):
+            response = app.post(
+                "/foo",
+                params=requestor.call_body(
+                    "get",
+                    {"arg1": "a"},
+                    stateless=stateless
+                ),
+                headers=requestor.headers(stateless)
+            )
+            self.assertEqual(200, response.status_code)
+
+        stats = json.loads(app.get("/_stats").text)
+        get_stats = stats["foo"]["get"]
+        self.assertEqual(
+            sorted([
+                "read", "handshake", "decode", "handler", "validate",
+                "encode", "total", "write", "request_bytes",
+                "response_bytes"
+            ]),
+            sorted(get_stats)
+        )
+        self.assertEqual(2, get_stats["total"]["count"])
+        # Both responses were sent.
+        self.assertEqual(2, get_stats["write"]["count"])
+        self.assertEqual(1, get_stats["handshake"]["count"])
+        self.assertGreater(get_stats["request_bytes"]["p50"], 0)
+
+        response = app.get("/_stats", params={"format": "prometheus"})
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        self.assertIn(
+            'pyramid_avro_phase_seconds_count{service="foo",message="get",'
+            'phase="handler"} 2',
+            response.text
+        )
+
+    def test_pools(self):
+        config = p_config.Configurator(settings={
+            "avro.stats_path": "/_stats"
+        })
+        config.include("pyramid_avro")
+        config.add_avro_pool("reports", max_workers=2, max_queue=3)
+        config.add_avro_route("foo", schema=dummy_schema_file)
+        config.register_avro_message("foo", get_impl, "get", pool="reports")
+        app = webtest.TestApp(config.make_wsgi_app())
+        requestor = client.Requestor(dummy_protocol)
+        app.post(
+            "/foo",
+            params=requestor.call_body("get", {"arg1": "a"}),
+            headers=requestor.headers()
+        )
+
+        stats = json.loads(app.get("/_stats").text)
+        reports = stats[pa_metrics.POOLS]["reports"]
+        self.assertEqual(2, reports["max_workers"])
+        self.assertEqual(0, reports["active"])
+        self.assertEqual(0, reports["queued"])
+        self.assertEqual(0, reports["rejected"])
+        self.assertEqual(1, reports["completed"])
+
+        text = app.get("/_stats", params={"format": "prometheus"}).text
+        self.assertIn("# TYPE pyramid_avro_pool_queued gauge", text)
+        self.assertIn('pyramid_avro_pool_max_queue{pool="reports"} 3', text)
+        self.assertIn(
+            'pyramid_avro_pool_completed_total{pool="reports"} 1',
+            text
+        )
+
+    def test_disabled(self):
+        app = self.make_app(**{"avro.stats_path": "/_stats"})
+        self.assertEqual({}, json.loads(app.get("/_stats").text))
+        self.make_app().get("/_stats", status=404)
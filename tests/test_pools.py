@@ -0,0 +1,123 @@
+import threading
+import unittest
+
+from pyramid import config as p_config
+
+from pyramid_avro import pools as pa_pools
+
+
+def echo_impl(request):
+    return (request.message, request.avro_data["arg1"])
+
+
+class BlockingCalls(object):
+    """Holds calls on a pool until released."""
+
+    def __init__(self):
+        self.started = threading.Semaphore(0)
+        self.release = threading.Event()
+
+    def __call__(self, value):
+        self.started.release()
+        self.release.wait(5)
+        return value
+
+
+def run_in_thread(pool, fn, *args):
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(pool.run(fn, *args))
+    )
+    thread.start()
+    return thread, results
+
+
+class ExecutorPoolTest(unittest.TestCase):
+
+    def _pool(self, **kwargs):
+        pool = pa_pools.ExecutorPool("test", **kwargs)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def test_run(self):
+        pool = self._pool(max_workers=2)
+        self.assertEqual(3, pool.run(lambda a, b: a + b, 1, 2))
+        self.assertRaises(ZeroDivisionError, pool.run, lambda: 1 // 0)
+        stats = pool.stats()
+        self.assertEqual(0, stats["active"])
+        self.assertEqual(2, stats["completed"])
+
+    def test_reject(self):
+        pool = self._pool(max_workers=1, max_queue=1)
+        calls = BlockingCalls()
+        running = run_in_thread(pool, calls, 1)
+        self.assertTrue(calls.started.acquire(True, 5))
+        queued = run_in_thread(pool, calls, 2)
+        # Wait for the second call to be accounted for.
+        for _ in range(500):
+            if pool.stats()["queued"]:
+                break
+            threading.Event().wait(0.01)
+
+        self.assertRaises(pa_pools.PoolRejected, pool.run, calls, 3)
+        stats = pool.stats()
+        self.assertEqual(1, stats["active"])
+        self.assertEqual(1, stats["queued"])
+        self.assertEqual(1, stats["rejected"])
+
+        calls.release.set()
+        for thread, results in (running, queued):
+            thread.join(5)
+        self.assertEqual([1], running[1])
+        self.assertEqual([2], queued[1])
+        self.assertEqual(0, pool.stats()["queued"])
+
+    def test_caller_runs(self):
+        pool = self._pool(max_workers=1, rejection="caller_runs")
+        calls = BlockingCalls()
+        thread, results = run_in_thread(pool, calls, 1)
+        self.assertTrue(calls.started.acquire(True, 5))
+
+        caller = threading.current_thread()
+        self.assertIs(caller, pool.run(threading.current_thread))
+        self.assertEqual(1, pool.stats()["caller_runs"])
+        calls.release.set()
+        thread.join(5)
+
+    def test_block(self):
+        pool = self._pool(
+            max_workers=1,
+            rejection="block",
+            block_timeout=0.01
+        )
+        calls = BlockingCalls()
+        thread, results = run_in_thread(pool, calls, 1)
+        self.assertTrue(calls.started.acquire(True, 5))
+        self.assertRaises(pa_pools.PoolRejected, pool.run, calls, 2)
+
+        calls.release.set()
+        thread.join(5)
+        self.assertEqual(3, pool.run(calls, 3))
+
+    def test_process_pool(self):
+        pool = self._pool(kind="process", max_workers=1)
+        self.assertEqual(
+            ("get", "arg"),
+            pool.run(pa_pools.call_in_process, echo_impl, "get",
+                     {"arg1": "arg"})
+        )
+
+    def test_invalid_options(self):
+        for kwargs in [
+            {"kind": "fiber"},
+            {"max_workers": 0},
+            {"max_queue": -1},
+            {"rejection": "drop"},
+            {"block_timeout": "never"}
+        ]:
+            self.assertRaises(
+                p_config.ConfigurationError,
+                pa_pools.ExecutorPool,
+                "bad",
+                **kwargs
+            )
@@ -0,0 +1,178 @@
+import os
+import pstats
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+import webtest
+from pyramid import config as p_config
+
+from pyramid_avro import client
+from pyramid_avro import profiling
+
+here = os.path.abspath(os.path.dirname(__file__))
+dummy_schema_file = os.path.join(here, "protocols", "test.avpr")
+with open(dummy_schema_file) as _file:
+    dummy_protocol = _file.read()
+
+
+def busy_wait(seconds):
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        pass
+
+
+def slow_get(request):
+    busy_wait(0.05)
+    return request.avro_data["arg1"]
+
+
+def get2(request):
+    return request.avro_data["arg1"]
+
+
+class SamplingProfilerTest(unittest.TestCase):
+
+    def test_sample(self):
+        profile = profiling.SamplingProfiler(interval=0.001)
+        profile.start()
+        busy_wait(0.05)
+        profile.stop()
+        self.assertGreater(profile.samples, 0)
+        collapsed = profile.collapsed()
+        self.assertIn("busy_wait (", collapsed)
+        for line in collapsed.splitlines():
+            stack, count = line.rsplit(" ", 1)
+            self.assertGreater(int(count), 0)
+            # Outermost frame first.
+            if "busy_wait" in stack:
+                self.assertLess(
+                    stack.index("test_sample"),
+                    stack.index("busy_wait")
+                )
+
+    def test_shared_sampler(self):
+        first = profiling.SamplingProfiler(interval=0.002)
+        second = profiling.SamplingProfiler(interval=0.002)
+        first.start()
+        second.start()
+        sampler = profiling.stack_sampler(0.002)
+        self.assertEqual(set([first, second]), sampler.profilers)
+        busy_wait(0.02)
+        first.stop()
+        second.stop()
+        self.assertEqual(set(), sampler.profilers)
+        # Sampled together, from one thread.
+        self.assertGreater(first.samples, 0)
+        self.assertEqual(first.samples, second.samples)
+        samples = first.samples
+        busy_wait(0.01)
+        self.assertEqual(samples, first.samples)
+
+    def test_short_profiles(self):
+        # Each is shorter than the interval, but together they're sampled.
+        profiles = []
+        for _ in range(100):
+            profile = profiling.SamplingProfiler(interval=0.001)
+            profile.start()
+            busy_wait(0.0005)
+            profile.stop()
+            profiles.append(profile)
+        self.assertGreater(sum(profile.samples for profile in profiles), 0)
+
+
+class RouteProfilerTest(unittest.TestCase):
+
+    def test_should_profile(self):
+        request = mock.Mock(headers={})
+        profiler = profiling.RouteProfiler("foo", "profiles")
+        self.assertFalse(profiler.should_profile(request))
+        profiler.sample_rate = 1.0
+        self.assertTrue(profiler.should_profile(request))
+
+        profiler = profiling.RouteProfiler("foo", "profiles", secret="s3")
+        self.assertFalse(profiler.should_profile(request))
+        request.headers[profiling.PROFILE_HEADER] = "wrong"
+        self.assertFalse(profiler.should_profile(request))
+        request.headers[profiling.PROFILE_HEADER] = "s3"
+        self.assertTrue(profiler.should_profile(request))
+
+        profiler = profiling.RouteProfiler("foo", "profiles", always=True)
+        self.assertTrue(profiler.should_profile(mock.Mock(headers={})))
+
+
+class ProfiledRouteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.profile_dir = os.path.join(self.dir, "profiles")
+        self.requestor = client.Requestor(dummy_protocol)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_app(self, **settings):
+        settings["avro.profile_dir"] = self.profile_dir
+        config = p_config.Configurator(settings=settings)
+        config.include("pyramid_avro")
+        config.add_avro_route("foo", schema=dummy_schema_file)
+        config.register_avro_message("foo", slow_get, "get")
+        config.register_avro_message("foo", get2, "get2")
+        return webtest.TestApp(config.make_wsgi_app())
+
+    def call(self, app, message_name, headers=None):
+        request_headers = self.requestor.headers()
+        request_headers.update(headers or {})
+        response = app.post(
+            "/foo",
+            params=self.requestor.call_body(message_name, {"arg1": "a"}),
+            headers=request_headers
+        )
+        self.assertEqual(200, response.status_code)
+
+    def test_secret_header(self):
+        app = self.make_app(**{
+            "avro.profile_secret": "s3",
+            "avro.profile_interval": "0.001"
+        })
+        self.call(app, "get")
+        self.assertFalse(os.path.exists(self.profile_dir))
+
+        self.call(app, "get", {profiling.PROFILE_HEADER: "s3"})
+        self.call(app, "get", {profiling.PROFILE_HEADER: "s3"})
+        self.assertEqual(["foo.get.collapsed"], os.listdir(self.profile_dir))
+        path = os.path.join(self.profile_dir, "foo.get.collapsed")
+        with open(path) as _file:
+            collapsed = _file.read()
+        self.assertIn("slow_get (", collapsed)
+
+    def test_pstats(self):
+        app = self.make_app(**{
+            "avro.profile": "true",
+            "avro.profile_format": "pstats",
+            "avro.profile_messages": "get"
+        })
+        self.call(app, "get")
+        self.call(app, "get2")
+        files = os.listdir(self.profile_dir)
+        self.assertEqual(1, len(files))
+        self.assertTrue(files[0].startswith("foo.get."))
+        self.assertTrue(files[0].endswith(".pstats"))
+
+        stats = pstats.Stats(os.path.join(self.profile_dir, files[0]))
+        functions = [name for _, _, name in stats.stats]
+        self.assertIn("slow_get", functions)
+        self.assertIn("read_call", functions)
+        self.assertIn("write_call_response", functions)
+
+    def test_config(self):
+        config = p_config.Configurator(settings={"avro.profile": "true"})
+        config.include("pyramid_avro")
+        self.assertRaises(
+            p_config.ConfigurationError,
+            config.add_avro_route,
+            "foo",
+            schema=dummy_schema_file
+        )
@@ -1,15 +1,22 @@
 import io
+import operator
 import os
+import threading
 import unittest
 
 import mock
 import pytest
 import webtest
+from avro import io as avro_io
 from avro import ipc as avro_ipc
 from avro import protocol as avro_protocol
 from avro import schema as avro_schema
 from webob import exc as http_exc
 
+from pyramid_avro import client
+from pyramid_avro import framing
+from pyramid_avro import handshake
+from pyramid_avro import pools
 from pyramid_avro import routes as pa_routes
 
 here = os.path.abspath(os.path.dirname(__file__))
@@ -94,6 +101,38 @@ class RuntimeAppTransceiver(CachedBufferTransceiver):
         return self.read_message(response)
 
 
+def build_call_request(message, args, protocol=dummy_avro_protocol,
+                       send_protocol=False):
+    with io.BytesIO() as _buffer:
+        encoder = avro_io.BinaryEncoder(_buffer)
+        requestor = avro_ipc.Requestor(protocol, None)
+        requestor._send_protocol = send_protocol
+        requestor._WriteHandshakeRequest(encoder)
+        requestor._WriteCallRequest(message, args, encoder)
+        return _buffer.getvalue()
+
+
+def read_call_response(message, call_response, protocol=dummy_avro_protocol,
+                       handshake=True):
+    with io.BytesIO(call_response) as _buffer:
+        decoder = avro_io.BinaryDecoder(_buffer)
+        requestor = avro_ipc.Requestor(protocol, None)
+        # Sets up the requestor's notion of the remote protocol.
+        requestor._WriteHandshakeRequest(avro_io.BinaryEncoder(io.BytesIO()))
+        if handshake:
+            requestor._ReadHandshakeResponse(decoder)
+        return requestor._ReadCallResponse(message, decoder)
+
+
+def build_stateless_call_request(message, args,
+                                 protocol=dummy_avro_protocol):
+    with io.BytesIO() as _buffer:
+        encoder = avro_io.BinaryEncoder(_buffer)
+        requestor = avro_ipc.Requestor(protocol, None)
+        requestor._WriteCallRequest(message, args, encoder)
+        return _buffer.getvalue()
+
+
 class ServiceResponderTest(unittest.TestCase):
 
     def test_bad_executor(self):
@@ -131,6 +170,184 @@ class ServiceResponderTest(unittest.TestCase):
         response = responder.Invoke(get_msg, {"arg1": "arg1"})
         self.assertEqual("[get] - arg1: arg1", response)
 
+    def test_respond(self):
+        def good_return_type(command, **args):
+            return "[{}] - arg1: {}".format(command, args["arg1"])
+
+        responder = pa_routes.ServiceResponder(
+            good_return_type,
+            dummy_avro_protocol
+        )
+        call_response = responder.Respond(
+            build_call_request("get", {"arg1": "arg1"})
+        )
+        self.assertEqual(
+            "[get] - arg1: arg1",
+            read_call_response("get", call_response)
+        )
+
+    def test_validation_modes(self):
+
+        def bad_return_type(command, **args):
+            return {}
+
+        get_msg = dummy_avro_protocol.message_map.get("get")
+        for mode in ("off", "encode"):
+            responder = pa_routes.ServiceResponder(
+                bad_return_type,
+                dummy_avro_protocol,
+                validate_response=mode
+            )
+            # No validation pass happens at invoke time...
+            self.assertEqual({}, responder.Invoke(get_msg, {"arg1": "arg1"}))
+
+            # ...but the response still can't be encoded.
+            call_response = responder.Respond(
+                build_call_request("get", {"arg1": "arg1"})
+            )
+            try:
+                read_call_response("get", call_response)
+            except avro_ipc.AvroRemoteException as ex:
+                self.assertIn(responder.response_mismatch, str(ex))
+            else:
+                self.assertTrue(False, "Error response not returned.")
+
+        responder = pa_routes.ServiceResponder(
+            bad_return_type,
+            dummy_avro_protocol,
+            validate_response="sampled",
+            validate_sample_rate=0
+        )
+        self.assertEqual({}, responder.Invoke(get_msg, {"arg1": "arg1"}))
+        responder.validate_sample_rate = 1
+        self.assertRaises(
+            avro_ipc.AvroRemoteException,
+            responder.Invoke,
+            get_msg,
+            {"arg1": "arg1"}
+        )
+
+    def test_sampled_encoding(self):
+
+        def good_return_type(command, **args):
+            return args["arg1"]
+
+        responder = pa_routes.ServiceResponder(
+            good_return_type,
+            dummy_avro_protocol,
+            validate_response="sampled",
+            validate_sample_rate=0.5
+        )
+        codec = responder.codec.messages["get"]
+        with mock.patch.object(
+            codec,
+            "write_response",
+            wraps=codec.write_response
+        ) as checked, mock.patch.object(
+            codec,
+            "write_response_unchecked",
+            wraps=codec.write_response_unchecked
+        ) as unchecked:
+            for draw, writer in ((0.9, unchecked), (0.1, checked)):
+                checked.reset_mock()
+                unchecked.reset_mock()
+                with mock.patch.object(
+                    pa_routes.random,
+                    "random",
+                    return_value=draw
+                ):
+                    call_response = responder.Respond(
+                        build_call_request("get", {"arg1": "a"})
+                    )
+                self.assertEqual(
+                    "a",
+                    read_call_response("get", call_response)
+                )
+                # Only responses drawn for validation are encoded with
+                # type checks.
+                self.assertEqual(1, writer.call_count)
+                self.assertEqual(
+                    1,
+                    checked.call_count + unchecked.call_count
+                )
+
+    def test_message_validation_modes(self):
+
+        def bad_return_type(command, **args):
+            return {}
+
+        responder = pa_routes.ServiceResponder(
+            bad_return_type,
+            dummy_avro_protocol,
+            validate_response="off",
+            validate_messages="get:full"
+        )
+        self.assertEqual("full", responder.validation_mode("get"))
+        self.assertEqual("off", responder.validation_mode("get2"))
+        get_msg = dummy_avro_protocol.message_map.get("get")
+        self.assertRaises(
+            avro_ipc.AvroRemoteException,
+            responder.Invoke,
+            get_msg,
+            {"arg1": "arg1"}
+        )
+
+        self.assertRaises(
+            avro_schema.AvroException,
+            pa_routes.ServiceResponder,
+            bad_return_type,
+            dummy_avro_protocol,
+            validate_messages={"not-defined": "off"}
+        )
+
+    def test_protocol_cache(self):
+        def good_return_type(command, **args):
+            return args["arg1"]
+
+        responder = pa_routes.ServiceResponder(
+            good_return_type,
+            dummy_avro_protocol,
+            protocol_cache_size=2
+        )
+        client_protocols = [
+            avro_protocol.Parse(
+                dummy_protocol.replace('"get2"', '"get{}"'.format(index))
+            )
+            for index in range(3, 6)
+        ]
+        for client_protocol in client_protocols:
+            for send_protocol in (False, True, False):
+                call_request = build_call_request(
+                    "get",
+                    {"arg1": "arg"},
+                    client_protocol,
+                    send_protocol=send_protocol
+                )
+                call_response = responder.Respond(call_request)
+                if send_protocol:
+                    self.assertEqual(
+                        "arg",
+                        read_call_response("get", call_response)
+                    )
+
+        # The first client protocol was evicted; the local one never is.
+        self.assertIsNone(
+            responder.get_protocol_cache(client_protocols[0].md5)
+        )
+        self.assertEqual(
+            client_protocols[2].md5,
+            responder.get_protocol_cache(client_protocols[2].md5).md5
+        )
+        self.assertIs(
+            dummy_avro_protocol,
+            responder.get_protocol_cache(dummy_avro_protocol.md5)
+        )
+        stats = responder.protocol_cache.stats()
+        self.assertEqual(2, stats["size"])
+        self.assertEqual(1, stats["evictions"])
+        self.assertEqual(4, stats["hits"])
+        self.assertEqual(7, stats["misses"])
+
 
 @pytest.mark.usefixtures("initialize_application")
 class AvroServiceRouteTest(unittest.TestCase):
@@ -159,6 +376,65 @@ class AvroServiceRouteTest(unittest.TestCase):
             "get"
         )
 
+    def test_request_data_modes(self):
+        route = pa_routes.AvroServiceRoute("/foo", dummy_protocol)
+        args = {"arg1": {"nested": [1]}}
+
+        handed_over = route.prepare_request_data("get", args)
+        self.assertIs(args, handed_over)
+
+        route.register_message_impl("get", raise_out, request_data="copy")
+        copied = route.prepare_request_data("get", args)
+        self.assertEqual(args, copied)
+        self.assertIsNot(args["arg1"], copied["arg1"])
+        # Other messages keep the route's default.
+        self.assertIs(args, route.prepare_request_data("get2", args))
+
+        route.register_message_impl("get", raise_out, request_data="readonly")
+        view = route.prepare_request_data("get", args)
+        self.assertEqual(args, view)
+        self.assertRaises(TypeError, operator.setitem, view, "arg1", None)
+
+        route = pa_routes.AvroServiceRoute(
+            "/foo",
+            dummy_protocol,
+            request_data="copy"
+        )
+        self.assertIsNot(args, route.prepare_request_data("get", args))
+
+    def test_message_pools(self):
+        route = pa_routes.AvroServiceRoute("/foo", dummy_protocol)
+        pool = pools.ExecutorPool("test", max_workers=1)
+        self.addCleanup(pool.shutdown)
+        caller = threading.current_thread()
+        route.register_message_impl(
+            "get",
+            lambda req: threading.current_thread() is caller,
+            pool=pool
+        )
+        request = mock.Mock()
+        with mock.patch(
+            "pyramid.threadlocal.get_current_request",
+            return_value=request
+        ):
+            self.assertFalse(route.execute_command("get", arg1="arg"))
+            self.assertEqual(1, pool.stats()["completed"])
+
+            with mock.patch.object(
+                pool,
+                "run",
+                side_effect=pools.PoolRejected("Full.")
+            ):
+                self.assertRaises(
+                    avro_ipc.AvroRemoteException,
+                    route.execute_command,
+                    "get",
+                    arg1="arg"
+                )
+
+        route.register_message_impl("get", lambda req: None)
+        self.assertNotIn("get", route.message_pools)
+
     def _route_and_request(self, invalid_request=False):
         environ = {
             "CONTENT_TYPE": "avro/binary",
@@ -189,12 +465,152 @@ class AvroServiceRouteTest(unittest.TestCase):
 
         route, request = self._route_and_request()
         with mock.patch(
-                "avro.ipc.FramedReader.Read",
+                "pyramid_avro.framing.FrameReader.read_message",
                 side_effect=avro_ipc.ConnectionClosedException()
         ):
             response = route(request)
             self.assertEqual(400, response.status_code)
 
+    def test_chunked_request(self):
+        route, request = self._route_and_request()
+        del request.environ["CONTENT_LENGTH"]
+        request.environ["HTTP_TRANSFER_ENCODING"] = "chunked"
+        route.register_message_impl("get", lambda req: req.avro_data["arg1"])
+        with mock.patch(
+            "pyramid.threadlocal.get_current_request",
+            return_value=request
+        ):
+            response = route(request)
+        self.assertEqual(200, response.status_code)
+        call_response = CachedBufferTransceiver.read_message(response)
+        self.assertEqual("arg", read_call_response("get", call_response))
+
+        # Without a length or chunked encoding there's nothing to read.
+        route, request = self._route_and_request()
+        del request.environ["CONTENT_LENGTH"]
+        self.assertRaises(http_exc.HTTPBadRequest, route, request)
+
+    def test_framed_response(self):
+        route, request = self._route_and_request()
+        route = pa_routes.AvroServiceRoute(
+            "/foo",
+            dummy_protocol,
+            response_frame_size=4
+        )
+        route.register_message_impl("get", lambda req: req.avro_data["arg1"])
+        with mock.patch(
+            "pyramid.threadlocal.get_current_request",
+            return_value=request
+        ):
+            response = route(request)
+
+        chunks = list(response.app_iter)
+        self.assertTrue(len(chunks) > 2)
+        self.assertEqual(len(b"".join(chunks)), response.content_length)
+        call_response = CachedBufferTransceiver.read_message(response)
+        self.assertEqual("arg", read_call_response("get", call_response))
+
+    def test_truncated_request(self):
+        route, request = self._route_and_request()
+        body = request.environ["wsgi.input"].getvalue()
+        request.environ["wsgi.input"] = io.BytesIO(body[:-6])
+        request.environ["CONTENT_LENGTH"] = str(len(body) - 6)
+        response = route(request)
+        self.assertEqual(400, response.status_code)
+
+    def _stateless_request(self, headers, protocol=dummy_avro_protocol):
+        body = CachedBufferTransceiver.format_message(
+            build_stateless_call_request("get", {"arg1": "arg"}, protocol)
+        )
+        return webtest.TestRequest.blank(
+            "/foo",
+            method="POST",
+            body=body,
+            content_type="avro/binary",
+            headers=headers
+        )
+
+    def test_stateless_handshake(self):
+        route = pa_routes.AvroServiceRoute("/foo", dummy_protocol)
+        route.register_message_impl("get", lambda req: req.avro_data["arg1"])
+        server_hash = handshake.encode_hash(dummy_avro_protocol.md5)
+
+        for headers in [
+            {"Avro-Client-Hash": server_hash},
+            {"Avro-Client-Hash": server_hash, "Avro-Server-Hash": server_hash}
+        ]:
+            request = self._stateless_request(headers)
+            with mock.patch(
+                "pyramid.threadlocal.get_current_request",
+                return_value=request
+            ):
+                response = route(request)
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(server_hash, response.headers["Avro-Server-Hash"])
+            call_response = CachedBufferTransceiver.read_message(response)
+            self.assertEqual(
+                "arg",
+                read_call_response("get", call_response, handshake=False)
+            )
+
+    def test_stateless_handshake_learned_protocol(self):
+        client_protocol = avro_protocol.Parse(
+            dummy_protocol.replace('"get2"', '"get3"')
+        )
+        client_hash = handshake.encode_hash(client_protocol.md5)
+        route = pa_routes.AvroServiceRoute("/foo", dummy_protocol)
+        route.register_message_impl("get", lambda req: req.avro_data["arg1"])
+        headers = {"Avro-Client-Hash": client_hash}
+
+        # Unknown until the client completes a regular handshake.
+        with pytest.raises(http_exc.HTTPPreconditionFailed) as ex:
+            route(self._stateless_request(headers, client_protocol))
+        self.assertEqual("required", ex.value.headers["Avro-Handshake"])
+
+        call_request = build_call_request(
+            "get",
+            {"arg1": "arg"},
+            client_protocol,
+            send_protocol=True
+        )
+        route.responder.Respond(call_request)
+
+        request = self._stateless_request(headers, client_protocol)
+        with mock.patch(
+            "pyramid.threadlocal.get_current_request",
+            return_value=request
+        ):
+            response = route(request)
+        self.assertEqual(200, response.status_code)
+
+    def test_stateless_handshake_refused(self):
+        server_hash = handshake.encode_hash(dummy_avro_protocol.md5)
+        other_hash = handshake.encode_hash(b"\x00" * 16)
+        route = pa_routes.AvroServiceRoute("/foo", dummy_protocol)
+
+        # Server protocol mismatch.
+        with pytest.raises(http_exc.HTTPPreconditionFailed) as ex:
+            route(self._stateless_request({
+                "Avro-Client-Hash": server_hash,
+                "Avro-Server-Hash": other_hash
+            }))
+        self.assertEqual("required", ex.value.headers["Avro-Handshake"])
+        self.assertEqual(server_hash, ex.value.headers["Avro-Server-Hash"])
+
+        # Malformed hash.
+        request = self._stateless_request({"Avro-Client-Hash": "bogus"})
+        self.assertRaises(http_exc.HTTPBadRequest, route, request)
+
+        # Disabled.
+        route = pa_routes.AvroServiceRoute(
+            "/foo",
+            dummy_protocol,
+            stateless_handshake=False
+        )
+        with pytest.raises(http_exc.HTTPPreconditionFailed) as ex:
+            route(self._stateless_request({"Avro-Client-Hash": server_hash}))
+        self.assertNotIn("Avro-Server-Hash", ex.value.headers)
+
     def test_view_http_exception(self):
         route, request, = self._route_and_request()
         with mock.patch(
@@ -251,3 +667,123 @@ class AccessWithClientTest(unittest.TestCase):
             self._do_request,
             "get2", {"arg1": "arg"}
         )
+
+    def test_batch(self):
+        requestor = client.Requestor(dummy_protocol)
+        calls = [("get", {"arg1": "a"}), ("get2", {"arg1": "b"})]
+        names = [name for name, _ in calls]
+        for stateless in (False, True):
+            response = self.app.post(
+                "/foo",
+                params=requestor.batch_body(calls, stateless=stateless),
+                headers=requestor.headers(stateless, is_batch=True)
+            )
+            self.assertEqual("1", response.headers["Avro-Batch"])
+            results = requestor.read_batch_body(
+                names,
+                response.body,
+                stateless=stateless
+            )
+            self.assertEqual("a", results[0])
+            self.assertIsInstance(results[1], avro_ipc.AvroRemoteException)
+
+    def test_bad_batch(self):
+        requestor = client.Requestor(dummy_protocol)
+        headers = requestor.headers(stateless=True, is_batch=True)
+        body = requestor.batch_body([("get", {"arg1": "a"})], stateless=True)
+
+        # One call short: every call gets the decoding error.
+        message = bytearray(
+            framing.FrameReader(io.BytesIO(body)).read_message()
+        )
+        message[0] = 4
+        body = b"".join(framing.FramedMessageIterator(message))
+        response = self.app.post("/foo", params=body, headers=headers)
+        results = requestor.read_batch_body(
+            ["get", "get"],
+            response.body,
+            stateless=True
+        )
+        for result in results:
+            self.assertIsInstance(result, avro_ipc.AvroRemoteException)
+
+        # No calls at all.
+        message[0] = 0
+        body = b"".join(framing.FramedMessageIterator(message))
+        response = self.app.post(
+            "/foo",
+            params=body,
+            headers=headers,
+            expect_errors=True
+        )
+        self.assertEqual(400, response.status_code)
+
+
+class LazyAvroServiceRouteTest(unittest.TestCase):
+
+    def test_materialize(self):
+        route = pa_routes.LazyAvroServiceRoute(
+            "avro.foo",
+            dummy_protocol_file,
+            batch_workers=2
+        )
+        route.register_message_impl("get", raise_out)
+        self.assertFalse(route.is_materialized)
+
+        built = []
+        start = threading.Event()
+
+        def materialize():
+            start.wait()
+            built.append(route.materialize())
+
+        real_route = pa_routes.AvroServiceRoute
+        with mock.patch.object(
+                pa_routes,
+                "AvroServiceRoute",
+                side_effect=real_route
+        ) as route_class:
+            threads = [
+                threading.Thread(target=materialize) for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            start.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(1, route_class.call_count)
+        self.assertTrue(route.is_materialized)
+        self.assertEqual(1, len(set(map(id, built))))
+        self.assertIs(raise_out, built[0].dispatch["get"])
+        self.assertEqual(2, built[0].batch_dispatcher.workers)
+        self.assertIs(built[0].protocol, route.protocol)
+
+        # Later registrations go straight to the route.
+        route.register_message_impl("get2", raise_out)
+        self.assertIs(raise_out, built[0].dispatch["get2"])
+        self.assertRaises(
+            avro_schema.AvroException,
+            route.register_message_impl,
+            "bogus",
+            raise_out
+        )
+
+    def test_view(self):
+        route = pa_routes.LazyAvroServiceRoute(
+            "avro.foo",
+            dummy_protocol_file,
+            fingerprint="stale"
+        )
+        route.register_message_impl(
+            "get",
+            lambda request: request.avro_data["arg1"]
+        )
+        request = mock.MagicMock()
+        request.content_length = 0
+        self.assertRaises(http_exc.HTTPBadRequest, route, request)
+        self.assertTrue(route.is_materialized)
+
+        broken = pa_routes.LazyAvroServiceRoute("avro.foo", "missing.avpr")
+        self.assertEqual(500, broken(request).status_code)
+        self.assertFalse(broken.is_materialized)
@@ -0,0 +1,179 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from pyramid_avro import compiler as pa_compiler
+from pyramid_avro import scripts as pa_scripts
+
+compile_fn = "pyramid_avro.compiler.compile_all"
+
+config_file = """
+[app:main]
+use = call:tests.conftest:test_app
+avro.tools_jar = {jar}
+avro.compiler = python
+avro.protocol_dir = protocols
+avro.service.foo =
+    protocol = foo.avdl
+avro.service.bar =
+    schema = bar.avpr
+"""
+
+
+class CompileMainTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.dir, "protocols", "nested"))
+        for name in ("a.avdl", "nested/b.avdl", "nested/c.avpr"):
+            self.touch(os.path.join("protocols", name))
+        self.jar = os.path.join(self.dir, "tools.jar")
+        self.out = io.StringIO()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def touch(self, name):
+        path = os.path.join(self.dir, name)
+        open(path, "w").close()
+        return path
+
+    def path(self, *parts):
+        return os.path.join(self.dir, "protocols", *parts)
+
+    def test_find_protocols(self):
+        self.assertEqual(
+            [self.path("a.avdl"), self.path("nested", "b.avdl")],
+            pa_scripts.find_protocols(self.path())
+        )
+        self.assertEqual(
+            [self.path("a.avdl")],
+            pa_scripts.find_protocols(self.path("a.avdl"))
+        )
+
+    def test_paths(self):
+        results = {self.path("a.avpr"): True, self.path("b.avpr"): False}
+        with mock.patch(compile_fn, return_value=results) as _mocked:
+            exit_code = pa_scripts.compile_main(
+                [self.path(), "--tools-jar", self.jar, "-j", "2", "--force"],
+                out=self.out
+            )
+        self.assertEqual(0, exit_code)
+        _mocked.assert_called_once_with(
+            [
+                pa_compiler.CompileJob(
+                    self.path("a.avdl"),
+                    self.path("a.avpr"),
+                    self.jar
+                ),
+                pa_compiler.CompileJob(
+                    self.path("nested", "b.avdl"),
+                    self.path("nested", "b.avpr"),
+                    self.jar
+                )
+            ],
+            workers=2,
+            cache=False,
+            backend="java"
+        )
+        self.assertIn(
+            "compiled {}\n".format(self.path("a.avpr")),
+            self.out.getvalue()
+        )
+        self.assertIn(
+            "up to date {}\n".format(self.path("b.avpr")),
+            self.out.getvalue()
+        )
+
+    def test_config(self):
+        ini = self.touch("development.ini")
+        with open(ini, "w") as _file:
+            _file.write(config_file.format(jar=self.jar))
+
+        with mock.patch(compile_fn, return_value={}) as _mocked:
+            exit_code = pa_scripts.compile_main(["-c", ini], out=self.out)
+        self.assertEqual(0, exit_code)
+        # Services with only a schema have nothing to compile.
+        _mocked.assert_called_once_with(
+            [pa_compiler.CompileJob(
+                self.path("foo.avdl"),
+                self.path("foo.avpr"),
+                self.jar
+            )],
+            workers=pa_compiler.COMPILE_WORKERS,
+            cache=True,
+            backend="python"
+        )
+
+    def test_errors(self):
+        error = pa_compiler.CompileError([
+            (self.path("a.avdl"), "Bad a."),
+            (self.path("nested", "b.avdl"), "Bad b.")
+        ])
+        with mock.patch(compile_fn, side_effect=error):
+            exit_code = pa_scripts.compile_main(
+                [self.path(), "--tools-jar", self.jar],
+                out=self.out
+            )
+        self.assertEqual(1, exit_code)
+        output = self.out.getvalue()
+        self.assertIn("2 protocol(s) failed to compile", output)
+        self.assertIn("    Bad a.", output)
+        self.assertIn("    Bad b.", output)
+
+        with mock.patch("sys.stderr"):
+            # Nothing to compile, or no jar to compile with.
+            self.assertRaises(SystemExit, pa_scripts.compile_main, [])
+            self.assertRaises(
+                SystemExit,
+                pa_scripts.compile_main,
+                [self.path()]
+            )
+
+
+class LoadMainTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.ini = os.path.join(self.dir, "load.ini")
+        with open(self.ini, "w") as _file:
+            _file.write("[app:main]\nuse = call:tests.conftest:test_app\n")
+        self.out = io.StringIO()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_in_process(self):
+        exit_code = pa_scripts.load_main(
+            [self.ini, "-m", "get", "-n", "20", "-c", "2", "--json"],
+            out=self.out
+        )
+        self.assertEqual(0, exit_code)
+        report = json.loads(self.out.getvalue())
+        self.assertEqual(20, report["requests"])
+        self.assertEqual({}, report["errors"])
+        self.assertIn("p99", report["latency"])
+
+        # get2 has no implementation in the test app.
+        self.out = io.StringIO()
+        exit_code = pa_scripts.load_main(
+            [self.ini, "-s", "foo", "-n", "20", "--seed", "1"],
+            out=self.out
+        )
+        self.assertEqual(1, exit_code)
+        self.assertIn("AvroRemoteException", self.out.getvalue())
+
+    def test_errors(self):
+        with mock.patch("sys.stderr"):
+            for argv in (
+                [self.ini, "-s", "missing"],
+                [self.ini, "-m", "missing"],
+                [self.ini, "-c", "0"],
+                ["http://127.0.0.1:1/foo"]
+            ):
+                self.assertRaises(SystemExit, pa_scripts.load_main, argv)
@@ -8,6 +8,54 @@ from pyramid_avro import settings as pa_settings
 
 TRUTHY = list(p_settings.truthy) + [True, 1]
 BAD_INPUT = ["", None, False, True, 1, 0]
+DEFAULTS = {
+    "default_path_prefix": None,
+    "protocol_dir": None,
+    "auto_compile": False,
+    "compile_cache": True,
+    "compile_workers": 4,
+    "compiler": "java",
+    "tools_jar": None,
+    "parse_cache_dir": None,
+    "lazy_routes": False,
+    "eager_services": frozenset(),
+    "reload_schemas": False,
+    "reload_interval": 1.0,
+    "metrics": False,
+    "metrics_window": 1024,
+    "stats_path": None,
+    "tracing": False,
+    "trace_exporter": "none",
+    "trace_file": None,
+    "profile": False,
+    "profile_sample_rate": 0.0,
+    "profile_secret": None,
+    "profile_messages": frozenset(),
+    "profile_dir": None,
+    "profile_format": "collapsed",
+    "profile_interval": 0.005,
+    "compression": (),
+    "compression_min_size": 1024,
+    "compression_level": None,
+    "request_compression": ("gzip", "deflate"),
+    "max_decompressed_size": 64 * 1024 * 1024,
+    "validate_response": "full",
+    "validate_sample_rate": 0.1,
+    "request_data": "direct",
+    "response_frame_size": 65536,
+    "stateless_handshake": True,
+    "protocol_cache_size": 64,
+    "batch_workers": 1,
+    "batch_max_calls": 1000,
+    "service": {},
+    "pool": {}
+}
+
+
+def expected_options(**overrides):
+    options = DEFAULTS.copy()
+    options.update(overrides)
+    return options
 
 
 class DeriveServicePathTest(unittest.TestCase):
@@ -140,26 +188,17 @@ class DeriveServicePathTest(unittest.TestCase):
 class GetConfigOptionsTest(unittest.TestCase):
     def test_empty(self):
         # Test an empty settings dict.
-        defaults = {
-            "default_path_prefix": None,
-            "protocol_dir": None,
-            "auto_compile": False,
-            "tools_jar": None,
-            "service": {}
-        }
+        defaults = expected_options()
         settings = {}
         avro_settings = pa_settings.get_config_options(settings)
 
         self.assertEqual(defaults, avro_settings)
 
     def test_auto_compile_truthy(self):
-        expected = {
-            "default_path_prefix": None,
-            "protocol_dir": None,
-            "auto_compile": True,
-            "tools_jar": "non-empty-string",
-            "service": {}
-        }
+        expected = expected_options(
+            auto_compile=True,
+            tools_jar="non-empty-string"
+        )
         settings = {"avro.tools_jar": "non-empty-string"}
         for val in TRUTHY:
             settings["avro.auto_compile"] = val
@@ -187,17 +226,11 @@ class GetConfigOptionsTest(unittest.TestCase):
     def test_service_def_properties(self):
         foo_service_str = "protocol = foo.avdl"
         settings_dict = {"avro.service.foo": foo_service_str}
-        expected = {
-            "default_path_prefix": None,
-            "protocol_dir": None,
-            "auto_compile": False,
-            "tools_jar": None,
-            "service": {
-                "foo": {
-                    "protocol": "foo.avdl"
-                }
+        expected = expected_options(service={
+            "foo": {
+                "protocol": "foo.avdl"
             }
-        }
+        })
         actual = pa_settings.get_config_options(settings_dict)
         self.assertEqual(expected, actual)
 
@@ -215,25 +248,170 @@ class GetConfigOptionsTest(unittest.TestCase):
         actual = pa_settings.get_config_options(settings_dict)
         self.assertEqual(expected, actual)
 
+    def test_pool_def_properties(self):
+        settings_dict = {
+            "avro.pool.slow": "kind = process\n"
+                              "max_workers = 2\n"
+                              "max_queue = 8\n"
+                              "rejection = Block\n"
+                              "block_timeout = 1.5",
+            "avro.pool.fast": "max_workers = 16"
+        }
+        expected = expected_options(pool={
+            "slow": {
+                "kind": "process",
+                "max_workers": 2,
+                "max_queue": 8,
+                "rejection": "block",
+                "block_timeout": 1.5
+            },
+            "fast": {"max_workers": 16}
+        })
+        actual = pa_settings.get_config_options(settings_dict)
+        self.assertEqual(expected, actual)
+
+        for val in ["", "workers = 2", "max_queue = -1", "kind = fiber"]:
+            self.assertRaises(
+                p_config.ConfigurationError,
+                pa_settings.get_config_options,
+                {"avro.pool.slow": val}
+            )
+
+    def test_validation_options(self):
+        settings_dict = {
+            "avro.validate_response": " Sampled ",
+            "avro.validate_sample_rate": "0.25",
+            "avro.service.foo": "schema = foo.avpr\n"
+                                "validate_response = off\n"
+                                "validate_messages = get:encode, put:full"
+        }
+        expected = expected_options(
+            validate_response="sampled",
+            validate_sample_rate=0.25,
+            service={"foo": {
+                "schema": "foo.avpr",
+                "validate_response": "off",
+                "validate_messages": "get:encode, put:full"
+            }}
+        )
+        actual = pa_settings.get_config_options(settings_dict)
+        self.assertEqual(expected, actual)
+
+        for key, val in [
+            ("avro.validate_response", "sometimes"),
+            ("avro.validate_sample_rate", "lots"),
+            ("avro.validate_sample_rate", "1.5"),
+        ]:
+            self.assertRaises(
+                p_config.ConfigurationError,
+                pa_settings.get_config_options,
+                {key: val}
+            )
+
+    def test_request_data(self):
+        actual = pa_settings.get_config_options(
+            {"avro.request_data": "ReadOnly"}
+        )
+        self.assertEqual(expected_options(request_data="readonly"), actual)
+        self.assertRaises(
+            p_config.ConfigurationError,
+            pa_settings.get_config_options,
+            {"avro.request_data": "shared"}
+        )
+
+    def test_response_frame_size(self):
+        actual = pa_settings.get_config_options(
+            {"avro.response_frame_size": "8192"}
+        )
+        self.assertEqual(expected_options(response_frame_size=8192), actual)
+        for val in ("0", "-1", "big"):
+            self.assertRaises(
+                p_config.ConfigurationError,
+                pa_settings.get_config_options,
+                {"avro.response_frame_size": val}
+            )
+
+    def test_protocol_cache_size(self):
+        actual = pa_settings.get_config_options(
+            {"avro.protocol_cache_size": "8"}
+        )
+        self.assertEqual(expected_options(protocol_cache_size=8), actual)
+        self.assertRaises(
+            p_config.ConfigurationError,
+            pa_settings.get_config_options,
+            {"avro.protocol_cache_size": "0"}
+        )
+
+    def test_batch_options(self):
+        actual = pa_settings.get_config_options({
+            "avro.batch_workers": "4",
+            "avro.batch_max_calls": "50"
+        })
+        self.assertEqual(
+            expected_options(batch_workers=4, batch_max_calls=50),
+            actual
+        )
+        self.assertRaises(
+            p_config.ConfigurationError,
+            pa_settings.get_config_options,
+            {"avro.batch_workers": "0"}
+        )
+
+    def test_lazy_routes(self):
+        actual = pa_settings.get_config_options({
+            "avro.lazy_routes": "true",
+            "avro.eager_services": "foo,\nbar baz"
+        })
+        self.assertEqual(
+            expected_options(
+                lazy_routes=True,
+                eager_services=frozenset(["foo", "bar", "baz"])
+            ),
+            actual
+        )
+        self.assertEqual(
+            frozenset(["foo"]),
+            pa_settings.parse_name_list(["foo"])
+        )
+
+    def test_parse_message_options(self):
+        self.assertEqual({}, pa_settings.parse_message_options(None))
+        self.assertEqual(
+            {"get": "off", "put": "encode"},
+            pa_settings.parse_message_options(
+                "get:OFF,put:encode",
+                pa_settings.parse_validation_mode
+            )
+        )
+        self.assertEqual(
+            {"get": "full"},
+            pa_settings.parse_message_options({"get": "full"})
+        )
+        self.assertRaises(
+            p_config.ConfigurationError,
+            pa_settings.parse_message_options,
+            "get"
+        )
+        self.assertRaises(
+            p_config.ConfigurationError,
+            pa_settings.parse_message_options,
+            {"get": "bogus"},
+            pa_settings.parse_validation_mode
+        )
+
     def test_multiple_service_def(self):
         settings_dict = {
             "avro.service.foo": "protocol = foo.avdl",
             "avro.service.bar": "schema = bar.avpr",
         }
-        expected = {
-            "default_path_prefix": None,
-            "protocol_dir": None,
-            "auto_compile": False,
-            "tools_jar": None,
-            "service": {
-                "foo": {
-                    "protocol": "foo.avdl"
-                },
-                "bar": {
-                    "schema": "bar.avpr"
-                }
+        expected = expected_options(service={
+            "foo": {
+                "protocol": "foo.avdl"
+            },
+            "bar": {
+                "schema": "bar.avpr"
             }
-        }
+        })
         actual = pa_settings.get_config_options(settings_dict)
         self.assertEqual(expected, actual)
 
@@ -252,26 +430,14 @@ class GetConfigOptionsTest(unittest.TestCase):
         settings_dict = {
             "avro.service.foo": "protocol = foo.avdl"
         }
-        expected = {
-            "default_path_prefix": None,
-            "protocol_dir": None,
-            "auto_compile": False,
-            "tools_jar": None,
-            "service": {"foo": {"protocol": "foo.avdl"}}
-        }
+        expected = expected_options(service={"foo": {"protocol": "foo.avdl"}})
         actual = pa_settings.get_config_options(settings_dict)
         self.assertDictEqual(expected, actual)
 
         settings_dict = {
             "avro.service.foo": "schema = foo.avpr"
         }
-        expected = {
-            "default_path_prefix": None,
-            "protocol_dir": None,
-            "auto_compile": False,
-            "tools_jar": None,
-            "service": {"foo": {"schema": "foo.avpr"}}
-        }
+        expected = expected_options(service={"foo": {"schema": "foo.avpr"}})
         actual = pa_settings.get_config_options(settings_dict)
         self.assertDictEqual(expected, actual)
 
@@ -0,0 +1,300 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import webtest
+from pyramid import config as p_config
+
+from pyramid_avro import client
+from pyramid_avro import codecs
+from pyramid_avro import framing
+from pyramid_avro import tracing
+
+here = os.path.abspath(os.path.dirname(__file__))
+dummy_schema_file = os.path.join(here, "protocols", "test.avpr")
+with open(dummy_schema_file) as _file:
+    dummy_protocol = _file.read()
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+SPAN_ID = "00f067aa0ba902b7"
+TRACEPARENT = "00-{}-{}-01".format(TRACE_ID, SPAN_ID)
+
+seen_spans = []
+
+
+def get_impl(request):
+    seen_spans.append((request.avro_span, tracing.current_span()))
+    return request.avro_data["arg1"]
+
+
+async def get2_impl(request):
+    seen_spans.append((request.avro_span, tracing.current_span()))
+    return request.avro_data["arg1"]
+
+
+def failing_impl(request):
+    raise ValueError("Nope.")
+
+
+def make_exporter(options):
+    return tracing.InMemoryExporter(max_spans=5)
+
+
+class TraceparentTest(unittest.TestCase):
+
+    def test_parse(self):
+        context = tracing.parse_traceparent(TRACEPARENT)
+        self.assertEqual(tracing.SpanContext(TRACE_ID, SPAN_ID, True), context)
+        self.assertEqual(TRACEPARENT, tracing.format_traceparent(context))
+        self.assertEqual(
+            context,
+            tracing.parse_traceparent(TRACEPARENT.encode("ascii"))
+        )
+        # Later versions may add fields.
+        self.assertEqual(
+            tracing.SpanContext(TRACE_ID, SPAN_ID, False),
+            tracing.parse_traceparent(
+                "01-{}-{}-00-more".format(TRACE_ID, SPAN_ID)
+            )
+        )
+        invalid = [
+            None,
+            "",
+            b"\xff",
+            "00-{}-{}-01-more".format(TRACE_ID, SPAN_ID),
+            "ff-{}-{}-01".format(TRACE_ID, SPAN_ID),
+            "00-{}-{}-01".format("0" * 32, SPAN_ID),
+            "00-{}-{}-01".format(TRACE_ID, "0" * 16),
+            "00-{}-{}-01".format(TRACE_ID.upper(), SPAN_ID),
+            "00-{}-{}".format(TRACE_ID, SPAN_ID)
+        ]
+        for value in invalid:
+            self.assertIsNone(tracing.parse_traceparent(value), value)
+
+    def test_inject(self):
+        requestor = client.Requestor(dummy_protocol)
+        self.assertNotIn(tracing.TRACEPARENT, requestor.headers())
+        self.assertIsNone(tracing.current_context())
+
+        context = tracing.parse_traceparent(TRACEPARENT)
+        span = tracing.Span("client", context)
+        headers = tracing.call_in_span(span, requestor.headers)
+        self.assertEqual(TRACEPARENT, headers[tracing.TRACEPARENT])
+        encoded = tracing.call_in_span(
+            span,
+            requestor.encode_call,
+            "get",
+            {"arg1": "a"}
+        )
+        metadata, _ = codecs.decode(codecs.read_metadata, encoded)
+        self.assertEqual(
+            {tracing.TRACEPARENT: TRACEPARENT.encode("ascii")},
+            metadata
+        )
+        self.assertIsNone(tracing.current_span())
+
+
+class RouteTracingTest(unittest.TestCase):
+
+    def setUp(self):
+        del seen_spans[:]
+        config = p_config.Configurator(settings={
+            "avro.tracing": "true",
+            "avro.trace_exporter": "memory"
+        })
+        config.include("pyramid_avro")
+        config.add_avro_route("foo", schema=dummy_schema_file)
+        config.register_avro_message("foo", get_impl, "get")
+        config.register_avro_message("foo", get2_impl, "get2")
+        self.app = webtest.TestApp(config.make_wsgi_app())
+        self.exporter = config.registry.getUtility(tracing.ISpanExporter)
+        self.requestor = client.Requestor(dummy_protocol)
+
+    def post(self, body, headers):
+        response = self.app.post("/foo", params=body, headers=headers)
+        self.assertEqual(200, response.status_code)
+        return response.body
+
+    def exported(self):
+        spans = list(self.exporter.spans)
+        self.exporter.clear()
+        return spans
+
+    def test_call(self):
+        parent = tracing.Span("client", tracing.parse_traceparent(TRACEPARENT))
+        body = tracing.call_in_span(
+            parent,
+            self.requestor.call_body,
+            "get",
+            {"arg1": "a"}
+        )
+        response_body = self.post(body, self.requestor.headers())
+
+        spans = self.exported()
+        self.assertEqual(
+            ["get", "decode", "handler", "encode"],
+            [span.name for span in spans]
+        )
+        span = spans[0]
+        self.assertEqual(tracing.SPAN_SERVER, span.kind)
+        self.assertEqual("foo", span.service)
+        self.assertEqual(TRACE_ID, span.trace_id)
+        self.assertEqual(SPAN_ID, span.parent_id)
+        self.assertNotEqual(SPAN_ID, span.span_id)
+        self.assertIsNone(span.error)
+        self.assertGreater(span.duration, 0)
+        for child in spans[1:]:
+            self.assertEqual(tracing.SPAN_INTERNAL, child.kind)
+            self.assertEqual(TRACE_ID, child.trace_id)
+            self.assertEqual(span.span_id, child.parent_id)
+            self.assertGreaterEqual(child.start_time, span.start_time)
+            self.assertLessEqual(child.duration, span.duration)
+
+        # The handler ran in the call's span.
+        self.assertEqual([(span, span)], seen_spans)
+        self.assertIsNone(tracing.current_span())
+
+        # The response metadata carries the server span.
+        buf = framing.FrameReader(io.BytesIO(response_body)).read_message()
+        _, pos = codecs.decode(codecs.read_handshake_response, buf)
+        metadata, _ = codecs.decode(codecs.read_metadata, buf, pos)
+        self.assertEqual(
+            tracing.format_traceparent(span.context).encode("ascii"),
+            metadata[tracing.TRACEPARENT]
+        )
+
+    def test_headers_and_async(self):
+        headers = self.requestor.headers(stateless=True)
+        headers[tracing.TRACEPARENT] = TRACEPARENT
+        self.post(
+            self.requestor.call_body("get2", {"arg1": "a"}, stateless=True),
+            headers
+        )
+        span = self.exported()[0]
+        self.assertEqual("get2", span.name)
+        self.assertEqual(SPAN_ID, span.parent_id)
+        self.assertEqual([(span, span)], seen_spans)
+
+        # Without any context, calls start a trace of their own.
+        self.post(
+            self.requestor.call_body("get", {"arg1": "a"}),
+            self.requestor.headers()
+        )
+        span = self.exported()[0]
+        self.assertIsNone(span.parent_id)
+        self.assertNotEqual(TRACE_ID, span.trace_id)
+
+    def test_batch(self):
+        headers = self.requestor.headers(is_batch=True)
+        headers[tracing.TRACEPARENT] = TRACEPARENT
+        self.post(
+            self.requestor.batch_body([
+                ("get", {"arg1": "a"}),
+                ("get", {"arg1": "b"})
+            ]),
+            headers
+        )
+        spans = [
+            span for span in self.exported()
+            if span.kind == tracing.SPAN_SERVER
+        ]
+        self.assertEqual(2, len(spans))
+        self.assertNotEqual(spans[0].span_id, spans[1].span_id)
+        for span in spans:
+            self.assertEqual(SPAN_ID, span.parent_id)
+        self.assertEqual(
+            [(span, span) for span in spans],
+            seen_spans
+        )
+
+    def test_error(self):
+        config = p_config.Configurator(settings={"avro.tracing": "true"})
+        exporter = tracing.InMemoryExporter()
+        config.registry.registerUtility(exporter, tracing.ISpanExporter)
+        config.include("pyramid_avro")
+        config.add_avro_route("foo", schema=dummy_schema_file)
+        config.register_avro_message("foo", failing_impl, "get")
+        app = webtest.TestApp(config.make_wsgi_app())
+        app.post(
+            "/foo",
+            params=self.requestor.call_body("get", {"arg1": "a"}),
+            headers=self.requestor.headers()
+        )
+        self.assertIn("Nope.", exporter.spans[0].error)
+
+
+class ExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_file(self):
+        path = os.path.join(self.dir, "spans.jsonl")
+        exporter = tracing.make_exporter(tracing.EXPORTER_FILE, path)
+        span = tracing.Span("get", tracing.parse_traceparent(TRACEPARENT))
+        span.stop("decode", span.start())
+        span.finish()
+        exporter.export([span] + span.children)
+        exporter.export([span])
+
+        with open(path) as _file:
+            records = [json.loads(line) for line in _file]
+        self.assertEqual(
+            ["get", "decode", "get"],
+            [record["name"] for record in records]
+        )
+        self.assertEqual(SPAN_ID, records[1]["parent_id"])
+        self.assertEqual(TRACE_ID, records[1]["trace_id"])
+
+        self.assertRaises(
+            ValueError,
+            tracing.make_exporter,
+            tracing.EXPORTER_FILE
+        )
+        self.assertIsNone(tracing.make_exporter(tracing.EXPORTER_NONE))
+
+    def test_trace_file(self):
+        path = os.path.join(self.dir, "spans.jsonl")
+        for trace_file, expected in (
+            ("spans.jsonl", os.path.join(here, "spans.jsonl")),
+            (path, path)
+        ):
+            config = p_config.Configurator(settings={
+                "avro.tracing": "true",
+                "avro.trace_exporter": "file",
+                "avro.trace_file": trace_file
+            })
+            config.include("pyramid_avro")
+            config.add_avro_route("foo", schema=dummy_schema_file)
+            exporter = config.registry.getUtility(tracing.ISpanExporter)
+            # Relative to the application's package, like profile_dir.
+            self.assertEqual(expected, exporter.path)
+
+    def test_config(self):
+        config = p_config.Configurator(settings={
+            "avro.tracing": "true",
+            "avro.trace_exporter": "tests.test_tracing.make_exporter"
+        })
+        config.include("pyramid_avro")
+        config.add_avro_route("foo", schema=dummy_schema_file)
+        config.add_avro_route("bar", schema=dummy_schema_file)
+        exporter = config.registry.getUtility(tracing.ISpanExporter)
+        self.assertEqual(5, exporter.spans.maxlen)
+
+        config = p_config.Configurator(settings={
+            "avro.tracing": "true",
+            "avro.trace_exporter": "tests.test_tracing.missing"
+        })
+        config.include("pyramid_avro")
+        self.assertRaises(
+            p_config.ConfigurationError,
+            config.add_avro_route,
+            "foo",
+            schema=dummy_schema_file
+        )
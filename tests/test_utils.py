@@ -11,6 +11,7 @@ from avro import protocol as avro_protocol
 from pyramid_avro import utils as pa_utils
 
 sub_proc_cmd = "pyramid_avro.utils.run_subprocess_command"
+run_compile = "pyramid_avro.compiler.run_compile"
 
 
 class RunSubprocessCommandTest(unittest.TestCase):
@@ -115,12 +116,9 @@ class CompileProtocolTest(unittest.TestCase):
         _, jar_file = tempfile.mkstemp("foo.jar")
         _, protocol = tempfile.mkstemp("bar.avdl")
         schema = ""
-        expected_command = [
-            "java", "-jar", jar_file, "idl", protocol, schema
-        ]
-        with mock.patch(sub_proc_cmd) as _mock_fn:
+        with mock.patch(run_compile) as _mock_fn:
             pa_utils.compile_protocol(protocol, schema, jar_file)
-            _mock_fn.assert_called_with(expected_command)
+            _mock_fn.assert_called_with(protocol, schema, jar_file)
 
         os.remove(jar_file)
         os.remove(protocol)
@@ -0,0 +1,265 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import mock
+import pytest
+from pyramid import config as p_config
+
+import pyramid_avro as pa
+from pyramid_avro import compiler as pa_compiler
+from pyramid_avro import routes as pa_routes
+from pyramid_avro import watch as pa_watch
+
+here = os.path.abspath(os.path.dirname(__file__))
+dummy_schema_file = os.path.join(here, "protocols", "test.avpr")
+with open(dummy_schema_file) as _file:
+    dummy_schema = json.load(_file)
+
+
+def get_impl(request):
+    return request.avro_data["arg1"]
+
+
+def thing_fields(route):
+    thing, = [t for t in route.protocol.types if t.name == "Thing"]
+    return [field.name for field in thing.fields]
+
+
+class WatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.schema_file = os.path.join(self.dir, "foo.avpr")
+        self.write_schema()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_schema(self, *extra_messages):
+        schema = json.loads(json.dumps(dummy_schema))
+        for message in extra_messages:
+            schema["messages"][message] = schema["messages"]["get"]
+        tmp_path = self.schema_file + ".tmp"
+        with open(tmp_path, "w") as _file:
+            json.dump(schema, _file)
+        # Replaced, as deployment tools do.
+        os.rename(tmp_path, self.schema_file)
+
+
+class FileWatcherTest(WatchTestCase):
+
+    def test_check(self):
+        other = os.path.join(self.dir, "missing.avpr")
+        watcher = pa_watch.FileWatcher(
+            [self.schema_file, other],
+            lambda paths: None
+        )
+        self.assertEqual([], watcher.check())
+        self.write_schema("put")
+        with open(other, "w") as _file:
+            _file.write("{}")
+        self.assertEqual(sorted([self.schema_file, other]), watcher.check())
+        self.assertEqual([], watcher.check())
+        os.remove(other)
+        self.assertEqual([other], watcher.check())
+
+    def run_watcher(self, **kwargs):
+        changed = []
+        called = threading.Event()
+
+        def callback(paths):
+            changed.append(paths)
+            called.set()
+
+        watcher = pa_watch.FileWatcher([self.schema_file], callback, **kwargs)
+        watcher.start()
+        try:
+            with open(os.path.join(self.dir, "unrelated.txt"), "w") as _file:
+                _file.write("ignored")
+            self.write_schema("put")
+            self.assertTrue(called.wait(5))
+        finally:
+            watcher.stop(5)
+        self.assertEqual([[self.schema_file]], changed)
+        return watcher
+
+    def test_poll(self):
+        watcher = self.run_watcher(interval=0.01, use_inotify=False)
+        self.assertEqual("poll", watcher.backend)
+
+    @pytest.mark.skipif(pa_watch._libc is None, reason="No inotify.")
+    def test_inotify(self):
+        # Woken by the change rather than the (long) interval.
+        watcher = self.run_watcher(interval=60)
+        self.assertEqual("inotify", watcher.backend)
+
+
+class ReloadTest(WatchTestCase):
+
+    def test_reload(self):
+        route = pa_routes.LazyAvroServiceRoute("avro.foo", self.schema_file)
+        route.register_message_impl("get", get_impl)
+        self.assertFalse(route.reload())
+        old_route = route.materialize()
+        self.assertFalse(route.reload())
+
+        self.write_schema("put")
+        self.assertTrue(route.reload())
+        new_route = route.materialize()
+        self.assertIsNot(old_route, new_route)
+        self.assertIn("put", new_route.protocol.message_map)
+        self.assertNotIn("put", old_route.protocol.message_map)
+        # Implementations carry over, and new ones reach the new route.
+        self.assertIs(old_route.dispatch, new_route.dispatch)
+        route.register_message_impl("put", get_impl)
+        self.assertIs(get_impl, new_route.dispatch["put"])
+
+        # A broken schema leaves the route as it was.
+        with open(self.schema_file, "w") as _file:
+            _file.write("{")
+        self.assertRaises(Exception, route.reload)
+        self.assertIs(new_route, route.materialize())
+
+    def test_reloader(self):
+        route = pa_routes.LazyAvroServiceRoute("avro.foo", self.schema_file)
+        route.materialize()
+        protocol = os.path.join(self.dir, "foo.avdl")
+        job = pa_compiler.CompileJob(protocol, self.schema_file, None)
+        reloader = pa_watch.SchemaReloader(
+            {self.schema_file: [route]},
+            [job],
+            backend="python"
+        )
+        self.assertEqual([protocol, self.schema_file], reloader.paths)
+
+        with open(protocol, "w") as _file:
+            _file.write("protocol Foo { string get(string arg1); }")
+        reloader([protocol])
+        self.assertEqual(["get"], list(route.protocol.message_map))
+
+        # Failures are logged.
+        with open(protocol, "w") as _file:
+            _file.write("protocol Foo {")
+        with mock.patch.object(pa_watch.logger, "exception") as log:
+            reloader([protocol])
+        self.assertEqual(1, log.call_count)
+        self.assertEqual(["get"], list(route.protocol.message_map))
+
+    def test_imports(self):
+        common = os.path.join(self.dir, "common.avdl")
+        protocol = os.path.join(self.dir, "foo.avdl")
+        with open(common, "w") as _file:
+            _file.write("protocol Common { record Thing { string a; } }")
+        with open(protocol, "w") as _file:
+            _file.write(
+                'protocol Foo { import idl "common.avdl"; '
+                "string get(string arg1); }"
+            )
+        os.remove(self.schema_file)
+        config = p_config.Configurator(settings={
+            "avro.auto_compile": "true",
+            "avro.compiler": "python",
+            "avro.reload_schemas": "true",
+            "avro.reload_interval": "0.01"
+        })
+        pa.add_avro_route(
+            config,
+            "foo",
+            protocol=protocol,
+            schema=self.schema_file
+        )
+        pa.register_avro_message(config, "foo", get_impl, "get")
+        config.commit()
+
+        watcher = config.registry.avro_schema_watcher
+        self.addCleanup(watcher.stop, 5)
+        route = config.registry.getUtility(
+            pa_routes.IAvroServiceRoute,
+            name="avro.foo"
+        )
+        self.assertEqual(
+            frozenset([common, protocol, self.schema_file]),
+            watcher.paths
+        )
+        self.assertEqual(
+            ["a"],
+            thing_fields(route)
+        )
+
+        # Editing only the imported IDL recompiles and reloads the service.
+        with open(common, "w") as _file:
+            _file.write(
+                "protocol Common { record Thing { string a; int b; } }"
+            )
+        watcher.stop(5)
+        watcher.callback(watcher.check())
+        self.assertEqual(
+            ["a", "b"],
+            thing_fields(route)
+        )
+        self.assertIs(get_impl, route.materialize().dispatch["get"])
+
+    def test_config(self):
+        config = p_config.Configurator(settings={
+            "avro.reload_schemas": "true",
+            "avro.reload_interval": "0.01"
+        })
+        pa.add_avro_route(config, "foo", schema=self.schema_file)
+        pa.register_avro_message(config, "foo", get_impl, "get")
+        config.commit()
+
+        watcher = config.registry.avro_schema_watcher
+        self.addCleanup(watcher.stop, 5)
+        route = config.registry.getUtility(
+            pa_routes.IAvroServiceRoute,
+            name="avro.foo"
+        )
+        self.assertTrue(route.is_materialized)
+        self.assertEqual(frozenset([self.schema_file]), watcher.paths)
+
+        self.write_schema("put")
+        watcher.stop(5)
+        # Whether or not the watcher got there first, the route is reloaded.
+        watcher.callback(watcher.check())
+        self.assertIn("put", route.protocol.message_map)
+        self.assertIs(get_impl, route.materialize().dispatch["get"])
+
+    def test_fork(self):
+        config = p_config.Configurator(settings={
+            "avro.reload_schemas": "true",
+            "avro.reload_interval": "0.01"
+        })
+        pa.add_avro_route(config, "foo", schema=self.schema_file)
+        pa.register_avro_message(config, "foo", get_impl, "get")
+        config.commit()
+
+        watcher = config.registry.avro_schema_watcher
+        self.addCleanup(watcher.stop, 5)
+        route = config.registry.getUtility(
+            pa_routes.IAvroServiceRoute,
+            name="avro.foo"
+        )
+        self.assertIs(watcher, route.watcher)
+        self.assertTrue(watcher.running)
+        parent_thread = watcher._thread
+
+        # In a forked worker, the first request starts the watcher afresh.
+        pid = os.getpid() + 1
+        route.materialize = mock.Mock()
+        with mock.patch.object(pa_watch.os, "getpid", return_value=pid):
+            self.assertFalse(watcher.running)
+            route(mock.Mock())
+            self.assertTrue(watcher.running)
+            child_thread = watcher._thread
+            self.assertIsNot(parent_thread, child_thread)
+            route(mock.Mock())
+            self.assertIs(child_thread, watcher._thread)
+
+        # A stopped watcher stays stopped.
+        watcher.stop(5)
+        watcher.ensure_started()
+        self.assertFalse(watcher.running)